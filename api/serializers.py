@@ -2,6 +2,7 @@ from django.contrib.auth.models import User
 from rest_framework import serializers
 
 from marketplace.models import Category, Favorite, Listing, Message, UserProfile
+from marketplace.utils.geo import distances_from
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,6 +25,17 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["id", "name", "slug", "icon", "color", "parent"]
 
 
+class ListingListSerializer(serializers.ListSerializer):
+    """Computes the distances of a whole page in one vectorised call"""
+
+    def to_representation(self, data):
+        listings = list(data.all() if hasattr(data, 'all') else data)
+        reference = self.child.get_reference_point()
+        if reference:
+            self.context['listing_distances'] = distances_from(listings, *reference)
+        return super().to_representation(listings)
+
+
 class ListingSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
@@ -36,6 +48,7 @@ class ListingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Listing
+        list_serializer_class = ListingListSerializer
         fields = [
             "id",
             "title",
@@ -81,22 +94,32 @@ class ListingSerializer(serializers.ModelSerializer):
             "distance"
         ]
     
-    def get_distance(self, obj):
-        """Calculate distance from a reference point if provided in context"""
+    def get_reference_point(self):
+        """Return (ref_latitude, ref_longitude) from the request, if valid"""
         request = self.context.get('request')
         if not request:
             return None
             
         ref_lat = request.query_params.get('ref_latitude')
         ref_lon = request.query_params.get('ref_longitude')
+        if not (ref_lat and ref_lon):
+            return None
+        try:
+            return float(ref_lat), float(ref_lon)
+        except (ValueError, TypeError):
+            return None
+    
+    def get_distance(self, obj):
+        """Distance from the reference point, precomputed per page by ListingListSerializer"""
+        reference = self.get_reference_point()
+        if not reference or not obj.has_coordinates:
+            return None
         
-        if ref_lat and ref_lon and obj.has_coordinates:
-            try:
-                distance = obj.distance_to_point(float(ref_lat), float(ref_lon))
-                return round(distance, 2) if distance else None
-            except (ValueError, TypeError):
-                return None
-        return None
+        distances = self.context.get('listing_distances')
+        if distances is None or obj.pk not in distances:
+            distances = distances_from([obj], *reference)
+        distance = distances.get(obj.pk)
+        return round(distance, 2) if distance is not None else None
     
     def get_main_image(self, obj):
         """Get the main image URL for the listing"""
@@ -1,4 +1,4 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
 from . import views
@@ -12,6 +12,9 @@ router.register(r"users", views.UserProfileViewSet)
 
 urlpatterns = [
     path("", include(router.urls)),
+    re_path(r"^suggest/?$", views.suggest, name="suggest"),
+    path("search/popular/", views.popular_searches, name="popular_searches"),
+    path("analytics/daily/", views.seller_daily_stats, name="seller_daily_stats"),
     # Location-based endpoints
     path("locations/search/", views.search_locations, name="search_locations"),
     path("locations/popular/", views.get_popular_locations, name="popular_locations"),
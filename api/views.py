@@ -4,6 +4,7 @@ from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from decimal import Decimal
+import time
 
 from marketplace.models import (
     Category,
@@ -13,7 +14,16 @@ from marketplace.models import (
     UserProfile,
     Location,
 )
+from marketplace.ai_search.engine import SEMANTIC_SEARCH_LIMIT, semantic_search as find_similar_listings
 from marketplace.location_services import LocationService
+from marketplace.recommendations.data.events import record_listing_view
+from marketplace.search.facets import FacetedListMixin
+from marketplace.search.filters import FoldedSearchFilter, ListingSearchFilter
+from marketplace.search.popular import LIST_SIZE, listing_searches
+from marketplace.search.suggest import SUGGEST_LIMIT, get_suggestions
+from marketplace.services.daily_stats import date_range, listing_series, seller_series
+from marketplace.utils.geo import within_radius
+from marketplace.utils.text import folded_prefix_q
 from .serializers import (
     CategorySerializer,
     FavoriteCreateSerializer,
@@ -26,6 +36,9 @@ from .serializers import (
     UserSerializer,
 )
 
+# Days of statistics served by default
+STATS_DAYS = 30
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -48,8 +61,8 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ["name"]
+    filter_backends = [FoldedSearchFilter]
+    search_fields = ["name_folded"]
 
     @action(detail=True, methods=["get"])
     def subcategories(self, request, pk=None):
@@ -68,10 +81,9 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(FacetedListMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.all()
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["title", "description", "location"]
+    filter_backends = [ListingSearchFilter, filters.OrderingFilter]
     ordering_fields = ["created_at", "price", "views"]
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
 
@@ -101,7 +113,7 @@ class ListingViewSet(viewsets.ModelViewSet):
         # Filter by location
         location = self.request.query_params.get("location")
         if location:
-            queryset = queryset.filter(location__icontains=location)
+            queryset = queryset.filter(folded_prefix_q("location_folded", location))
         
         # Filter by coordinates and radius (for location-based search)
         latitude = self.request.query_params.get("latitude")
@@ -114,14 +126,8 @@ class ListingViewSet(viewsets.ModelViewSet):
                 lon = float(longitude)
                 radius_km = float(radius)
                 
-                # Get nearby listings using our Location model method
-                nearby_ids = [
-                    listing.id for listing in Listing.get_nearby_listings(lat, lon, radius_km)
-                ]
-                if nearby_ids:
-                    queryset = queryset.filter(id__in=nearby_ids)
-                else:
-                    queryset = queryset.none()  # No results if no nearby listings
+                # Prune by grid cell in SQL, nearest first
+                queryset = within_radius(queryset, lat, lon, radius_km).order_by("distance_km")
                     
             except (ValueError, TypeError):
                 pass  # Ignore invalid coordinates
@@ -135,9 +141,7 @@ class ListingViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        # Increment view count
-        instance.views += 1
-        instance.save(update_fields=["views"])
+        record_listing_view(request, instance.pk)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -184,6 +188,18 @@ class ListingViewSet(viewsets.ModelViewSet):
                 {"detail": "Listing not in favorites"}, status=status.HTTP_404_NOT_FOUND
             )
     
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None):
+        """Daily views, favorites, messages and contacts of the listing, for its owner"""
+        listing = self.get_object()
+        if listing.user != request.user:
+            return Response(
+                {"detail": "Only the owner can see the listing's statistics"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        start, end = date_range(_days_param(request))
+        return Response({"days": listing_series(listing.pk, start, end)})
+
     @action(detail=True, methods=["get"])
     def nearby(self, request, pk=None):
         """Get nearby listings for a specific listing"""
@@ -339,6 +355,50 @@ def search_locations(request):
     })
 
 
+@api_view(['GET'])
+def suggest(request):
+    """Typeahead suggestions (listing titles, categories, cities) for a partial query"""
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    
+    return Response({
+        'query': query,
+        'results': get_suggestions(query, limit),
+    })
+
+
+@api_view(['GET'])
+def popular_searches(request):
+    """Most searched listing terms of the last week and terms trending today"""
+    try:
+        limit = min(int(request.GET.get('limit', 10)), LIST_SIZE)
+    except ValueError:
+        limit = 10
+    
+    return Response({
+        'popular': listing_searches.popular(limit),
+        'trending': listing_searches.trending(limit),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def seller_daily_stats(request):
+    """Daily views, favorites, messages and contacts of all of the user's listings"""
+    start, end = date_range(_days_param(request))
+    return Response({'days': seller_series(request.user.pk, start, end)})
+
+
+def _days_param(request) -> int:
+    try:
+        return int(request.GET.get('days', STATS_DAYS))
+    except ValueError:
+        return STATS_DAYS
+
+
 @api_view(['GET'])
 def get_popular_locations(request):
     """Get popular Romanian cities for location selection"""
@@ -446,3 +506,22 @@ def get_location_analytics(request):
             'health': {'status': 'unknown'},
             'popular_locations': []
         })
+
+
+@api_view(['GET'])
+def semantic_search(request):
+    """Listings closest in meaning to a free-text query, with similarity scores"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', SEMANTIC_SEARCH_LIMIT))
+    except ValueError:
+        limit = SEMANTIC_SEARCH_LIMIT
+    
+    started = time.perf_counter()
+    results = find_similar_listings(query, limit) if query else []
+    
+    return Response({
+        'query': query,
+        'results': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
@@ -1,28 +1,14 @@
-
-
-from transformers import pipeline
 from fastapi import APIRouter
 
+from .engine import SEMANTIC_SEARCH_LIMIT, semantic_search as find_similar_listings
+
 router = APIRouter()
-searcher = pipeline(
-    "text-classification", 
-    model="distilbert-base-uncased",
-    tokenizer="distilbert-base-uncased"
-)
 
-def expand_query(query: str) -> list[str]:
-    """Generate semantic variations of search terms"""
-    return [
-        query,
-        searcher.tokenizer.mask_token.replace("[MASK]", query),
-        f"vintage {query}" if "old" in query else query
-    ]
 
 @router.post("/search")
-async def semantic_search(query: str):
+def semantic_search(query: str, limit: int = SEMANTIC_SEARCH_LIMIT):
+    """Nearest listings to a free-text query, see engine"""
     return {
-        "original_query": query,
-        "expanded_terms": expand_query(query),
-        "matches": searcher(query)
+        "query": query,
+        "results": find_similar_listings(query, limit),
     }
-
@@ -0,0 +1,141 @@
+"""
+Text embeddings for semantic listing search.
+The default HashingEmbedder needs nothing beyond NumPy: folded words and
+character trigrams are hashed into a fixed number of buckets and weighted
+by TF-IDF, which matches inflected Romanian forms ("masina", "masini")
+well enough for retrieval. Set SEMANTIC_SEARCH_MODEL to a
+sentence-transformers model name to embed with a local model instead.
+"""
+import logging
+import math
+import re
+import zlib
+from typing import Iterable, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from ..utils.text import fold_text
+
+logger = logging.getLogger(__name__)
+
+HASHING_DIMENSIONS = 512
+
+# Title words count this many times more than description words
+TITLE_WEIGHT = 2
+TRIGRAM_WEIGHT = 0.5
+MIN_TRIGRAM_WORD_LENGTH = 4
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def listing_text(title: str, description: str) -> str:
+    """The text a listing is embedded from"""
+    return ' '.join([title or ''] * TITLE_WEIGHT + [description or ''])
+
+
+def _features(text: str) -> List[tuple]:
+    """(feature, weight) pairs of a text, before hashing"""
+    features = []
+    for word in _WORD_RE.findall(fold_text(text)):
+        if len(word) < 2:
+            continue
+        features.append((word, 1.0))
+        if len(word) >= MIN_TRIGRAM_WORD_LENGTH:
+            padded = f'#{word}#'
+            features.extend(('~' + padded[i:i + 3], TRIGRAM_WEIGHT) for i in range(len(padded) - 2))
+    return features
+
+
+class HashingEmbedder:
+    """Signed feature hashing with TF-IDF weights learned by fit()"""
+    name = 'hashing'
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS, idf: Optional[np.ndarray] = None):
+        self.dimensions = dimensions
+        self.idf = idf if idf is not None else np.ones(dimensions, dtype=np.float32)
+        self._buckets = {}
+
+    def _bucket(self, feature: str):
+        bucket = self._buckets.get(feature)
+        if bucket is None:
+            digest = zlib.crc32(feature.encode('utf-8'))
+            # The top bit picks the sign, so collisions tend to cancel out
+            bucket = (digest % self.dimensions, -1.0 if digest & 0x80000000 else 1.0)
+            if len(self._buckets) < 500000:
+                self._buckets[feature] = bucket
+        return bucket
+
+    def _term_frequencies(self, text: str) -> dict:
+        frequencies = {}
+        for feature, weight in _features(text):
+            bucket, sign = self._bucket(feature)
+            frequencies[bucket] = frequencies.get(bucket, 0.0) + sign * weight
+        return frequencies
+
+    def fit(self, texts: Iterable[str]):
+        """Learn bucket document frequencies from a corpus"""
+        document_frequency = np.zeros(self.dimensions, dtype=np.float64)
+        documents = 0
+        for text in texts:
+            documents += 1
+            for bucket in self._term_frequencies(text):
+                document_frequency[bucket] += 1
+        self.idf = (np.log((documents + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        """L2-normalised float32 vectors, one row per text"""
+        texts = list(texts)
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, frequency in self._term_frequencies(text).items():
+                # Sublinear term frequency, keeping the hashing sign
+                if abs(frequency) >= 1:
+                    frequency = math.copysign(1 + math.log(abs(frequency)), frequency)
+                vectors[row, bucket] = frequency
+        vectors *= self.idf
+        return _normalise(vectors)
+
+    def state(self) -> dict:
+        return {'idf': self.idf}
+
+
+class SentenceTransformerEmbedder:
+    """Embeddings from a local sentence-transformers model (CPU)"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+
+    def fit(self, texts: Iterable[str]):
+        return self
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        vectors = self.model.encode(list(texts), batch_size=64, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def state(self) -> dict:
+        return {}
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def get_embedder(state: Optional[dict] = None):
+    """The configured embedder, restored from a saved index state when given"""
+    model_name = getattr(settings, 'SEMANTIC_SEARCH_MODEL', None)
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except ImportError:
+            logger.warning("sentence-transformers is not installed, falling back to hashed TF-IDF embeddings")
+    state = state or {}
+    idf = state.get('idf')
+    return HashingEmbedder(dimensions=len(idf) if idf is not None else HASHING_DIMENSIONS, idf=idf)
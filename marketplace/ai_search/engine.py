@@ -0,0 +1,321 @@
+"""
+Semantic listing search.
+Listing titles and descriptions are embedded (see embeddings) into an IVF
+index (see index) built by ``manage.py build_semantic_index`` under
+SEMANTIC_INDEX_DIR. A process that finds no build starts one in a
+background thread and finds nothing until it is published; builds hold an
+exclusive lock on the index directory, so processes starting at once build
+it only once. Listings changed after the build are embedded in the
+background into a small in-memory delta that is searched exactly, and their
+stale rows in the built index are masked out, so edits show up without a
+rebuild.
+"""
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ..utils.background import BackgroundJob
+from ..utils.cache_utils import CACHE_PREFIX_SEARCH, get_generation
+from .embeddings import get_embedder, listing_text
+from .index import DEFAULT_NPROBE, IVFIndex, top_k
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_SEARCH_LIMIT = 10
+MAX_SEMANTIC_SEARCH_LIMIT = 50
+
+# Lookups must stay under this many seconds (checked by tests/test_semantic_search.py)
+SEMANTIC_LATENCY_TARGET = 0.01
+
+EMBED_BATCH_SIZE = 1000
+
+# Above this many changed listings the delta should be compacted by a rebuild
+MAX_DELTA_SIZE = 5000
+
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'build.lock'
+
+
+def index_dir() -> str:
+    return getattr(settings, 'SEMANTIC_INDEX_DIR', os.path.join(settings.BASE_DIR, 'var', 'semantic_index'))
+
+
+def _build_time(build_name: str) -> int:
+    return int(build_name[len('build-'):])
+
+
+@contextmanager
+def build_lock(blocking: bool = True):
+    """Hold the index directory's build lock across processes; yields False if not blocking and it is taken"""
+    root = index_dir()
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SemanticSearchEngine:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.index = None
+        self.embedder = None
+        self.build_name = None
+        self._current_mtime = None
+        self._builder = BackgroundJob(self.build_missing, 'semantic-index-build')
+        self._refresher = BackgroundJob(self.refresh, 'semantic-index-refresh')
+        self._reset_delta(None)
+
+    def _reset_delta(self, synced_until):
+        self._delta = {}            # listing pk -> vector
+        self._stale = set()         # pks whose row in the built index is outdated
+        self._delta_arrays = None
+        self._stale_array = None
+        self.synced_until = synced_until
+        self.generation = None
+
+    # Building and loading
+
+    def build(self):
+        """Embed every active listing and write a new index build, after any build going in another process"""
+        with build_lock():
+            self._build()
+
+    def build_missing(self):
+        """Build unless another process is building or has published a build"""
+        with build_lock(blocking=False) as locked:
+            if not locked:
+                logger.info("Semantic index is being built by another process")
+            elif self._current_build() is None:
+                self._build()
+
+    def _build(self):
+        from ..models import Listing
+
+        started = time.perf_counter()
+        root = index_dir()
+        synced_until = timezone.now()
+        # Listings changed from here on are left to the delta (see refresh), so
+        # later passes never see more rows than counted here
+        rows = (Listing.objects.filter(status='active', updated_at__lt=synced_until).order_by('pk')
+                .values_list('pk', 'title', 'description'))
+        count = rows.count()
+        embedder = get_embedder()
+        embedder.fit(listing_text(title, description) for _, title, description in rows.iterator())
+
+        build_name = f'build-{time.time_ns()}'
+        build_path = os.path.join(root, build_name)
+        os.makedirs(build_path)
+        raw_path = os.path.join(build_path, 'raw.npy')
+        raw = np.lib.format.open_memmap(raw_path, mode='w+', dtype=np.float32, shape=(count, embedder.dimensions))
+        # Pks are read in the pass that embeds, so each vector lands on its own listing
+        ids = np.empty(count, dtype=np.int64)
+        position = 0
+        batch = []
+        for pk, title, description in rows.iterator():
+            if position + len(batch) == count:
+                # Reactivated by a bulk update that left updated_at alone
+                logger.warning("Semantic index build saw more listings than it counted, the rest wait for a rebuild")
+                break
+            ids[position + len(batch)] = pk
+            batch.append(listing_text(title, description))
+            if len(batch) == EMBED_BATCH_SIZE:
+                raw[position:position + len(batch)] = embedder.embed(batch)
+                position += len(batch)
+                batch = []
+        if batch:
+            raw[position:position + len(batch)] = embedder.embed(batch)
+            position += len(batch)
+        # Listings deleted or deactivated between the two passes
+        ids = ids[:position]
+
+        IVFIndex.build(ids, raw[:position], build_path, metadata={
+            'embedder': embedder.name,
+            'synced_until': synced_until.isoformat(),
+        })
+        del raw
+        os.remove(raw_path)
+        for name, array in embedder.state().items():
+            np.save(os.path.join(build_path, f'{name}.npy'), array)
+
+        # Publish atomically, then drop all but the previous build
+        # (processes still mapping it keep their pages until they reload).
+        # Only builds older than this one go, whoever wrote the directory
+        pointer = os.path.join(root, CURRENT_FILE + '.tmp')
+        with open(pointer, 'w') as current:
+            current.write(build_name)
+        os.replace(pointer, os.path.join(root, CURRENT_FILE))
+        builds = sorted(
+            (name for name in os.listdir(root) if name.startswith('build-')
+             and _build_time(name) <= _build_time(build_name)),
+            key=_build_time,
+        )
+        for name in builds[:-2]:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+        logger.info(f"Semantic index built for {len(ids)} listings in {time.perf_counter() - started:.1f}s")
+        with self._lock:
+            self._load(build_name)
+
+    def _current_build(self) -> Optional[str]:
+        try:
+            with open(os.path.join(index_dir(), CURRENT_FILE)) as current:
+                return current.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load(self, build_name: str):
+        path = os.path.join(index_dir(), build_name)
+        index = IVFIndex.load(path)
+        state = {}
+        for name in ('idf',):
+            array_path = os.path.join(path, f'{name}.npy')
+            if os.path.exists(array_path):
+                state[name] = np.load(array_path)
+        embedder = get_embedder(state)
+        if embedder.name != index.metadata.get('embedder'):
+            logger.warning(f"Semantic index was built with {index.metadata.get('embedder')}, rebuild it for {embedder.name}")
+        self.index = index
+        self.embedder = embedder
+        self.build_name = build_name
+        self._reset_delta(parse_datetime(index.metadata['synced_until']))
+
+    def ensure_ready(self) -> bool:
+        """
+        Load the current build and start applying recent changes in the
+        background. Without a build one is started in the background too;
+        returns whether an index can be searched.
+        """
+        with self._lock:
+            try:
+                mtime = os.stat(os.path.join(index_dir(), CURRENT_FILE)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is None:
+                self._builder.start()
+                return self.index is not None
+            if self.index is None or mtime != self._current_mtime:
+                self._current_mtime = mtime
+                build_name = self._current_build()
+                if build_name != self.build_name:
+                    self._load(build_name)
+            stale = get_generation(CACHE_PREFIX_SEARCH) != self.generation
+        if stale:
+            self._refresher.start()
+        return True
+
+    # Incremental updates
+
+    def refresh(self):
+        """Re-embed the listings changed since the last sync into the delta; searches carry on meanwhile"""
+        from ..models import Listing
+
+        with self._lock:
+            generation = get_generation(CACHE_PREFIX_SEARCH)
+            build_name, synced_until, embedder = self.build_name, self.synced_until, self.embedder
+        if embedder is None:
+            return
+        changed = Listing.objects.order_by()
+        if synced_until is not None:
+            changed = changed.filter(updated_at__gte=synced_until)
+        rows = list(changed.values_list('pk', 'status', 'title', 'description', 'updated_at'))
+        active = [(pk, title, description) for pk, status, title, description, _ in rows if status == 'active']
+        vectors = embedder.embed(listing_text(title, description) for _, title, description in active)
+
+        with self._lock:
+            if self.build_name != build_name:
+                # A newer build was loaded meanwhile and is refreshed on its own
+                return
+            for pk, status, _, _, _ in rows:
+                self._stale.add(pk)
+                self._delta.pop(pk, None)
+            for (pk, _, _), vector in zip(active, vectors):
+                self._delta[pk] = vector
+            if rows:
+                self.synced_until = max(row[4] for row in rows)
+                self._delta_arrays = self._stale_array = None
+            self.generation = generation
+            if len(self._delta) > MAX_DELTA_SIZE:
+                logger.warning(f"Semantic index delta holds {len(self._delta)} listings, run build_semantic_index")
+
+    def remove_listing(self, pk):
+        """Drop a deleted listing; other processes wait for the next build"""
+        with self._lock:
+            if self.index is None:
+                return
+            self._stale.add(pk)
+            self._delta.pop(pk, None)
+            self._delta_arrays = self._stale_array = None
+
+    # Lookup
+
+    def search(self, query: str, limit: int = SEMANTIC_SEARCH_LIMIT,
+               nprobe: int = DEFAULT_NPROBE) -> List[Tuple[int, float]]:
+        """(listing pk, cosine score) of the nearest listings, best first; none until an index is built"""
+        if not self.ensure_ready():
+            return []
+        started = time.perf_counter()
+        with self._lock:
+            vector = self.embedder.embed([query])[0]
+            if not vector.any():
+                return []
+            if self._stale_array is None:
+                self._stale_array = np.fromiter(self._stale, dtype=np.int64, count=len(self._stale))
+            if self._delta_arrays is None:
+                delta_ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+                delta_vectors = (np.vstack(list(self._delta.values())) if self._delta
+                                 else np.empty((0, len(vector)), dtype=np.float32))
+                self._delta_arrays = (delta_ids, delta_vectors)
+            index, stale, (delta_ids, delta_vectors) = self.index, self._stale_array, self._delta_arrays
+
+        ids, scores = index.search(vector, limit, nprobe=nprobe, exclude=stale)
+        if len(delta_ids):
+            ids, scores = top_k(np.concatenate([ids, delta_ids]),
+                                np.concatenate([scores, delta_vectors @ vector]), limit)
+        keep = scores > 0
+        results = [(int(pk), float(score)) for pk, score in zip(ids[keep], scores[keep])]
+
+        elapsed = time.perf_counter() - started
+        if elapsed > SEMANTIC_LATENCY_TARGET:
+            logger.warning(f"Semantic search for {query!r} took {elapsed * 1000:.1f}ms")
+        return results
+
+
+semantic_engine = SemanticSearchEngine()
+
+
+def semantic_search(query: str, limit: int = SEMANTIC_SEARCH_LIMIT) -> List[dict]:
+    """Nearest active listings to a free-text query, with their scores"""
+    from ..models import Listing
+
+    limit = min(max(limit, 1), MAX_SEMANTIC_SEARCH_LIMIT)
+    matches = semantic_engine.search(query, limit)
+    listings = Listing.objects.filter(pk__in=[pk for pk, _ in matches], status='active').select_related('category')
+    by_pk = {listing.pk: listing for listing in listings}
+    return [
+        {
+            'id': pk,
+            'title': by_pk[pk].title,
+            'price': str(by_pk[pk].price) if by_pk[pk].price is not None else None,
+            'city': by_pk[pk].city,
+            'category': by_pk[pk].category.name,
+            'score': round(score, 4),
+        }
+        for pk, score in matches if pk in by_pk
+    ]
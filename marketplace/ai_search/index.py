@@ -0,0 +1,149 @@
+"""
+Inverted-file (IVF) approximate nearest neighbour index over unit vectors.
+Vectors are clustered around nlist centroids by spherical k-means and stored
+grouped by cluster, so a query only scores the nprobe closest clusters.
+Arrays are saved as .npy files and opened memory-mapped, so every worker
+process shares the same pages through the OS cache.
+"""
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Below this many vectors a single cluster (exact search) is fastest
+MIN_VECTORS_FOR_CLUSTERING = 256
+MAX_LISTS = 4096
+KMEANS_SAMPLE_SIZE = 50000
+KMEANS_ITERATIONS = 10
+DEFAULT_NPROBE = 8
+
+# Rows scored per matrix product while assigning vectors to clusters
+ASSIGN_CHUNK = 8192
+
+MANIFEST = 'manifest.json'
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK])
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE_SIZE:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), KMEANS_SAMPLE_SIZE, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Reseed empty clusters with random points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms[empty] = 1
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, vectors: np.ndarray,
+                 metadata: Optional[dict] = None):
+        self.centroids = centroids
+        self.offsets = offsets  # cluster c holds rows offsets[c]:offsets[c + 1]
+        self.ids = ids
+        self.vectors = vectors
+        self.metadata = metadata or {}
+
+    @property
+    def dimensions(self) -> int:
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, path: str, nlist: Optional[int] = None,
+              metadata: Optional[dict] = None) -> 'IVFIndex':
+        """Cluster the vectors and write the index files to path"""
+        os.makedirs(path, exist_ok=True)
+        count = len(ids)
+        if nlist is None:
+            nlist = 1 if count < MIN_VECTORS_FOR_CLUSTERING else min(int(np.sqrt(count)), MAX_LISTS)
+        if nlist > 1:
+            centroids = train_centroids(vectors, nlist)
+            assignment = _nearest_centroids(vectors, centroids)
+        else:
+            mean = np.asarray(vectors).sum(axis=0, keepdims=True) if count else np.zeros((1, vectors.shape[1]))
+            centroids = (mean / max(np.linalg.norm(mean), 1e-12)).astype(np.float32)
+            assignment = np.zeros(count, dtype=np.int32)
+
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=offsets[1:])
+
+        sorted_vectors = np.lib.format.open_memmap(
+            os.path.join(path, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(count, vectors.shape[1])
+        )
+        for start in range(0, count, ASSIGN_CHUNK):
+            sorted_vectors[start:start + ASSIGN_CHUNK] = vectors[order[start:start + ASSIGN_CHUNK]]
+        sorted_vectors.flush()
+        del sorted_vectors
+        np.save(os.path.join(path, 'ids.npy'), np.asarray(ids, dtype=np.int64)[order])
+        np.save(os.path.join(path, 'centroids.npy'), centroids)
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        with open(os.path.join(path, MANIFEST), 'w') as manifest:
+            json.dump(dict(metadata or {}, count=count, nlist=len(centroids)), manifest)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        with open(os.path.join(path, MANIFEST)) as manifest:
+            metadata = json.load(manifest)
+        return cls(
+            centroids=np.load(os.path.join(path, 'centroids.npy')),
+            offsets=np.load(os.path.join(path, 'offsets.npy')),
+            ids=np.load(os.path.join(path, 'ids.npy'), mmap_mode='r'),
+            vectors=np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+            metadata=metadata,
+        )
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = DEFAULT_NPROBE,
+               exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ids and cosine scores of the k nearest vectors, best first"""
+        if not len(self.ids):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidate_ids = []
+        candidate_scores = []
+        for cluster in probes:
+            start, stop = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == stop:
+                continue
+            candidate_ids.append(self.ids[start:stop])
+            candidate_scores.append(self.vectors[start:stop] @ query)
+        if not candidate_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        if exclude is not None and len(exclude):
+            keep = ~np.isin(ids, exclude)
+            ids, scores = ids[keep], scores[keep]
+        return top_k(ids, scores, k)
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k best (id, score) pairs, best first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[best], scores[best]
+    order = np.argsort(-scores, kind='stable')
+    return np.asarray(ids[order]), np.asarray(scores[order])
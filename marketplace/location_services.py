@@ -11,6 +11,7 @@ from typing import Dict, List, Optional, Tuple
 import logging
 from decimal import Decimal
 from ratelimit import limits, sleep_and_retry
+from .utils.text import fold_text, folded_prefix_q
 
 # Nominatim usage policy requires max 1 request per second
 NOMINATIM_RATE_LIMIT = 1  # requests per second
@@ -77,6 +78,18 @@ class LocationService:
         'Botoșani': (47.7402, 26.6656),
         'Satu Mare': (47.7914, 22.8816),
     }
+
+    # Folded spellings that are not plain diacritic variants of ROMANIA_CITIES
+    CITY_ALIASES = {
+        'bucharest': 'București',
+        'cluj': 'Cluj-Napoca',
+    }
+
+    # Folded name -> canonical name, covers every spelling with or without diacritics
+    FOLDED_CITIES = {
+        **{fold_text(city): city for city in ROMANIA_CITIES},
+        **CITY_ALIASES,
+    }
     
     @staticmethod
     def normalize_location_name(location: str) -> str:
@@ -84,31 +97,12 @@ class LocationService:
         if not location:
             return ""
         
-        # Remove extra spaces and normalize case
-        location = location.strip().title()
+        canonical = LocationService.FOLDED_CITIES.get(fold_text(location))
+        if canonical:
+            return canonical
         
-        # Handle common variations
-        replacements = {
-            'Bucuresti': 'București',
-            'Bucharest': 'București',
-            'Cluj': 'Cluj-Napoca',
-            'Iasi': 'Iași',
-            'Timisoara': 'Timișoara',
-            'Constanta': 'Constanța',
-            'Brasov': 'Brașov',
-            'Galati': 'Galați',
-            'Ploiesti': 'Ploiești',
-            'Braila': 'Brăila',
-            'Pitesti': 'Pitești',
-            'Targu Mures': 'Târgu Mureș',
-            'Botosani': 'Botoșani',
-        }
-        
-        for old, new in replacements.items():
-            if location.lower() == old.lower():
-                return new
-        
-        return location
+        # Remove extra spaces and normalize case
+        return location.strip().title()
     
     @staticmethod
     def get_coordinates_from_city(city: str) -> Optional[Tuple[float, float]]:
@@ -292,29 +286,22 @@ class LocationService:
             return cached_result
         
         results = []
-        query_lower = query.lower().strip()
+        query_folded = fold_text(query)
+        alias = LocationService.CITY_ALIASES.get(query_folded)
         
-        # Strategy 1: Exact and fuzzy matching in known Romanian cities
+        # Strategy 1: Exact and prefix matching in known Romanian cities,
+        # compared on folded names so diacritics and case never matter
         def city_match_score(city_name, query):
             """Calculate match score for city names"""
-            city_lower = city_name.lower()
-            if city_lower == query_lower:
+            city_folded = fold_text(city_name)
+            if city_folded == query_folded:
                 return 100  # Exact match
-            elif city_lower.startswith(query_lower):
+            elif city_name == alias:
+                return 95   # Known alias, e.g. Bucharest
+            elif city_folded.startswith(query_folded):
                 return 90   # Starts with query
-            elif query_lower in city_lower:
+            elif query_folded in city_folded:
                 return 80   # Contains query
-            else:
-                # Fuzzy matching for diacritics and common variations
-                normalized_city = LocationService.normalize_location_name(city_name).lower()
-                normalized_query = LocationService.normalize_location_name(query).lower()
-                
-                if normalized_city == normalized_query:
-                    return 95
-                elif normalized_city.startswith(normalized_query):
-                    return 85
-                elif normalized_query in normalized_city:
-                    return 75
             return 0
         
         # Search in known cities with scoring
@@ -338,7 +325,14 @@ class LocationService:
         for score, city_result in city_matches[:min(5, limit)]:
             results.append(city_result)
         
-        # Strategy 2: OpenStreetMap search for more detailed results
+        # Strategy 2: cities that already have listings, an indexed prefix
+        # lookup on the folded city column before falling back to Nominatim
+        if len(results) < limit:
+            results.extend(LocationService._search_listing_cities(
+                query, limit - len(results), exclude={fold_text(r['city']) for r in results}
+            ))
+        
+        # Strategy 3: OpenStreetMap search for more detailed results
         if len(results) < limit:
             try:
                 # Try multiple search variations
@@ -425,6 +419,44 @@ class LocationService:
         logger.info(f"✅ Location search for '{query}' returned {len(final_results)} results")
         return final_results
     
+    @staticmethod
+    def _search_listing_cities(query: str, limit: int, exclude=()) -> List[Dict]:
+        """Find cities of existing listings whose folded name starts with query"""
+        from django.db.models import Avg, Count, Max
+        from .models import Listing
+        
+        rows = (
+            Listing.objects.filter(folded_prefix_q('city_folded', query))
+            .exclude(latitude__isnull=True)
+            .values('city_folded')
+            .annotate(
+                city=Max('city'),
+                county=Max('county'),
+                latitude=Avg('latitude'),
+                longitude=Avg('longitude'),
+                listings=Count('id'),
+            )
+            .order_by('-listings')[:limit + len(exclude)]
+        )
+        
+        matches = []
+        for row in rows:
+            if row['city_folded'] in exclude:
+                continue
+            matches.append({
+                'name': row['city'],
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+                'type': 'city',
+                'formatted_address': f"{row['city']}, România",
+                'city': row['city'],
+                'county': row['county'] or '',
+                'match_score': 70,
+            })
+            if len(matches) >= limit:
+                break
+        return matches
+    
     @staticmethod
     def populate_listing_coordinates(listing):
         """Populate coordinates for a listing based on its location data"""
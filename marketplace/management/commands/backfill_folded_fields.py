@@ -0,0 +1,53 @@
+"""
+Management command to recompute the folded search keys of listings and categories.
+Useful after bulk imports or queryset.update() calls, which bypass Model.save().
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.models import Category, Listing
+
+
+class Command(BaseCommand):
+    help = 'Backfill folded (case- and diacritic-insensitive) search keys in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows updated per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        categories = self.backfill(Category, ['name_folded'], batch_size, Category.fill_folded_fields)
+        self.stdout.write(f'Categories updated: {categories}')
+
+        listing_fields = list(Listing.FOLDED_FIELDS)
+        listings = self.backfill(Listing, listing_fields, batch_size, Listing.fill_folded_fields)
+        self.stdout.write(f'Listings updated: {listings}')
+
+        self.stdout.write(self.style.SUCCESS('Folded search keys backfilled'))
+
+    def backfill(self, model, fields, batch_size, fill):
+        """Walk model by primary key in chunks, bulk-updating only stale rows"""
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            stale = []
+            for obj in batch:
+                before = [getattr(obj, field) for field in fields]
+                fill(obj)
+                if before != [getattr(obj, field) for field in fields]:
+                    stale.append(obj)
+            if stale:
+                model.objects.bulk_update(stale, fields)
+                updated += len(stale)
+            last_pk = batch[-1].pk
+        return updated
@@ -0,0 +1,24 @@
+"""
+Management command to build the semantic search index from scratch.
+Run it after bulk imports or when the in-memory delta of changed listings
+grows large; workers pick up the new build on their next lookup.
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.ai_search.engine import index_dir, semantic_engine
+
+
+class Command(BaseCommand):
+    help = 'Build the semantic search index for all active listings'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Writing semantic index to {index_dir()}')
+
+        semantic_engine.build()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Semantic index built, {len(semantic_engine.index)} listings indexed '
+                f'with {semantic_engine.embedder.name} embeddings'
+            )
+        )
@@ -0,0 +1,80 @@
+"""
+Management command to compare the recommenders offline.
+Trains every registered recommender on the older part of a favorites
+dataset and reports precision@k, recall@k, coverage, training time and
+memory and query latency against the newer part. Nothing is written: the
+run happens in a scratch database that is dropped afterwards.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.recommendations.evaluation import (
+    DEFAULT_K, MAX_TEST_USERS, TEST_FRACTION, generate_dataset, load_csv, load_database, run_evaluation,
+)
+from marketplace.recommendations.services import RECOMMENDERS
+
+
+class Command(BaseCommand):
+    help = 'Evaluate the recommenders on a time split of favorites'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recommenders',
+            nargs='+',
+            choices=sorted(RECOMMENDERS),
+            help='Recommenders to evaluate (default: all)',
+        )
+        parser.add_argument(
+            '--source',
+            choices=['synthetic', 'database', 'csv'],
+            default='synthetic',
+            help='Where the favorites come from (default: synthetic)',
+        )
+        parser.add_argument(
+            '--file',
+            help='CSV of user, listing, timestamp rows for --source csv',
+        )
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users (default: 1000)')
+        parser.add_argument('--listings', type=int, default=500, help='Synthetic listings (default: 500)')
+        parser.add_argument('--k', type=int, default=DEFAULT_K, help=f'Recommendations per user (default: {DEFAULT_K})')
+        parser.add_argument(
+            '--test-fraction',
+            type=float,
+            default=TEST_FRACTION,
+            help=f'Share of the newest favorites held out (default: {TEST_FRACTION})',
+        )
+        parser.add_argument(
+            '--max-users',
+            type=int,
+            default=MAX_TEST_USERS,
+            help=f'Test users sampled (default: {MAX_TEST_USERS})',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+
+    def handle(self, *args, **options):
+        if options['source'] == 'csv':
+            if not options['file']:
+                raise CommandError('--source csv needs --file')
+            dataset = load_csv(options['file'])
+        elif options['source'] == 'database':
+            dataset = load_database()
+        else:
+            dataset = generate_dataset(users=options['users'], listings=options['listings'], seed=options['seed'])
+
+        results = run_evaluation(
+            dataset, options['recommenders'], k=options['k'], test_fraction=options['test_fraction'],
+            max_users=options['max_users'], seed=options['seed'],
+        )
+        k = options['k']
+        self.stdout.write(
+            f"{'recommender':<14}{f'prec@{k}':>9}{f'rec@{k}':>9}{'cover':>8}{'train s':>9}{'peak MB':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sim p95':>9}"
+        )
+        for result in results:
+            latency = result.recommend_latency
+            self.stdout.write(
+                f"{result.name:<14}{result.precision:>9.4f}{result.recall:>9.4f}{result.coverage:>8.3f}"
+                f"{result.train_seconds:>9.2f}{result.peak_memory / 2 ** 20:>9.1f}"
+                f"{latency[50]:>9.2f}{latency[95]:>9.2f}{latency[99]:>9.2f}{result.similar_latency[95]:>9.2f}"
+            )
+        users = results[0].users if results else 0
+        self.stdout.write(self.style.SUCCESS(f'Evaluated {len(results)} recommenders on {users} test users'))
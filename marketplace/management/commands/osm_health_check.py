@@ -70,6 +70,10 @@ class Command(BaseCommand):
             )
             self.stdout.write(f"📊 Success Rate: {health['success_rate']}%")
             self.stdout.write(f"⏱️  Average Response Time: {health['avg_response_time']}s")
+            self.stdout.write(
+                f"⏱️  p50 / p95 / p99: {health['p50_response_time']}s / "
+                f"{health['p95_response_time']}s / {health['p99_response_time']}s"
+            )
             self.stdout.write(f"📈 Total Requests Today: {health['total_requests_today']}")
             
             # Test geocoding with a known location
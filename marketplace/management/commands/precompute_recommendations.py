@@ -0,0 +1,39 @@
+"""
+Management command to precompute every user's recommendations.
+Run it periodically (e.g. hourly from cron), or once with --follow as a
+long-running worker that also applies new favorites, views and contacts
+within seconds; /recommendations/recommendations/ serves the stored lists
+and falls back to popular listings for users without one.
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.recommendations.services.precomputed import LIST_SIZE, follow, precompute_all
+
+
+class Command(BaseCommand):
+    help = 'Precompute the recommendations of every active user'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Scoring processes (default: RECOMMENDATION_WORKERS or the CPU count)',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=LIST_SIZE,
+            help=f'Listings stored per user (default: {LIST_SIZE})',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep running, updating the lists of users touched by new interactions',
+        )
+
+    def handle(self, *args, **options):
+        if options['follow']:
+            follow(workers=options['workers'], size=options['size'])
+            return
+        stored = precompute_all(workers=options['workers'], size=options['size'])
+        self.stdout.write(self.style.SUCCESS(f'Stored recommendations for {stored} users'))
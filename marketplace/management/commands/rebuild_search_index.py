@@ -0,0 +1,22 @@
+"""
+Management command to (re)build the listing full-text search index.
+Useful after bulk imports or queryset.update() calls, which bypass signals.
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all listings'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Using search backend: {backend.__class__.__name__}')
+
+        backend.install()
+        indexed = backend.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Search index rebuilt, {indexed} listings indexed')
+        )
@@ -0,0 +1,22 @@
+"""
+Management command to recount the business gauges.
+Run it periodically (e.g. hourly from cron) to correct the drift left by
+bulk updates and rolled back transactions, see
+marketplace.services.business_gauges.
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.services import business_gauges
+
+
+class Command(BaseCommand):
+    help = 'Recount active users, active and featured listings and revenue'
+
+    def handle(self, *args, **options):
+        if not business_gauges.incremental():
+            self.stdout.write('Gauges are counted on every read: monitoring is off or the cache is not shared')
+            return
+        drift = business_gauges.reconcile()
+        for gauge, difference in drift.items():
+            self.stdout.write(f'{gauge}: {difference:+d}')
+        self.stdout.write(self.style.SUCCESS('Gauges reconciled'))
@@ -0,0 +1,30 @@
+"""
+Management command to recompute every user's analytics.
+Run it periodically (e.g. nightly from cron); in between, the totals are
+kept current incrementally, see marketplace.services.user_analytics.
+"""
+
+from django.core.management.base import BaseCommand
+from marketplace.services.user_analytics import USER_CHUNK, refresh
+
+
+class Command(BaseCommand):
+    help = 'Recompute the analytics of all users with grouped queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            nargs='+',
+            help='Only these user ids (default: all users)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=USER_CHUNK,
+            help=f'Users refreshed per set of queries (default: {USER_CHUNK})',
+        )
+
+    def handle(self, *args, **options):
+        written = refresh(options['users'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed analytics of {written} users'))
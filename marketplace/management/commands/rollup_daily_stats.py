@@ -0,0 +1,38 @@
+"""
+Management command to roll up the daily listing and seller figures.
+Run it periodically (e.g. every 15 minutes from cron); each run recomputes
+whole days from the stored interaction events, see
+marketplace.services.daily_stats.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.services.daily_stats import rollup_days
+
+
+class Command(BaseCommand):
+    help = 'Roll up daily views, favorites, messages and contacts per listing and seller'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='Number of days rolled up, ending with --until (default: 2, today and yesterday)',
+        )
+        parser.add_argument(
+            '--until',
+            help='Last day rolled up, YYYY-MM-DD (default: today)',
+        )
+
+    def handle(self, *args, **options):
+        until = None
+        if options['until']:
+            try:
+                until = date.fromisoformat(options['until'])
+            except ValueError:
+                raise CommandError(f"Invalid date {options['until']!r}, expected YYYY-MM-DD")
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        written = rollup_days(options['days'], until)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {written} listing days over {options['days']} days"))
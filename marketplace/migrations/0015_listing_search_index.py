@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# The search backends' SQL as of this migration, frozen so later changes to
+# marketplace.search (such as reading the folded columns 0016 adds) cannot
+# break a fresh migrate. Only raw columns exist here; 0016 refolds the
+# PostgreSQL documents once the folded columns are backfilled.
+SQLITE_TABLE = 'marketplace_listing_fts'
+POSTGRES_TABLE = 'marketplace_listing_search'
+SEARCH_FIELDS = ('title', 'description', 'location', 'city', 'county', 'address')
+POSTGRES_WEIGHTS = (
+    ('title', 'A'),
+    ('location', 'B'),
+    ('city', 'B'),
+    ('description', 'C'),
+    ('county', 'D'),
+    ('address', 'D'),
+)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            columns = ', '.join(SEARCH_FIELDS)
+            source = ', '.join(f"COALESCE({field}, '')" for field in SEARCH_FIELDS)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} "
+                f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, {columns}) SELECT id, {source} FROM marketplace_listing"
+            )
+        elif connection.vendor == 'postgresql':
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', lower(COALESCE({field}, ''))), '{weight}')"
+                for field, weight in POSTGRES_WEIGHTS
+            )
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+                f"listing_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+                f"ON {POSTGRES_TABLE} USING GIN (document)"
+            )
+            cursor.execute(f"TRUNCATE {POSTGRES_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {POSTGRES_TABLE} (listing_id, document) "
+                f"SELECT id, {document} FROM marketplace_listing"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    table = {'sqlite': SQLITE_TABLE, 'postgresql': POSTGRES_TABLE}.get(connection.vendor)
+    if table:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0014_listing_marketplace_expires_9c9d32_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
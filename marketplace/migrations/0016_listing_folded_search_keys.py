@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+from marketplace.utils.text import fold_text
+
+BATCH_SIZE = 1000
+
+LISTING_FOLDED_FIELDS = {
+    'title_folded': ('title', 200),
+    'location_folded': ('location', 100),
+    'city_folded': ('city', 100),
+    'county_folded': ('county', 100),
+}
+
+
+def _backfill(model, fields):
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        for obj in batch:
+            for folded, (source, max_length) in fields.items():
+                setattr(obj, folded, fold_text(getattr(obj, source), max_length=max_length))
+        model.objects.bulk_update(batch, list(fields))
+        last_pk = batch[-1].pk
+
+
+def backfill_folded_fields(apps, schema_editor):
+    _backfill(apps.get_model('marketplace', 'Category'), {'name_folded': ('name', 100)})
+    _backfill(apps.get_model('marketplace', 'Listing'), LISTING_FOLDED_FIELDS)
+
+
+# PostgresFTSBackend's document as of this migration, frozen like 0015's
+POSTGRES_TABLE = 'marketplace_listing_search'
+POSTGRES_WEIGHTS = (
+    ('title', 'A'),
+    ('location', 'B'),
+    ('city', 'B'),
+    ('description', 'C'),
+    ('county', 'D'),
+    ('address', 'D'),
+)
+
+
+def fold_search_documents(apps, schema_editor):
+    """'simple' keeps diacritics, so index every column folded, as PostgresFTSBackend does"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    document = ' || '.join(
+        f"setweight(to_tsvector('simple', COALESCE(%s, '')), '{weight}')" for _, weight in POSTGRES_WEIGHTS
+    )
+    sql = (
+        f"INSERT INTO {POSTGRES_TABLE} (listing_id, document) VALUES (%s, {document}) "
+        f"ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document"
+    )
+    Listing = apps.get_model('marketplace', 'Listing')
+    rows = Listing.objects.order_by('pk').values_list('pk', *[field for field, _ in POSTGRES_WEIGHTS])
+    with connection.cursor() as cursor:
+        batch = []
+        for pk, *values in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append([pk, *[fold_text(value) for value in values]])
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0015_listing_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='name_folded',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='city_folded',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='county_folded',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='location_folded',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='title_folded',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city_folded', 'status'], name='marketplace_city_fo_673df9_idx'),
+        ),
+        migrations.RunPython(backfill_folded_fields, migrations.RunPython.noop),
+        migrations.RunPython(fold_search_documents, migrations.RunPython.noop),
+    ]
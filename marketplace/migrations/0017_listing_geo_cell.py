@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+from marketplace.utils.geo import grid_cell
+
+BATCH_SIZE = 1000
+
+
+def backfill_geo_cells(apps, schema_editor):
+    Listing = apps.get_model('marketplace', 'Listing')
+    located = Listing.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    last_pk = 0
+    while True:
+        batch = list(located.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        for listing in batch:
+            listing.geo_cell = grid_cell(listing.latitude, listing.longitude)
+        Listing.objects.bulk_update(batch, ['geo_cell'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0016_listing_folded_search_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='geo_cell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['geo_cell', 'status'], name='marketplace_geo_cel_60685d_idx'),
+        ),
+        migrations.RunPython(backfill_geo_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0017_listing_geo_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTermCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('listing', 'Listing search'), ('location', 'Location search')], max_length=10)),
+                ('term', models.CharField(max_length=100)),
+                ('label', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'date', 'count'], name='marketplace_kind_1cdcf4_idx')],
+                'unique_together': {('kind', 'term', 'date')},
+            },
+        ),
+    ]
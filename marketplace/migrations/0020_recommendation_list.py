@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('marketplace', '0019_interactionevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationList',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('entries', models.BinaryField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0020_recommendation_list'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useranalytics',
+            name='unique_viewers',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ListingVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sketch', models.BinaryField()),
+                ('listing', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='marketplace.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='marketplace_date_b8aa78_idx')],
+                'unique_together': {('listing', 'date')},
+            },
+        ),
+    ]
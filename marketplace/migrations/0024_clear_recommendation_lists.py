@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def clear_recommendation_lists(apps, schema_editor):
+    # Lists stored before listing pks were packed as 64-bit integers would be
+    # misread; users get popular listings until precompute_recommendations runs
+    apps.get_model('marketplace', 'RecommendationList').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0023_listing_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_recommendation_lists, migrations.RunPython.noop),
+    ]
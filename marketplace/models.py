@@ -7,6 +7,8 @@ import uuid
 from math import radians, cos, sin, asin, sqrt
 import logging
 from .utils.cache_utils import ListingCache, invalidate_listing_cache
+from .utils.geo import grid_cell, within_radius
+from .utils.text import fold_text
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -27,6 +29,8 @@ class Category(models.Model):
         null=True,
         related_name="subcategories",
     )
+    # Case- and diacritic-folded copy of name for indexed lookups
+    name_folded = models.CharField(max_length=100, blank=True, default="", editable=False, db_index=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -38,10 +42,18 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        self.fill_folded_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'name_folded'}
         super().save(*args, **kwargs)
         # Invalidate cache after saving
         from .utils.cache_utils import CategoryCache
         CategoryCache.invalidate_categories()
+
+    def fill_folded_fields(self):
+        """Recompute the folded search key from name"""
+        self.name_folded = fold_text(self.name, max_length=100)
         
     def get_listings_count(self):
         """Safely get the count of listings for this category"""
@@ -110,6 +122,24 @@ class Listing(models.Model):
     metadata = models.JSONField(blank=True, null=True)  # For additional attributes
     is_verified = models.BooleanField(default=False)
 
+    # Case- and diacritic-folded copies of the searchable text fields,
+    # filled on save so lookups can use plain indexes instead of iexact/icontains
+    title_folded = models.CharField(max_length=200, blank=True, default="", editable=False, db_index=True)
+    location_folded = models.CharField(max_length=100, blank=True, default="", editable=False, db_index=True)
+    city_folded = models.CharField(max_length=100, blank=True, default="", editable=False)
+    county_folded = models.CharField(max_length=100, blank=True, default="", editable=False, db_index=True)
+
+    # Grid cell of (latitude, longitude), see utils.geo; kept in sync on save
+    geo_cell = models.BigIntegerField(blank=True, null=True, editable=False)
+
+    # Maps each folded column to its source field
+    FOLDED_FIELDS = {
+        "title_folded": "title",
+        "location_folded": "location",
+        "city_folded": "city",
+        "county_folded": "county",
+    }
+
     class Meta:
         ordering = ["-created_at"]
         indexes = [
@@ -119,15 +149,38 @@ class Listing(models.Model):
             models.Index(fields=["is_featured", "created_at"]),
             models.Index(fields=["price", "status"]),
             models.Index(fields=["city", "status"]),
+            models.Index(fields=["city_folded", "status"]),
             models.Index(fields=["latitude", "longitude"]),  # For geospatial queries
+            models.Index(fields=["geo_cell", "status"]),  # For radius queries
             models.Index(fields=["expires_at"]),  # For expiration jobs
             models.Index(fields=["location_verified"]),  # For verified listings
             models.Index(fields=["is_premium", "created_at"]),  # For premium listings
+            models.Index(fields=["updated_at"]),  # For in-process indexes catching up on changes
         ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.fill_folded_fields()
+        self.geo_cell = grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            extra_fields = {
+                folded for folded, source in self.FOLDED_FIELDS.items() if source in update_fields
+            }
+            if update_fields & {'latitude', 'longitude'}:
+                extra_fields.add('geo_cell')
+            kwargs['update_fields'] = update_fields | extra_fields
+        super().save(*args, **kwargs)
+
+    def fill_folded_fields(self):
+        """Recompute the folded search keys from their source fields"""
+        for folded, source in self.FOLDED_FIELDS.items():
+            max_length = self._meta.get_field(folded).max_length
+            setattr(self, folded, fold_text(getattr(self, source), max_length=max_length))
+
     @property
     def main_image(self):
         """Get the main image or first image if none marked as main"""
@@ -209,30 +262,19 @@ class Listing(models.Model):
     
     @classmethod
     def get_nearby_listings(cls, latitude, longitude, radius_km=10, exclude_listing=None):
-        """Get listings within a certain radius"""
-        from django.db.models import Q
-        from decimal import Decimal
-        from math import cos, radians
-        
-        # Rough conversion: 1 degree ≈ 111 km
-        lat_range = Decimal(str(radius_km)) / Decimal('111')
-        lon_range = lat_range / Decimal(str(cos(radians(float(latitude)))))
-        
-        min_lat = Decimal(str(latitude)) - lat_range
-        max_lat = Decimal(str(latitude)) + lat_range
-        min_lon = Decimal(str(longitude)) - lon_range
-        max_lon = Decimal(str(longitude)) + lon_range
-        
-        queryset = cls.objects.filter(
-            latitude__range=(min_lat, max_lat),
-            longitude__range=(min_lon, max_lon),
-            status='active'
-        ).exclude(latitude__isnull=True, longitude__isnull=True)
+        """
+        Get active listings within a certain radius, nearest first.
+        Each listing is annotated with ``distance_km``.
+        """
+        queryset = within_radius(
+            cls.objects.filter(status='active'),
+            float(latitude), float(longitude), float(radius_km)
+        )
         
         if exclude_listing:
             queryset = queryset.exclude(pk=exclude_listing.pk)
         
-        return queryset
+        return queryset.order_by('distance_km')
 
 
 class Report(models.Model):
@@ -563,35 +605,140 @@ class UserAnalytics(models.Model):
     """Track user analytics for premium users"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='analytics')
     total_views = models.PositiveIntegerField(default=0)
+    # Estimated distinct visitors of all the user's listings lately, see utils.unique_visitors
+    unique_viewers = models.PositiveIntegerField(default=0)
     total_messages = models.PositiveIntegerField(default=0)
     total_favorites = models.PositiveIntegerField(default=0)
     total_listings = models.PositiveIntegerField(default=0)
     total_sales = models.PositiveIntegerField(default=0)
     conversion_rate = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
     last_updated = models.DateTimeField(auto_now=True)
-    monthly_data = models.JSONField(default=dict)  # Store monthly breakdown
+    # Day by day figures are in SellerDailyStats
     
     def __str__(self):
         return f"Analytics for {self.user.username}"
     
     def update_analytics(self):
-        """Update analytics data"""
-        from . import models  # Import to access Listing model
-        self.total_listings = models.Listing.objects.filter(user=self.user).count()
-        self.total_views = sum(listing.views for listing in models.Listing.objects.filter(user=self.user))
-        self.total_messages = models.Message.objects.filter(receiver=self.user).count()
-        
-        # Calculate favorites for user's listings
-        user_listings = models.Listing.objects.filter(user=self.user)
-        self.total_favorites = sum(models.Favorite.objects.filter(listing=listing).count() for listing in user_listings)
-        
-        # Calculate conversion rate (favorites to messages ratio)
-        if self.total_favorites > 0:
-            self.conversion_rate = (self.total_messages / self.total_favorites) * 100
-        
+        """Recompute all totals with a few aggregate queries, see services.user_analytics"""
+        from .services.user_analytics import compute
+        for field, value in compute([self.user_id])[self.user_id].items():
+            setattr(self, field, value)
         self.save()
 
 
+class SearchTermCount(models.Model):
+    """Daily search count of one folded query, written by search.popular"""
+    KIND_CHOICES = [
+        ('listing', 'Listing search'),
+        ('location', 'Location search'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    term = models.CharField(max_length=100)  # folded, see utils.text.fold_text
+    label = models.CharField(max_length=100)  # as first typed by a user
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('kind', 'term', 'date')
+        indexes = [
+            models.Index(fields=['kind', 'date', 'count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.label} ({self.date}): {self.count}"
+
+
+class InteractionEvent(models.Model):
+    """One view, favorite or contact on a listing, written in batches by recommendations.data.events"""
+    KIND_CHOICES = [
+        ('view', 'View'),
+        ('favorite', 'Favorite'),
+        ('unfavorite', 'Favorite removed'),
+        ('contact', 'Contact'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # No constraints: events outlive the listings and users they mention
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True,
+                             db_constraint=False, related_name='+')
+    listing = models.ForeignKey(Listing, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    session_key = models.CharField(max_length=40, blank=True)  # identifies anonymous visitors
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'created_at']),
+            models.Index(fields=['listing', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} of listing {self.listing_id} at {self.created_at}"
+
+
+class ListingVisitorSketch(models.Model):
+    """Distinct visitors of a listing on one day, written by utils.unique_visitors"""
+    # No constraint: sketches are flushed in batches and may outlive their listing
+    listing = models.ForeignKey(Listing, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    date = models.DateField()
+    # Compressed HyperLogLog registers, see utils.hyperloglog
+    sketch = models.BinaryField()
+
+    class Meta:
+        unique_together = ('listing', 'date')
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"Visitors of listing {self.listing_id} on {self.date}"
+
+
+class DailyStats(models.Model):
+    """One day of views, favorites and contacts, rolled up by services.daily_stats"""
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    favorites = models.PositiveIntegerField(default=0)  # added that day
+    messages = models.PositiveIntegerField(default=0)   # about a listing
+    contacts = models.PositiveIntegerField(default=0)   # distinct users who sent them
+
+    class Meta:
+        abstract = True
+
+
+class ListingDailyStats(DailyStats):
+    # No constraint: the figures outlive the listing
+    listing = models.ForeignKey(Listing, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+    class Meta:
+        unique_together = ('listing', 'date')
+
+    def __str__(self):
+        return f"Listing {self.listing_id} on {self.date}"
+
+
+class SellerDailyStats(DailyStats):
+    """The figures of all of a seller's listings; contacts are distinct over all of them"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = ('user', 'date')
+
+    def __str__(self):
+        return f"Seller {self.user_id} on {self.date}"
+
+
+class RecommendationList(models.Model):
+    """A user's precomputed recommendations, see recommendations.services.precomputed"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    # (listing pk, score) pairs packed as little-endian int64 / float32, best first
+    entries = models.BinaryField()
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Recommendations for user {self.user_id}"
+
+
 class Location(models.Model):
     """Model for managing locations and geographical data"""
     name = models.CharField(max_length=255)
@@ -0,0 +1,320 @@
+"""
+Keyset (cursor) pagination for listing feeds, search results and the API.
+Pages are fetched with a WHERE on the last row's sort key instead of OFFSET,
+so deep pages cost the same as the first one. Totals come from a COUNT(*)
+cached until the next listing save or delete, or COUNT_CACHE_TIMEOUT
+seconds (bulk updates are seen after the timeout).
+With cache_pages the primary keys of each page are read through SearchCache,
+which is invalidated by every listing save or delete.
+"""
+import base64
+import binascii
+import datetime
+import json
+import operator
+from collections import OrderedDict
+from collections.abc import Sequence
+from decimal import Decimal
+from functools import reduce
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .utils.cache_utils import (
+    CACHE_PREFIX_SEARCH,
+    CACHE_TIMEOUT_SHORT,
+    SearchCache,
+    get_generation,
+    make_queryset_cache_key,
+)
+
+CURSOR_PARAM = 'cursor'
+COUNT_CACHE_TIMEOUT = CACHE_TIMEOUT_SHORT
+DEFAULT_ORDERING = ('-created_at', '-id')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded or does not fit the ordering"""
+
+
+def cached_count(queryset, timeout: int = COUNT_CACHE_TIMEOUT) -> int:
+    """COUNT(*) of queryset, cached per distinct SQL statement and search cache generation"""
+    key = make_queryset_cache_key('listing_count', queryset, get_generation(CACHE_PREFIX_SEARCH))
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, reverse: bool = False) -> str:
+    payload = json.dumps({'k': [_encode_value(v) for v in values], 'r': int(reverse)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[list, bool]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return list(payload['k']), bool(payload['r'])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+class KeysetPage(Sequence):
+    """A page of results with cursors to its neighbours, template-compatible with Page"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_querystring = ''
+        self.previous_querystring = ''
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by its sort key.
+    ordering defaults to the queryset's own ordering; the primary key is
+    appended as a tie-breaker so every row has a unique position.
+    cache_pages caches the page's primary keys in SearchCache; only use it
+    for Listing querysets, whose writes invalidate that cache.
+    """
+
+    def __init__(self, queryset, per_page: int = 20, ordering=None, cache_pages: bool = False):
+        self.per_page = per_page
+        self.cache_pages = cache_pages
+        self.ordering = self._resolve_ordering(queryset, ordering)
+        self.queryset = queryset
+        self._keys = [(name.lstrip('-'), name.startswith('-'), self._is_nullable(queryset, name.lstrip('-')))
+                      for name in self.ordering]
+
+    @staticmethod
+    def _is_sort_key(queryset, name) -> bool:
+        if not isinstance(name, str) or '__' in name or not name.lstrip('-'):
+            return False
+        name = name.lstrip('-')
+        if name == 'pk' or name in queryset.query.annotations:
+            return True
+        try:
+            queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    @classmethod
+    def _resolve_ordering(cls, queryset, ordering) -> Tuple[str, ...]:
+        ordering = list(ordering or queryset.query.order_by or queryset.model._meta.ordering or DEFAULT_ORDERING)
+        if not all(cls._is_sort_key(queryset, name) for name in ordering):
+            ordering = list(DEFAULT_ORDERING)
+        ordering = ['-id' if name == '-pk' else 'id' if name == 'pk' else name for name in ordering]
+        if not any(name.lstrip('-') == 'id' for name in ordering):
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return tuple(ordering)
+
+    @staticmethod
+    def _is_nullable(queryset, name) -> bool:
+        if name in queryset.query.annotations:
+            return False
+        return queryset.model._meta.get_field(name).null
+
+    @cached_property
+    def count(self) -> int:
+        """Approximate total, see cached_count"""
+        return cached_count(self.queryset)
+
+    def _order_by(self, reverse: bool):
+        expressions = []
+        for name, descending, nullable in self._keys:
+            if reverse:
+                descending = not descending
+            if not nullable:
+                expressions.append(f'-{name}' if descending else name)
+                continue
+            # Pin NULL placement so it does not depend on the database vendor
+            nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+            expressions.append(F(name).desc(**nulls) if descending else F(name).asc(**nulls))
+        return expressions
+
+    def _seek(self, values, reverse: bool) -> Q:
+        """
+        Rows strictly after (or before, when reverse) the given sort key.
+        NULLs always sort last in the forward direction.
+        """
+        conditions = []
+        equal = Q()
+        for (name, descending, nullable), value in zip(self._keys, values):
+            if value is None:
+                # Nothing sorts after NULL, every non-NULL value sorts before it
+                step = Q(**{f'{name}__isnull': False}) if reverse else None
+                equal_step = Q(**{f'{name}__isnull': True})
+            else:
+                forward_lookup = 'lt' if descending else 'gt'
+                backward_lookup = 'gt' if descending else 'lt'
+                step = Q(**{f'{name}__{backward_lookup if reverse else forward_lookup}': value})
+                if nullable and not reverse:
+                    step |= Q(**{f'{name}__isnull': True})
+                equal_step = Q(**{name: value})
+            if step is not None:
+                conditions.append(equal & step)
+            equal &= equal_step
+        return reduce(operator.or_, conditions, Q(pk__in=[]))
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        values, reverse = decode_cursor(cursor) if cursor else ([], False)
+        if values and len(values) != len(self._keys):
+            raise InvalidCursor('Cursor does not match the ordering')
+
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        try:
+            if values:
+                queryset = queryset.filter(self._seek(values, reverse))
+            rows = self._fetch(queryset[:self.per_page + 1])
+        except (ValidationError, ValueError, TypeError):
+            if not values:
+                raise
+            raise InvalidCursor('Cursor values do not match the ordering')
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        # A forward page reached through a cursor always has rows before it,
+        # a backward page always has rows after it
+        has_next = has_more if not reverse else bool(values)
+        has_previous = has_more if reverse else bool(values)
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self._cursor_for(rows[-1], reverse=False)
+        if rows and has_previous:
+            previous_cursor = self._cursor_for(rows[0], reverse=True)
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    def _fetch(self, queryset) -> list:
+        if not self.cache_pages:
+            return list(queryset)
+        ids = SearchCache.get_result_ids(queryset)
+        if ids is None:
+            rows = list(queryset)
+            SearchCache.set_result_ids(queryset, [row.pk for row in rows])
+            return rows
+        # Reload by primary key, keeping the annotations of the original queryset
+        by_pk = {row.pk: row for row in self.queryset.order_by().filter(pk__in=ids)}
+        return [by_pk[pk] for pk in ids if pk in by_pk]
+
+    def get_page(self, params) -> KeysetPage:
+        """
+        Like Paginator.get_page: read the cursor from request parameters,
+        fall back to the first page on a bad cursor and build the
+        querystrings of the neighbouring pages.
+        """
+        try:
+            page = self.page(params.get(CURSOR_PARAM))
+        except InvalidCursor:
+            page = self.page()
+        for attr, cursor in (('next_querystring', page.next_cursor), ('previous_querystring', page.previous_cursor)):
+            if cursor:
+                query = params.copy()
+                query.pop('page', None)
+                query[CURSOR_PARAM] = cursor
+                setattr(page, attr, query.urlencode())
+        return page
+
+    def _cursor_for(self, obj, reverse: bool) -> str:
+        return encode_cursor([getattr(obj, name) for name, _, _ in self._keys], reverse=reverse)
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination backed by KeysetPaginator.
+    The response keeps the count/next/previous/results shape of page-number pagination.
+    Pages are cached by primary key, so it is meant for Listing endpoints.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = CURSOR_PARAM
+    cache_pages = True
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None) -> List:
+        self.request = request
+        self.paginator = KeysetPaginator(
+            queryset, per_page=self.get_page_size(request), cache_pages=self.cache_pages
+        )
+        try:
+            self.page = self.paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor as exc:
+            raise NotFound(str(exc))
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.paginator.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,31 @@
+from .events import (
+    CONTACT,
+    FAVORITE,
+    UNFAVORITE,
+    VIEW,
+    DatabaseSink,
+    Event,
+    EventCollector,
+    EventSink,
+    FileSink,
+    RedisSink,
+    collector,
+    get_sink,
+    record_listing_view,
+)
+
+__all__ = [
+    'CONTACT',
+    'FAVORITE',
+    'UNFAVORITE',
+    'VIEW',
+    'DatabaseSink',
+    'Event',
+    'EventCollector',
+    'EventSink',
+    'FileSink',
+    'RedisSink',
+    'collector',
+    'get_sink',
+    'record_listing_view',
+]
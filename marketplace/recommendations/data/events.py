@@ -0,0 +1,358 @@
+"""
+Interaction events: listing views, favorites and contacts.
+Request threads only append events to a bounded in-process ring buffer; a
+background thread drains it every FLUSH_INTERVAL seconds, or as soon as
+FLUSH_SIZE events are waiting, writing each batch to the configured sink
+in one round-trip and handing it to in-process subscribers such as the
+view counter; the recommender's worker reads them back from the sink (see
+EventSink.since). The sink is picked from settings.INTERACTION_EVENT_SINK:
+'database' (InteractionEvent rows), 'redis' (a capped stream) or 'file'
+(JSON lines). When the buffer is full the oldest events are dropped and
+counted, so a slow sink never blocks or grows a request thread's memory.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from marketplace.utils.background import background_safe, table_exists
+from marketplace.utils.unique_visitors import unique_visitors, visitor_fingerprint
+from marketplace.utils.view_counter import view_counter
+
+logger = logging.getLogger(__name__)
+
+VIEW = 'view'
+FAVORITE = 'favorite'
+UNFAVORITE = 'unfavorite'
+CONTACT = 'contact'
+
+BUFFER_SIZE = 50000
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 5
+
+# InteractionEvent rows older than this are purged, at most once per PURGE_INTERVAL
+RETENTION_DAYS = 90
+PURGE_INTERVAL = 3600
+
+REDIS_STREAM = 'interaction_events'
+REDIS_STREAM_LENGTH = 1_000_000
+
+
+class Event(NamedTuple):
+    kind: str
+    user_id: Optional[int]
+    listing_id: int
+    session_key: str
+    created_at: datetime
+
+
+Listener = Callable[[List[Event]], None]
+
+
+class EventSink(ABC):
+    """Where flushed batches of events are stored"""
+
+    # False when only the recording thread may write, see EventCollector.record
+    background_safe = True
+
+    @abstractmethod
+    def write(self, events: List[Event]):
+        """Store a batch of events in one round-trip"""
+        pass
+
+    def recent(self, kinds: Iterable[str], limit: int) -> List[Event]:
+        """The newest stored events of signed-in users of the given kinds, newest first"""
+        return []
+
+    def since(self, position, limit: int) -> Optional[Tuple[List[Event], object]]:
+        """
+        Stored events of signed-in users after position, oldest first, and
+        the position after them; position None starts from the newest
+        stored event. None when the sink cannot be read back in order.
+        """
+        return None
+
+
+class DatabaseSink(EventSink):
+    def __init__(self):
+        # The first write purges, however long the host has been up
+        self._purged_at = float('-inf')
+
+    @property
+    def background_safe(self) -> bool:
+        return background_safe()
+
+    def write(self, events: List[Event]):
+        from marketplace.models import InteractionEvent
+
+        InteractionEvent.objects.bulk_create(
+            [InteractionEvent(kind=event.kind, user_id=event.user_id, listing_id=event.listing_id,
+                              session_key=event.session_key, created_at=event.created_at)
+             for event in events],
+            batch_size=FLUSH_SIZE,
+        )
+        if time.monotonic() - self._purged_at >= PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            InteractionEvent.objects.filter(
+                created_at__lt=timezone.now() - timedelta(days=RETENTION_DAYS)
+            ).delete()
+
+    def recent(self, kinds: Iterable[str], limit: int) -> List[Event]:
+        from marketplace.models import InteractionEvent
+
+        rows = (
+            InteractionEvent.objects.filter(kind__in=list(kinds), user__isnull=False)
+            .order_by('-created_at')
+            .values_list('kind', 'user_id', 'listing_id', 'session_key', 'created_at')[:limit]
+        )
+        return [Event(*row) for row in rows.iterator(chunk_size=10000)]
+
+    def since(self, position, limit: int) -> Tuple[List[Event], int]:
+        from marketplace.models import InteractionEvent
+
+        if position is None:
+            return [], InteractionEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        rows = list(
+            InteractionEvent.objects.filter(pk__gt=position)
+            .order_by('pk')
+            .values_list('pk', 'kind', 'user_id', 'listing_id', 'session_key', 'created_at')[:limit]
+        )
+        events = [Event(*row[1:]) for row in rows if row[2] is not None]
+        return events, rows[-1][0] if rows else position
+
+
+class RedisSink(EventSink):
+    """Appends events to a Redis stream capped at about REDIS_STREAM_LENGTH entries"""
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or getattr(settings, 'INTERACTION_EVENT_REDIS_URL', 'redis://localhost:6379/0')
+        self._client = None
+
+    @property
+    def client(self):
+        # Connect on first use, never at import time
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def write(self, events: List[Event]):
+        pipeline = self.client.pipeline(transaction=False)
+        for event in events:
+            pipeline.xadd(REDIS_STREAM, {'event': _dumps(event)}, maxlen=REDIS_STREAM_LENGTH, approximate=True)
+        pipeline.execute()
+
+    def recent(self, kinds: Iterable[str], limit: int) -> List[Event]:
+        kinds = set(kinds)
+        events = []
+        last = '+'
+        while len(events) < limit:
+            entries = self.client.xrevrange(REDIS_STREAM, max=last, count=10000)
+            if last != '+':
+                entries = entries[1:]
+            if not entries:
+                break
+            for _, fields in entries:
+                event = _loads(fields[b'event'])
+                if event.kind in kinds and event.user_id is not None:
+                    events.append(event)
+            last = entries[-1][0]
+        return events[:limit]
+
+
+class FileSink(EventSink):
+    """Appends events to a JSON lines file, for development and tests"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or getattr(settings, 'INTERACTION_EVENT_FILE',
+                                    os.path.join(settings.BASE_DIR, 'var', 'interaction_events.jsonl'))
+        self._lock = threading.Lock()
+
+    def write(self, events: List[Event]):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as log:
+                log.write(''.join(_dumps(event) + '\n' for event in events))
+
+    def recent(self, kinds: Iterable[str], limit: int) -> List[Event]:
+        kinds = set(kinds)
+        try:
+            with open(self.path, encoding='utf-8') as log:
+                events = [_loads(line) for line in log if line.strip()]
+        except FileNotFoundError:
+            return []
+        return [event for event in reversed(events) if event.kind in kinds and event.user_id is not None][:limit]
+
+
+def _dumps(event: Event) -> str:
+    return json.dumps(event._replace(created_at=event.created_at.isoformat()))
+
+
+def _loads(data) -> Event:
+    kind, user_id, listing_id, session_key, created_at = json.loads(data)
+    return Event(kind, user_id, listing_id, session_key, datetime.fromisoformat(created_at))
+
+
+SINKS = {
+    'database': DatabaseSink,
+    'redis': RedisSink,
+    'file': FileSink,
+}
+
+
+def get_sink(name: Optional[str] = None) -> EventSink:
+    """Build the sink configured by settings.INTERACTION_EVENT_SINK"""
+    name = name or getattr(settings, 'INTERACTION_EVENT_SINK', 'database')
+    if name not in SINKS:
+        raise ValueError(f"Unknown interaction event sink {name!r}, expected one of {', '.join(SINKS)}")
+    return SINKS[name]()
+
+
+class EventCollector:
+    """Buffered interaction event pipeline, see module docstring"""
+
+    def __init__(self, sink: Optional[EventSink] = None, background: bool = True, buffer_size: int = BUFFER_SIZE):
+        self._sink = sink
+        self.background = background
+        self.buffer_size = buffer_size
+        self._listeners: List[Listener] = []
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Forked workers start empty; their parent flushes its own buffer
+        self._buffer = deque(maxlen=self.buffer_size)
+        self._lock = threading.Lock()           # guards the buffer
+        self._flush_lock = threading.Lock()     # keeps batches in order
+        self._wake = threading.Event()
+        self._thread = None
+        self._flushed_at = time.monotonic()
+        self.dropped = 0
+
+    @property
+    def sink(self) -> EventSink:
+        if self._sink is None:
+            self._sink = get_sink()
+        return self._sink
+
+    @property
+    def pending(self) -> int:
+        """Events buffered, not flushed yet"""
+        return len(self._buffer)
+
+    def subscribe(self, listener: Listener):
+        """Call listener with every flushed batch, from the flushing thread"""
+        self._listeners.append(listener)
+
+    def record(self, kind: str, listing_id: int, user_id: Optional[int] = None, session_key: Optional[str] = None):
+        """
+        Queue one event. Without a background thread (disabled, or a sink
+        that only the recording thread may write) a due flush runs inline.
+        """
+        event = Event(kind, user_id, listing_id, session_key or '', timezone.now())
+        with self._lock:
+            if len(self._buffer) == self.buffer_size:
+                self.dropped += 1
+            self._buffer.append(event)
+            waiting = len(self._buffer)
+        if self.background and self.sink.background_safe:
+            self._ensure_thread()
+            if waiting >= FLUSH_SIZE:
+                self._wake.set()
+        elif waiting >= FLUSH_SIZE or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='interaction-events', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self) -> int:
+        """Write the buffered events to the sink and subscribers; returns how many"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+                self._flushed_at = time.monotonic()
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                logger.warning(f"Interaction event buffer overflowed, dropped {dropped} events")
+            if not events:
+                return 0
+            try:
+                self.sink.write(events)
+            except Exception as e:
+                logger.error(f"Failed to write {len(events)} interaction events: {e}")
+            for listener in self._listeners:
+                try:
+                    listener(events)
+                except Exception as e:
+                    logger.error(f"Interaction event listener {listener!r} failed: {e}")
+            return len(events)
+
+    def since(self, position, limit: int) -> Optional[Tuple[List[Event], object]]:
+        """Stored events after position, oldest first; see EventSink.since"""
+        try:
+            return self.sink.since(position, limit)
+        except Exception as e:
+            logger.error(f"Failed to read stored interaction events: {e}")
+            return [], position
+
+    def recent(self, kinds: Iterable[str], limit: int) -> List[Event]:
+        """Stored events of signed-in users, newest first; see EventSink.recent"""
+        try:
+            return self.sink.recent(kinds, limit)
+        except Exception as e:
+            logger.error(f"Failed to read recent interaction events: {e}")
+            return []
+
+
+collector = EventCollector()
+
+
+def _flush_at_exit():
+    """Flush the events still buffered when the process exits, if their table is still there"""
+    from marketplace.models import InteractionEvent
+
+    if not collector.pending:
+        return
+    if isinstance(collector.sink, DatabaseSink) and not table_exists(InteractionEvent):
+        return
+    collector.flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+def record_listing_view(request, listing_id: int):
+    """Count a detail page or API view of a listing and its visitor, and record it for the user or session"""
+    view_counter.add(listing_id)
+    unique_visitors.add(listing_id, visitor_fingerprint(request))
+    session = getattr(request, 'session', None)
+    collector.record(
+        VIEW, listing_id,
+        user_id=request.user.pk if request.user.is_authenticated else None,
+        session_key=session.session_key if session is not None else None,
+    )
@@ -0,0 +1,299 @@
+"""
+Offline evaluation of recommenders.
+A favorites dataset (the live Favorite table, a CSV file of user, listing,
+timestamp rows, or a synthetic one) is split by time: favorites before the
+cutoff are the training set, later ones are held out. Every registered
+recommender (see services.RECOMMENDERS) is trained on the training set and
+asked for k listings per test user; precision@k and recall@k are measured
+against the held-out favorites, coverage is the share of listings ever
+recommended. Training time, peak traced memory while training and per-query
+latency percentiles are reported alongside.
+
+Every run happens in a scratch database (see utils.scratch_database) that
+is dropped afterwards: the dataset, live favorites included, is written
+there as new users and listings, and the interaction event pipeline is
+pointed at it, with no subscribers, for the run. Live listings are never
+locked or hidden and no event of the run reaches the live counters.
+"""
+import csv
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from marketplace.models import Category, Favorite, InteractionEvent, Listing
+from marketplace.utils.scratch_database import scratch_database
+from .data.events import CONTACT, VIEW, DatabaseSink, collector
+from .services import RECOMMENDERS
+from .services.collaborative_filtering import MAX_RECENT_INTERACTIONS
+
+User = get_user_model()
+
+DEFAULT_K = 10
+TEST_FRACTION = 0.2
+MAX_TEST_USERS = 1000
+SIMILAR_QUERIES = 200
+PERCENTILES = (50, 95, 99)
+
+Interaction = Tuple[int, int, datetime]  # (user key, listing key, favorited at)
+StoredEvent = Tuple[str, int, int, datetime]  # (kind, user key, listing key, created at)
+
+
+@dataclass
+class Dataset:
+    favorites: List[Interaction]
+    # Listing key -> title, description (the title when missing) and category key
+    titles: Dict[int, str] = field(default_factory=dict)
+    descriptions: Dict[int, str] = field(default_factory=dict)
+    categories: Dict[int, int] = field(default_factory=dict)
+    # Views and contacts of signed-in users
+    events: List[StoredEvent] = field(default_factory=list)
+
+
+@dataclass
+class Split:
+    train: List[Interaction]
+    held_out: Dict[int, Set[int]]  # user key -> listing keys favorited after the cutoff
+    cutoff: datetime
+
+
+@dataclass
+class EvaluationResult:
+    name: str
+    users: int
+    k: int
+    precision: float
+    recall: float
+    coverage: float
+    train_seconds: float
+    peak_memory: int  # bytes allocated while training, as traced by tracemalloc
+    recommend_latency: Dict[int, float]  # percentile -> milliseconds
+    similar_latency: Dict[int, float]
+
+
+# Datasets
+
+def generate_dataset(users: int = 1000, listings: int = 500, favorites_per_user: int = 8, topics: int = 20,
+                     days: int = 90, seed: int = 0) -> Dataset:
+    """
+    Users favorite listings of two preferred topics, popular ones more
+    often, with a little noise; a topic's listings share title words and
+    every four topics share a category.
+    """
+    rng = np.random.default_rng(seed)
+    listing_topics = rng.integers(0, topics, listings)
+    by_topic = [np.flatnonzero(listing_topics == topic) for topic in range(topics)]
+    popularity = rng.pareto(1.5, listings) + 1
+    titles = {
+        key: f'Produs subiect{listing_topics[key]} varianta{listing_topics[key]}x{rng.integers(0, 3)}'
+        for key in range(listings)
+    }
+    categories = {key: int(listing_topics[key]) // 4 for key in range(listings)}
+
+    start = timezone.now() - timedelta(days=days)
+    favorites = []
+    for user in range(users):
+        candidates = np.concatenate([by_topic[topic] for topic in rng.choice(topics, 2, replace=False)])
+        count = min(max(int(rng.poisson(favorites_per_user)), 1), len(candidates))
+        if not count:
+            continue
+        weights = popularity[candidates] / popularity[candidates].sum()
+        chosen = set(rng.choice(candidates, count, replace=False, p=weights).tolist())
+        if rng.random() < 0.2:
+            chosen.add(int(rng.integers(0, listings)))
+        for key in chosen:
+            favorites.append((user, key, start + timedelta(seconds=float(rng.uniform(0, days * 86400)))))
+    return Dataset(favorites, titles, categories)
+
+
+def load_csv(path: str) -> Dataset:
+    """Rows of user, listing, ISO timestamp; a header row is skipped"""
+    favorites = []
+    with open(path, newline='', encoding='utf-8') as source:
+        for row in csv.reader(source):
+            if not row or not row[0].strip().lstrip('-').isdigit():
+                continue
+            favorited_at = parse_datetime(row[2].strip())
+            if timezone.is_naive(favorited_at):
+                favorited_at = timezone.make_aware(favorited_at)
+            favorites.append((int(row[0]), int(row[1]), favorited_at))
+    listings = {listing for _, listing, _ in favorites}
+    return Dataset(favorites, titles={key: f'Anunț {key}' for key in listings})
+
+
+def load_database() -> Dataset:
+    """The active listings with their favorites and the newest views and contacts currently stored"""
+    titles, descriptions, categories = {}, {}, {}
+    listings = Listing.objects.filter(status='active').values_list('pk', 'title', 'description', 'category_id')
+    for pk, title, description, category_id in listings.iterator(chunk_size=10000):
+        titles[pk], descriptions[pk], categories[pk] = title, description, category_id
+    favorites = Favorite.objects.filter(listing__status='active').values_list('user_id', 'listing_id', 'created_at')
+    events = (
+        InteractionEvent.objects.filter(kind__in=[VIEW, CONTACT], user__isnull=False)
+        .order_by('-created_at')
+        .values_list('kind', 'user_id', 'listing_id', 'created_at')[:MAX_RECENT_INTERACTIONS]
+    )
+    return Dataset(
+        list(favorites.iterator(chunk_size=10000)), titles, descriptions, categories,
+        [event for event in events.iterator(chunk_size=10000) if event[2] in titles],
+    )
+
+
+def time_split(favorites: Sequence[Interaction], test_fraction: float = TEST_FRACTION) -> Split:
+    """Hold out the newest test_fraction of favorites, for users with earlier ones"""
+    if not favorites:
+        return Split([], {}, timezone.now())
+    times = sorted(favorited_at for _, _, favorited_at in favorites)
+    cutoff = times[min(int(len(times) * (1 - test_fraction)), len(times) - 1)]
+    train = [favorite for favorite in favorites if favorite[2] < cutoff]
+    trained_users = {user for user, _, _ in train}
+    held_out = {}
+    for user, listing, favorited_at in favorites:
+        if favorited_at >= cutoff and user in trained_users:
+            held_out.setdefault(user, set()).add(listing)
+    return Split(train, held_out, cutoff)
+
+
+def materialize(dataset: Dataset, split: Split) -> Tuple[Dict[int, int], Dict[int, int]]:
+    """
+    Write the training set to the (scratch) database; returns the user and
+    listing pks of the keys. Only bulk writes are used, so no signal
+    handler sees the rows.
+    """
+    run = uuid.uuid4().hex[:8]
+    seller, = User.objects.bulk_create([User(username=f'eval-{run}-seller')])
+    category_keys = list(set(dataset.categories.values()) | {None})
+    categories = dict(zip(category_keys, Category.objects.bulk_create([
+        Category(name=f'Evaluare {key}', slug=f'eval-{run}-{key}') for key in category_keys
+    ])))
+    user_keys = sorted({user for user, _, _ in dataset.favorites} | {user for _, user, _, _ in dataset.events})
+    users = User.objects.bulk_create([User(username=f'eval-{run}-{key}') for key in user_keys], batch_size=1000)
+    listing_keys = sorted(dataset.titles)
+    listings = [
+        Listing(title=dataset.titles[key], description=dataset.descriptions.get(key, dataset.titles[key]),
+                location='Evaluare', user=seller, category=categories[dataset.categories.get(key)],
+                status='active')
+        for key in listing_keys
+    ]
+    for listing in listings:
+        listing.fill_folded_fields()
+    listings = Listing.objects.bulk_create(listings, batch_size=1000)
+    user_pks = {key: user.pk for key, user in zip(user_keys, users)}
+    listing_pks = {key: listing.pk for key, listing in zip(listing_keys, listings)}
+    Favorite.objects.bulk_create(
+        [Favorite(user_id=user_pks[user], listing_id=listing_pks[listing])
+         for user, listing, _ in split.train if listing in listing_pks],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    InteractionEvent.objects.bulk_create(
+        [InteractionEvent(kind=kind, user_id=user_pks[user], listing_id=listing_pks[listing], created_at=created_at)
+         for kind, user, listing, created_at in dataset.events if created_at < split.cutoff],
+        batch_size=1000,
+    )
+    return user_pks, listing_pks
+
+
+@contextmanager
+def isolated_events():
+    """Store the events of the block in the (scratch) database and tell no subscriber about them"""
+    collector.flush()
+    saved = collector._sink, collector._listeners, collector.background
+    collector._sink, collector._listeners, collector.background = DatabaseSink(), [], False
+    try:
+        yield
+    finally:
+        collector._sink, collector._listeners, collector.background = saved
+
+
+# Evaluation
+
+def _percentiles(latencies: List[float]) -> Dict[int, float]:
+    if not latencies:
+        return {percentile: 0.0 for percentile in PERCENTILES}
+    values = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+    return dict(zip(PERCENTILES, values.tolist()))
+
+
+def evaluate(recommender_class, held_out: Dict[int, Set[int]], listing_pks: Sequence[int], k: int = DEFAULT_K,
+             seed: int = 0) -> EvaluationResult:
+    """Train one recommender on the current database and score it against held_out (user pk -> listing pks)"""
+    recommender = recommender_class()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        recommender.train_model()
+        train_seconds = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    users = User.objects.in_bulk(list(held_out))
+    precisions, recalls, latencies = [], [], []
+    recommended = set()
+    for user_pk, expected in held_out.items():
+        started = time.perf_counter()
+        items = recommender.recommend_for_user(users[user_pk], k)
+        latencies.append(time.perf_counter() - started)
+        ids = [item['id'] for item in items]
+        recommended.update(ids)
+        hits = len(expected.intersection(ids))
+        precisions.append(hits / k)
+        recalls.append(hits / len(expected))
+
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(np.array(listing_pks, dtype=np.int64), min(SIMILAR_QUERIES, len(listing_pks)),
+                         replace=False) if len(listing_pks) else []
+    similar_latencies = []
+    for listing_pk in queries:
+        started = time.perf_counter()
+        recommender.similar_items(int(listing_pk), k)
+        similar_latencies.append(time.perf_counter() - started)
+
+    return EvaluationResult(
+        name=recommender_class.name,
+        users=len(held_out),
+        k=k,
+        precision=float(np.mean(precisions)) if precisions else 0.0,
+        recall=float(np.mean(recalls)) if recalls else 0.0,
+        coverage=len(recommended) / len(listing_pks) if len(listing_pks) else 0.0,
+        train_seconds=train_seconds,
+        peak_memory=peak_memory,
+        recommend_latency=_percentiles(latencies),
+        similar_latency=_percentiles(similar_latencies),
+    )
+
+
+def run_evaluation(dataset: Dataset, names: Optional[Sequence[str]] = None, k: int = DEFAULT_K,
+                   test_fraction: float = TEST_FRACTION, max_users: int = MAX_TEST_USERS,
+                   seed: int = 0) -> List[EvaluationResult]:
+    """Split dataset by time and evaluate the named recommenders (all registered ones by default)"""
+    names = list(names or RECOMMENDERS)
+    unknown = [name for name in names if name not in RECOMMENDERS]
+    if unknown:
+        raise ValueError(f"Unknown recommenders {', '.join(unknown)}, expected some of {', '.join(RECOMMENDERS)}")
+
+    split = time_split(dataset.favorites, test_fraction)
+    rng = np.random.default_rng(seed)
+    test_users = sorted(split.held_out)
+    if len(test_users) > max_users:
+        test_users = sorted(rng.choice(test_users, max_users, replace=False).tolist())
+
+    with scratch_database(), isolated_events():
+        user_pks, listing_pks = materialize(dataset, split)
+        held_out = {
+            user_pks[user]: {listing_pks[listing] for listing in split.held_out[user] if listing in listing_pks}
+            for user in test_users
+        }
+        held_out = {user: expected for user, expected in held_out.items() if expected}
+        return [
+            evaluate(RECOMMENDERS[name], held_out, sorted(listing_pks.values()), k, seed)
+            for name in names
+        ]
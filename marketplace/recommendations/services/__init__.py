@@ -1,7 +1,12 @@
-from .base_recommender import BaseRecommender
+from .base_recommender import RECOMMENDERS, BaseRecommender
 from .collaborative_filtering import CollaborativeFilteringRecommender
+from .content_based import ContentBasedRecommender
+from .popularity import PopularityRecommender
 
 __all__ = [
+    'RECOMMENDERS',
     'BaseRecommender',
     'CollaborativeFilteringRecommender',
+    'ContentBasedRecommender',
+    'PopularityRecommender',
 ]
@@ -1,12 +1,24 @@
 
+import heapq
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List
 from django.contrib.auth import get_user_model
+from marketplace.models import Listing
 
 User = get_user_model()
 
+# name -> BaseRecommender subclass, for evaluation; subclasses register by setting name
+RECOMMENDERS: Dict[str, type] = {}
+
+
 class BaseRecommender(ABC):
     """Abstract base class for recommendation engines"""
+    name: str = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name:
+            RECOMMENDERS[cls.name] = cls
     
     @abstractmethod
     def recommend_for_user(self, user: User, limit: int = 5) -> List[dict]:
@@ -22,3 +34,23 @@ class BaseRecommender(ABC):
     def train_model(self):
         """Retrain recommendation model"""
         pass
+
+
+def listing_summaries(scores: Dict[int, float], limit: int, exclude=()) -> List[Dict]:
+    """The best scored active listings as API dicts, best first"""
+    exclude = set(exclude)
+    # Over-fetch a little, some candidates may no longer be active
+    candidates = heapq.nlargest(limit * 2, (pk for pk in scores if pk not in exclude), key=scores.__getitem__)
+    listings = Listing.objects.filter(pk__in=candidates, status='active').select_related('category')
+    by_pk = {listing.pk: listing for listing in listings}
+    return [
+        {
+            'id': pk,
+            'title': by_pk[pk].title,
+            'price': str(by_pk[pk].price) if by_pk[pk].price is not None else None,
+            'city': by_pk[pk].city,
+            'category': by_pk[pk].category.name,
+            'score': round(scores[pk], 4),
+        }
+        for pk in candidates if pk in by_pk
+    ][:limit]
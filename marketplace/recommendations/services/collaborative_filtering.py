@@ -1,46 +1,424 @@
+"""
+Item-based collaborative filtering over listing favorites and views.
+Interactions are streamed into a sparse user x item matrix, and every
+listing keeps its TOP_NEIGHBOURS most similar listings (cosine over the
+users who interacted with both) in flat arrays. A user's recommendations
+are the listings most similar to the ones they favorited; similar items
+are a row lookup.
 
+The model is updated online: apply_pending() reads the favorite,
+unfavorite, view and contact events every process stored since the last
+call (see data.events; with a sink that cannot be read back, only new
+favorites are polled) and applies them in one micro-batch, which
+recomputes the neighbour lists of the touched listings only. Every
+COMPACTION_INTERVAL seconds the model is retrained, which also folds in
+the small score drift the micro-batches leave in untouched lists. Web
+processes hold no model: they serve the lists precomputed from it by the
+precompute_recommendations worker (see precomputed).
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from typing import List, Dict
 import numpy as np
-from collections import defaultdict
-from .base_recommender import BaseRecommender
 from django.contrib.auth import get_user_model
-from marketplace.models import Listing, Favorite
+from django.db import connection
+from django.utils import timezone
+
+from marketplace.models import Favorite
+from ..data.events import CONTACT, FAVORITE, UNFAVORITE, VIEW, collector
+from .base_recommender import BaseRecommender, listing_summaries
+from .sparse import CSRMatrix, cooccurrence_neighbours, expand_rows, item_neighbours
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+TOP_NEIGHBOURS = 50
+
+# Only a user's most recent favorites count; heavy collectors add cost, not signal
+MAX_ITEMS_PER_USER = 500
+
+# Scoring a user's favorites must stay under this many seconds (checked by tests/test_performance.py)
+SCORE_LATENCY_TARGET = 0.05
+
+FAVORITE_WEIGHT = 1.0
+CONTACT_WEIGHT = 1.0
+VIEW_WEIGHT = 0.5
+
+# Seconds between reads of the interactions stored by every process
+POLL_INTERVAL = 5
+# Stored events applied per micro-batch
+POLL_BATCH = 10000
+
+COMPACTION_INTERVAL = 3600
+# Changed interactions after which compaction starts early
+MAX_DELTA_SIZE = 50000
+
+# View and contact interactions remembered for retraining (favorites are re-read
+# from the database); a new process starts from the newest stored events
+MAX_RECENT_INTERACTIONS = 1_000_000
+
+FAVORITE_STREAM_CHUNK = 10000
+
+Interaction = Tuple[int, int, float]  # (user pk, listing pk, weight); weight 0 removes
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ItemSimilarityModel:
+    """
+    Neighbour lists of every listing with interactions. Listings and users
+    are addressed by index: the trained ones in pk order, then the ones
+    first seen by apply() in arrival order.
+    """
+
+    def __init__(self, user_ids: np.ndarray, item_ids: np.ndarray, user_items: CSRMatrix,
+                 popularity: np.ndarray, synced_until=None, top_k: int = TOP_NEIGHBOURS):
+        self.top_k = top_k
+        self.user_ids = user_ids        # sorted user pks of the trained rows
+        self.item_ids = item_ids        # sorted listing pks of the trained columns
+        self.user_items = user_items
+        self.item_users = user_items.transpose()
+        self.neighbours = item_neighbours(user_items, top_k)
+        self.popularity = popularity    # favorites per trained item
+        self.synced_until = synced_until
+
+        # Online state, folded into the trained arrays by the next compaction
+        self.n_items = len(item_ids)
+        self.item_pks = item_ids.copy()
+        self.norms2 = np.bincount(user_items.indices, weights=user_items.data.astype(np.float64) ** 2,
+                                  minlength=len(item_ids))
+        self._new_items = {}            # listing pk -> index
+        self._new_users = {}            # user pk -> index
+        self._delta_by_user = {}        # user index -> {item index: weight}
+        self._delta_by_item = {}        # item index -> {user index: weight}
+        self._overrides = {}            # item index -> (neighbour indices, scores)
+        self.delta_size = 0
+
+    @classmethod
+    def train(cls, interactions: Iterable[Interaction] = (), top_k: int = TOP_NEIGHBOURS) -> 'ItemSimilarityModel':
+        synced_until = timezone.now()
+        rows = (
+            Favorite.objects.filter(listing__status='active')
+            .order_by('user_id', '-created_at')
+            .values_list('user_id', 'listing_id')
+        )
+        favorites = np.fromiter(rows.iterator(chunk_size=FAVORITE_STREAM_CHUNK),
+                                dtype=[('user', np.int64), ('item', np.int64)])
+
+        # Rows arrive grouped by user, newest first
+        users = favorites['user']
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.empty(0, dtype=np.int64)
+        rank = np.arange(len(users)) - np.repeat(starts, np.diff(np.r_[starts, len(users)]))
+        favorites = favorites[rank < MAX_ITEMS_PER_USER]
+
+        interactions = np.array(list(interactions), dtype=np.float64).reshape(-1, 3)
+        all_users = np.concatenate([favorites['user'], interactions[:, 0].astype(np.int64)])
+        all_items = np.concatenate([favorites['item'], interactions[:, 1].astype(np.int64)])
+        weights = np.r_[np.full(len(favorites), FAVORITE_WEIGHT), interactions[:, 2]]
+        user_ids, user_index = np.unique(all_users, return_inverse=True)
+        item_ids, item_index = np.unique(all_items, return_inverse=True)
+        user_items = CSRMatrix.from_coo(user_index, item_index, weights, (len(user_ids), len(item_ids)),
+                                        combine='max')
+        popularity = np.bincount(item_index[:len(favorites)], minlength=len(item_ids))
+        return cls(user_ids, item_ids, user_items, popularity, synced_until, top_k)
+
+    # Index mapping
+
+    def _lookup(self, trained: np.ndarray, new: dict, pk: int, create: bool = False) -> Optional[int]:
+        position = int(np.searchsorted(trained, pk))
+        if position < len(trained) and trained[position] == pk:
+            return position
+        index = new.get(pk)
+        if index is None and create:
+            index = new[pk] = len(trained) + len(new)
+        return index
+
+    def item_index(self, pk: int, create: bool = False) -> Optional[int]:
+        index = self._lookup(self.item_ids, self._new_items, pk, create)
+        if index is not None and index >= self.n_items:
+            self.n_items = index + 1
+            self.item_pks = _grow(self.item_pks, self.n_items)
+            self.item_pks[index] = pk
+            self.norms2 = _grow(self.norms2, self.n_items)
+        return index
+
+    def user_index(self, pk: int, create: bool = False) -> Optional[int]:
+        return self._lookup(self.user_ids, self._new_users, pk, create)
+
+    def positions(self, listing_ids) -> np.ndarray:
+        """Indices of the listings that have neighbour lists"""
+        listing_ids = np.asarray(listing_ids, dtype=np.int64)
+        positions = np.searchsorted(self.item_ids, listing_ids)
+        if len(self.item_ids):
+            trained = self.item_ids[np.minimum(positions, len(self.item_ids) - 1)] == listing_ids
+        else:
+            trained = np.zeros(len(listing_ids), dtype=bool)
+        new = [self._new_items[pk] for pk in listing_ids[~trained].tolist() if pk in self._new_items]
+        return np.r_[positions[trained], np.array(new, dtype=np.int64)].astype(np.int64)
+
+    # Online updates
+
+    def weight(self, user: int, item: int) -> float:
+        delta = self._delta_by_user.get(user)
+        if delta is not None and item in delta:
+            return delta[item]
+        if user < self.user_items.shape[0]:
+            cols, data = self.user_items.row(user)
+            position = np.searchsorted(cols, item)
+            if position < len(cols) and cols[position] == item:
+                return float(data[position])
+        return 0.0
+
+    def _merged_rows(self, base: CSRMatrix, rows: np.ndarray, delta: dict, n_cols: int):
+        """(row position, column, weight) of the given rows with online changes applied, sorted"""
+        trained = rows < base.shape[0]
+        positions, owner = expand_rows(base, rows[trained])
+        owners = [np.flatnonzero(trained)[owner]]
+        cols = [base.indices[positions].astype(np.int64)]
+        weights = [base.data[positions].astype(np.float64)]
+        for position, row in enumerate(rows.tolist()):
+            changes = delta.get(row)
+            if changes:
+                owners.append(np.full(len(changes), position))
+                cols.append(np.fromiter(changes.keys(), dtype=np.int64, count=len(changes)))
+                weights.append(np.fromiter(changes.values(), dtype=np.float64, count=len(changes)))
+        owners, cols, weights = np.concatenate(owners), np.concatenate(cols), np.concatenate(weights)
+        # Online changes come last and win
+        keys = owners * n_cols + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        keep = keep[weights[keep] != 0]
+        return owners[keep], cols[keep], weights[keep]
+
+    def apply(self, interactions: Iterable[Interaction]) -> List[int]:
+        """Apply interaction changes and recompute the neighbour lists they affect; returns their listing pks"""
+        dirty = set()
+        for user_pk, listing_pk, weight in interactions:
+            user = self.user_index(user_pk, create=True)
+            item = self.item_index(listing_pk, create=True)
+            old = self.weight(user, item)
+            new = 0.0 if weight == 0 else max(old, weight)
+            if new == old:
+                continue
+            # Items the user interacted with co-occur with this one
+            _, cols, _ = self._merged_rows(self.user_items, np.array([user]), self._delta_by_user, self.n_items)
+            dirty.update(cols.tolist())
+            dirty.add(item)
+            self._delta_by_user.setdefault(user, {})[item] = new
+            self._delta_by_item.setdefault(item, {})[user] = new
+            self.norms2[item] += new * new - old * old
+            self.delta_size += 1
+        if not dirty:
+            return []
+        items = np.array(sorted(dirty), dtype=np.int64)
+        self._recompute(items)
+        return self.item_pks[items].tolist()
+
+    def _recompute(self, items: np.ndarray):
+        n_users = self.user_items.shape[0] + len(self._new_users)
+        owner, users, item_weights = self._merged_rows(self.item_users, items, self._delta_by_item, n_users)
+        involved = np.unique(users)
+        user_owner, user_cols, user_weights = self._merged_rows(
+            self.user_items, involved, self._delta_by_user, self.n_items
+        )
+        indptr = np.zeros(len(involved) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(user_owner, minlength=len(involved)), out=indptr[1:])
+        user_items = CSRMatrix(indptr, user_cols, user_weights, (len(involved), self.n_items))
+
+        norms = np.sqrt(np.maximum(self.norms2[:self.n_items], 0))
+        rows, cols, scores = cooccurrence_neighbours(
+            items[owner], np.searchsorted(involved, users), item_weights, user_items, norms, self.top_k
+        )
+        bounds = np.searchsorted(rows, np.r_[items, items[-1] + 1])
+        for position, item in enumerate(items.tolist()):
+            span = slice(bounds[position], bounds[position + 1])
+            self._overrides[item] = (cols[span].astype(np.int32), scores[span].astype(np.float32))
+
+    # Lookup
+
+    def _row(self, item: int) -> Tuple[np.ndarray, np.ndarray]:
+        override = self._overrides.get(item)
+        if override is not None:
+            return override
+        if item < self.neighbours.shape[0]:
+            return self.neighbours.row(item)
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+    def similar(self, listing_id: int) -> Dict[int, float]:
+        positions = self.positions([listing_id])
+        if not len(positions):
+            return {}
+        cols, scores = self._row(positions[0])
+        return dict(zip(self.item_pks[cols].tolist(), scores.tolist()))
+
+    def score(self, listing_ids) -> Dict[int, float]:
+        """Summed similarity of every neighbour of the given listings"""
+        positions = self.positions(listing_ids)
+        overridden = np.array([position in self._overrides for position in positions.tolist()], dtype=bool)
+        trained = positions[~overridden]
+        spans, _ = expand_rows(self.neighbours, trained[trained < self.neighbours.shape[0]])
+        cols = [self.neighbours.indices[spans]]
+        scores = [self.neighbours.data[spans]]
+        for position in positions[overridden].tolist():
+            row_cols, row_scores = self._overrides[position]
+            cols.append(row_cols)
+            scores.append(row_scores)
+        cols, scores = np.concatenate(cols), np.concatenate(scores)
+        if not len(cols):
+            return {}
+        cols, inverse = np.unique(cols, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        return dict(zip(self.item_pks[cols].tolist(), totals.tolist()))
+
+    def most_popular(self, limit: int) -> Dict[int, float]:
+        best = np.argsort(-self.popularity, kind='stable')[:limit]
+        best = best[self.popularity[best] > 0]
+        return dict(zip(self.item_ids[best].tolist(), self.popularity[best].astype(float).tolist()))
+
+    def __len__(self):
+        return self.n_items
+
+
 class CollaborativeFilteringRecommender(BaseRecommender):
-    """User-based collaborative filtering recommender"""
-    
+    """Item-based collaborative filtering recommender, see module docstring"""
+    name = 'collaborative'
+
     def __init__(self):
-        self.user_similarity = None
-        self.user_vectors = None
-        
+        self._lock = threading.RLock()      # held while the model changes
+        self._interactions = deque(maxlen=MAX_RECENT_INTERACTIONS)  # recent views and contacts
+        self._seeded = False
+        self._event_position = None         # of the last stored event applied, see EventSink.since
+        self.model: Optional[ItemSimilarityModel] = None
+        self.trained_at = None
+        self._polled_at = 0.0
+        self._compacting = False
+
+    # Training
+
     def train_model(self):
-        """Train user-user similarity matrix"""
-        # Get all user favorites
-        favorites = Favorite.objects.all().select_related('user', 'listing')
-        
-        # Create user-item matrix
-        user_vectors = defaultdict(dict)
-        for fav in favorites:
-            user_vectors[fav.user.id][fav.listing.id] = 1
-            
-        self.user_vectors = dict(user_vectors)
-        self._calculate_similarities()
-        
-    def _calculate_similarities(self):
-        """Compute cosine similarity between users"""
-        # Implementation omitted for brevity
-        pass
-        
+        """Rebuild the item-item neighbour lists from all favorites and recent views and contacts"""
+        with self._lock:
+            started = time.perf_counter()
+            if not self._seeded:
+                self._seeded = True
+                # Events stored from here on are applied by apply_pending
+                _, self._event_position = collector.since(None, 0) or (None, None)
+                stored = collector.recent((VIEW, CONTACT), MAX_RECENT_INTERACTIONS)
+                self._interactions.extendleft(
+                    (event.user_id, event.listing_id, CONTACT_WEIGHT if event.kind == CONTACT else VIEW_WEIGHT)
+                    for event in stored
+                )
+            model = ItemSimilarityModel.train(self._interactions.copy())
+            self.model = model
+            self.trained_at = self._polled_at = time.monotonic()
+        logger.info(f"Recommender trained on {len(model)} listings in {time.perf_counter() - started:.2f}s")
+
+    def _compact(self):
+        try:
+            self.train_model()
+        except Exception as e:
+            logger.error(f"Recommender compaction failed: {e}")
+        finally:
+            self._compacting = False
+            connection.close()
+
+    def ensure_trained(self) -> ItemSimilarityModel:
+        """Train on first use, apply stored interactions and start compaction when due"""
+        if self.model is None:
+            with self._lock:
+                if self.model is None:
+                    self.train_model()
+        elif not self._compacting and (
+            time.monotonic() - self.trained_at > COMPACTION_INTERVAL or self.model.delta_size > MAX_DELTA_SIZE
+        ):
+            self._compacting = True
+            threading.Thread(target=self._compact, name='recommender-compaction', daemon=True).start()
+        if time.monotonic() - self._polled_at >= POLL_INTERVAL:
+            self.apply_pending()
+        return self.model
+
+    # Online updates
+
+    def apply_pending(self, block: bool = False) -> List[int]:
+        """
+        Apply the interactions stored since the last call, by any process;
+        returns the listings whose neighbour lists changed. Never waits for
+        a training or another call unless block.
+        """
+        if not self._lock.acquire(blocking=block):
+            return []
+        try:
+            model = self.model
+            if model is None:
+                return []
+            self._polled_at = time.monotonic()
+            interactions = self._poll_events()
+            if interactions is None:
+                interactions = self._poll_favorites(model)
+            return model.apply(interactions) if interactions else []
+        except Exception as e:
+            logger.error(f"Failed to apply recommender updates: {e}")
+            return []
+        finally:
+            self._lock.release()
+
+    def _poll_events(self) -> Optional[List[Interaction]]:
+        stored = collector.since(self._event_position, POLL_BATCH)
+        if stored is None:
+            return None
+        events, self._event_position = stored
+        interactions = []
+        for event in events:
+            if event.kind == FAVORITE:
+                interactions.append((event.user_id, event.listing_id, FAVORITE_WEIGHT))
+            elif event.kind == UNFAVORITE:
+                interactions.append((event.user_id, event.listing_id, 0.0))
+            elif event.kind in (VIEW, CONTACT):
+                weight = CONTACT_WEIGHT if event.kind == CONTACT else VIEW_WEIGHT
+                interaction = (event.user_id, event.listing_id, weight)
+                # Kept for the next compaction, which re-reads only favorites
+                self._interactions.append(interaction)
+                interactions.append(interaction)
+        return interactions
+
+    def _poll_favorites(self, model: ItemSimilarityModel) -> List[Interaction]:
+        rows = list(
+            Favorite.objects.filter(created_at__gte=model.synced_until, listing__status='active')
+            .order_by('created_at')
+            .values_list('user_id', 'listing_id', 'created_at')
+        )
+        if rows:
+            model.synced_until = rows[-1][2]
+        return [(user_id, listing_id, FAVORITE_WEIGHT) for user_id, listing_id, _ in rows]
+
+    # Recommendations
+
     def recommend_for_user(self, user: User, limit: int = 5) -> List[Dict]:
-        """Generate recommendations for user"""
-        # Implementation omitted for brevity
-        return []
-        
+        """Listings similar to the user's favorites, most popular ones for new users"""
+        model = self.ensure_trained()
+        favorites = list(
+            Favorite.objects.filter(user=user).order_by('-created_at')
+            .values_list('listing_id', flat=True)[:MAX_ITEMS_PER_USER]
+        )
+        scores = model.score(favorites)
+        if not scores:
+            scores = model.most_popular(limit + len(favorites))
+        return listing_summaries(scores, limit, exclude=favorites)
+
     def similar_items(self, listing_id: int, limit: int = 5) -> List[Dict]:
-        """Find similar listings using user behavior"""
-        # Implementation omitted for brevity  
-        return []
+        """Listings favorited by the same users as listing_id"""
+        model = self.ensure_trained()
+        return listing_summaries(model.similar(listing_id), limit, exclude=[listing_id])
+
 
+recommender = CollaborativeFilteringRecommender()
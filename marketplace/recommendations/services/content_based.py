@@ -0,0 +1,451 @@
+"""
+Content-based similar listings.
+Every active listing is described by TF-IDF weights of its title and
+description words, its category, its log-price and a coarse region. Its
+candidates are the listings sharing words with it, found through the
+inverted index of the words; they are scored as
+
+    TEXT_WEIGHT * text cosine + CATEGORY_WEIGHT * same category
+    + PRICE_WEIGHT * log-price closeness + REGION_WEIGHT * same region
+
+and the best TOP_SIMILAR are kept per listing. Large catalogues are scored
+in a process pool when the building process runs a single thread. Listings
+changed after the build are rescored when the search cache generation
+moves (any listing write, in any process), and the index is rebuilt every
+SIMILAR_REBUILD_INTERVAL seconds. Both run in background threads while the
+current index keeps answering (before the first build, similar listings are
+the newest of the same category).
+"""
+import logging
+import math
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+
+from marketplace.ai_search.embeddings import listing_text
+from marketplace.models import Favorite, Listing
+from marketplace.utils.background import BackgroundJob
+from marketplace.utils.cache_utils import CACHE_PREFIX_SEARCH, get_generation
+from marketplace.utils.geo import GRID_COLUMNS
+from marketplace.utils.text import fold_text
+from .base_recommender import BaseRecommender, listing_summaries
+from .sparse import CSRMatrix, block_neighbours, expand_rows, from_blocks, row_blocks, top_k_per_row
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+TOP_SIMILAR = 20
+# Listings sharing the most text with a listing that are rescored with all features
+TEXT_CANDIDATES = 200
+
+TEXT_WEIGHT = 0.55
+CATEGORY_WEIGHT = 0.25
+PRICE_WEIGHT = 0.12
+REGION_WEIGHT = 0.08
+
+# Prices this many times apart are not close at all
+PRICE_RATIO_BAND = 3.0
+
+# Grid cells (see utils.geo) per region edge, about 55 km
+REGION_CELLS = 5
+
+MIN_WORD_LENGTH = 3
+# Words in more listings than this share carry no signal and blow up candidate pairs
+MAX_DOCUMENT_SHARE = 0.05
+MIN_STOPWORD_COUNT = 100
+
+SIMILAR_REBUILD_INTERVAL = 6 * 3600
+
+# Below this many listings the build runs in-process
+PARALLEL_MIN_LISTINGS = 20000
+
+LISTING_STREAM_CHUNK = 5000
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(title: str, description: str) -> Counter:
+    text = fold_text(listing_text(title, description))
+    return Counter(word for word in _WORD_RE.findall(text) if len(word) >= MIN_WORD_LENGTH)
+
+
+def _region(geo_cell: Optional[int], city_key: str) -> str:
+    if geo_cell is not None:
+        row, column = divmod(geo_cell, GRID_COLUMNS)
+        return f'g{row // REGION_CELLS}:{column // REGION_CELLS}'
+    return f'c{city_key}' if city_key else ''
+
+
+def rescore(rows: np.ndarray, cols: np.ndarray, text: np.ndarray, features: dict) -> np.ndarray:
+    """Combined similarity of (row, col) pairs with the given text cosines"""
+    category, log_price, region = features['category'], features['log_price'], features['region']
+    same_category = (category[rows] == category[cols]) & (category[rows] >= 0)
+    same_region = (region[rows] == region[cols]) & (region[rows] >= 0)
+    with np.errstate(invalid='ignore'):
+        closeness = np.clip(1 - np.abs(log_price[rows] - log_price[cols]) / math.log(PRICE_RATIO_BAND), 0, 1)
+    closeness = np.nan_to_num(closeness)
+    return (TEXT_WEIGHT * text + CATEGORY_WEIGHT * same_category
+            + PRICE_WEIGHT * closeness + REGION_WEIGHT * same_region)
+
+
+def score_rows(item_words: CSRMatrix, word_items: CSRMatrix, features: dict, start: int, stop: int):
+    """(row, col, score) of the TOP_SIMILAR neighbours of rows start:stop"""
+    ones = np.ones(item_words.shape[0])
+    rows, cols, text = block_neighbours(item_words, word_items, start, stop, ones, TEXT_CANDIDATES)
+    return top_k_per_row(rows, cols, rescore(rows, cols, text, features), TOP_SIMILAR)
+
+
+# Set in pool workers by _init_worker, inherited through fork
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _score_block(bounds):
+    item_words, word_items, features = _worker_state
+    return score_rows(item_words, word_items, features, *bounds)
+
+
+class SimilarListingsIndex:
+    """Top neighbours of every active listing, see module docstring"""
+
+    def __init__(self, item_ids: np.ndarray, item_words: CSRMatrix, vocabulary: Dict[str, int],
+                 idf: np.ndarray, features: dict, regions: Dict[str, int], neighbours: CSRMatrix,
+                 synced_until=None):
+        self.item_pks = item_ids.copy()
+        self.n_items = len(item_ids)
+        self.index_of = {int(pk): position for position, pk in enumerate(item_ids.tolist())}
+        self.item_words = item_words
+        self.word_items = item_words.transpose()
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.features = features
+        self.regions = regions
+        self.neighbours = neighbours
+        self.synced_until = synced_until
+
+        # Online state, folded in by the next build
+        self._vectors = {}      # index -> (word indices, weights) of changed listings
+        self._overrides = {}    # index -> (neighbour indices, scores)
+        self.removed = set()    # indices of listings no longer active
+
+    @classmethod
+    def build(cls, workers: Optional[int] = None) -> 'SimilarListingsIndex':
+        synced_until = Listing.objects.aggregate(latest=Max('updated_at'))['latest']
+        rows = Listing.objects.filter(status='active').order_by('pk').values_list(
+            'pk', 'title', 'description', 'category_id', 'price', 'geo_cell', 'city_folded'
+        )
+        vocabulary, regions = {}, {}
+        pks, categories, prices, region_ids = [], [], [], []
+        coo_rows, coo_words, coo_counts = [], [], []
+        for position, (pk, title, description, category_id, price, geo_cell, city_key) in enumerate(
+            rows.iterator(chunk_size=LISTING_STREAM_CHUNK)
+        ):
+            pks.append(pk)
+            categories.append(category_id if category_id is not None else -1)
+            prices.append(math.log(float(price)) if price else math.nan)
+            region = _region(geo_cell, city_key)
+            region_ids.append(regions.setdefault(region, len(regions)) if region else -1)
+            for word, count in _words(title, description).items():
+                coo_rows.append(position)
+                coo_words.append(vocabulary.setdefault(word, len(vocabulary)))
+                coo_counts.append(count)
+
+        n_items = len(pks)
+        coo_rows = np.array(coo_rows, dtype=np.int64)
+        coo_words = np.array(coo_words, dtype=np.int64)
+        document_frequency = np.bincount(coo_words, minlength=len(vocabulary))
+        idf = np.log((n_items + 1) / (document_frequency + 1)) + 1
+        # Stop words: too common to tell listings apart
+        idf[document_frequency > max(MAX_DOCUMENT_SHARE * n_items, MIN_STOPWORD_COUNT)] = 0
+        weights = (1 + np.log(np.array(coo_counts, dtype=np.float64))) * idf[coo_words]
+        item_words = _normalised(CSRMatrix.from_coo(coo_rows, coo_words, weights, (n_items, len(vocabulary))))
+        features = {
+            'category': np.array(categories, dtype=np.int64),
+            'log_price': np.array(prices, dtype=np.float64),
+            'region': np.array(region_ids, dtype=np.int64),
+        }
+        neighbours = _all_neighbours(item_words, features, workers)
+        return cls(np.array(pks, dtype=np.int64), item_words, vocabulary, idf, features, regions,
+                   neighbours, synced_until)
+
+    # Online updates
+
+    def _vector(self, title: str, description: str):
+        counts = [(self.vocabulary[word], count) for word, count in _words(title, description).items()
+                  if word in self.vocabulary]
+        words = np.array([word for word, _ in counts], dtype=np.int64)
+        weights = (1 + np.log(np.array([count for _, count in counts], dtype=np.float64))) * self.idf[words]
+        norm = np.linalg.norm(weights)
+        if norm > 0:
+            weights /= norm
+        return words, weights
+
+    def _append(self, pk: int) -> int:
+        index = self.n_items
+        self.n_items += 1
+        if self.n_items > len(self.item_pks):
+            size = max(self.n_items, 2 * len(self.item_pks))
+            self.item_pks = np.resize(self.item_pks, size)
+            for name, fill in (('category', -1), ('log_price', math.nan), ('region', -1)):
+                grown = np.full(size, fill, dtype=self.features[name].dtype)
+                grown[:index] = self.features[name][:index]
+                self.features[name] = grown
+        self.item_pks[index] = pk
+        self.index_of[pk] = index
+        return index
+
+    def apply(self, rows):
+        """Rescore listings given as (pk, status, title, description, category, price, geo cell, city)"""
+        changed = []
+        for pk, status, title, description, category_id, price, geo_cell, city_key in rows:
+            index = self.index_of.get(pk)
+            if status != 'active':
+                if index is not None:
+                    self.removed.add(index)
+                continue
+            if index is None:
+                index = self._append(pk)
+            self.removed.discard(index)
+            self.features['category'][index] = category_id if category_id is not None else -1
+            self.features['log_price'][index] = math.log(float(price)) if price else math.nan
+            region = _region(geo_cell, city_key)
+            self.features['region'][index] = self.regions.setdefault(region, len(self.regions)) if region else -1
+            self._vectors[index] = self._vector(title, description)
+            changed.append(index)
+        if changed:
+            self._rescore(np.array(changed, dtype=np.int64))
+
+    def _rescore(self, changed: np.ndarray):
+        changed = np.unique(changed)
+        # Text dot products against the trained listings, through the inverted index
+        sources, words, weights = [], [], []
+        for index in changed.tolist():
+            vector_words, vector_weights = self._vectors[index]
+            sources.append(np.full(len(vector_words), index))
+            words.append(vector_words)
+            weights.append(vector_weights)
+        sources, words, weights = np.concatenate(sources), np.concatenate(words), np.concatenate(weights)
+        positions, owner = expand_rows(self.word_items, words)
+        others = self.word_items.indices[positions].astype(np.int64)
+        products = weights[owner] * self.word_items.data[positions]
+        rows = sources[owner]
+
+        # Changed listings against each other, with their current vectors
+        delta_ids = np.fromiter(self._vectors, dtype=np.int64, count=len(self._vectors))
+        delta_words = [self._vectors[index][0] for index in delta_ids.tolist()]
+        delta = CSRMatrix.from_coo(
+            np.repeat(np.arange(len(delta_ids)), [len(words) for words in delta_words]),
+            np.concatenate(delta_words),
+            np.concatenate([self._vectors[index][1] for index in delta_ids.tolist()]),
+            (len(delta_ids), len(self.vocabulary)),
+        ).transpose()
+        delta_positions, delta_owner = expand_rows(delta, words)
+        changed_rows = sources[delta_owner]
+        changed_cols = delta_ids[delta.indices[delta_positions]]
+        changed_products = weights[delta_owner] * delta.data[delta_positions]
+
+        # Trained vectors of changed listings are stale
+        stale = np.isin(others, delta_ids)
+        rows = np.r_[rows[~stale], changed_rows]
+        others = np.r_[others[~stale], changed_cols]
+        products = np.r_[products[~stale], changed_products]
+        keep = rows != others
+        rows, others, products = rows[keep], others[keep], products[keep]
+        if len(rows):
+            keys, inverse = np.unique(rows * self.n_items + others, return_inverse=True)
+            text = np.bincount(inverse, weights=products)
+            rows, others = keys // self.n_items, keys % self.n_items
+        else:
+            text = np.empty(0)
+        rows, others, text = top_k_per_row(rows, others, text, TEXT_CANDIDATES)
+        scores = rescore(rows, others, text, self.features)
+        rows, others, scores = top_k_per_row(rows, others, scores, TOP_SIMILAR)
+
+        bounds = np.searchsorted(rows, np.r_[changed, changed[-1] + 1])
+        for position, index in enumerate(changed.tolist()):
+            span = slice(bounds[position], bounds[position + 1])
+            self._overrides[index] = (others[span].astype(np.int32), scores[span].astype(np.float32))
+        # The changed listings may now belong in their neighbours' lists too
+        for index, other, score in zip(rows.tolist(), others.tolist(), scores.tolist()):
+            self._insert(other, index, score)
+
+    def _insert(self, row: int, item: int, score: float):
+        cols, scores = self._row(row)
+        keep = cols != item
+        cols, scores = cols[keep], scores[keep]
+        if len(cols) >= TOP_SIMILAR and score <= scores.min():
+            return
+        cols, scores = np.r_[cols, item].astype(np.int32), np.r_[scores, score].astype(np.float32)
+        order = np.argsort(-scores, kind='stable')[:TOP_SIMILAR]
+        self._overrides[row] = (cols[order], scores[order])
+
+    # Lookup
+
+    def _row(self, index: int):
+        override = self._overrides.get(index)
+        if override is not None:
+            return override
+        if index < self.neighbours.shape[0]:
+            return self.neighbours.row(index)
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+    def similar(self, listing_id: int) -> Dict[int, float]:
+        index = self.index_of.get(listing_id)
+        if index is None or index in self.removed:
+            return {}
+        cols, scores = self._row(index)
+        return {
+            int(self.item_pks[col]): float(score)
+            for col, score in zip(cols.tolist(), scores.tolist()) if col not in self.removed
+        }
+
+    def __len__(self):
+        return self.n_items - len(self.removed)
+
+
+def _normalised(matrix: CSRMatrix) -> CSRMatrix:
+    norms = np.sqrt(np.bincount(matrix.row_ids(), weights=matrix.data.astype(np.float64) ** 2,
+                                minlength=matrix.shape[0]))
+    data = matrix.data / np.where(norms > 0, norms, 1)[matrix.row_ids()]
+    keep = data > 0
+    rows = matrix.row_ids()[keep]
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=matrix.shape[0]), out=indptr[1:])
+    return CSRMatrix(indptr, matrix.indices[keep], data[keep].astype(np.float32), matrix.shape)
+
+
+def _all_neighbours(item_words: CSRMatrix, features: dict, workers: Optional[int] = None) -> CSRMatrix:
+    word_items = item_words.transpose()
+    blocks = list(row_blocks(item_words, word_items))
+    n_items = item_words.shape[0]
+    if workers is None:
+        workers = getattr(settings, 'SIMILAR_LISTINGS_WORKERS', None) or os.cpu_count() or 1
+        # A forked child of a threaded process (a web worker) inherits locks held by the other threads
+        if n_items < PARALLEL_MIN_LISTINGS or threading.active_count() > 1:
+            workers = 1
+    if workers > 1 and len(blocks) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Workers inherit the arrays through fork instead of pickling them per block
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker,
+                                 initargs=((item_words, word_items, features),)) as pool:
+            results = list(pool.map(_score_block, blocks))
+    else:
+        results = [score_rows(item_words, word_items, features, start, stop) for start, stop in blocks]
+    return from_blocks(results, n_items)
+
+
+class ContentBasedRecommender(BaseRecommender):
+    """Recommends listings that look like the ones a user favorited"""
+    name = 'content'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.index: Optional[SimilarListingsIndex] = None
+        self.built_at = None
+        self.generation = None
+        self._builder = BackgroundJob(self.train_model, 'similar-listings-build')
+        self._refresher = BackgroundJob(self.refresh, 'similar-listings-refresh')
+
+    def train_model(self, workers: Optional[int] = None):
+        """Rebuild the neighbour lists of every active listing"""
+        started = time.perf_counter()
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        index = SimilarListingsIndex.build(workers)
+        with self._lock:
+            # ensure_fresh reads these without the lock and expects built_at once index is set
+            self.built_at = time.monotonic()
+            self.generation = generation
+            self.index = index
+        logger.info(f"Similar listings index built for {len(index)} listings in "
+                    f"{time.perf_counter() - started:.2f}s")
+
+    def refresh(self):
+        """Rescore the listings changed since the last sync"""
+        index = self.index
+        if index is None:
+            return
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        changed = Listing.objects.order_by('updated_at')
+        if index.synced_until is not None:
+            changed = changed.filter(updated_at__gte=index.synced_until)
+        rows = list(changed.values_list(
+            'pk', 'status', 'title', 'description', 'category_id', 'price', 'geo_cell', 'city_folded',
+            'updated_at'
+        ))
+        with self._lock:
+            # A rebuild that landed meanwhile is caught up by the next refresh
+            if self.index is not index:
+                return
+            index.apply(row[:-1] for row in rows)
+            if rows:
+                index.synced_until = rows[-1][-1]
+            self.generation = generation
+
+    def ensure_fresh(self) -> Optional[SimilarListingsIndex]:
+        """The current index, None until the first build lands; starts a refresh or rebuild when due"""
+        if self.index is None or time.monotonic() - self.built_at > SIMILAR_REBUILD_INTERVAL:
+            self._builder.start()
+        if self.index is not None and get_generation(CACHE_PREFIX_SEARCH) != self.generation:
+            self._refresher.start()
+        return self.index
+
+    def remove_listing(self, pk: int):
+        """Hide a deleted listing; other processes drop it on their next rebuild"""
+        with self._lock:
+            if self.index is not None and pk in self.index.index_of:
+                self.index.removed.add(self.index.index_of[pk])
+
+    def similar_scores(self, listing_id: int) -> Dict[int, float]:
+        index = self.ensure_fresh()
+        return index.similar(listing_id) if index is not None else {}
+
+    def similar_items(self, listing_id: int, limit: int = 5) -> List[Dict]:
+        """Listings with the closest text, category, price and region"""
+        return listing_summaries(self.similar_scores(listing_id), limit, exclude=[listing_id])
+
+    def similar_listings(self, listing: Listing, limit: int = 4) -> List[Listing]:
+        """Listing objects for the detail page, topped up with the newest of the same category"""
+        scores = self.similar_scores(listing.pk)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit * 2]
+        queryset = Listing.objects.filter(status='active').select_related('category').prefetch_related('images')
+        by_pk = {item.pk: item for item in queryset.filter(pk__in=ranked)}
+        similar = [by_pk[pk] for pk in ranked if pk in by_pk][:limit]
+        if len(similar) < limit:
+            similar += list(
+                queryset.filter(category_id=listing.category_id)
+                .exclude(pk__in=[listing.pk] + [item.pk for item in similar])
+                .order_by('-created_at')[:limit - len(similar)]
+            )
+        return similar
+
+    def recommend_for_user(self, user: User, limit: int = 5) -> List[Dict]:
+        """Listings similar to the user's most recent favorites"""
+        index = self.ensure_fresh()
+        if index is None:
+            return []
+        favorites = list(
+            Favorite.objects.filter(user=user).order_by('-created_at').values_list('listing_id', flat=True)[:50]
+        )
+        scores = {}
+        for listing_id in favorites:
+            for pk, score in index.similar(listing_id).items():
+                scores[pk] = scores.get(pk, 0.0) + score
+        return listing_summaries(scores, limit, exclude=favorites)
+
+
+content_recommender = ContentBasedRecommender()
@@ -0,0 +1,46 @@
+"""
+Most-favorited listings for everyone: the baseline other recommenders
+have to beat (see recommendations.evaluation).
+"""
+from typing import Dict, List
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+
+from marketplace.models import Favorite, Listing
+from .base_recommender import BaseRecommender, listing_summaries
+
+User = get_user_model()
+
+
+class PopularityRecommender(BaseRecommender):
+    """Recommends the active listings with the most favorites"""
+    name = 'popular'
+
+    def __init__(self):
+        self.scores: Dict[int, float] = {}
+        self.categories: Dict[int, int] = {}
+
+    def train_model(self):
+        """Count the favorites of every active listing"""
+        rows = (
+            Favorite.objects.filter(listing__status='active')
+            .values('listing_id', 'listing__category_id').annotate(favorites=Count('id'))
+            .values_list('listing_id', 'listing__category_id', 'favorites')
+        )
+        self.scores, self.categories = {}, {}
+        for listing_id, category_id, count in rows:
+            self.scores[listing_id] = float(count)
+            self.categories[listing_id] = category_id
+
+    def recommend_for_user(self, user: User, limit: int = 5) -> List[Dict]:
+        favorites = list(Favorite.objects.filter(user=user).values_list('listing_id', flat=True))
+        return listing_summaries(self.scores, limit, exclude=favorites)
+
+    def similar_items(self, listing_id: int, limit: int = 5) -> List[Dict]:
+        """The most favorited listings of the same category"""
+        category_id = self.categories.get(listing_id)
+        if category_id is None:
+            category_id = Listing.objects.filter(pk=listing_id).values_list('category_id', flat=True).first()
+        scores = {pk: score for pk, score in self.scores.items() if self.categories[pk] == category_id}
+        return listing_summaries(scores, limit, exclude=[listing_id])
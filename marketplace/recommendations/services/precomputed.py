@@ -0,0 +1,243 @@
+"""
+Precomputed per-user recommendations.
+``manage.py precompute_recommendations`` trains the collaborative filtering
+model once and scores every active user with favorites in a process pool.
+Each user's LIST_SIZE best listings are stored as one RecommendationList row
+of packed (int64 pk, float32 score) pairs, so serving them is a primary key
+lookup plus one query for the listings, which drops those no longer active.
+Users without a stored list get the most favorited active listings.
+
+Run with --follow, the command keeps going (follow()): every POLL_INTERVAL
+seconds it applies the interactions stored since (see
+CollaborativeFilteringRecommender.apply_pending) and rescores the users who
+favorited a listing whose neighbours changed, so new favorites reach the
+lists within seconds; every COMPACTION_INTERVAL seconds it retrains and
+recomputes everything.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from marketplace.models import Favorite, RecommendationList
+from marketplace.utils.cache_utils import CACHE_TIMEOUT_MEDIUM, make_cache_key
+from .base_recommender import listing_summaries
+from .collaborative_filtering import (
+    COMPACTION_INTERVAL,
+    MAX_ITEMS_PER_USER,
+    POLL_INTERVAL,
+    ItemSimilarityModel,
+    recommender,
+)
+
+logger = logging.getLogger(__name__)
+
+LIST_SIZE = 50
+
+ENTRY_DTYPE = np.dtype([('listing', '<i8'), ('score', '<f4')])
+
+# Users scored per pool task, and rows upserted per query
+USER_CHUNK = 2000
+WRITE_BATCH = 1000
+
+POPULAR_SIZE = 100
+POPULAR_CACHE_TIMEOUT = CACHE_TIMEOUT_MEDIUM
+
+
+def pack(scores: Dict[int, float], size: int = LIST_SIZE, exclude=()) -> bytes:
+    """The size best scored listings as packed entries, best first"""
+    exclude = set(exclude)
+    pks = np.fromiter((pk for pk in scores if pk not in exclude), dtype=np.int64)
+    values = np.fromiter((scores[pk] for pk in pks.tolist()), dtype=np.float64, count=len(pks))
+    best = np.argsort(-values, kind='stable')[:size]
+    entries = np.empty(len(best), dtype=ENTRY_DTYPE)
+    entries['listing'] = pks[best]
+    entries['score'] = values[best]
+    return entries.tobytes()
+
+
+def unpack(data: bytes) -> Dict[int, float]:
+    entries = np.frombuffer(bytes(data), dtype=ENTRY_DTYPE)
+    return dict(zip(entries['listing'].tolist(), entries['score'].tolist()))
+
+
+# Scoring
+
+def favorites_by_user(user_ids=None) -> Iterator[Tuple[int, List[int]]]:
+    """(user pk, newest favorited listing pks) of every active user, or of the given ones, one query"""
+    rows = Favorite.objects.filter(user__is_active=True)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=list(user_ids))
+    rows = (
+        rows
+        .order_by('user_id', '-created_at')
+        .values_list('user_id', 'listing_id')
+    )
+    user_id, listings = None, []
+    for row_user, listing_id in rows.iterator(chunk_size=10000):
+        if row_user != user_id:
+            if listings:
+                yield user_id, listings
+            user_id, listings = row_user, []
+        if len(listings) < MAX_ITEMS_PER_USER:
+            listings.append(listing_id)
+    if listings:
+        yield user_id, listings
+
+
+def score_users(model: ItemSimilarityModel, users: List[Tuple[int, List[int]]],
+                size: int = LIST_SIZE) -> List[Tuple[int, bytes]]:
+    """Packed recommendations of each (user pk, favorites); users with none are skipped"""
+    results = []
+    for user_id, favorites in users:
+        entries = pack(model.score(favorites), size, exclude=favorites)
+        if entries:
+            results.append((user_id, entries))
+    return results
+
+
+# Set in pool workers by _init_worker, inherited through fork
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _score_chunk(users):
+    model, size = _worker_state
+    return score_users(model, users, size)
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def precompute_all(workers: Optional[int] = None, size: int = LIST_SIZE) -> int:
+    """Retrain the model and store fresh lists for every user; returns how many were stored"""
+    started = timezone.now()
+    timer = time.perf_counter()
+    recommender.train_model()
+    model = recommender.model
+    if workers is None:
+        workers = getattr(settings, 'RECOMMENDATION_WORKERS', None) or os.cpu_count() or 1
+    chunks = _chunks(favorites_by_user(), USER_CHUNK)
+
+    stored = 0
+    batch = []
+
+    def write(rows):
+        _store(rows, started)
+
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Workers inherit the model through fork instead of pickling it per chunk
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_init_worker, initargs=((model, size),))
+        results = pool.map(_score_chunk, chunks)
+    else:
+        pool = None
+        results = (score_users(model, chunk, size) for chunk in chunks)
+    try:
+        for rows in results:
+            batch.extend(rows)
+            while len(batch) >= WRITE_BATCH:
+                write(batch[:WRITE_BATCH])
+                stored += WRITE_BATCH
+                batch = batch[WRITE_BATCH:]
+        if batch:
+            write(batch)
+            stored += len(batch)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Users who lost all their favorites or were deactivated
+    RecommendationList.objects.filter(computed_at__lt=started).delete()
+    logger.info(f"Precomputed recommendations for {stored} users in {time.perf_counter() - timer:.1f}s")
+    return stored
+
+
+def _store(rows: List[Tuple[int, bytes]], computed_at):
+    RecommendationList.objects.bulk_create(
+        [RecommendationList(user_id=user_id, entries=entries, computed_at=computed_at) for user_id, entries in rows],
+        update_conflicts=True, unique_fields=['user'], update_fields=['entries', 'computed_at'],
+    )
+
+
+def precompute_changed(size: int = LIST_SIZE) -> int:
+    """Apply the interactions stored since the last call and rescore the users they affect; returns how many"""
+    changed = recommender.apply_pending(block=True)
+    if not changed:
+        return 0
+    computed_at = timezone.now()
+    users = set()
+    for listings in _chunks(changed, USER_CHUNK):
+        users.update(Favorite.objects.filter(listing_id__in=listings).values_list('user_id', flat=True))
+    stored = 0
+    for chunk in _chunks(sorted(users), USER_CHUNK):
+        rows = score_users(recommender.model, list(favorites_by_user(chunk)), size)
+        for start in range(0, len(rows), WRITE_BATCH):
+            _store(rows[start:start + WRITE_BATCH], computed_at)
+        stored += len(rows)
+    return stored
+
+
+def follow(workers: Optional[int] = None, size: int = LIST_SIZE, stop: Optional[threading.Event] = None):
+    """Keep every user's list fresh until stop is set, see module docstring"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        precompute_all(workers, size)
+        computed_at = time.monotonic()
+        while time.monotonic() - computed_at < COMPACTION_INTERVAL and not stop.wait(POLL_INTERVAL):
+            try:
+                stored = precompute_changed(size)
+            except Exception as e:
+                logger.error(f"Failed to update precomputed recommendations: {e}")
+                continue
+            if stored:
+                logger.info(f"Updated the recommendations of {stored} users")
+
+
+# Serving
+
+def popular_scores() -> Dict[int, float]:
+    """Favorite counts of the most favorited active listings, cached"""
+    key = make_cache_key('popular_listings')
+    scores = cache.get(key)
+    if scores is None:
+        rows = (
+            Favorite.objects.filter(listing__status='active')
+            .values('listing_id').annotate(favorites=Count('id'))
+            .order_by('-favorites', 'listing_id')
+            .values_list('listing_id', 'favorites')[:POPULAR_SIZE]
+        )
+        scores = {listing_id: float(count) for listing_id, count in rows}
+        cache.set(key, scores, POPULAR_CACHE_TIMEOUT)
+    return scores
+
+
+def recommend_for_user(user_id: int, limit: int = 5) -> List[Dict]:
+    """The user's stored recommendations that are still active, topped up with popular listings"""
+    entries = RecommendationList.objects.filter(user_id=user_id).values_list('entries', flat=True).first()
+    summaries = listing_summaries(unpack(entries), limit) if entries is not None else []
+    if len(summaries) < limit:
+        summaries += listing_summaries(popular_scores(), limit - len(summaries),
+                                       exclude=[summary['id'] for summary in summaries])
+    return summaries
@@ -0,0 +1,160 @@
+"""
+Minimal compressed sparse row matrices on NumPy arrays, and the blockwise
+item-item cosine similarity the collaborative filtering engine is built on.
+"""
+from typing import Tuple
+
+import numpy as np
+
+# Co-occurring (item, item) pairs expanded at once while computing similarities
+PAIR_BUDGET = 2_000_000
+
+
+class CSRMatrix:
+    """Row i holds columns indices[indptr[i]:indptr[i + 1]] with values data[...]"""
+    __slots__ = ('indptr', 'indices', 'data', 'shape')
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, shape: Tuple[int, int]):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+
+    @classmethod
+    def from_coo(cls, rows: np.ndarray, cols: np.ndarray, data: np.ndarray, shape: Tuple[int, int],
+                 combine: str = 'sum') -> 'CSRMatrix':
+        """Build from (row, col, value) triples; duplicates are summed, or the largest kept"""
+        if len(rows):
+            keys = rows.astype(np.int64) * shape[1] + cols
+            if combine == 'max':
+                order = np.lexsort((data, keys))
+                keys, data = keys[order], data[order]
+                last = np.r_[keys[1:] != keys[:-1], True]
+                keys, data = keys[last], data[last]
+            else:
+                keys, inverse = np.unique(keys, return_inverse=True)
+                data = np.bincount(inverse, weights=data, minlength=len(keys))
+            rows, cols = keys // shape[1], keys % shape[1]
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, cols.astype(np.int32), data.astype(np.float32), shape)
+
+    def row(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.data[start:stop]
+
+    def row_lengths(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def row_ids(self) -> np.ndarray:
+        """The row of every stored value"""
+        return np.repeat(np.arange(self.shape[0]), self.row_lengths())
+
+    def transpose(self) -> 'CSRMatrix':
+        order = np.argsort(self.indices, kind='stable')
+        indptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=self.shape[1]), out=indptr[1:])
+        return CSRMatrix(indptr, self.row_ids()[order].astype(np.int32), self.data[order], (self.shape[1], self.shape[0]))
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+
+def expand_rows(matrix: CSRMatrix, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions into matrix.indices of every value in the given rows, and which row it came from"""
+    lengths = matrix.indptr[rows + 1] - matrix.indptr[rows]
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(owner.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return matrix.indptr[rows][owner] + offsets, owner
+
+
+def top_k_per_row(rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, k: int):
+    """Keep the k best scores of every row; the result is sorted by row, then by score"""
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < k
+    return rows[keep], cols[keep], scores[keep]
+
+
+def cooccurrence_neighbours(sources: np.ndarray, users: np.ndarray, weights: np.ndarray,
+                            user_items: CSRMatrix, norms: np.ndarray, k: int):
+    """
+    The k most cosine-similar items of each source item, as (row, col, score)
+    arrays. Entry n says users[n] (a row of user_items) interacted with
+    sources[n] with weight weights[n].
+    """
+    positions, owner = expand_rows(user_items, users)
+    other = user_items.indices[positions]
+    pair_weights = weights[owner].astype(np.float64) * user_items.data[positions]
+    source = sources[owner]
+    distinct = source != other
+    n_items = user_items.shape[1]
+    keys = source[distinct].astype(np.int64) * n_items + other[distinct]
+    if not len(keys):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    dots = np.bincount(inverse, weights=pair_weights[distinct], minlength=len(keys))
+    rows, cols = keys // n_items, keys % n_items
+    scores = dots / (norms[rows] * norms[cols])
+    positive = scores > 0
+    return top_k_per_row(rows[positive], cols[positive], scores[positive], k)
+
+
+def row_blocks(row_features: CSRMatrix, feature_rows: CSRMatrix, pair_budget: int = PAIR_BUDGET):
+    """
+    Split the rows of row_features into (start, stop) ranges whose
+    co-occurrence pairs through feature_rows fit pair_budget.
+    """
+    n_rows = row_features.shape[0]
+    feature_lengths = feature_rows.row_lengths()
+    pair_counts = np.r_[0, np.cumsum(feature_lengths[row_features.indices])][row_features.indptr]
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(pair_counts, pair_counts[start] + pair_budget, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+
+def block_neighbours(row_features: CSRMatrix, feature_rows: CSRMatrix, start: int, stop: int,
+                     norms: np.ndarray, k: int):
+    """cooccurrence_neighbours() of rows start:stop of row_features"""
+    entries = slice(row_features.indptr[start], row_features.indptr[stop])
+    return cooccurrence_neighbours(
+        np.repeat(np.arange(start, stop), row_features.row_lengths()[start:stop]),
+        row_features.indices[entries], row_features.data[entries], feature_rows, norms, k,
+    )
+
+
+def item_neighbours(user_items: CSRMatrix, k: int, pair_budget: int = PAIR_BUDGET) -> CSRMatrix:
+    """
+    The k most cosine-similar items of every item, as an items x items matrix.
+    Items are processed in blocks whose co-occurrence pairs fit pair_budget,
+    so memory stays bounded however many interactions there are.
+    """
+    item_users = user_items.transpose()
+    norms = item_norms(user_items)
+    blocks = [
+        block_neighbours(item_users, user_items, start, stop, norms, k)
+        for start, stop in row_blocks(item_users, user_items, pair_budget)
+    ]
+    return from_blocks(blocks, user_items.shape[1])
+
+
+def from_blocks(blocks, n_rows: int) -> CSRMatrix:
+    """Stack (row, col, score) blocks, already sorted by row, into a square matrix"""
+    rows = np.concatenate([block[0] for block in blocks]) if blocks else np.empty(0, dtype=np.int64)
+    cols = np.concatenate([block[1] for block in blocks]) if blocks else np.empty(0, dtype=np.int64)
+    scores = np.concatenate([block[2] for block in blocks]) if blocks else np.empty(0)
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return CSRMatrix(indptr, cols.astype(np.int32), scores.astype(np.float32), (n_rows, n_rows))
+
+
+def item_norms(user_items: CSRMatrix) -> np.ndarray:
+    """Euclidean norm of every item column"""
+    return np.sqrt(np.bincount(user_items.indices, weights=user_items.data.astype(np.float64) ** 2,
+                               minlength=user_items.shape[1]))
@@ -5,17 +5,27 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .services import CollaborativeFilteringRecommender
+from .services import precomputed
+from .services.content_based import content_recommender
 
 User = get_user_model()
-recommender = CollaborativeFilteringRecommender()
+
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 50
+
+
+def _limit(request):
+    try:
+        return min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        return DEFAULT_LIMIT
 
 @api_view(['GET'])
 def user_recommendations(request, user_id):
-    """Get personalized recommendations for user"""
+    """Get personalized recommendations for user, precomputed by precompute_recommendations"""
     try:
         user = User.objects.get(pk=user_id)
-        recommendations = recommender.recommend_for_user(user)
+        recommendations = precomputed.recommend_for_user(user.pk, _limit(request))
         return Response(recommendations)
     except User.DoesNotExist:
         return Response(
@@ -26,7 +36,7 @@ def user_recommendations(request, user_id):
 @api_view(['GET'])
 def similar_listings(request, listing_id):
     """Get similar listings to specified item"""
-    similar = recommender.similar_items(listing_id)
+    similar = content_recommender.similar_items(listing_id, _limit(request))
     return Response(similar)
 
 
@@ -0,0 +1,52 @@
+"""
+Full-text search for marketplace listings.
+
+The concrete backend is picked from settings.MARKETPLACE_SEARCH_BACKEND
+('auto', 'sqlite', 'postgresql' or 'orm'); 'auto' follows the database vendor.
+"""
+from django.conf import settings
+from django.db import connection
+
+from .base_backend import BaseSearchBackend, ORMSearchBackend, parse_query
+from .postgres_backend import PostgresFTSBackend
+from .sqlite_backend import SQLiteFTSBackend
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresFTSBackend,
+    'orm': ORMSearchBackend,
+}
+
+_backends = {}
+
+
+def backend_for_vendor(vendor: str) -> BaseSearchBackend:
+    """Get the search backend matching a database vendor"""
+    if vendor not in _backends:
+        _backends[vendor] = BACKENDS.get(vendor, ORMSearchBackend)()
+    return _backends[vendor]
+
+
+def get_search_backend() -> BaseSearchBackend:
+    """Get the configured search backend"""
+    name = getattr(settings, 'MARKETPLACE_SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = connection.vendor
+    return backend_for_vendor(name)
+
+
+def search_listings(queryset, query: str):
+    """Filter a Listing queryset by a full-text query, annotating search_rank"""
+    return get_search_backend().search(queryset, query)
+
+
+__all__ = [
+    'BaseSearchBackend',
+    'ORMSearchBackend',
+    'SQLiteFTSBackend',
+    'PostgresFTSBackend',
+    'backend_for_vendor',
+    'get_search_backend',
+    'parse_query',
+    'search_listings',
+]
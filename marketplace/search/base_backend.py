@@ -0,0 +1,93 @@
+import re
+from abc import ABC, abstractmethod
+from typing import List
+
+from django.db import connection as default_connection
+from django.db.models import Q, QuerySet, Value, FloatField
+
+from ..utils.text import fold_text
+
+# Columns of marketplace_listing that are indexed for full-text search
+SEARCH_FIELDS = ('title', 'description', 'location', 'city', 'county', 'address')
+
+# Folded shadow columns used instead of the raw column where available
+FOLDED_SEARCH_FIELDS = {
+    'title': 'title_folded',
+    'location': 'location_folded',
+    'city': 'city_folded',
+    'county': 'county_folded',
+}
+
+# Upper bound on the number of terms taken from a single query
+MAX_QUERY_TERMS = 10
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def parse_query(query: str) -> List[str]:
+    """Split a raw user query into safe, case- and diacritic-folded search terms"""
+    if not query:
+        return []
+    return _TERM_RE.findall(fold_text(query))[:MAX_QUERY_TERMS]
+
+
+class BaseSearchBackend(ABC):
+    """Abstract base class for listing full-text search backends"""
+
+    vendor = None
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        """
+        Restrict queryset to listings matching query.
+        Matching rows are annotated with ``search_rank`` (higher is better).
+        """
+        terms = parse_query(query)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return self._search(queryset, terms)
+
+    @abstractmethod
+    def _search(self, queryset: QuerySet, terms: List[str]) -> QuerySet:
+        """Filter and rank queryset for already parsed terms"""
+        pass
+
+    def index_listing(self, listing, connection=None):
+        """Add or refresh a single listing in the index"""
+        pass
+
+    def remove_listing(self, listing_id: int, connection=None):
+        """Drop a single listing from the index"""
+        pass
+
+    def install(self, connection=None):
+        """Create the index structures in the database"""
+        pass
+
+    def uninstall(self, connection=None):
+        """Drop the index structures from the database"""
+        pass
+
+    def rebuild(self, connection=None) -> int:
+        """Re-index every listing, returns the number of indexed rows"""
+        return 0
+
+    @staticmethod
+    def _connection(connection):
+        return connection or default_connection
+
+
+class ORMSearchBackend(BaseSearchBackend):
+    """Fallback backend for databases without native full-text search"""
+
+    vendor = 'orm'
+
+    def _search(self, queryset, terms):
+        for term in terms:
+            term_filter = Q()
+            for field in SEARCH_FIELDS:
+                if field in FOLDED_SEARCH_FIELDS:
+                    term_filter |= Q(**{f'{FOLDED_SEARCH_FIELDS[field]}__contains': term})
+                else:
+                    term_filter |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(term_filter)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,127 @@
+"""
+Facet counts (category, city, price bucket) for listing filter sidebars.
+All three facets come from a single GROUP BY over the filtered queryset and
+are cached per distinct SQL statement for FACET_CACHE_TIMEOUT seconds, or
+until the search cache generation moves (any listing write).
+"""
+import logging
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Max, Value, When
+from rest_framework.response import Response
+
+from ..utils.cache_utils import CACHE_PREFIX_SEARCH, CACHE_TIMEOUT_SHORT, get_generation, make_queryset_cache_key
+
+logger = logging.getLogger(__name__)
+
+FACET_CACHE_TIMEOUT = CACHE_TIMEOUT_SHORT
+
+# Uncached facet computation must stay under this many seconds (checked by tests/test_performance.py)
+FACET_LATENCY_TARGET = 0.2
+
+MAX_CITY_FACETS = 20
+
+# (key, lower bound inclusive, upper bound exclusive) in listing currency units
+PRICE_BUCKETS = (
+    ('0-100', None, 100),
+    ('100-500', 100, 500),
+    ('500-1000', 500, 1000),
+    ('1000-5000', 1000, 5000),
+    ('5000-20000', 5000, 20000),
+    ('20000+', 20000, None),
+)
+
+
+def price_bucket_expression():
+    """CASE expression mapping price to its PRICE_BUCKETS key, NULL without a price"""
+    whens = []
+    for key, _, upper in PRICE_BUCKETS:
+        if upper is None:
+            whens.append(When(price__isnull=False, then=Value(key)))
+        else:
+            whens.append(When(price__lt=Decimal(upper), then=Value(key)))
+    return Case(*whens, default=Value(None), output_field=CharField())
+
+
+def compute_facets(queryset) -> dict:
+    """Count listings per category, city and price bucket in one query"""
+    started = time.perf_counter()
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket_expression())
+        .values('category_id', 'category__name', 'category__slug', 'city_folded', 'price_bucket')
+        .annotate(count=Count('id'), city=Max('city'))
+    )
+
+    categories = {}
+    category_counts = Counter()
+    cities = {}
+    city_counts = Counter()
+    price_counts = Counter()
+    for row in rows:
+        count = row['count']
+        category_counts[row['category_id']] += count
+        categories[row['category_id']] = (row['category__name'], row['category__slug'])
+        if row['city_folded']:
+            city_counts[row['city_folded']] += count
+            cities[row['city_folded']] = row['city']
+        if row['price_bucket']:
+            price_counts[row['price_bucket']] += count
+
+    facets = {
+        'categories': [
+            {'id': category_id, 'name': categories[category_id][0], 'slug': categories[category_id][1], 'count': count}
+            for category_id, count in category_counts.most_common()
+        ],
+        'cities': [
+            {'name': cities[folded], 'key': folded, 'count': count}
+            for folded, count in city_counts.most_common(MAX_CITY_FACETS)
+        ],
+        'price': [
+            {'key': key, 'min': lower, 'max': upper, 'count': price_counts[key]}
+            for key, lower, upper in PRICE_BUCKETS
+        ],
+    }
+
+    elapsed = time.perf_counter() - started
+    if elapsed > FACET_LATENCY_TARGET:
+        logger.warning(f"Facet computation took {elapsed:.3f}s, target is {FACET_LATENCY_TARGET}s")
+    return facets
+
+
+def get_facets(queryset) -> dict:
+    """Facet counts for a filtered Listing queryset, served from cache when possible"""
+    key = make_queryset_cache_key('listing_facets', queryset, get_generation(CACHE_PREFIX_SEARCH))
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
+
+class FacetedListMixin:
+    """
+    ViewSet mixin adding facet counts to list responses when ?facets=true.
+    Facets describe the whole filtered result set, not just the current page.
+    """
+    facets_query_param = 'facets'
+
+    def wants_facets(self, request) -> bool:
+        return request.query_params.get(self.facets_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            data = self.get_serializer(queryset, many=True).data
+            if not self.wants_facets(request):
+                return Response(data)
+            return Response({'results': data, 'facets': get_facets(queryset)})
+
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        if self.wants_facets(request):
+            response.data['facets'] = get_facets(queryset)
+        return response
@@ -0,0 +1,40 @@
+from django.db.models import Q
+from rest_framework import filters
+
+from ..pagination import CURSOR_PARAM
+from ..utils.text import fold_text, folded_prefix_q
+from . import search_listings
+from .popular import record_search
+
+
+class ListingSearchFilter(filters.SearchFilter):
+    """
+    DRF search filter backed by the listing full-text index.
+    Results are ordered by relevance unless an explicit ordering is requested.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        # Count each search once, not once per page
+        if getattr(view, 'action', None) == 'list' and CURSOR_PARAM not in request.query_params:
+            record_search(query)
+        return search_listings(queryset, query).order_by('-search_rank', '-created_at')
+
+
+class FoldedSearchFilter(filters.SearchFilter):
+    """
+    DRF search filter doing an indexed prefix lookup on folded shadow columns.
+    The view's search_fields must name folded columns, e.g. ``name_folded``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        search_fields = self.get_search_fields(view, request)
+        if not search_fields or not fold_text(query):
+            return queryset
+        lookup = Q()
+        for field in search_fields:
+            lookup |= folded_prefix_q(field, query)
+        return queryset.filter(lookup)
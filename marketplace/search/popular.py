@@ -0,0 +1,278 @@
+"""
+Popular and trending search terms from live query traffic.
+Each process counts queries in a Space-Saving summary of at most
+TRACKED_TERMS counters, so memory stays bounded however many distinct
+queries arrive. Summaries are flushed every FLUSH_INTERVAL seconds, in a
+background thread, into SearchTermCount (one row per kind, term and day).
+Only the searches a counter is guaranteed to have seen (its count minus the
+error it inherited on eviction) are stored, so rare terms taking turns at
+the smallest counter do not pile up phantom searches. The popular and
+trending lists are recomputed by the flush and served from the cache; once
+they are LIST_REFRESH_INTERVAL seconds old a request starts a flush and is
+served the stale lists (empty ones before the first) until it lands. Counts
+a process gathered since its last flush are lost if it exits.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from ..utils.background import BackgroundJob
+from ..utils.cache_utils import CACHE_TIMEOUT_MEDIUM, make_cache_key
+from ..utils.text import fold_text
+
+logger = logging.getLogger(__name__)
+
+KIND_LISTING = 'listing'
+KIND_LOCATION = 'location'
+
+# Counters kept per process and kind; terms outside the top few hundred are noise
+TRACKED_TERMS = 300
+
+FLUSH_INTERVAL = 60
+
+# Longer queries are pasted text, not search terms
+MAX_TERM_LENGTH = 100
+
+POPULAR_DAYS = 7
+TRENDING_BASELINE_DAYS = 7
+# Terms searched fewer times today never trend
+TRENDING_MIN_COUNT = 3
+RETENTION_DAYS = 30
+
+LIST_SIZE = 20
+LIST_REFRESH_INTERVAL = CACHE_TIMEOUT_MEDIUM
+# Stale lists stay cached long after they are due, to be served during the refresh
+LIST_CACHE_TIMEOUT = 24 * CACHE_TIMEOUT_MEDIUM
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters summary (Metwally et al.).
+    Keeps at most capacity counters; a new item takes over the smallest one
+    and inherits its count as overestimation error, so every item with a
+    true frequency above total / capacity is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity: int = TRACKED_TERMS):
+        self.capacity = capacity
+        self.total = 0
+        self._counters = {}  # item -> [count, error]
+        self._heap = []      # (count, item), lazily updated
+
+    def add(self, item, count: int = 1):
+        """Count item; returns the item it evicted, if any"""
+        self.total += count
+        evicted = None
+        counter = self._counters.get(item)
+        if counter is None:
+            if len(self._counters) < self.capacity:
+                counter = self._counters[item] = [0, 0]
+            else:
+                evicted, minimum = self._pop_min()
+                counter = self._counters[item] = [minimum, minimum]
+        counter[0] += count
+        heapq.heappush(self._heap, (counter[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c[0], key) for key, c in self._counters.items()]
+            heapq.heapify(self._heap)
+        return evicted
+
+    def _pop_min(self) -> Tuple[object, int]:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self._counters.get(item)
+            # Skip entries left behind by later increments
+            if counter is not None and counter[0] == count:
+                del self._counters[item]
+                return item, count
+
+    def top(self, n: int = None) -> List[Tuple[object, int, int]]:
+        """(item, count, error) for the n most frequent items"""
+        rows = ((item, counter[0], counter[1]) for item, counter in self._counters.items())
+        if n is None:
+            return sorted(rows, key=lambda row: row[1], reverse=True)
+        return heapq.nlargest(n, rows, key=lambda row: row[1])
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class SearchTermTracker:
+    """Per-process counting of one kind of search query, see module docstring"""
+
+    def __init__(self, kind: str, capacity: int = TRACKED_TERMS):
+        self.kind = kind
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._reset()
+        self._last_flush = time.monotonic()
+        self._flusher = BackgroundJob(self.flush, f'{kind}-search-terms-flush')
+
+    def _reset(self):
+        self._summary = SpaceSaving(self.capacity)
+        self._labels = {}
+
+    def record(self, query: str):
+        """Count one search for query"""
+        term = fold_text(query, max_length=MAX_TERM_LENGTH)
+        if not term:
+            return
+        with self._lock:
+            evicted = self._summary.add(term)
+            if evicted is not None:
+                self._labels.pop(evicted, None)
+            self._labels.setdefault(term, ' '.join(str(query).split())[:MAX_TERM_LENGTH])
+            due = time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+        if due:
+            self._flusher.start()
+
+    def flush(self):
+        """Add the counts gathered since the last flush to SearchTermCount and refresh the lists"""
+        from ..models import SearchTermCount
+
+        with self._lock:
+            rows = [(term, count - error) for term, count, error in self._summary.top() if count > error]
+            labels = self._labels
+            self._reset()
+            self._last_flush = time.monotonic()
+        if not rows:
+            if self._lists_due(cache.get(self._lists_key())):
+                self.refresh_lists()
+            return
+
+        today = timezone.localdate()
+        try:
+            with transaction.atomic():
+                existing = {
+                    row.term: row for row in SearchTermCount.objects.filter(
+                        kind=self.kind, date=today, term__in=[term for term, _ in rows]
+                    )
+                }
+                created = []
+                for term, count in rows:
+                    if term in existing:
+                        existing[term].count = F('count') + count
+                    else:
+                        created.append(SearchTermCount(
+                            kind=self.kind, term=term, label=labels.get(term, term), date=today, count=count
+                        ))
+                SearchTermCount.objects.bulk_update(existing.values(), ['count'])
+                try:
+                    with transaction.atomic():
+                        SearchTermCount.objects.bulk_create(created)
+                except IntegrityError:
+                    # Another process created some of the rows first
+                    for row in created:
+                        updated = SearchTermCount.objects.filter(
+                            kind=self.kind, term=row.term, date=today
+                        ).update(count=F('count') + row.count)
+                        if not updated:
+                            row.save()
+                SearchTermCount.objects.filter(
+                    kind=self.kind, date__lt=today - timedelta(days=RETENTION_DAYS)
+                ).delete()
+        except Exception as e:
+            logger.error(f"Failed to flush {self.kind} search terms: {e}")
+            return
+        self.refresh_lists()
+
+    # Lists
+
+    def _lists_key(self) -> str:
+        return make_cache_key('search_terms', self.kind)
+
+    def refresh_lists(self) -> Dict[str, List[dict]]:
+        lists = {
+            'popular': self.compute_popular(),
+            'trending': self.compute_trending(),
+            'computed_at': time.time(),
+        }
+        cache.set(self._lists_key(), lists, LIST_CACHE_TIMEOUT)
+        return lists
+
+    @staticmethod
+    def _lists_due(lists) -> bool:
+        return lists is None or time.time() - lists['computed_at'] >= LIST_REFRESH_INTERVAL
+
+    def _lists(self) -> Dict[str, List[dict]]:
+        lists = cache.get(self._lists_key())
+        if self._lists_due(lists):
+            self._flusher.start()
+            # Inline where the flusher cannot run in the background
+            lists = cache.get(self._lists_key()) or lists
+        return lists or {'popular': [], 'trending': []}
+
+    def popular(self, limit: int = 10, days: int = POPULAR_DAYS) -> List[dict]:
+        """Most searched terms of the last days, precomputed for POPULAR_DAYS"""
+        if days != POPULAR_DAYS:
+            return self.compute_popular(days)[:limit]
+        return self._lists()['popular'][:limit]
+
+    def trending(self, limit: int = 10) -> List[dict]:
+        """Terms searched today far more often than on the days before"""
+        return self._lists()['trending'][:limit]
+
+    def compute_popular(self, days: int = POPULAR_DAYS) -> List[dict]:
+        from ..models import SearchTermCount
+
+        since = timezone.localdate() - timedelta(days=days - 1)
+        rows = (
+            SearchTermCount.objects.filter(kind=self.kind, date__gte=since)
+            .values('term')
+            .annotate(total=Sum('count'), label=Max('label'))
+            .order_by('-total', 'term')[:LIST_SIZE]
+        )
+        return [{'term': row['term'], 'text': row['label'], 'count': row['total']} for row in rows]
+
+    def compute_trending(self) -> List[dict]:
+        from ..models import SearchTermCount
+
+        today = timezone.localdate()
+        current = list(
+            SearchTermCount.objects.filter(kind=self.kind, date=today, count__gte=TRENDING_MIN_COUNT)
+            .order_by('-count')
+            .values('term', 'label', 'count')[:self.capacity]
+        )
+        baseline = dict(
+            SearchTermCount.objects.filter(
+                kind=self.kind,
+                term__in=[row['term'] for row in current],
+                date__gte=today - timedelta(days=TRENDING_BASELINE_DAYS),
+                date__lt=today,
+            )
+            .values('term')
+            .annotate(total=Sum('count'))
+            .values_list('term', 'total')
+        )
+        trending = []
+        for row in current:
+            daily_average = baseline.get(row['term'], 0) / TRENDING_BASELINE_DAYS
+            score = row['count'] / (daily_average + 1)
+            if score > 1:
+                trending.append({
+                    'term': row['term'], 'text': row['label'], 'count': row['count'], 'score': round(score, 2)
+                })
+        trending.sort(key=lambda item: item['score'], reverse=True)
+        return trending[:LIST_SIZE]
+
+
+listing_searches = SearchTermTracker(KIND_LISTING)
+location_searches = SearchTermTracker(KIND_LOCATION)
+
+
+def record_search(query: str, kind: str = KIND_LISTING):
+    """Count a search query typed by a user"""
+    tracker = location_searches if kind == KIND_LOCATION else listing_searches
+    try:
+        tracker.record(query)
+    except Exception as e:
+        logger.error(f"Failed to record search term: {e}")
+
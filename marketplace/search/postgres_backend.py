@@ -0,0 +1,114 @@
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from ..utils.text import fold_text
+from .base_backend import BaseSearchBackend
+
+SEARCH_TABLE = 'marketplace_listing_search'
+SEARCH_CONFIG = 'simple'
+
+# Listings folded and inserted per round-trip by rebuild()
+REBUILD_BATCH = 1000
+
+# tsvector weight per indexed column
+FIELD_WEIGHTS = (
+    ('title', 'A'),
+    ('location', 'B'),
+    ('city', 'B'),
+    ('description', 'C'),
+    ('county', 'D'),
+    ('address', 'D'),
+)
+
+
+def _document_sql(source):
+    """Build the weighted tsvector expression, source formats each column"""
+    return ' || '.join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', COALESCE({source(field)}, '')), '{weight}')"
+        for field, weight in FIELD_WEIGHTS
+    )
+
+
+def _document_values(values):
+    """'simple' keeps diacritics, so every column is folded like the terms parse_query produces"""
+    return [fold_text(value) for value in values]
+
+
+class PostgresFTSBackend(BaseSearchBackend):
+    """PostgreSQL tsvector backend with a GIN-indexed side table"""
+
+    vendor = 'postgresql'
+
+    def _tsquery(self, terms):
+        # Terms only contain word characters, so prefix syntax is safe here
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def _search(self, queryset, terms):
+        tsquery = self._tsquery(terms)
+        matching_ids = RawSQL(
+            f"SELECT listing_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('{SEARCH_CONFIG}', %s)",
+            (tsquery,),
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank_cd(document, to_tsquery('{SEARCH_CONFIG}', %s)) "
+            f"FROM {SEARCH_TABLE} WHERE listing_id = marketplace_listing.id",
+            (tsquery,),
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank)
+
+    def _upsert_sql(self):
+        return (
+            f"INSERT INTO {SEARCH_TABLE} (listing_id, document) VALUES (%s, {_document_sql(lambda field: '%s')}) "
+            f"ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document"
+        )
+
+    def index_listing(self, listing, connection=None):
+        values = _document_values(getattr(listing, field) for field, _ in FIELD_WEIGHTS)
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(self._upsert_sql(), [listing.pk, *values])
+
+    def remove_listing(self, listing_id, connection=None):
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE listing_id = %s", [listing_id])
+
+    def install(self, connection=None):
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                f"listing_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+                f"ON {SEARCH_TABLE} USING GIN (document)"
+            )
+
+    def uninstall(self, connection=None):
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def rebuild(self, connection=None):
+        # Folded in Python, like index_listing: description and address have no folded shadow column
+        from ..models import Listing
+
+        connection = self._connection(connection)
+        fields = [field for field, _ in FIELD_WEIGHTS]
+        rows = (
+            Listing.objects.using(connection.alias).order_by('pk')
+            .values_list('pk', *fields).iterator(chunk_size=REBUILD_BATCH)
+        )
+        indexed = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+            batch = []
+            for pk, *values in rows:
+                batch.append([pk, *_document_values(values)])
+                if len(batch) == REBUILD_BATCH:
+                    cursor.executemany(self._upsert_sql(), batch)
+                    indexed += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(self._upsert_sql(), batch)
+                indexed += len(batch)
+        return indexed
@@ -0,0 +1,73 @@
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .base_backend import BaseSearchBackend, SEARCH_FIELDS
+
+FTS_TABLE = 'marketplace_listing_fts'
+
+# bm25 column weights, in SEARCH_FIELDS order
+FIELD_WEIGHTS = (10.0, 1.0, 4.0, 4.0, 2.0, 1.0)
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 backend, rows are keyed by listing id (FTS rowid)"""
+
+    vendor = 'sqlite'
+
+    def _match_expression(self, terms):
+        # Every term is quoted so FTS5 operators in user input stay literal
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def _search(self, queryset, terms):
+        match = self._match_expression(terms)
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+        matching_ids = RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            (match,),
+        )
+        # bm25() is lower for better matches, negate it so callers can order by -search_rank
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = marketplace_listing.id",
+            (match,),
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank)
+
+    def index_listing(self, listing, connection=None):
+        columns = ', '.join(SEARCH_FIELDS)
+        placeholders = ', '.join(['%s'] * len(SEARCH_FIELDS))
+        values = [getattr(listing, field) or '' for field in SEARCH_FIELDS]
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [listing.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (%s, {placeholders})",
+                [listing.pk, *values],
+            )
+
+    def remove_listing(self, listing_id, connection=None):
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [listing_id])
+
+    def install(self, connection=None):
+        columns = ', '.join(SEARCH_FIELDS)
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def uninstall(self, connection=None):
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+    def rebuild(self, connection=None):
+        columns = ', '.join(SEARCH_FIELDS)
+        source = ', '.join(f"COALESCE({field}, '')" for field in SEARCH_FIELDS)
+        with self._connection(connection).cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) "
+                f"SELECT id, {source} FROM marketplace_listing"
+            )
+            return cursor.rowcount
@@ -0,0 +1,298 @@
+"""
+Typeahead suggestions for the search box.
+Listing titles, category names and cities live in an in-process sorted array
+searched with bisect, so a lookup never touches the database. The index is
+refreshed incrementally whenever the search cache generation moves (any
+listing write, in any process) and rebuilt from scratch every
+SUGGEST_REBUILD_INTERVAL seconds to drop listings deleted elsewhere. Both
+run in background threads, the rebuild loading a new index and swapping it
+in, so lookups keep using what is loaded (or find nothing before the first
+build). A failed rebuild is retried after SUGGEST_RETRY_INTERVAL seconds.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from ..utils.background import BackgroundJob
+from ..utils.cache_utils import CACHE_PREFIX_SEARCH, CategoryCache, get_generation
+from ..utils.text import PREFIX_UPPER_BOUND, fold_text
+from .popular import LIST_SIZE, listing_searches, location_searches
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+
+# Lookups must stay under this many seconds (checked by tests/test_performance.py)
+SUGGEST_LATENCY_TARGET = 0.005
+
+SUGGEST_REBUILD_INTERVAL = 3600
+SUGGEST_RETRY_INTERVAL = 60
+
+# Memoised answers per (prefix, limit), dropped on every index change
+MAX_MEMOISED_PREFIXES = 2048
+
+# Words shorter than this do not start a suggestion on their own
+MIN_WORD_LENGTH = 2
+
+TERM_TITLE = 'title'
+TERM_CATEGORY = 'category'
+TERM_CITY = 'city'
+
+
+def search_term_counts() -> Dict[str, int]:
+    """How often each folded term was searched for recently, see search.popular"""
+    counts = {}
+    for tracker in (listing_searches, location_searches):
+        for item in tracker.popular(LIST_SIZE):
+            counts[item['term']] = counts.get(item['term'], 0) + item['count']
+    return counts
+
+
+class Term:
+    """One suggestion: a distinct folded title, category name or city"""
+    __slots__ = ('kind', 'key', 'label', 'slug', 'listings')
+
+    def __init__(self, kind: str, key: str, label: str, slug: Optional[str] = None):
+        self.kind = kind
+        self.key = key
+        self.label = label
+        self.slug = slug
+        self.listings = 0
+
+    def as_dict(self, searches: int) -> dict:
+        data = {'type': self.kind, 'text': self.label, 'listings': self.listings, 'searches': searches}
+        if self.slug:
+            data['slug'] = self.slug
+        return data
+
+
+class SuggestIndex:
+    """
+    Prefix index over suggestion terms.
+    Every term is reachable from the start of each of its words, so
+    "iph" finds "Apple iPhone 13". Suggestions are ranked by how often
+    they were searched for, then by the number of active listings.
+    """
+
+    # Attributes replaced together when a rebuilt index is swapped in
+    _STATE = (
+        '_terms', '_entries', '_listings', '_categories', '_searches', '_memo',
+        'built_at', 'generation', 'synced_until',
+    )
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Created on first use: the indexes rebuild() loads into never need them
+        self._rebuilder = None
+        self._refresher = None
+        self._failed_at = None
+        self._clear()
+
+    def _clear(self):
+        self._terms = {}            # (kind, key) -> Term
+        self._entries = []          # sorted (prefix key, kind, key)
+        self._listings = {}         # listing pk -> (title key, city key, category id)
+        self._categories = {}       # category pk -> Term
+        self._searches = {}         # folded term -> search count
+        self._memo = OrderedDict()
+        self.built_at = None
+        self.generation = None
+        self.synced_until = None
+        self._bulk = False
+
+    # Maintenance
+
+    def rebuild(self):
+        """Load every active listing, category and search count into a new index and swap it in"""
+        started = time.perf_counter()
+        fresh = SuggestIndex()
+        try:
+            fresh._load()
+        except Exception:
+            self._failed_at = time.monotonic()
+            raise
+        self._failed_at = None
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+        logger.info(f"Suggest index rebuilt with {len(self._terms)} terms in {time.perf_counter() - started:.3f}s")
+
+    def _load(self):
+        from ..models import Listing
+
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        with self._lock:
+            # Append entries unsorted and sort once at the end
+            self._bulk = True
+            for category in CategoryCache.get_all_categories():
+                self._categories[category['id']] = self._add_term(
+                    TERM_CATEGORY, fold_text(category['name']), category['name'], category['slug']
+                )
+            self.synced_until = Listing.objects.order_by('-updated_at').values_list('updated_at', flat=True).first()
+            self._apply(self._rows(Listing.objects.filter(status='active')).iterator())
+            self._bulk = False
+            self._entries.sort()
+            self._searches = search_term_counts()
+            self.built_at = time.monotonic()
+            self.generation = generation
+
+    def refresh(self):
+        """Apply the listings changed since the last sync; lookups carry on while they are read"""
+        from ..models import Listing
+
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        with self._lock:
+            built_at, synced_until = self.built_at, self.synced_until
+        changed = Listing.objects.all()
+        if synced_until is not None:
+            changed = changed.filter(updated_at__gte=synced_until)
+        rows = list(self._rows(changed))
+        searches = search_term_counts()
+        with self._lock:
+            if self.built_at != built_at:
+                # A rebuild was swapped in meanwhile
+                return
+            latest = self._apply(rows)
+            if latest is not None:
+                self.synced_until = latest
+            self._searches = searches
+            self._memo.clear()
+            self.generation = generation
+
+    def ensure_fresh(self):
+        """Start a refresh if the index is stale, or a rebuild when one is due, in the background"""
+        with self._lock:
+            if self._rebuilder is None:
+                self._rebuilder = BackgroundJob(self.rebuild, 'suggest-index-rebuild')
+            if self._refresher is None:
+                self._refresher = BackgroundJob(self.refresh, 'suggest-index-refresh')
+        now = time.monotonic()
+        due = self.built_at is None or now - self.built_at > SUGGEST_REBUILD_INTERVAL
+        backing_off = self._failed_at is not None and now - self._failed_at < SUGGEST_RETRY_INTERVAL
+        if due and not backing_off:
+            self._rebuilder.start()
+        if self.built_at is not None and get_generation(CACHE_PREFIX_SEARCH) != self.generation:
+            self._refresher.start()
+
+    @staticmethod
+    def _rows(queryset):
+        return queryset.order_by().values_list(
+            'pk', 'status', 'title', 'title_folded', 'city', 'city_folded', 'category_id', 'updated_at'
+        )
+
+    def _apply(self, rows):
+        latest = None
+        for pk, status, title, title_key, city, city_key, category_id, updated_at in rows:
+            self.remove_listing(pk)
+            if status == 'active':
+                self._add_listing(pk, title, title_key, city, city_key, category_id)
+            if latest is None or updated_at > latest:
+                latest = updated_at
+        return latest
+
+    def _add_listing(self, pk, title, title_key, city, city_key, category_id):
+        if title_key:
+            self._add_term(TERM_TITLE, title_key, title).listings += 1
+        if city_key:
+            self._add_term(TERM_CITY, city_key, city).listings += 1
+        category = self._categories.get(category_id)
+        if category is not None:
+            category.listings += 1
+        self._listings[pk] = (title_key, city_key, category_id)
+        self._memo.clear()
+
+    def remove_listing(self, pk):
+        """Forget a listing's contribution to its title, city and category"""
+        with self._lock:
+            contribution = self._listings.pop(pk, None)
+            if contribution is None:
+                return
+            title_key, city_key, category_id = contribution
+            for kind, key in ((TERM_TITLE, title_key), (TERM_CITY, city_key)):
+                term = self._terms.get((kind, key))
+                if term is not None:
+                    term.listings -= 1
+                    if term.listings <= 0:
+                        self._remove_term(term)
+            category = self._categories.get(category_id)
+            if category is not None:
+                category.listings -= 1
+            self._memo.clear()
+
+    def _add_term(self, kind: str, key: str, label: str, slug: Optional[str] = None) -> Term:
+        term = self._terms.get((kind, key))
+        if term is None:
+            term = self._terms[(kind, key)] = Term(kind, key, label, slug)
+            for prefix_key in self._prefix_keys(key):
+                if self._bulk:
+                    self._entries.append((prefix_key, kind, key))
+                else:
+                    insort(self._entries, (prefix_key, kind, key))
+        return term
+
+    def _remove_term(self, term: Term):
+        del self._terms[(term.kind, term.key)]
+        for prefix_key in self._prefix_keys(term.key):
+            entry = (prefix_key, term.kind, term.key)
+            index = bisect_left(self._entries, entry)
+            if index < len(self._entries) and self._entries[index] == entry:
+                del self._entries[index]
+
+    @staticmethod
+    def _prefix_keys(key: str) -> List[str]:
+        words = key.split(' ')
+        keys = [key]
+        for position in range(1, len(words)):
+            if len(words[position]) >= MIN_WORD_LENGTH:
+                keys.append(' '.join(words[position:]))
+        return keys
+
+    # Lookup
+
+    def suggest(self, query: str, limit: int = SUGGEST_LIMIT) -> List[dict]:
+        """Best suggestions starting with query (at a word boundary)"""
+        prefix = fold_text(query)
+        if not prefix:
+            return []
+        started = time.perf_counter()
+        with self._lock:
+            memo_key = (prefix, limit)
+            if memo_key in self._memo:
+                self._memo.move_to_end(memo_key)
+                return self._memo[memo_key]
+
+            start = bisect_left(self._entries, (prefix,))
+            stop = bisect_left(self._entries, (prefix + PREFIX_UPPER_BOUND,), lo=start)
+            candidates = {(kind, key) for _, kind, key in self._entries[start:stop]}
+            best = heapq.nlargest(limit, (self._terms[candidate] for candidate in candidates), key=self._rank)
+            results = [term.as_dict(self._searches.get(term.key, 0)) for term in best]
+
+            self._memo[memo_key] = results
+            if len(self._memo) > MAX_MEMOISED_PREFIXES:
+                self._memo.popitem(last=False)
+
+        elapsed = time.perf_counter() - started
+        if elapsed > SUGGEST_LATENCY_TARGET:
+            logger.warning(f"Suggest lookup for {prefix!r} took {elapsed * 1000:.1f}ms")
+        return results
+
+    def _rank(self, term: Term):
+        # Shorter labels win ties so "iphone" ranks above "iphone 13 pro max"
+        return (self._searches.get(term.key, 0), term.listings, -len(term.key))
+
+    def __len__(self):
+        return len(self._terms)
+
+
+suggest_index = SuggestIndex()
+
+
+def get_suggestions(query: str, limit: int = SUGGEST_LIMIT) -> List[dict]:
+    """Typeahead suggestions for a partial search query"""
+    suggest_index.ensure_fresh()
+    return suggest_index.suggest(query, min(max(limit, 1), MAX_SUGGEST_LIMIT))
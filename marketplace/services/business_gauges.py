@@ -0,0 +1,157 @@
+"""
+Business gauges for monitoring: active users, active and featured listings,
+revenue from succeeded payments.
+When monitoring is on and the cache is shared by all processes (Redis,
+see CACHES in settings), each gauge is a cache counter: saves and deletes
+of users, listings and payments apply the change of the instance's
+contribution with an atomic incr (signals in marketplace.signals), so
+reading the gauges is one get_many instead of counting whole tables.
+Bulk updates and rolled back transactions bypass the deltas; reconcile()
+recounts everything and is run periodically by
+manage.py reconcile_gauges, and whenever a gauge is missing from the cache.
+A per-process cache (LocMemCache, the default) would give every worker
+its own drifting counters, so there the signals are not connected and
+read() counts the tables instead, at most once per MONITORING_INTERVAL
+seconds in each process.
+"""
+import logging
+import time
+from decimal import Decimal
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Sum
+
+from ..models import Listing, Payment
+from ..utils.cache_utils import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_USERS = 'active_users'
+ACTIVE_LISTINGS = 'active_listings'
+FEATURED_LISTINGS = 'featured_listings'
+# In bani, so the counter stays an integer
+REVENUE = 'revenue'
+
+GAUGES = [ACTIVE_USERS, ACTIVE_LISTINGS, FEATURED_LISTINGS, REVENUE]
+
+CACHE_PREFIX_GAUGE = 'gauge'
+
+# (time.monotonic(), gauges) of the last count by read() without a shared cache
+_counted = None
+
+# Fields each model's contribution depends on
+TRACKED_FIELDS = {
+    User: ['is_active'],
+    Listing: ['status', 'is_featured'],
+    Payment: ['status', 'amount'],
+}
+
+
+def incremental() -> bool:
+    """Whether the gauges are kept as cache counters, see module docstring"""
+    return (getattr(settings, 'MONITORING_ENABLED', True)
+            and not isinstance(caches['default'], (LocMemCache, DummyCache)))
+
+
+def _key(gauge: str) -> str:
+    return make_cache_key(CACHE_PREFIX_GAUGE, gauge)
+
+
+def _contribution(model, values: Dict) -> Dict[str, int]:
+    """What one row with these field values adds to the gauges"""
+    if model is User:
+        return {ACTIVE_USERS: int(bool(values['is_active']))}
+    if model is Listing:
+        active = values['status'] == 'active'
+        return {ACTIVE_LISTINGS: int(active), FEATURED_LISTINGS: int(active and bool(values['is_featured']))}
+    succeeded = values['status'] == 'succeeded' and values['amount'] is not None
+    return {REVENUE: round(Decimal(values['amount']) * 100) if succeeded else 0}
+
+
+def _values(instance) -> Optional[Dict]:
+    """The tracked field values of an instance, None when some are deferred"""
+    fields = TRACKED_FIELDS[type(instance)]
+    if any(field not in instance.__dict__ for field in fields):
+        return None
+    return {field: instance.__dict__[field] for field in fields}
+
+
+def track(instance):
+    """Remember the values an instance was loaded or last saved with"""
+    instance._gauge_values = _values(instance)
+
+
+def _apply(deltas: Dict[str, int]):
+    for gauge, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_key(gauge), delta)
+        except ValueError:
+            # Missing gauges are recounted by the next read
+            pass
+        except Exception as e:
+            logger.error(f"Failed to update gauge {gauge}: {e}")
+
+
+def saved(instance, created: bool):
+    """Apply the change of a saved instance's contribution"""
+    model = type(instance)
+    values, previous = _values(instance), getattr(instance, '_gauge_values', None)
+    track(instance)
+    if values is None or (previous is None and not created):
+        # Saved or loaded with deferred fields: the delta is unknown until reconciled
+        return
+    new = _contribution(model, values)
+    old = _contribution(model, previous) if not created else {}
+    _apply({gauge: value - old.get(gauge, 0) for gauge, value in new.items()})
+
+
+def deleted(instance):
+    """Remove a deleted instance's contribution"""
+    values = getattr(instance, '_gauge_values', None)
+    if values is not None:
+        _apply({gauge: -value for gauge, value in _contribution(type(instance), values).items()})
+
+
+def count() -> Dict[str, int]:
+    """Every gauge counted from the database"""
+    revenue = Payment.objects.filter(status='succeeded').aggregate(total=Sum('amount'))['total'] or 0
+    return {
+        ACTIVE_USERS: User.objects.filter(is_active=True).count(),
+        ACTIVE_LISTINGS: Listing.objects.filter(status='active').count(),
+        FEATURED_LISTINGS: Listing.objects.filter(status='active', is_featured=True).count(),
+        REVENUE: round(revenue * 100),
+    }
+
+
+def reconcile() -> Dict[str, int]:
+    """Recount every gauge and correct the cached values; returns the drift corrected"""
+    current = cache.get_many([_key(gauge) for gauge in GAUGES])
+    counted = count()
+    cache.set_many({_key(gauge): value for gauge, value in counted.items()}, None)
+    return {gauge: value - current.get(_key(gauge), value) for gauge, value in counted.items()}
+
+
+def _recent_count() -> Dict[str, int]:
+    global _counted
+    counted = _counted
+    if counted is None or time.monotonic() - counted[0] >= getattr(settings, 'MONITORING_INTERVAL', 60):
+        counted = _counted = (time.monotonic(), count())
+    return dict(counted[1])
+
+
+def read() -> Dict[str, int]:
+    """Current gauges in one cache round-trip; recounted when any is missing or the cache is per process"""
+    if not incremental():
+        return _recent_count()
+    values = cache.get_many([_key(gauge) for gauge in GAUGES])
+    if len(values) < len(GAUGES):
+        reconcile()
+        values = cache.get_many([_key(gauge) for gauge in GAUGES])
+    return {gauge: values.get(_key(gauge), 0) for gauge in GAUGES}
@@ -0,0 +1,111 @@
+"""
+Daily rollups of listing and seller figures for charts.
+rollup() aggregates one day of stored interaction events (InteractionEvent
+rows, written by the 'database' event sink) with one grouped query per
+table and upserts the ListingDailyStats and SellerDailyStats rows of that
+day, so running it again over the same day is harmless. It is run
+periodically by manage.py rollup_daily_stats, for today and the previous
+days still changing. Charts then read one row per day with series(),
+however many events there were. With another INTERACTION_EVENT_SINK no rows
+are stored, so the rollups find nothing and rollup_days() logs a warning.
+
+Per day: views, favorites added, messages about a listing (contact events)
+and contacts, the distinct users who sent them.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from ..models import InteractionEvent, ListingDailyStats, SellerDailyStats
+from ..recommendations.data.events import CONTACT, FAVORITE, VIEW
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['views', 'favorites', 'messages', 'contacts']
+
+# Longest range served to charts
+MAX_DAYS = 365
+
+WRITE_BATCH = 1000
+
+AGGREGATES = {
+    'views': Count('id', filter=Q(kind=VIEW)),
+    'favorites': Count('id', filter=Q(kind=FAVORITE)),
+    'messages': Count('id', filter=Q(kind=CONTACT)),
+    'contacts': Count('user', filter=Q(kind=CONTACT), distinct=True),
+}
+
+
+def day_bounds(day: date):
+    """Start and end of a local day"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _upsert(model, key: str, day: date, rows: Iterable[Dict]) -> int:
+    objects = [
+        model(**{key: row['key'], 'date': day}, **{field: row[field] for field in FIELDS})
+        for row in rows
+    ]
+    model.objects.bulk_create(
+        objects, batch_size=WRITE_BATCH, update_conflicts=True,
+        unique_fields=[key.removesuffix('_id'), 'date'], update_fields=FIELDS,
+    )
+    return len(objects)
+
+
+def rollup(day: date) -> int:
+    """Recompute the listing and seller figures of one day; returns how many listing rows were written"""
+    start, end = day_bounds(day)
+    events = InteractionEvent.objects.filter(created_at__gte=start, created_at__lt=end).order_by()
+    listings = events.values(key=F('listing_id')).annotate(**AGGREGATES)
+    written = _upsert(ListingDailyStats, 'listing_id', day, listings)
+    # Events of deleted listings have no seller any more
+    sellers = events.filter(listing__user_id__isnull=False).values(key=F('listing__user_id')).annotate(**AGGREGATES)
+    _upsert(SellerDailyStats, 'user_id', day, sellers)
+    return written
+
+
+def rollup_days(days: int = 2, until: Optional[date] = None) -> int:
+    """Roll up the given number of days up to until (default today), oldest first"""
+    sink = getattr(settings, 'INTERACTION_EVENT_SINK', 'database')
+    if sink != 'database':
+        logger.warning(f"Daily stats read InteractionEvent rows, which the {sink!r} event sink does not write")
+    until = until or timezone.localdate()
+    written = 0
+    for offset in range(days - 1, -1, -1):
+        written += rollup(until - timedelta(days=offset))
+    return written
+
+
+def series(model, start: date, end: date, **key) -> List[Dict]:
+    """The figures of every day from start to end inclusive, zero on days without a row"""
+    rows = {
+        row['date']: row
+        for row in model.objects.filter(date__gte=start, date__lte=end, **key).values('date', *FIELDS)
+    }
+    empty = dict.fromkeys(FIELDS, 0)
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        days.append({**empty, **rows.get(day, {}), 'date': day})
+    return days
+
+
+def listing_series(listing_id: int, start: date, end: date) -> List[Dict]:
+    return series(ListingDailyStats, start, end, listing_id=listing_id)
+
+
+def seller_series(user_id: int, start: date, end: date) -> List[Dict]:
+    return series(SellerDailyStats, start, end, user_id=user_id)
+
+
+def date_range(days: int, until: Optional[date] = None):
+    """The last days up to until (default today), at most MAX_DAYS"""
+    until = until or timezone.localdate()
+    days = max(1, min(days, MAX_DAYS))
+    return until - timedelta(days=days - 1), until
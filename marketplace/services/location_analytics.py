@@ -1,179 +1,188 @@
 """
 Location Analytics Service for monitoring OpenStreetMap usage and performance
+
+Every figure is its own cache counter per day, updated with an atomic
+incr, so concurrent workers never overwrite each other's counts and a
+request costs a few increments whatever the traffic. Response times are
+counted in the fixed buckets of utils.histogram, from which the
+percentiles are computed when stats are read; counters of several days
+are read back in one get_many.
 """
 
 import logging
 from django.core.cache import cache
 from django.utils import timezone
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-import json
+from typing import Dict, Iterable, List, Optional
+from datetime import timedelta
+
+from marketplace.search.popular import KIND_LOCATION, location_searches, record_search
+from marketplace.utils.histogram import LATENCY_BUCKETS, bucket_index, percentiles
 
 logger = logging.getLogger(__name__)
 
+# Counters outlive the week of the weekly stats
+COUNTER_TIMEOUT = 8 * 86400
+
+GEOCODING_COUNTERS = ['total_requests', 'successful_requests', 'failed_requests', 'response_ms']
+SEARCH_COUNTERS = ['total_searches', 'total_results', 'response_ms']
+# One counter per bucket of the response time histogram
+LATENCY_COUNTERS = [f'latency_{index}' for index in range(len(LATENCY_BUCKETS))]
+
+METRICS = {
+    'geocoding': GEOCODING_COUNTERS + LATENCY_COUNTERS,
+    'search': SEARCH_COUNTERS + LATENCY_COUNTERS,
+    'rate_limits': ['total_hits'],
+}
+
+
 class LocationAnalytics:
     """Analytics service for location operations"""
-    
+
     CACHE_PREFIX = "location_analytics"
-    
+
+    @classmethod
+    def _key(cls, metric: str, date: str, counter) -> str:
+        return f"{cls.CACHE_PREFIX}_{metric}_{date}_{counter}"
+
+    @classmethod
+    def _incr(cls, key: str, delta: int = 1):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # First count of the day (or evicted); add() lets only one process create it
+            cache.add(key, 0, COUNTER_TIMEOUT)
+            cache.incr(key, delta)
+
+    @classmethod
+    def _count(cls, metric: str, counters: Dict[str, int], response_time: float):
+        date = timezone.now().strftime('%Y-%m-%d')
+        for counter, delta in counters.items():
+            if delta:
+                cls._incr(cls._key(metric, date, counter), delta)
+        cls._incr(cls._key(metric, date, 'response_ms'), round(response_time * 1000))
+        cls._incr(cls._key(metric, date, f'latency_{bucket_index(response_time)}'))
+
     @classmethod
     def log_geocoding_request(cls, query: str, success: bool, response_time: float, service: str = "nominatim"):
         """Log a geocoding request for analytics"""
         try:
-            # Daily stats
-            date_key = timezone.now().strftime('%Y-%m-%d')
-            stats_key = f"{cls.CACHE_PREFIX}_daily_{date_key}"
-            
-            daily_stats = cache.get(stats_key, {
-                'total_requests': 0,
-                'successful_requests': 0,
-                'failed_requests': 0,
-                'avg_response_time': 0,
-                'queries': []
-            })
-            
-            daily_stats['total_requests'] += 1
-            if success:
-                daily_stats['successful_requests'] += 1
-            else:
-                daily_stats['failed_requests'] += 1
-            
-            # Update average response time
-            total_time = daily_stats['avg_response_time'] * (daily_stats['total_requests'] - 1)
-            daily_stats['avg_response_time'] = (total_time + response_time) / daily_stats['total_requests']
-            
-            # Store recent queries (max 100)
-            daily_stats['queries'].append({
-                'query': query,
-                'success': success,
-                'response_time': response_time,
-                'timestamp': timezone.now().isoformat()
-            })
-            
-            if len(daily_stats['queries']) > 100:
-                daily_stats['queries'] = daily_stats['queries'][-100:]
-            
-            cache.set(stats_key, daily_stats, 86400)  # 24 hours
-            
+            cls._count('geocoding', {
+                'total_requests': 1,
+                'successful_requests': int(success),
+                'failed_requests': int(not success),
+            }, response_time)
         except Exception as e:
             logger.error(f"Failed to log geocoding analytics: {e}")
-    
+
     @classmethod
     def log_location_search(cls, query: str, results_count: int, response_time: float):
         """Log a location search request"""
         try:
-            date_key = timezone.now().strftime('%Y-%m-%d')
-            search_key = f"{cls.CACHE_PREFIX}_search_{date_key}"
-            
-            search_stats = cache.get(search_key, {
-                'total_searches': 0,
-                'avg_results': 0,
-                'avg_response_time': 0,
-                'popular_queries': {}
-            })
-            
-            search_stats['total_searches'] += 1
-            
-            # Update averages
-            total_results = search_stats['avg_results'] * (search_stats['total_searches'] - 1)
-            search_stats['avg_results'] = (total_results + results_count) / search_stats['total_searches']
-            
-            total_time = search_stats['avg_response_time'] * (search_stats['total_searches'] - 1)
-            search_stats['avg_response_time'] = (total_time + response_time) / search_stats['total_searches']
-            
-            # Track popular queries
-            query_lower = query.lower()
-            search_stats['popular_queries'][query_lower] = search_stats['popular_queries'].get(query_lower, 0) + 1
-            
-            cache.set(search_key, search_stats, 86400)
-            
+            cls._count('search', {'total_searches': 1, 'total_results': results_count}, response_time)
+
+            # Popular queries are counted in bounded memory, see search.popular
+            record_search(query, KIND_LOCATION)
+
         except Exception as e:
             logger.error(f"Failed to log search analytics: {e}")
-    
+
+    @classmethod
+    def _read(cls, dates: Iterable[str]) -> Dict[str, Dict]:
+        """Every counter of the given days, in one cache round-trip"""
+        dates = list(dates)
+        values = cache.get_many([
+            cls._key(metric, date, counter)
+            for date in dates for metric, counters in METRICS.items() for counter in counters
+        ])
+
+        def counts(metric, date, counters):
+            return {counter: values.get(cls._key(metric, date, counter), 0) for counter in counters}
+
+        stats = {}
+        for date in dates:
+            geocoding = counts('geocoding', date, GEOCODING_COUNTERS)
+            geocoding_latency = list(counts('geocoding', date, LATENCY_COUNTERS).values())
+            requests = geocoding['total_requests']
+            search = counts('search', date, SEARCH_COUNTERS)
+            search_latency = list(counts('search', date, LATENCY_COUNTERS).values())
+            searches = search['total_searches']
+            stats[date] = {
+                'date': date,
+                'geocoding': {
+                    'total_requests': requests,
+                    'successful_requests': geocoding['successful_requests'],
+                    'failed_requests': geocoding['failed_requests'],
+                    'avg_response_time': round(geocoding['response_ms'] / requests / 1000, 3) if requests else 0,
+                    **{f'{name}_response_time': value for name, value in percentiles(geocoding_latency).items()},
+                    'latency_histogram': geocoding_latency,
+                },
+                'search': {
+                    'total_searches': searches,
+                    'avg_results': search['total_results'] / searches if searches else 0,
+                    'avg_response_time': round(search['response_ms'] / searches / 1000, 3) if searches else 0,
+                    **{f'{name}_response_time': value for name, value in percentiles(search_latency).items()},
+                    'latency_histogram': search_latency,
+                },
+                'rate_limits': counts('rate_limits', date, ['total_hits']),
+            }
+        return stats
+
     @classmethod
     def get_daily_stats(cls, date: Optional[str] = None) -> Dict:
         """Get daily location service statistics"""
         if not date:
             date = timezone.now().strftime('%Y-%m-%d')
-        
-        geocoding_key = f"{cls.CACHE_PREFIX}_daily_{date}"
-        search_key = f"{cls.CACHE_PREFIX}_search_{date}"
-        
-        geocoding_stats = cache.get(geocoding_key, {})
-        search_stats = cache.get(search_key, {})
-        
-        return {
-            'date': date,
-            'geocoding': geocoding_stats,
-            'search': search_stats
-        }
-    
+        return cls._read([date])[date]
+
     @classmethod
     def get_weekly_stats(cls) -> List[Dict]:
         """Get weekly statistics"""
-        stats = []
         today = timezone.now().date()
-        
-        for i in range(7):
-            date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            daily_stats = cls.get_daily_stats(date)
-            stats.append(daily_stats)
-        
-        return list(reversed(stats))
-    
+        dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6, -1, -1)]
+        return list(cls._read(dates).values())
+
     @classmethod
     def get_service_health(cls) -> Dict:
         """Get current service health status"""
         today_stats = cls.get_daily_stats()
-        geocoding = today_stats.get('geocoding', {})
-        
-        total_requests = geocoding.get('total_requests', 0)
-        successful_requests = geocoding.get('successful_requests', 0)
-        
+        geocoding = today_stats['geocoding']
+
+        total_requests = geocoding['total_requests']
+        successful_requests = geocoding['successful_requests']
+
         if total_requests == 0:
             success_rate = 100  # No requests yet today
         else:
             success_rate = (successful_requests / total_requests) * 100
-        
-        avg_response_time = geocoding.get('avg_response_time', 0)
-        
+
+        # A few slow requests should show, an average hides them
+        p95_response_time = geocoding['p95_response_time']
+
         # Determine health status
-        if success_rate >= 95 and avg_response_time < 2.0:
+        if success_rate >= 95 and p95_response_time < 2.0:
             status = "healthy"
-        elif success_rate >= 90 and avg_response_time < 5.0:
+        elif success_rate >= 90 and p95_response_time < 5.0:
             status = "degraded"
         else:
             status = "unhealthy"
-        
+
         return {
             'status': status,
             'success_rate': round(success_rate, 2),
-            'avg_response_time': round(avg_response_time, 3),
+            'avg_response_time': geocoding['avg_response_time'],
+            'p50_response_time': geocoding['p50_response_time'],
+            'p95_response_time': p95_response_time,
+            'p99_response_time': geocoding['p99_response_time'],
             'total_requests_today': total_requests,
             'last_updated': timezone.now().isoformat()
         }
-    
+
     @classmethod
     def get_popular_locations(cls, days: int = 7) -> List[Dict]:
         """Get most popular searched locations"""
-        popular_queries = {}
-        today = timezone.now().date()
-        
-        for i in range(days):
-            date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            search_key = f"{cls.CACHE_PREFIX}_search_{date}"
-            search_stats = cache.get(search_key, {})
-            
-            day_queries = search_stats.get('popular_queries', {})
-            for query, count in day_queries.items():
-                popular_queries[query] = popular_queries.get(query, 0) + count
-        
-        # Sort by popularity
-        sorted_queries = sorted(popular_queries.items(), key=lambda x: x[1], reverse=True)
-        
         return [
-            {'query': query, 'search_count': count}
-            for query, count in sorted_queries[:20]
+            {'query': item['text'], 'search_count': item['count']}
+            for item in location_searches.popular(20, days=days)
         ]
 
     @classmethod
@@ -181,21 +190,6 @@ class LocationAnalytics:
         """Log when we hit rate limits"""
         try:
             date_key = timezone.now().strftime('%Y-%m-%d')
-            rate_limit_key = f"{cls.CACHE_PREFIX}_rate_limits_{date_key}"
-            
-            rate_limit_stats = cache.get(rate_limit_key, {
-                'total_hits': 0,
-                'timestamps': []
-            })
-            
-            rate_limit_stats['total_hits'] += 1
-            rate_limit_stats['timestamps'].append(timezone.now().isoformat())
-            
-            # Keep only last 100 timestamps
-            if len(rate_limit_stats['timestamps']) > 100:
-                rate_limit_stats['timestamps'] = rate_limit_stats['timestamps'][-100:]
-            
-            cache.set(rate_limit_key, rate_limit_stats, 86400)
-            
+            cls._incr(cls._key('rate_limits', date_key, 'total_hits'))
         except Exception as e:
             logger.error(f"Failed to log rate limit hit: {e}")
@@ -15,6 +15,7 @@ from dataclasses import dataclass
 from math import radians, cos, sin, asin, sqrt
 import time
 from requests_cache import CachedSession
+from ..utils.text import fold_text, folded_prefix_q
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +62,18 @@ class LocationService:
         'Botoșani': (47.7402, 26.6656),
         'Satu Mare': (47.7914, 22.8816),
     }
+
+    # Folded spellings that are not plain diacritic variants of ROMANIA_CITIES
+    CITY_ALIASES = {
+        'bucharest': 'București',
+        'cluj': 'Cluj-Napoca',
+    }
+
+    # Folded name -> canonical name, covers every spelling with or without diacritics
+    FOLDED_CITIES = {
+        **{fold_text(city): city for city in ROMANIA_CITIES},
+        **CITY_ALIASES,
+    }
     
     def __init__(self):
         self._last_request_time = 0
@@ -133,30 +146,11 @@ class LocationService:
         if not location:
             return ""
         
-        location = location.strip().title()
-        
-        # Handle common variations
-        replacements = {
-            'Bucuresti': 'București',
-            'Bucharest': 'București',
-            'Cluj': 'Cluj-Napoca',
-            'Iasi': 'Iași',
-            'Timisoara': 'Timișoara',
-            'Constanta': 'Constanța',
-            'Brasov': 'Brașov',
-            'Galati': 'Galați',
-            'Ploiesti': 'Ploiești',
-            'Braila': 'Brăila',
-            'Pitesti': 'Pitești',
-            'Targu Mures': 'Târgu Mureș',
-            'Botosani': 'Botoșani',
-        }
-        
-        for old, new in replacements.items():
-            if location.lower() == old.lower():
-                return new
+        canonical = self.FOLDED_CITIES.get(fold_text(location))
+        if canonical:
+            return canonical
         
-        return location
+        return location.strip().title()
     
     def get_coordinates_from_city(self, city: str) -> Optional[Tuple[float, float]]:
         """Get coordinates for a Romanian city from local cache"""
@@ -314,10 +308,11 @@ class LocationService:
         
         results = []
         
-        # First, search in our known Romanian cities
-        query_lower = query.lower()
+        # First, search in our known Romanian cities, ignoring case and diacritics
+        query_folded = fold_text(query)
+        alias = self.CITY_ALIASES.get(query_folded)
         for city, coords in self.ROMANIA_CITIES.items():
-            if query_lower in city.lower():
+            if query_folded in fold_text(city) or city == alias:
                 results.append(LocationResult(
                     name=city,
                     latitude=coords[0],
@@ -328,6 +323,11 @@ class LocationService:
                     location_type="city"
                 ))
         
+        # Then cities that already have listings, via the indexed folded city column
+        if len(results) < limit:
+            known = {fold_text(result.city) for result in results}
+            results.extend(self._search_listing_cities(query, limit - len(results), known))
+        
         # If we have enough results, return them
         if len(results) >= limit:
             result_dicts = [result.__dict__ for result in results[:limit]]
@@ -372,6 +372,39 @@ class LocationService:
         cache.set(cache_key, result_dicts, 3600)
         return results[:limit]
     
+    def _search_listing_cities(self, query: str, limit: int, exclude=()) -> List[LocationResult]:
+        """Find cities of existing listings whose folded name starts with query"""
+        from django.db.models import Avg, Count, Max
+        from ..models import Listing
+        
+        rows = (
+            Listing.objects.filter(folded_prefix_q('city_folded', query))
+            .exclude(latitude__isnull=True)
+            .values('city_folded')
+            .annotate(
+                city=Max('city'),
+                county=Max('county'),
+                latitude=Avg('latitude'),
+                longitude=Avg('longitude'),
+                listings=Count('id'),
+            )
+            .order_by('-listings')[:limit + len(exclude)]
+        )
+        
+        matches = [
+            LocationResult(
+                name=row['city'],
+                latitude=float(row['latitude']),
+                longitude=float(row['longitude']),
+                formatted_address=f"{row['city']}, România",
+                city=row['city'],
+                county=row['county'] or '',
+                location_type="city"
+            )
+            for row in rows if row['city_folded'] not in exclude
+        ]
+        return matches[:limit]
+    
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Calculate distance between two points using Haversine formula"""
@@ -0,0 +1,143 @@
+"""
+Seller analytics (UserAnalytics) without per-listing loops.
+compute() gathers the totals of a chunk of users with one grouped query per
+source (listings and their views, favorites, received messages, visitor
+sketches), whatever the number of listings; refresh() upserts the rows of
+every chunk in one statement and is run periodically by
+manage.py refresh_user_analytics. Between full refreshes single events are
+added to the existing rows with UPDATE ... SET total = total + n: listing
+and message signals directly, views and favorites from the interaction
+event batches. The conversion rate is only recomputed by full refreshes.
+"""
+import logging
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from ..models import Favorite, Listing, Message, UserAnalytics
+from ..recommendations.data.events import FAVORITE, UNFAVORITE, VIEW
+from ..utils.unique_visitors import unique_visitors
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Users refreshed per set of queries
+USER_CHUNK = 1000
+
+# conversion_rate has max_digits=5, decimal_places=2
+MAX_CONVERSION_RATE = Decimal('999.99')
+
+COUNTERS = ['total_listings', 'total_views', 'total_favorites', 'total_messages', 'unique_viewers']
+
+
+def conversion_rate(messages: int, favorites: int) -> Decimal:
+    """Messages received per 100 favorites"""
+    if not favorites:
+        return Decimal('0.00')
+    return min(Decimal(messages * 100) / favorites, MAX_CONVERSION_RATE).quantize(Decimal('0.01'))
+
+
+def compute(user_ids: Iterable[int]) -> Dict[int, Dict]:
+    """Analytics fields of each user, four queries per call"""
+    user_ids = list(user_ids)
+    totals = {user_id: dict.fromkeys(COUNTERS, 0) for user_id in user_ids}
+
+    listings = (
+        Listing.objects.filter(user_id__in=user_ids).order_by()
+        .values('user_id').annotate(listings=Count('id'), views=Sum('views'))
+    )
+    for row in listings:
+        totals[row['user_id']].update(total_listings=row['listings'], total_views=row['views'] or 0)
+    favorites = (
+        Favorite.objects.filter(listing__user_id__in=user_ids).order_by()
+        .values_list('listing__user_id').annotate(favorites=Count('id'))
+    )
+    for user_id, count in favorites:
+        totals[user_id]['total_favorites'] = count
+    messages = (
+        Message.objects.filter(receiver_id__in=user_ids).order_by()
+        .values_list('receiver_id').annotate(messages=Count('id'))
+    )
+    for user_id, count in messages:
+        totals[user_id]['total_messages'] = count
+    for user_id, count in unique_visitors.totals_by_seller(user_ids).items():
+        totals[user_id]['unique_viewers'] = count
+
+    for fields in totals.values():
+        fields['conversion_rate'] = conversion_rate(fields['total_messages'], fields['total_favorites'])
+    return totals
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def refresh(user_ids: Optional[Iterable[int]] = None, chunk_size: int = USER_CHUNK) -> int:
+    """Recompute the analytics of the given users (default: all); returns how many rows were written"""
+    if user_ids is None:
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+    # Visitors counted by this process so far
+    unique_visitors.flush()
+    written = 0
+    for chunk in _chunks(user_ids, chunk_size):
+        now = timezone.now()
+        rows = [
+            UserAnalytics(user_id=user_id, last_updated=now, **fields)
+            for user_id, fields in compute(chunk).items()
+        ]
+        UserAnalytics.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['user'],
+            update_fields=COUNTERS + ['conversion_rate', 'last_updated'],
+        )
+        written += len(rows)
+    return written
+
+
+# Incremental updates
+
+def bump(user_ids: Iterable[int], **deltas: int):
+    """Add deltas to counters of the users' existing rows, never going below zero"""
+    values = {
+        field: F(field) + delta if delta >= 0 else Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items() if delta
+    }
+    if values:
+        UserAnalytics.objects.filter(user_id__in=list(user_ids)).update(**values)
+
+
+def record_events(events):
+    """Interaction event listener: add the batch's views and favorites to the sellers' counters"""
+    changes = defaultdict(Counter)
+    for event in events:
+        if event.kind == VIEW:
+            changes[event.listing_id]['total_views'] += 1
+        elif event.kind == FAVORITE:
+            changes[event.listing_id]['total_favorites'] += 1
+        elif event.kind == UNFAVORITE:
+            changes[event.listing_id]['total_favorites'] -= 1
+    if not changes:
+        return
+    sellers = dict(Listing.objects.filter(pk__in=list(changes)).values_list('pk', 'user_id'))
+    by_seller = defaultdict(Counter)
+    for listing_id, counts in changes.items():
+        if listing_id in sellers:
+            by_seller[sellers[listing_id]].update(counts)
+    # One UPDATE per distinct set of deltas
+    groups: Dict[tuple, List[int]] = defaultdict(list)
+    for user_id, counts in by_seller.items():
+        groups[tuple(sorted(counts.items()))].append(user_id)
+    for deltas, user_ids in groups.items():
+        bump(user_ids, **dict(deltas))
@@ -1,7 +1,32 @@
+import logging
+from functools import partial
+
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
-from .models import UserProfile
+from .models import Favorite, Message, UserProfile, Listing
+from .recommendations.data.events import CONTACT, FAVORITE, UNFAVORITE, collector
+from .recommendations.services.content_based import content_recommender
+from .search import get_search_backend
+from .ai_search.engine import semantic_engine
+from .search.suggest import suggest_index
+from .services import business_gauges, user_analytics
+from .utils.cache_utils import invalidate_listing_cache
+from .utils.unique_visitors import unique_visitors
+from .utils.view_counter import view_counter
+
+logger = logging.getLogger(__name__)
+
+# Saves touching only these fields leave cached search results valid;
+# view counts change all the time (see utils.view_counter)
+SEARCH_NEUTRAL_FIELDS = frozenset({'views'})
+
+# View counts and visitor sketches are written behind, with the batches
+collector.subscribe(view_counter.record_events)
+collector.subscribe(unique_visitors.record_events)
+# Sellers' view and favorite totals follow the batches between full refreshes
+collector.subscribe(user_analytics.record_events)
 
 
 @receiver(post_save, sender=User)
@@ -18,3 +43,137 @@ def save_user_profile(sender, instance, **kwargs):
         instance.profile.save()
     except UserProfile.DoesNotExist:
         UserProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Listing)
+def index_listing_for_search(sender, instance, raw=False, **kwargs):
+    """Keep the full-text search index in sync with listing edits."""
+    if raw:
+        return
+    try:
+        # Savepoint so an index failure never poisons the caller's transaction
+        with transaction.atomic():
+            get_search_backend().index_listing(instance)
+    except Exception as e:
+        logger.error(f"Failed to index listing {instance.pk} for search: {e}")
+
+
+@receiver(post_delete, sender=Listing)
+def remove_listing_from_search(sender, instance, **kwargs):
+    """Drop deleted listings from the full-text search index."""
+    try:
+        with transaction.atomic():
+            get_search_backend().remove_listing(instance.pk)
+    except Exception as e:
+        logger.error(f"Failed to remove listing {instance.pk} from search index: {e}")
+
+
+@receiver(post_save, sender=Listing)
+def invalidate_listing_cache_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Drop the cached listing and start a new search cache generation."""
+    if raw:
+        return
+    if update_fields and set(update_fields) <= SEARCH_NEUTRAL_FIELDS:
+        return
+    invalidate_listing_cache(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_cache_on_delete(sender, instance, **kwargs):
+    """Deleted listings must disappear from cached search results."""
+    invalidate_listing_cache(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_listing_from_suggestions(sender, instance, **kwargs):
+    """Other processes drop deleted listings on their next suggest index rebuild."""
+    suggest_index.remove_listing(instance.pk)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_listing_from_semantic_index(sender, instance, **kwargs):
+    """Other processes drop deleted listings on their next semantic index build."""
+    semantic_engine.remove_listing(instance.pk)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_listing_from_similar_listings(sender, instance, **kwargs):
+    """Other processes drop deleted listings on their next similar listings rebuild."""
+    content_recommender.remove_listing(instance.pk)
+
+
+@receiver(post_save, sender=Favorite)
+def record_favorite_event(sender, instance, created, raw=False, **kwargs):
+    """
+    New favorites reach analytics and the seller's totals through the interaction
+    event pipeline, once committed: the collector flushes outside the caller's
+    transaction, so events of rolled back writes would otherwise survive.
+    """
+    if created and not raw:
+        transaction.on_commit(partial(collector.record, FAVORITE, instance.listing_id, user_id=instance.user_id))
+
+
+@receiver(post_delete, sender=Favorite)
+def record_unfavorite_event(sender, instance, **kwargs):
+    transaction.on_commit(partial(collector.record, UNFAVORITE, instance.listing_id, user_id=instance.user_id))
+
+
+@receiver(post_save, sender=Message)
+def record_contact_event(sender, instance, created, raw=False, **kwargs):
+    """A message about a listing is a contact with its seller."""
+    if created and not raw and instance.listing_id:
+        transaction.on_commit(partial(collector.record, CONTACT, instance.listing_id, user_id=instance.sender_id))
+
+
+@receiver(post_save, sender=Listing)
+def count_new_listing(sender, instance, created, raw=False, **kwargs):
+    """Keep the seller's analytics current until the next full refresh."""
+    if created and not raw:
+        user_analytics.bump([instance.user_id], total_listings=1, total_views=instance.views)
+
+
+@receiver(post_delete, sender=Listing)
+def uncount_deleted_listing(sender, instance, **kwargs):
+    user_analytics.bump([instance.user_id], total_listings=-1, total_views=-instance.views)
+
+
+@receiver(post_save, sender=Message)
+def count_received_message(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        user_analytics.bump([instance.receiver_id], total_messages=1)
+
+
+# Business gauges follow every user, listing and payment change when they are
+# kept in a shared cache, see services.business_gauges
+
+def track_gauge_values(sender, instance, **kwargs):
+    business_gauges.track(instance)
+
+
+def update_gauges_on_save(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        business_gauges.saved(instance, created)
+
+
+def update_gauges_on_delete(sender, instance, **kwargs):
+    business_gauges.deleted(instance)
+
+
+def connect_gauge_signals():
+    for model in business_gauges.TRACKED_FIELDS:
+        post_init.connect(track_gauge_values, sender=model, dispatch_uid=f'track_gauge_values_{model.__name__}')
+        post_save.connect(update_gauges_on_save, sender=model, dispatch_uid=f'update_gauges_on_save_{model.__name__}')
+        post_delete.connect(update_gauges_on_delete, sender=model,
+                            dispatch_uid=f'update_gauges_on_delete_{model.__name__}')
+
+
+def disconnect_gauge_signals():
+    for model in business_gauges.TRACKED_FIELDS:
+        post_init.disconnect(sender=model, dispatch_uid=f'track_gauge_values_{model.__name__}')
+        post_save.disconnect(sender=model, dispatch_uid=f'update_gauges_on_save_{model.__name__}')
+        post_delete.disconnect(sender=model, dispatch_uid=f'update_gauges_on_delete_{model.__name__}')
+
+
+# Nothing runs on every model load unless the gauges are read from the cache
+if business_gauges.incremental():
+    connect_gauge_signals()
@@ -0,0 +1,78 @@
+"""
+Work kept off the request path.
+A BackgroundJob runs its function in a daemon thread, one run at a time:
+starting it while a run is going does nothing, so a request that finds an
+index missing or stale starts a rebuild and carries on with what is
+loaded. Where other threads cannot see the caller's uncommitted writes (an
+in-memory SQLite database, i.e. the test database) the job runs inline.
+"""
+import logging
+import os
+import threading
+from typing import Callable
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def background_safe() -> bool:
+    """Whether a thread of its own sees the same database as the calling one"""
+    # An in-memory SQLite database (the test database) is locked by the request's transaction
+    return not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+def table_exists(model) -> bool:
+    """Whether the database still has model's table; false once the test database is destroyed"""
+    try:
+        return model._meta.db_table in connection.introspection.table_names()
+    except Exception:
+        return False
+
+
+class BackgroundJob:
+    """Run func in a background thread, at most one run at a time, see module docstring"""
+
+    def __init__(self, func: Callable[[], None], name: str):
+        self.func = func
+        self.name = name
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def start(self) -> bool:
+        """Start a run unless one is going; returns whether one was started"""
+        if not background_safe():
+            self._run()
+            return True
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run_in_thread, name=self.name, daemon=True)
+            self._thread.start()
+        return True
+
+    def join(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            self.func()
+        except Exception as e:
+            logger.error(f"Background job {self.name} failed: {e}")
+
+    def _run_in_thread(self):
+        try:
+            self._run()
+        finally:
+            connection.close()
@@ -7,6 +7,7 @@ from django.conf import settings
 from functools import wraps
 import hashlib
 import json
+import time
 from typing import Any, Callable, Optional
 import logging
 
@@ -18,6 +19,12 @@ CACHE_PREFIX_CATEGORY = 'category'
 CACHE_PREFIX_USER = 'user'
 CACHE_PREFIX_SEARCH = 'search'
 CACHE_PREFIX_LOCATION = 'location'
+CACHE_PREFIX_GENERATION = 'generation'
+
+DEFAULT_POPULAR_SEARCHES = [
+    'iPhone', 'Samsung', 'Apartament', 'Mașină', 'Laptop',
+    'Bicicletă', 'Mobilă', 'Haine', 'Jocuri', 'Cărți'
+]
 
 # Cache timeouts (in seconds)
 CACHE_TIMEOUT_SHORT = 300  # 5 minutes
@@ -47,6 +54,51 @@ def make_cache_key(prefix: str, *args, **kwargs) -> str:
     return ':'.join(key_parts)
 
 
+def make_queryset_cache_key(prefix: str, queryset, *args) -> str:
+    """
+    Generate a cache key identifying a queryset by its SQL statement (and args, such as a generation)
+    """
+    sql = str(queryset.order_by().query)
+    return make_cache_key(prefix, *args, hashlib.md5(sql.encode('utf-8')).hexdigest())
+
+
+def _generation_key(namespace: str) -> str:
+    return make_cache_key(CACHE_PREFIX_GENERATION, namespace)
+
+
+def _generation_seed() -> int:
+    # Seed from the clock (microseconds) so a counter lost to eviction never
+    # restarts at a value whose keys may still be cached
+    return time.time_ns() // 1000
+
+
+def get_generation(namespace: str) -> int:
+    """
+    Current generation of a cache namespace.
+    Keys built with the generation are invalidated together by bump_generation.
+    """
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _generation_seed(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(namespace: str) -> int:
+    """
+    Invalidate every key of a namespace in O(1) by moving to a new generation.
+    Works on any backend: stale entries are never read again and expire on their own.
+    """
+    key = _generation_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Counter missing (never read or evicted): start a fresh one
+        cache.add(key, _generation_seed(), None)
+        return cache.incr(key)
+
+
 def cache_result(prefix: str, timeout: int = CACHE_TIMEOUT_MEDIUM):
     """
     Decorator to cache function results
@@ -159,29 +211,61 @@ class CategoryCache:
 
 
 class SearchCache:
-    """Cache manager for search results"""
+    """
+    Cache manager for search results.
+    Keys embed the current search generation, so any listing write
+    invalidates all cached results at once (see invalidate).
+    """
+    
+    @staticmethod
+    def make_key(*args, **kwargs) -> str:
+        """Search cache key bound to the current generation"""
+        return make_cache_key(CACHE_PREFIX_SEARCH, get_generation(CACHE_PREFIX_SEARCH), *args, **kwargs)
     
     @staticmethod
     def get_search_results(query: str, filters: dict) -> Optional[list]:
         """Get cached search results"""
-        cache_key = make_cache_key(CACHE_PREFIX_SEARCH, query, **filters)
-        return cache.get(cache_key)
+        return cache.get(SearchCache.make_key(query, **filters))
     
     @staticmethod
     def set_search_results(query: str, filters: dict, results: list, timeout: int = CACHE_TIMEOUT_SHORT):
         """Cache search results"""
-        cache_key = make_cache_key(CACHE_PREFIX_SEARCH, query, **filters)
-        cache.set(cache_key, results, timeout)
+        cache.set(SearchCache.make_key(query, **filters), results, timeout)
     
     @staticmethod
-    @cache_result(CACHE_PREFIX_SEARCH + ':popular', CACHE_TIMEOUT_MEDIUM)
-    def get_popular_searches():
-        """Get popular search terms (cached)"""
-        # This would typically query a search log table
-        return [
-            'iPhone', 'Samsung', 'Apartament', 'Mașină', 'Laptop',
-            'Bicicletă', 'Mobilă', 'Haine', 'Jocuri', 'Cărți'
-        ]
+    def page_key(queryset) -> str:
+        """Key of one page of results, identified by its ordered and sliced SQL"""
+        sql = str(queryset.query)
+        return SearchCache.make_key('page', hashlib.md5(sql.encode('utf-8')).hexdigest())
+    
+    @staticmethod
+    def get_result_ids(queryset) -> Optional[list]:
+        """Get the cached primary keys of a page of results"""
+        return cache.get(SearchCache.page_key(queryset))
+    
+    @staticmethod
+    def set_result_ids(queryset, ids: list, timeout: int = CACHE_TIMEOUT_SHORT):
+        """Cache the primary keys of a page of results"""
+        cache.set(SearchCache.page_key(queryset), list(ids), timeout)
+    
+    @staticmethod
+    def invalidate():
+        """Invalidate all cached search results"""
+        bump_generation(CACHE_PREFIX_SEARCH)
+    
+    @staticmethod
+    def get_popular_searches(limit: int = 10) -> list:
+        """Get popular search terms (precomputed from search traffic, see search.popular)"""
+        from marketplace.search.popular import listing_searches
+        terms = [item['text'] for item in listing_searches.popular(limit)]
+        # Until enough searches have been recorded
+        return terms or DEFAULT_POPULAR_SEARCHES[:limit]
+    
+    @staticmethod
+    def get_trending_searches(limit: int = 10) -> list:
+        """Get search terms trending today"""
+        from marketplace.search.popular import listing_searches
+        return [item['text'] for item in listing_searches.trending(limit)]
 
 
 class LocationCache:
@@ -270,18 +354,10 @@ def warm_cache():
 def invalidate_listing_cache(listing):
     """Invalidate all caches related to a listing"""
     ListingCache.delete_listing(listing.id)
-    # Also invalidate search cache as results might have changed
+    # Search results might have changed: move to a new generation instead of
+    # scanning for keys, which LocMem cannot do and Redis does with a costly KEYS
     try:
-        if hasattr(cache, 'delete_pattern'):
-            cache.delete_pattern(f"{CACHE_PREFIX_SEARCH}*")
-        elif hasattr(cache, 'keys'):
-            # Fallback for caches with keys method
-            keys = [key for key in cache.keys(f"{CACHE_PREFIX_SEARCH}*") if key is not None]
-            for key in keys:
-                cache.delete(key)
-        else:
-            # For LocMemCache and similar, we can't easily invalidate by pattern
-            logger.debug("Cache backend doesn't support pattern deletion, skipping search cache invalidation")
+        SearchCache.invalidate()
     except Exception as e:
         logger.warning(f"Failed to invalidate search cache: {e}")
 
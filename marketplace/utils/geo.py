@@ -0,0 +1,128 @@
+"""
+Grid-cell index helpers for radius queries.
+The globe is cut into fixed GRID_CELL_DEGREES squares numbered row by row,
+so a radius search becomes a handful of integer range lookups on an indexed
+column; exact haversine distances are then computed in SQL on the candidates only.
+Distances for an already loaded page are computed in one NumPy call instead.
+"""
+from math import cos, floor, radians
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.32
+
+# Cell edge in degrees (about 11 km of latitude)
+GRID_CELL_DEGREES = 0.1
+GRID_ROWS = int(round(180 / GRID_CELL_DEGREES))
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES))
+
+# Above this many cell rows a plain latitude band is cheaper than OR-ed ranges
+MAX_GRID_ROWS = 64
+
+
+def _row(latitude: float) -> int:
+    return min(max(int(floor((latitude + 90) / GRID_CELL_DEGREES)), 0), GRID_ROWS - 1)
+
+
+def _column(longitude: float) -> int:
+    return int(floor((longitude + 180) / GRID_CELL_DEGREES)) % GRID_COLUMNS
+
+
+def grid_cell(latitude, longitude):
+    """Return the grid cell number of a point, or None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    return _row(float(latitude)) * GRID_COLUMNS + _column(float(longitude))
+
+
+def grid_cells_q(latitude: float, longitude: float, radius_km: float, field: str = 'geo_cell') -> Q:
+    """
+    Build a Q matching every grid cell that intersects the bounding box
+    of the circle; one integer range per cell row.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    min_row = _row(latitude - lat_delta)
+    max_row = _row(latitude + lat_delta)
+    if max_row - min_row + 1 > MAX_GRID_ROWS:
+        return Q(**{f'{field}__range': (min_row * GRID_COLUMNS, (max_row + 1) * GRID_COLUMNS - 1)})
+
+    # Widest longitude span is at the box edge closest to a pole
+    max_abs_lat = min(abs(latitude) + lat_delta, 89.9)
+    lon_delta = radius_km / (KM_PER_DEGREE * cos(radians(max_abs_lat)))
+    if lon_delta >= 180:
+        column_ranges = [(0, GRID_COLUMNS - 1)]
+    else:
+        first = _column(longitude - lon_delta)
+        last = _column(longitude + lon_delta)
+        if first <= last:
+            column_ranges = [(first, last)]
+        else:  # crosses the antimeridian
+            column_ranges = [(first, GRID_COLUMNS - 1), (0, last)]
+
+    cells = Q()
+    for row in range(min_row, max_row + 1):
+        base = row * GRID_COLUMNS
+        for first, last in column_ranges:
+            cells |= Q(**{f'{field}__range': (base + first, base + last)})
+    return cells
+
+
+def haversine_km(latitude: float, longitude: float, lat_field: str = 'latitude', lon_field: str = 'longitude'):
+    """Database expression for the great-circle distance in km to a point"""
+    lat = Radians(Cast(F(lat_field), FloatField()))
+    lon = Radians(Cast(F(lon_field), FloatField()))
+    origin_lat = radians(latitude)
+    origin_lon = radians(longitude)
+    a = (
+        Power(Sin((lat - Value(origin_lat)) / 2), 2)
+        + Value(cos(origin_lat)) * Cos(lat) * Power(Sin((lon - Value(origin_lon)) / 2), 2)
+    )
+    # Clamp rounding noise so ASIN never sees a value above 1
+    return Value(2.0 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def within_radius(queryset, latitude: float, longitude: float, radius_km: float):
+    """
+    Restrict a Listing queryset to rows within radius_km of a point.
+    Rows are pruned by grid cell, then annotated with ``distance_km``.
+    """
+    return (
+        queryset.filter(grid_cells_q(latitude, longitude, radius_km))
+        .annotate(distance_km=haversine_km(latitude, longitude))
+        .filter(distance_km__lte=radius_km)
+    )
+
+
+def haversine_batch(latitudes, longitudes, latitude: float, longitude: float) -> np.ndarray:
+    """
+    Vectorised great-circle distances in km from one point to many.
+    Missing coordinates should be passed as NaN and come back as NaN.
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    origin_lat = radians(latitude)
+    origin_lon = radians(longitude)
+    a = (
+        np.sin((lat - origin_lat) / 2) ** 2
+        + cos(origin_lat) * np.cos(lat) * np.sin((lon - origin_lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distances_from(listings: Iterable, latitude: float, longitude: float) -> Dict[int, Optional[float]]:
+    """Map listing pk to its distance in km from a point, None without coordinates"""
+    listings = list(listings)
+    if not listings:
+        return {}
+    nan = float('nan')
+    latitudes = [nan if obj.latitude is None else float(obj.latitude) for obj in listings]
+    longitudes = [nan if obj.longitude is None else float(obj.longitude) for obj in listings]
+    distances = haversine_batch(latitudes, longitudes, latitude, longitude)
+    return {
+        obj.pk: None if np.isnan(distance) else float(distance)
+        for obj, distance in zip(listings, distances)
+    }
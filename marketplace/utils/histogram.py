@@ -0,0 +1,53 @@
+"""
+Fixed-bucket latency histograms.
+A histogram is a list of counts, one per bucket of LATENCY_BUCKETS (upper
+bounds in seconds, the last one unbounded). Recording a latency is one
+counter increment, histograms of several processes or days merge by adding
+their counts, and percentiles are interpolated within the bucket they fall
+in, so their error is bounded by the bucket width.
+"""
+from bisect import bisect_left
+from typing import Iterable, List, Sequence
+
+# Upper bounds in seconds, roughly 2.5x apart; the last bucket has no bound
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+PERCENTILES = (50, 95, 99)
+
+
+def bucket_index(value: float, buckets: Sequence[float] = LATENCY_BUCKETS) -> int:
+    """Index of the bucket counting value"""
+    return bisect_left(buckets, value)
+
+
+def merge(histograms: Iterable[Sequence[int]], size: int = len(LATENCY_BUCKETS)) -> List[int]:
+    """Bucket-wise sum of histograms"""
+    total = [0] * size
+    for counts in histograms:
+        for index, count in enumerate(counts):
+            total[index] += count
+    return total
+
+
+def percentile(counts: Sequence[int], q: float, buckets: Sequence[float] = LATENCY_BUCKETS) -> float:
+    """Estimated q-th percentile (0-100); 0 for an empty histogram"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = total * q / 100
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = buckets[index - 1] if index else 0.0
+            upper = buckets[index]
+            if upper == float('inf'):
+                # Nothing is known above the last bound
+                return lower
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return buckets[-2]
+
+
+def percentiles(counts: Sequence[int], buckets: Sequence[float] = LATENCY_BUCKETS) -> dict:
+    """p50, p95 and p99 of a histogram, in seconds"""
+    return {f'p{q}': round(percentile(counts, q, buckets), 4) for q in PERCENTILES}
@@ -0,0 +1,59 @@
+"""
+Throwaway databases for jobs that must not touch live data.
+scratch_database() creates an empty, migrated copy of the default
+database's schema (with Django's test database machinery: an in-memory
+database on SQLite, <NAME>_scratch elsewhere, which needs the CREATEDB
+privilege) and, while it is open, ScratchRouter sends every ORM query of
+the calling thread there. Other threads, such as request threads of the
+same process, keep using the default database. The scratch database is
+dropped on exit.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+
+SCRATCH_ALIAS = 'scratch'
+
+_state = threading.local()
+
+
+class ScratchRouter:
+    """Routes the queries of a thread inside scratch_database() to it, see module docstring"""
+
+    def db_for_read(self, model, **hints):
+        return SCRATCH_ALIAS if getattr(_state, 'active', False) else None
+
+    db_for_write = db_for_read
+
+
+def _scratch_settings() -> dict:
+    default = connections['default'].settings_dict
+    scratch = {**default, 'TEST': {**default.get('TEST', {})}}
+    if default['ENGINE'] == 'django.db.backends.sqlite3':
+        scratch['TEST']['NAME'] = None  # in memory, named after the alias
+    else:
+        scratch['TEST']['NAME'] = f"{default['NAME']}_{SCRATCH_ALIAS}"
+    return scratch
+
+
+@contextmanager
+def scratch_database():
+    """Run the block against a new, empty database; see module docstring"""
+    connections.settings[SCRATCH_ALIAS] = _scratch_settings()
+    connection = connections[SCRATCH_ALIAS]
+    old_name = connection.settings_dict['NAME']
+    try:
+        # Data migrations must backfill the scratch database, not the live one
+        _state.active = True
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                yield connection
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            _state.active = False
+    finally:
+        del connections[SCRATCH_ALIAS]
+        del connections.settings[SCRATCH_ALIAS]
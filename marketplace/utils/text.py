@@ -0,0 +1,33 @@
+"""
+Text folding helpers for Romanian search keys.
+Folded values are lowercase, free of diacritics and whitespace-normalised,
+so "Mașină  Nouă" and "masina noua" share the same key.
+"""
+import unicodedata
+
+from django.db.models import Q
+
+# Largest BMP code point, used as the open upper bound of prefix ranges
+PREFIX_UPPER_BOUND = '\uffff'
+
+
+def fold_text(value, max_length=None) -> str:
+    """Fold a string into its case- and diacritic-insensitive search key"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    folded = ' '.join(stripped.casefold().split())
+    return folded[:max_length] if max_length else folded
+
+
+def folded_prefix_q(field: str, value: str) -> Q:
+    """
+    Build an index-friendly prefix lookup on a folded column.
+    A half-open range works with plain B-tree indexes on every backend,
+    unlike LIKE, which SQLite only optimises for NOCASE columns.
+    """
+    prefix = fold_text(value)
+    if not prefix:
+        return Q()
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + PREFIX_UPPER_BOUND})
@@ -0,0 +1,223 @@
+"""
+Distinct visitors per listing and day.
+Listing.views counts every hit, refreshes and bots included. Each view also
+adds the visitor's fingerprint (user, session or client) to a HyperLogLog
+sketch of the listing and day, so unique visitors cost a few KB per listing
+at most, however many there are. Sketches are kept in process and merged
+into ListingVisitorSketch rows every FLUSH_INTERVAL seconds, or in a
+background thread as soon as MAX_PENDING_SKETCHES are held (a crawler
+walking the whole catalogue would otherwise hold one per listing); merging
+is a register-wise maximum, so processes flushing the same listing and day,
+and counts over several days or listings, combine exactly.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .background import BackgroundJob, table_exists
+from .hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 60
+# Listing days held in process before a flush is started, about 4 KB each
+MAX_PENDING_SKETCHES = 5000
+
+RETENTION_DAYS = 90
+# Window of the unique viewer counts shown to sellers
+UNIQUE_VIEWERS_DAYS = 30
+
+
+def client_address(request) -> str:
+    """
+    REMOTE_ADDR, or behind TRUSTED_PROXY_COUNT proxies the address the
+    outermost one appended to X-Forwarded-For. Entries before it were sent
+    by the client and are not trusted.
+    """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+    forwarded = [address for address in forwarded if address]
+    if proxies and forwarded:
+        return forwarded[-min(proxies, len(forwarded))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def visitor_fingerprint(request) -> str:
+    """The signed-in user, else the session, else a hash of the client's address and browser"""
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f's{session.session_key}'
+    address = client_address(request)
+    agent = request.META.get('HTTP_USER_AGENT', '')
+    return 'c' + hashlib.sha1(f'{address}|{agent}'.encode()).hexdigest()
+
+
+class UniqueVisitors:
+    """Per-process visitor sketches of listings, see module docstring"""
+
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        self._flusher = BackgroundJob(self.flush, 'visitor-sketches-flush')
+
+    def _reset(self):
+        # Forked workers start empty; their parent flushes its own sketches
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._sketches: Dict[Tuple[int, date], HyperLogLog] = {}
+        self._flushed_at = time.monotonic()
+
+    def add(self, listing_id: int, visitor: str, day: Optional[date] = None):
+        key = (listing_id, day or timezone.localdate())
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog()
+            sketch.add(visitor)
+            full = len(self._sketches) >= MAX_PENDING_SKETCHES
+        if full:
+            self._flusher.start()
+
+    @property
+    def pending(self) -> int:
+        """Listing days held in process, not flushed yet"""
+        return len(self._sketches)
+
+    def record_events(self, events):
+        """Interaction event listener: flush every FLUSH_INTERVAL seconds"""
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> int:
+        """Merge the sketches gathered since the last flush into ListingVisitorSketch; returns how many"""
+        from ..models import ListingVisitorSketch
+
+        with self._flush_lock:
+            with self._lock:
+                sketches, self._sketches = self._sketches, {}
+                self._flushed_at = time.monotonic()
+            if not sketches:
+                return 0
+            try:
+                with transaction.atomic():
+                    existing = {
+                        (row.listing_id, row.date): row
+                        for row in ListingVisitorSketch.objects.select_for_update().filter(
+                            listing_id__in={listing_id for listing_id, _ in sketches},
+                            date__in={day for _, day in sketches},
+                        )
+                    }
+                    created = []
+                    for (listing_id, day), sketch in sketches.items():
+                        row = existing.get((listing_id, day))
+                        if row is None:
+                            created.append(ListingVisitorSketch(listing_id=listing_id, date=day,
+                                                                sketch=sketch.to_bytes()))
+                        else:
+                            row.sketch = sketch.update(HyperLogLog.from_bytes(row.sketch)).to_bytes()
+                    ListingVisitorSketch.objects.bulk_update(existing.values(), ['sketch'])
+                    try:
+                        with transaction.atomic():
+                            ListingVisitorSketch.objects.bulk_create(created)
+                    except IntegrityError:
+                        # Another process created some of the rows first
+                        for row in created:
+                            self._merge_row(row)
+                    ListingVisitorSketch.objects.filter(
+                        date__lt=timezone.localdate() - timedelta(days=RETENTION_DAYS)
+                    ).delete()
+            except Exception as e:
+                logger.error(f"Failed to flush visitor sketches of {len(sketches)} listing days: {e}")
+                # Keep them for the next flush, up to MAX_PENDING_SKETCHES
+                with self._lock:
+                    for key, sketch in sketches.items():
+                        pending = self._sketches.get(key)
+                        if pending is not None:
+                            pending.update(sketch)
+                        elif len(self._sketches) < MAX_PENDING_SKETCHES:
+                            self._sketches[key] = sketch
+                return 0
+            return len(sketches)
+
+    @staticmethod
+    def _merge_row(row):
+        from ..models import ListingVisitorSketch
+
+        current = ListingVisitorSketch.objects.select_for_update().filter(
+            listing_id=row.listing_id, date=row.date
+        ).first()
+        if current is None:
+            row.save()
+        else:
+            merged = HyperLogLog.from_bytes(row.sketch).update(HyperLogLog.from_bytes(current.sketch))
+            current.sketch = merged.to_bytes()
+            current.save(update_fields=['sketch'])
+
+    def sketches(self, listing_ids: Iterable[int], days: int = UNIQUE_VIEWERS_DAYS) -> Dict[int, HyperLogLog]:
+        """Each listing's visitors over the last days, stored and not yet flushed"""
+        from ..models import ListingVisitorSketch
+
+        listing_ids = set(listing_ids)
+        since = timezone.localdate() - timedelta(days=days - 1)
+        merged = defaultdict(HyperLogLog)
+        rows = ListingVisitorSketch.objects.filter(listing_id__in=listing_ids, date__gte=since)
+        for listing_id, data in rows.values_list('listing_id', 'sketch').iterator(chunk_size=1000):
+            merged[listing_id].update(HyperLogLog.from_bytes(data))
+        with self._lock:
+            for (listing_id, day), sketch in self._sketches.items():
+                if listing_id in listing_ids and day >= since:
+                    merged[listing_id].update(sketch)
+        return dict(merged)
+
+    def count(self, listing_ids: Iterable[int], days: int = UNIQUE_VIEWERS_DAYS) -> Dict[int, int]:
+        """Estimated distinct visitors of each listing over the last days"""
+        return {listing_id: sketch.count() for listing_id, sketch in self.sketches(listing_ids, days).items()}
+
+    def total(self, listing_ids: Iterable[int], days: int = UNIQUE_VIEWERS_DAYS) -> int:
+        """Estimated distinct visitors of any of the listings over the last days"""
+        return HyperLogLog.union(self.sketches(listing_ids, days).values()).count()
+
+    def totals_by_seller(self, user_ids: Iterable[int], days: int = UNIQUE_VIEWERS_DAYS) -> Dict[int, int]:
+        """Estimated distinct visitors of each user's listings over the last days, from flushed sketches"""
+        from ..models import ListingVisitorSketch
+
+        since = timezone.localdate() - timedelta(days=days - 1)
+        merged = defaultdict(HyperLogLog)
+        rows = ListingVisitorSketch.objects.filter(listing__user_id__in=list(user_ids), date__gte=since)
+        for user_id, data in rows.values_list('listing__user_id', 'sketch').iterator(chunk_size=1000):
+            merged[user_id].update(HyperLogLog.from_bytes(data))
+        return {user_id: sketch.count() for user_id, sketch in merged.items()}
+
+    def annotate(self, listings, days: int = UNIQUE_VIEWERS_DAYS) -> int:
+        """Set unique_viewers on each listing; returns the distinct visitors of all of them"""
+        sketches = self.sketches([listing.pk for listing in listings], days)
+        for listing in listings:
+            sketch = sketches.get(listing.pk)
+            listing.unique_viewers = sketch.count() if sketch is not None else 0
+        return HyperLogLog.union(sketches.values()).count()
+
+
+unique_visitors = UniqueVisitors()
+
+
+def _flush_at_exit():
+    """Flush the sketches still held when the process exits, if their table is still there"""
+    from ..models import ListingVisitorSketch
+
+    if unique_visitors.pending and table_exists(ListingVisitorSketch):
+        unique_visitors.flush()
+
+
+atexit.register(_flush_at_exit)
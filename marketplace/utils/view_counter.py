@@ -0,0 +1,105 @@
+"""
+Write-behind listing view counts.
+A detail page or API view only bumps an in-process counter; flush() applies
+everything counted since the last flush with one
+UPDATE ... SET views = views + n per distinct n, instead of a
+read-modify-write and a write transaction per view. The counter is split
+into shards, each behind its own lock, and every thread sticks to one, so
+concurrent request threads rarely wait on each other.
+
+Counts are flushed along with every batch of interaction events (a view is
+always recorded with a view event, see record_listing_view) and at process
+exit, so at most a few seconds of views are lost if the process dies.
+"""
+import atexit
+import itertools
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from typing import Dict
+
+from django.db import transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+SHARDS = 16
+
+# Listings updated per query
+UPDATE_BATCH = 500
+
+
+class ViewCounter:
+    """Sharded in-process counter of listing views, see module docstring"""
+
+    def __init__(self, shards: int = SHARDS):
+        self.shards = shards
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Forked workers start empty; their parent flushes its own counts
+        self._locks = [threading.Lock() for _ in range(self.shards)]
+        self._counts = [Counter() for _ in range(self.shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+
+    def add(self, listing_id: int, count: int = 1):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = next(self._next_shard) % self.shards
+        with self._locks[shard]:
+            self._counts[shard][listing_id] += count
+
+    def pending(self) -> Dict[int, int]:
+        """Views counted but not flushed yet, by listing pk"""
+        total = Counter()
+        for lock, counts in zip(self._locks, self._counts):
+            with lock:
+                total.update(counts)
+        return dict(total)
+
+    def _drain(self) -> Counter:
+        total = Counter()
+        for shard, lock in enumerate(self._locks):
+            with lock:
+                counts, self._counts[shard] = self._counts[shard], Counter()
+            total.update(counts)
+        return total
+
+    def flush(self) -> int:
+        """Add the counted views to Listing.views; returns how many"""
+        from marketplace.models import Listing
+
+        with self._flush_lock:
+            counts = self._drain()
+            if not counts:
+                return 0
+            by_increment = defaultdict(list)
+            for listing_id, count in counts.items():
+                by_increment[count].append(listing_id)
+            try:
+                with transaction.atomic():
+                    for count, listing_ids in by_increment.items():
+                        for start in range(0, len(listing_ids), UPDATE_BATCH):
+                            Listing.objects.filter(pk__in=listing_ids[start:start + UPDATE_BATCH]).update(
+                                views=F('views') + count
+                            )
+            except Exception as e:
+                logger.error(f"Failed to flush views of {len(counts)} listings: {e}")
+                # Keep them for the next flush
+                for listing_id, count in counts.items():
+                    self.add(listing_id, count)
+                return 0
+            return sum(counts.values())
+
+    def record_events(self, events):
+        """Interaction event listener: flush with every batch"""
+        self.flush()
+
+
+view_counter = ViewCounter()
+# Views still counted when the process exits
+atexit.register(view_counter.flush)
@@ -4,10 +4,19 @@ from django.shortcuts import render
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.contrib.auth.forms import UserCreationForm
 from django.views.decorators.cache import cache_page
-from .utils.cache_utils import ListingCache, SearchCache
+from .utils.cache_utils import ListingCache
+from .pagination import CURSOR_PARAM, KeysetPagination, KeysetPaginator
+from .recommendations.data.events import record_listing_view
+from .utils.unique_visitors import UNIQUE_VIEWERS_DAYS, unique_visitors
+from .recommendations.services.content_based import content_recommender
+from .search import search_listings
+from .search.facets import get_facets
+from .search.popular import record_search
+from .search.filters import FoldedSearchFilter, ListingSearchFilter
+from .utils.geo import distances_from, within_radius
+from .utils.text import fold_text, folded_prefix_q
 from django.shortcuts import redirect
 from django.contrib.auth import login
 from django.contrib import messages
@@ -68,7 +77,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         return False
 
 
-class StandardResultsSetPagination(PageNumberPagination):
+class StandardResultsSetPagination(KeysetPagination):
     """
     Custom pagination class for API responses
     """
@@ -78,20 +87,19 @@ class StandardResultsSetPagination(PageNumberPagination):
 
     def get_paginated_response(self, data):
         return Response({
-            'count': self.page.paginator.count,
+            'count': self.paginator.count,
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data,
-            'page_size': self.page_size,
-            'total_pages': self.page.paginator.num_pages,
+            'page_size': self.paginator.per_page,
         })
 
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ["name"]
+    filter_backends = [FoldedSearchFilter]
+    search_fields = ["name_folded"]
 
     @action(detail=True, methods=["get"])
     def subcategories(self, request, pk=None):
@@ -112,8 +120,7 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
 
 class ListingViewSet(viewsets.ModelViewSet):
     queryset = Listing.objects.all()
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["title", "description", "location"]
+    filter_backends = [ListingSearchFilter, filters.OrderingFilter]
     ordering_fields = ["created_at", "price", "views"]
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
     pagination_class = StandardResultsSetPagination
@@ -147,44 +154,26 @@ class ListingViewSet(viewsets.ModelViewSet):
         # Filter by location
         location = self.request.query_params.get("location")
         if location:
-            queryset = queryset.filter(location__icontains=location)
+            queryset = queryset.filter(folded_prefix_q("location_folded", location))
 
         # Filter by city
         city = self.request.query_params.get("city")
         if city:
-            queryset = queryset.filter(city__icontains=city)
+            queryset = queryset.filter(city_folded=fold_text(city))
 
         # Filter by coordinates (for nearby listings)
         lat = self.request.query_params.get("latitude")
         lon = self.request.query_params.get("longitude")
+        radius = self.request.query_params.get("radius", "50")
         if lat and lon:
-            # Use efficient range query for geospatial search
-            lat_range = float(lat) - 0.5  # Rough approximation
-            lon_range = float(lon) - 0.5
-            queryset = queryset.filter(
-                latitude__range=(lat_range, float(lat) + 0.5),
-                longitude__range=(lon_range, float(lon) + 0.5)
-            )
+            try:
+                queryset = within_radius(queryset, float(lat), float(lon), float(radius)).order_by("distance_km")
+            except (ValueError, TypeError):
+                pass  # Ignore invalid coordinates
 
-        # Attempt to use cached search results
-        filters = {
-            "category_id": category_id,
-            "min_price": min_price,
-            "max_price": max_price,
-            "location": location,
-            "city": city,
-            "latitude": lat,
-            "longitude": lon,
-        }
-        cached_results = SearchCache.get_search_results(status, filters)
-        if cached_results:
-            return cached_results
-
-        # No cache, proceed with optimized query
-        queryset = queryset.order_by('-is_featured', '-created_at')
-
-        # Cache the result
-        SearchCache.set_search_results(status, filters, list(queryset))
+        # Result pages are cached by the paginator, keyed on the final SQL
+        if not queryset.query.order_by:
+            queryset = queryset.order_by('-is_featured', '-created_at')
 
         return queryset
 
@@ -195,9 +184,7 @@ class ListingViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        # Increment view count
-        instance.views += 1
-        instance.save(update_fields=["views"])
+        record_listing_view(request, instance.pk)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -374,7 +361,6 @@ def categories_view(request):
 def category_detail_view(request, category_slug):
     """Optimized category detail page with listings."""
     from django.shortcuts import get_object_or_404
-    from django.core.paginator import Paginator
     
     category = get_object_or_404(
         Category.objects.select_related('parent'),
@@ -389,14 +375,12 @@ def category_detail_view(request, category_slug):
         category_id__in=[category.id] + list(subcategories.values_list('id', flat=True)),
         status="active"
     ).select_related('category', 'user').order_by(
-        "category_id" if subcategories.exists() else "",
         "-is_featured", 
         "-created_at"
     )
     
-    # Paginate with optimized query
-    paginator = Paginator(listings, 20)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    # Paginate by cursor on (is_featured, created_at, id)
+    page_obj = KeysetPaginator(listings, 20).get_page(request.GET)
     
     context = {
         "category": category,
@@ -423,10 +407,7 @@ def listings_view(request):
     location = request.GET.get('location', '')
     
     if search_query:
-        listings = listings.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        listings = search_listings(listings, search_query)
     
     if category_id:
         listings = listings.filter(category_id=category_id)
@@ -444,13 +425,10 @@ def listings_view(request):
             pass
     
     if location:
-        listings = listings.filter(location__icontains=location)
+        listings = listings.filter(folded_prefix_q('location_folded', location))
     
-    # Handle pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(listings, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Handle pagination by cursor, no OFFSET
+    page_obj = KeysetPaginator(listings, 20).get_page(request.GET)
     
     context = {
         "listings": page_obj,
@@ -472,23 +450,19 @@ def listing_detail_view(request, listing_id):
     
     listing = get_object_or_404(Listing, id=listing_id, status="active")
     
-    # Increment views
-    listing.views += 1
-    listing.save(update_fields=['views'])
+    record_listing_view(request, listing.pk)
     
     # Get all images for this listing
     listing_images = ListingImage.objects.filter(listing=listing).order_by('order', 'id')
     
     # Get related listings
-    related_listings = Listing.objects.filter(
-        category=listing.category,
-        status="active"
-    ).exclude(id=listing.id)[:6]
+    related_listings = content_recommender.similar_listings(listing, limit=6)
     
     context = {
         "listing": listing,
         "listing_images": listing_images,
         "related_listings": related_listings,
+        "similar_listings": related_listings,
         "page_title": listing.title,
     }
     
@@ -540,10 +514,12 @@ def profile_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
     
-    user_listings = Listing.objects.filter(user=request.user).order_by("-created_at")
+    user_listings = list(Listing.objects.filter(user=request.user).order_by("-created_at"))
     
     context = {
         "user_listings": user_listings,
+        "unique_viewers": unique_visitors.annotate(user_listings),
+        "unique_viewers_days": UNIQUE_VIEWERS_DAYS,
         "page_title": "Profilul meu",
     }
     
@@ -776,13 +752,9 @@ def search_view(request):
     
     # Apply search query
     if query:
-        listings = listings.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(location__icontains=query) |
-            Q(city__icontains=query) |
-            Q(address__icontains=query)
-        )
+        listings = search_listings(listings, query)
+        if CURSOR_PARAM not in request.GET:
+            record_search(query)
     
     # Apply category filter
     if category_id:
@@ -826,42 +798,23 @@ def search_view(request):
     if location and not enable_distance:
         # Simple text-based location filter
         listings = listings.filter(
-            Q(location__icontains=location) |
-            Q(city__icontains=location) |
-            Q(county__icontains=location)
+            folded_prefix_q('location_folded', location) |
+            folded_prefix_q('city_folded', location) |
+            folded_prefix_q('county_folded', location)
         )
     
     # Apply distance-based filtering
+    has_distance = False
     if enable_distance and user_lat and user_lng:
         try:
-            from .models import Location
             user_latitude = float(user_lat)
             user_longitude = float(user_lng)
             distance_km = float(distance)
             
-            # Filter listings within the specified distance
-            nearby_listings = []
-            for listing in listings:
-                if listing.latitude and listing.longitude:
-                    distance_to_listing = Location.calculate_distance(
-                        user_latitude, user_longitude,
-                        float(listing.latitude), float(listing.longitude)
-                    )
-                    if distance_to_listing <= distance_km:
-                        # Add distance as an attribute for sorting/display
-                        listing._distance = distance_to_listing
-                        nearby_listings.append(listing)
-            
-            # Convert back to queryset with proper IDs
-            if nearby_listings:
-                listing_ids = [listing.id for listing in nearby_listings]
-                listings = Listing.objects.filter(id__in=listing_ids, status="active")
-                
-                # Store distance data for later use
-                distance_map = {listing.id: listing._distance for listing in nearby_listings}
-                request._distance_map = distance_map
-            else:
-                listings = Listing.objects.none()
+            # Prune by grid cell, then filter on exact distance in SQL;
+            # matching listings are annotated with distance_km
+            listings = within_radius(listings, user_latitude, user_longitude, distance_km)
+            has_distance = True
         
         except (ValueError, TypeError):
             pass
@@ -875,26 +828,30 @@ def search_view(request):
         listings = listings.order_by('created_at')
     elif sort_by == 'title':
         listings = listings.order_by('title')
-    elif sort_by == 'distance' and enable_distance and user_lat and user_lng:
-        # Sort by distance (if we have distance data)
-        if hasattr(request, '_distance_map'):
-            listings = list(listings)
-            listings.sort(key=lambda x: request._distance_map.get(x.id, float('inf')))
+    elif sort_by == 'distance' and has_distance:
+        listings = listings.order_by('distance_km', '-created_at')
+    elif query and sort_by in ('-featured', 'relevance'):
+        listings = listings.order_by('-search_rank', '-created_at')
     else:  # -created_at (default)
         listings = listings.order_by('-created_at')
     
-    # Handle pagination
-    from django.core.paginator import Paginator
-    paginator = Paginator(listings, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Handle pagination by cursor, no OFFSET
+    paginator = KeysetPaginator(listings, 20, cache_pages=True)
+    page_obj = paginator.get_page(request.GET)
     
     # Add distance information to listings for display
-    if hasattr(request, '_distance_map'):
+    if has_distance:
+        for listing in page_obj:
+            listing.distance_km = round(listing.distance_km, 1)
+    elif user_lat and user_lng:
+        # No radius filter, so compute the whole page in one vectorised call
+        try:
+            page_distances = distances_from(page_obj, float(user_lat), float(user_lng))
+        except (ValueError, TypeError):
+            page_distances = {}
         for listing in page_obj:
-            distance_km = request._distance_map.get(listing.id)
-            if distance_km is not None:
-                listing.distance_km = round(distance_km, 1)
+            if page_distances.get(listing.id) is not None:
+                listing.distance_km = round(page_distances[listing.id], 1)
     
     context = {
         "results": page_obj,
@@ -911,7 +868,8 @@ def search_view(request):
         "user_lng": user_lng,
         "date_from": date_from,
         "condition": condition,
-        "total_results": len(listings) if hasattr(request, '_distance_map') else listings.count(),
+        "total_results": paginator.count,
+        "facets": get_facets(listings),
         "page_title": f"Căutare: {query}" if query else "Căutare",
     }
     
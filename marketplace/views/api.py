@@ -1,5 +1,10 @@
-from rest_framework import viewsets
+from rest_framework import filters, viewsets
+from rest_framework.response import Response
 from ..models import Category, Listing, Message, Favorite, UserProfile
+from ..pagination import KeysetPagination
+from ..recommendations.data.events import record_listing_view
+from ..search.facets import FacetedListMixin
+from ..search.filters import ListingSearchFilter
 from ..serializers import (
     CategorySerializer,
     ListingSerializer,
@@ -16,8 +21,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     lookup_field = 'slug'
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(FacetedListMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.filter(status='active')
+    filter_backends = [ListingSearchFilter, filters.OrderingFilter]
+    ordering_fields = ['created_at', 'price', 'views']
+    pagination_class = KeysetPagination
     filterset_fields = ['category', 'user', 'is_featured']
     
     def get_serializer_class(self):
@@ -25,6 +33,12 @@ class ListingViewSet(viewsets.ModelViewSet):
             return ListingCreateSerializer
         return ListingSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        record_listing_view(request, instance.pk)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
 class MessageViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Message.objects.filter(
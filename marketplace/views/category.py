@@ -1,9 +1,9 @@
 
 
 from django.shortcuts import render, get_object_or_404
-from django.core.paginator import Paginator
 from django.views.decorators.cache import cache_page
 from ..models import Category, Listing
+from ..pagination import KeysetPaginator, cached_count
 
 @cache_page(60 * 60)  # Cache for 1 hour
 def category_list(request):
@@ -63,12 +63,10 @@ def category_detail(request, category_slug):
         
         try:
             listings = Listing.objects.filter(category=category, status='active').select_related('user')
-            listings_count = listings.count()
+            listings_count = cached_count(listings)
             logger.info(f"Found {listings_count} active listings for category {category.name}")
             
-            paginator = Paginator(listings, 20)
-            page_number = request.GET.get('page')
-            page_obj = paginator.get_page(page_number)
+            page_obj = KeysetPaginator(listings, 20).get_page(request.GET)
             
             return render(request, 'marketplace/category_detail.html', {
                 'category': category,
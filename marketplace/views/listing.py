@@ -1,8 +1,15 @@
 
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
 from django.views.decorators.cache import cache_page
 from ..models import Listing, Category, ListingImage
+from ..pagination import KeysetPaginator
+from ..recommendations.data.events import record_listing_view
+from ..recommendations.services.content_based import content_recommender
+from ..search import search_listings
+from ..utils.text import folded_prefix_q
+
+# Sort orders that keyset pagination can seek on
+LISTING_SORTS = ('-created_at', 'created_at', 'price', '-price', 'views', '-views')
 
 @cache_page(60 * 15)  # Cache for 15 minutes
 def listing_detail(request, slug):
@@ -26,9 +33,12 @@ def listing_detail(request, slug):
         # Get all images for the gallery
         listing_images = listing.images.all().order_by('order', 'created_at')
         
+        record_listing_view(request, listing.pk)
+        
         return render(request, 'marketplace/listing_detail.html', {
             'listing': listing,
-            'listing_images': listing_images
+            'listing_images': listing_images,
+            'similar_listings': content_recommender.similar_listings(listing),
         })
     except Exception as e:
         from django.contrib import messages
@@ -46,10 +56,14 @@ def listing_list(request):
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
     location = request.GET.get('location', '')
-    sort_by = request.GET.get('sort', '-created_at')
+    sort_by = request.GET.get('sort', '')
+    if sort_by not in LISTING_SORTS:
+        sort_by = ''
     
     if search_query:
-        listings = listings.filter(title__icontains=search_query)
+        listings = search_listings(listings, search_query)
+        # Rank by relevance unless the user picked an explicit sort order
+        sort_by = sort_by or '-search_rank'
     
     if category_id and category_id.isdigit():
         listings = listings.filter(category_id=category_id)
@@ -61,18 +75,16 @@ def listing_list(request):
         listings = listings.filter(price__lte=max_price)
     
     if location:
-        listings = listings.filter(location__icontains=location)
+        listings = listings.filter(folded_prefix_q('location_folded', location))
     
     # Apply sorting
-    listings = listings.order_by(sort_by)
+    listings = listings.order_by(sort_by or '-created_at')
     
     # Get all categories for the filter dropdown
     categories = Category.objects.filter(parent__isnull=True)
     
-    # Paginate results
-    paginator = Paginator(listings, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginate results by cursor, no OFFSET
+    page_obj = KeysetPaginator(listings, 20).get_page(request.GET)
     
     return render(request, 'marketplace/listings.html', {
         'listings': page_obj,
@@ -4,12 +4,21 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from ..forms import ProfileForm
+from ..models import Listing
+from ..utils.unique_visitors import UNIQUE_VIEWERS_DAYS, unique_visitors
 
 @login_required
 def profile_view(request):
     """User profile dashboard"""
+    user_listings = list(
+        Listing.objects.filter(user=request.user).select_related('category').order_by('-created_at')
+    )
     return render(request, 'marketplace/profile.html', {
-        'user': request.user
+        'user': request.user,
+        'user_listings': user_listings,
+        # Visitors of several listings are counted once
+        'unique_viewers': unique_visitors.annotate(user_listings),
+        'unique_viewers_days': UNIQUE_VIEWERS_DAYS,
     })
 
 @login_required
@@ -2,8 +2,12 @@
 
 from django.shortcuts import render
 from django.db.models import Q
-from django.core.paginator import Paginator
 from ..models import Listing, Category
+from ..pagination import CURSOR_PARAM, KeysetPaginator
+from ..search import search_listings
+from ..search.facets import get_facets
+from ..search.popular import record_search
+from ..utils.text import fold_text
 
 def search(request):
     """Unified search view"""
@@ -14,23 +18,24 @@ def search(request):
     results = Listing.objects.filter(status='active')
     
     if query:
-        results = results.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query)
-        )
+        results = search_listings(results, query).order_by('-search_rank', '-created_at')
+        if CURSOR_PARAM not in request.GET:
+            record_search(query)
     
     if category:
         results = results.filter(category__slug=category)
         
     if location:
+        folded_location = fold_text(location)
         results = results.filter(
-            Q(city__iexact=location) |
-            Q(county__iexact=location)
+            Q(city_folded=folded_location) |
+            Q(county_folded=folded_location)
         )
     
-    paginator = Paginator(results.select_related('category'), 20)
+    paginator = KeysetPaginator(results.select_related('category'), 20, cache_pages=True)
     return render(request, 'marketplace/search.html', {
-        'results': paginator.get_page(request.GET.get('page')),
+        'results': paginator.get_page(request.GET),
+        'facets': get_facets(results),
         'query': query,
         'categories': Category.objects.all()
     })
@@ -22,6 +22,8 @@ if not settings.configured:
 
 # Import Django models after setup
 from marketplace.models import User, Listing, Category
+from marketplace.search import search_listings
+from marketplace.utils.text import fold_text
 
 app = FastAPI(title="SQL Agent Server", description="Handles database operations for the marketplace")
 
@@ -153,9 +155,9 @@ def handle_search_listings(context: Dict[str, Any]):
         listings = Listing.objects.filter(status='active')
         
         if query:
-            listings = listings.filter(title__icontains=query)
+            listings = search_listings(listings, query).order_by('-search_rank', '-created_at')
         if category:
-            listings = listings.filter(category__name=category)
+            listings = listings.filter(category__name_folded=fold_text(category))
         if min_price:
             listings = listings.filter(price__gte=min_price)
         if max_price:
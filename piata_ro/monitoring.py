@@ -3,6 +3,7 @@
 """
 Monitoring and metrics system for Piața.ro marketplace
 """
+import hmac
 import time
 import threading
 import logging
@@ -11,19 +12,65 @@ from typing import Dict, Any, Optional, List
 from django.conf import settings
 from django.core.cache import cache
 from django.db import connection, connections
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, generate_latest
 from prometheus_client.core import REGISTRY
 import psutil
 import os
-from collections import defaultdict, deque
+from collections import defaultdict
 import json
+from contextlib import ExitStack
+
+from marketplace.utils.histogram import LATENCY_BUCKETS, bucket_index, percentiles
+from .profiling import profile_view
+from .query_instrumentation import STATEMENT_LENGTH, QueryReport, RequestQueries, sql_operation
 
 logger = logging.getLogger(__name__)
 
 
+# Request and response body sizes in bytes
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, float('inf'))
+
+# Database queries run by one request
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, float('inf'))
+
+# Label of requests that matched no URL pattern
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class RouteStats:
+    """Requests, errors and a fixed-bucket latency histogram of one route"""
+    
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.latency = [0] * len(LATENCY_BUCKETS)
+        
+    def record(self, duration: float, error: bool = False):
+        self.count += 1
+        self.errors += error
+        self.total_time += duration
+        self.latency[bucket_index(duration)] += 1
+        
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_response_time': self.total_time / self.count,
+            **{f'{name}_response_time': value for name, value in percentiles(self.latency).items()},
+        }
+
+
+def resolve_route(request):
+    """URL pattern and view name of a handled request, for metric labels"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE, UNMATCHED_ROUTE
+    return match.route, match.view_name or match._func_path
+
+
 class MetricsCollector:
     """Collect application metrics"""
     
@@ -35,17 +82,36 @@ class MetricsCollector:
     def _setup_metrics(self):
         """Setup Prometheus metrics"""
         # HTTP request metrics
+        # Labelled by URL pattern and view name, never by raw path, so the
+        # number of series is bounded by the URLconf
         self.http_requests_total = Counter(
             'http_requests_total',
             'Total HTTP requests',
-            ['method', 'endpoint', 'status_code'],
+            ['method', 'route', 'view', 'status_code'],
             registry=self.registry
         )
         
         self.http_request_duration = Histogram(
             'http_request_duration_seconds',
             'HTTP request duration',
-            ['method', 'endpoint'],
+            ['method', 'route', 'view'],
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry
+        )
+        
+        self.http_request_size = Histogram(
+            'http_request_size_bytes',
+            'HTTP request body size',
+            ['method', 'route', 'view'],
+            buckets=SIZE_BUCKETS,
+            registry=self.registry
+        )
+        
+        self.http_response_size = Histogram(
+            'http_response_size_bytes',
+            'HTTP response body size',
+            ['method', 'route', 'view'],
+            buckets=SIZE_BUCKETS,
             registry=self.registry
         )
         
@@ -64,6 +130,29 @@ class MetricsCollector:
             registry=self.registry
         )
         
+        self.db_queries_per_request = Histogram(
+            'db_queries_per_request',
+            'Database queries run by one request',
+            ['route', 'view'],
+            buckets=QUERY_COUNT_BUCKETS,
+            registry=self.registry
+        )
+        
+        self.db_time_per_request = Histogram(
+            'db_time_per_request_seconds',
+            'Time spent in database queries by one request',
+            ['route', 'view'],
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry
+        )
+        
+        self.n_plus_one_requests_total = Counter(
+            'db_n_plus_one_requests_total',
+            'Requests running one query shape N_PLUS_ONE_THRESHOLD times or more',
+            ['route', 'view'],
+            registry=self.registry
+        )
+        
         # Cache metrics
         self.cache_operations_total = Counter(
             'cache_operations_total',
@@ -91,6 +180,12 @@ class MetricsCollector:
             registry=self.registry
         )
         
+        self.featured_listings = Gauge(
+            'featured_listings',
+            'Number of active featured listings',
+            registry=self.registry
+        )
+        
         self.total_revenue = Gauge(
             'total_revenue',
             'Total revenue',
@@ -148,20 +243,43 @@ class MetricsCollector:
         for metric in self.custom_metrics.values():
             metric.registry = self.registry
             
-        # Performance tracking
-        self.response_times = defaultdict(lambda: deque(maxlen=100))
-        self.error_rates = defaultdict(lambda: deque(maxlen=100))
+        # Performance tracking: a latency histogram per route, see RouteStats
+        self.route_stats = defaultdict(RouteStats)
+        self._route_stats_lock = threading.Lock()
+        self.query_report = QueryReport()
         
-    def record_http_request(self, method: str, endpoint: str, status_code: int, duration: float):
+    def record_http_request(self, method: str, route: str, view: str, status_code: int, duration: float,
+                            request_size: int = 0, response_size: Optional[int] = None):
         """Record HTTP request metrics"""
-        self.http_requests_total.labels(method=method, endpoint=endpoint, status_code=status_code).inc()
-        self.http_request_duration.labels(method=method, endpoint=endpoint).observe(duration)
+        self.http_requests_total.labels(method=method, route=route, view=view, status_code=status_code).inc()
+        self.http_request_duration.labels(method=method, route=route, view=view).observe(duration)
+        self.http_request_size.labels(method=method, route=route, view=view).observe(request_size)
+        if response_size is not None:
+            self.http_response_size.labels(method=method, route=route, view=view).observe(response_size)
+        self.record_response_time(route, duration, error=status_code >= 500)
         
     def record_db_query(self, database: str, operation: str, duration: float):
         """Record database query metrics"""
         self.db_queries_total.labels(database=database, operation=operation).inc()
         self.db_query_duration.labels(database=database, operation=operation).observe(duration)
         
+    def record_request_queries(self, route: str, view: str, path: str, queries: RequestQueries):
+        """Record the database queries of one request and flag repeated query shapes"""
+        for alias, sql, duration in queries.queries:
+            self.record_db_query(alias, sql_operation(sql), duration)
+        self.db_queries_per_request.labels(route=route, view=view).observe(queries.count)
+        self.db_time_per_request.labels(route=route, view=view).observe(queries.time)
+        repeated = queries.repeated()
+        if repeated:
+            self.n_plus_one_requests_total.labels(route=route, view=view).inc()
+            shape, count = repeated[0]
+            logger.warning(f"Possible N+1 on {path} ({view}): {count} x {shape[:STATEMENT_LENGTH]}")
+        self.query_report.add(route, path, queries, repeated)
+        
+    def get_query_report(self) -> Dict[str, Any]:
+        """Per-route database query report, with sampled and N+1 requests in detail"""
+        return self.query_report.summary()
+        
     def record_cache_operation(self, operation: str, result: str):
         """Record cache operation metrics"""
         self.cache_operations_total.labels(operation=operation, result=result).inc()
@@ -175,15 +293,16 @@ class MetricsCollector:
         if metric_name in self.custom_metrics:
             self.custom_metrics[metric_name].inc(value)
             
-    def record_response_time(self, endpoint: str, response_time: float):
+    def record_response_time(self, endpoint: str, response_time: float, error: bool = False):
         """Record response time"""
-        self.response_times[endpoint].append(response_time)
+        with self._route_stats_lock:
+            self.route_stats[endpoint].record(response_time, error)
         
     def update_system_metrics(self):
         """Update system metrics"""
         try:
-            # CPU usage
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU usage since the previous scrape, without blocking the request
+            cpu_percent = psutil.cpu_percent(interval=None)
             self.cpu_usage.set(cpu_percent)
             
             # Memory usage
@@ -200,13 +319,11 @@ class MetricsCollector:
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
         try:
-            cache_stats = cache._cache.stats() if hasattr(cache, '_cache') else {}
+            # Only some backends (memcached clients) keep hit counts
+            stats = getattr(getattr(cache, '_cache', None), 'stats', None)
+            cache_stats = stats() if callable(stats) else {}
             
-            total_operations = (
-                cache_stats.get('hits', 0) + 
-                cache_stats.get('misses', 0) + 
-                cache_stats.get('hits', 0)
-            )
+            total_operations = cache_stats.get('hits', 0) + cache_stats.get('misses', 0)
             
             hit_ratio = cache_stats.get('hits', 0) / total_operations if total_operations > 0 else 0
             
@@ -225,31 +342,16 @@ class MetricsCollector:
             
     def get_performance_metrics(self) -> Dict[str, Any]:
         """Get performance metrics"""
-        performance_data = {}
-        
-        for endpoint, times in self.response_times.items():
-            if times:
-                performance_data[endpoint] = {
-                    'avg_response_time': sum(times) / len(times),
-                    'min_response_time': min(times),
-                    'max_response_time': max(times),
-                    'count': len(times)
-                }
-                
-        return performance_data
+        with self._route_stats_lock:
+            return {endpoint: stats.summary() for endpoint, stats in self.route_stats.items() if stats.count}
         
     def get_error_metrics(self) -> Dict[str, Any]:
         """Get error metrics"""
-        error_data = {}
-        
-        for endpoint, errors in self.error_rates.items():
-            if errors:
-                error_data[endpoint] = {
-                    'error_count': len(errors),
-                    'error_rate': len(errors) / max(1, len(self.response_times.get(endpoint, [])))
-                }
-                
-        return error_data
+        with self._route_stats_lock:
+            return {
+                endpoint: {'error_count': stats.errors, 'error_rate': stats.errors / stats.count}
+                for endpoint, stats in self.route_stats.items() if stats.errors
+            }
         
     def generate_metrics(self) -> str:
         """Generate metrics in Prometheus format"""
@@ -303,8 +405,7 @@ class ApplicationMonitor:
     def update_application_metrics(self):
         """Update application metrics"""
         try:
-            # Update database metrics
-            self._update_database_metrics()
+            # Database metrics are recorded per request, see MetricsMiddleware
             
             # Update cache metrics
             self._update_cache_metrics()
@@ -318,45 +419,6 @@ class ApplicationMonitor:
         except Exception as e:
             logger.error(f"Error updating application metrics: {e}")
             
-    def _update_database_metrics(self):
-        """Update database metrics"""
-        try:
-            for alias in settings.DATABASES:
-                connection = connections[alias]
-                
-                if hasattr(connection, 'queries_log'):
-                    queries = connection.queries_log
-                    
-                    for query in queries:
-                        duration = float(query.get('time', 0))
-                        operation = self._extract_operation_type(query.get('sql', ''))
-                        
-                        self.metrics_collector.record_db_query(alias, operation, duration)
-                        
-        except Exception as e:
-            logger.error(f"Error updating database metrics: {e}")
-            
-    def _extract_operation_type(self, sql: str) -> str:
-        """Extract operation type from SQL query"""
-        sql = sql.strip().upper()
-        
-        if sql.startswith('SELECT'):
-            return 'select'
-        elif sql.startswith('INSERT'):
-            return 'insert'
-        elif sql.startswith('UPDATE'):
-            return 'update'
-        elif sql.startswith('DELETE'):
-            return 'delete'
-        elif sql.startswith('CREATE'):
-            return 'create'
-        elif sql.startswith('ALTER'):
-            return 'alter'
-        elif sql.startswith('DROP'):
-            return 'drop'
-        else:
-            return 'other'
-            
     def _update_cache_metrics(self):
         """Update cache metrics"""
         try:
@@ -369,47 +431,42 @@ class ApplicationMonitor:
             logger.error(f"Error updating cache metrics: {e}")
             
     def _update_application_specific_metrics(self):
-        """Update application-specific metrics"""
+        """Update application-specific metrics from the incrementally kept gauges"""
         try:
-            # Update active users
-            from django.contrib.auth.models import User
-            active_users = User.objects.filter(is_active=True).count()
-            self.metrics_collector.active_users.set(active_users)
-            
-            # Update active listings
-            from marketplace.models import Listing
-            active_listings = Listing.objects.filter(status='active').count()
-            self.metrics_collector.active_listings.set(active_listings)
-            
-            # Update total revenue (if applicable)
-            from django.db.models import Sum
-            from marketplace.models import Transaction
-            
-            total_revenue = Transaction.objects.aggregate(
-                total=Sum('amount')
-            )['total'] or 0
-            
-            self.metrics_collector.total_revenue.set(float(total_revenue))
+            from marketplace.services.business_gauges import (
+                ACTIVE_LISTINGS, ACTIVE_USERS, FEATURED_LISTINGS, REVENUE, read,
+            )
+
+            gauges = read()
+            self.metrics_collector.active_users.set(gauges[ACTIVE_USERS])
+            self.metrics_collector.active_listings.set(gauges[ACTIVE_LISTINGS])
+            self.metrics_collector.featured_listings.set(gauges[FEATURED_LISTINGS])
+            # Succeeded payments, kept in bani
+            self.metrics_collector.total_revenue.set(gauges[REVENUE] / 100)
             
         except Exception as e:
             logger.error(f"Error updating application-specific metrics: {e}")
             
+    def _dashboard_data(self) -> Dict[str, Any]:
+        """Metrics of this process"""
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'pid': os.getpid(),
+            'system_metrics': {
+                'cpu_usage': self.metrics_collector.cpu_usage._value._value,
+                'memory_usage': self.metrics_collector.memory_usage._value._value,
+                'disk_usage': self.metrics_collector.disk_usage._value._value,
+            },
+            'performance_metrics': self.metrics_collector.get_performance_metrics(),
+            'error_metrics': self.metrics_collector.get_error_metrics(),
+            'database_metrics': self.metrics_collector.get_query_report(),
+            'cache_stats': self.metrics_collector.get_cache_stats(),
+        }
+        
     def _cache_metrics(self):
         """Cache metrics for dashboard"""
         try:
-            metrics_data = {
-                'timestamp': timezone.now().isoformat(),
-                'system_metrics': {
-                    'cpu_usage': self.metrics_collector.cpu_usage._value._value,
-                    'memory_usage': self.metrics_collector.memory_usage._value._value,
-                    'disk_usage': self.metrics_collector.disk_usage._value._value,
-                },
-                'performance_metrics': self.metrics_collector.get_performance_metrics(),
-                'error_metrics': self.metrics_collector.get_error_metrics(),
-                'cache_stats': self.metrics_collector.get_cache_stats(),
-            }
-            
-            cache.set('application_metrics', metrics_data, 300)
+            cache.set('application_metrics', self._dashboard_data(), 300)
             
         except Exception as e:
             logger.error(f"Error caching metrics: {e}")
@@ -417,14 +474,9 @@ class ApplicationMonitor:
     def get_metrics_dashboard(self) -> Dict[str, Any]:
         """Get metrics dashboard data"""
         try:
-            cached_metrics = cache.get('application_metrics')
-            
-            if cached_metrics:
-                return cached_metrics
-                
-            # If no cached metrics, generate fresh ones
-            self.update_application_metrics()
-            return cache.get('application_metrics', {})
+            # Request and query statistics are kept per process, so they are
+            # read fresh rather than from another process' cached copy
+            return self._dashboard_data()
             
         except Exception as e:
             logger.error(f"Error getting metrics dashboard: {e}")
@@ -464,39 +516,77 @@ class MetricsMiddleware:
         self.get_response = get_response
         
     def __call__(self, request):
-        start_time = time.time()
+        if not application_monitor.monitoring_enabled:
+            return self.get_response(request)
+        
+        start_time = time.perf_counter()
         
-        # Process request
-        response = self.get_response(request)
+        # Process request, seeing every query on every database
+        queries = RequestQueries()
+        with ExitStack() as stack:
+            for database in connections.all():
+                stack.enter_context(database.execute_wrapper(queries))
+            response = self.get_response(request)
         
         # Calculate duration
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
         
         # Record metrics
-        if application_monitor.monitoring_enabled:
-            application_monitor.metrics_collector.record_http_request(
-                method=request.method,
-                endpoint=request.path,
-                status_code=response.status_code,
-                duration=duration
-            )
-            
-            application_monitor.metrics_collector.record_response_time(
-                endpoint=request.path,
-                response_time=duration
-            )
-            
+        route, view = resolve_route(request)
+        metrics_collector = application_monitor.metrics_collector
+        metrics_collector.record_http_request(
+            method=request.method,
+            route=route,
+            view=view,
+            status_code=response.status_code,
+            duration=duration,
+            request_size=_content_length(request.META.get('CONTENT_LENGTH')),
+            response_size=_response_size(response),
+        )
+        metrics_collector.record_request_queries(route, view, request.path, queries)
+        
         return response
 
 
+def _content_length(value) -> int:
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+def _response_size(response) -> Optional[int]:
+    """Body size of a response; None for a stream without Content-Length"""
+    if response.has_header('Content-Length'):
+        return _content_length(response['Content-Length'])
+    if getattr(response, 'streaming', False):
+        return None
+    return len(response.content)
+
+
 # Views for metrics
+def _is_staff(request) -> bool:
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff
+
+
+def _has_metrics_token(request) -> bool:
+    token = getattr(settings, 'MONITORING_METRICS_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+
 @require_http_methods(["GET"])
 def metrics_view(request):
-    """Prometheus metrics endpoint"""
+    """Prometheus metrics endpoint. Staff or a scraper with MONITORING_METRICS_TOKEN only."""
+    if not (_is_staff(request) or _has_metrics_token(request)):
+        return JsonResponse({'error': 'Staff only'}, status=403)
     if not application_monitor.monitoring_enabled:
         return JsonResponse({'error': 'Monitoring disabled'}, status=503)
         
     try:
+        # The business gauges are read on scrape, see marketplace.services.business_gauges
+        application_monitor._update_application_specific_metrics()
         metrics = application_monitor.metrics_collector.generate_metrics()
         return HttpResponse(metrics, content_type='text/plain')
         
@@ -507,7 +597,9 @@ def metrics_view(request):
 
 @require_http_methods(["GET"])
 def dashboard_view(request):
-    """Metrics dashboard endpoint"""
+    """Metrics dashboard endpoint: per-route latency percentiles and query counts of this process. Staff only."""
+    if not _is_staff(request):
+        return JsonResponse({'error': 'Staff only'}, status=403)
     if not application_monitor.monitoring_enabled:
         return JsonResponse({'error': 'Monitoring disabled'}, status=503)
         
@@ -577,6 +669,7 @@ __all__ = [
     'MetricsMiddleware',
     'application_monitor',
     'metrics_view',
+    'profile_view',
     'dashboard_view',
     'health_metrics_view',
     'record_event_view'
@@ -0,0 +1,268 @@
+"""
+On-demand statistical profiling of production requests.
+ProfilingMiddleware profiles a request when staff turned profiling on for a
+fraction of requests (profile_view) or when a staff user sends the
+X-Profile header. The fraction is kept in the cache, so it reaches every
+worker process only when the cache is shared (Redis when REDIS_URL is set,
+see settings); with a per-process cache it applies to the process that
+served the request turning it on. While profiled
+requests run, one sampler thread reads their stacks every
+PROFILE_INTERVAL seconds with sys._current_frames(), so a request pays
+nothing but the GIL the sampler briefly takes, and requests that are not
+profiled pay one flag check. Stacks are counted per view in folded form
+("outer;inner;leaf count" lines), ready for flamegraph.pl or speedscope,
+and are kept per process.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples of a profiled request
+PROFILE_INTERVAL = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+# Longest a sampling rate set through profile_view stays on
+MAX_PROFILE_SECONDS = 3600
+MAX_STACK_DEPTH = 64
+# Distinct stacks kept per view; rarer new ones are counted as truncated
+MAX_STACKS = 5000
+TRUNCATED_STACK = '[truncated]'
+
+CACHE_KEY_RATE = 'profiling_rate'
+# How long a process trusts the rate it read from the cache
+RATE_CHECK_INTERVAL = 5
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def fold_stack(frame) -> str:
+    """Outermost to innermost function names of a stack, joined by ;"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """One thread sampling the stacks of the threads being profiled"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._active: Dict[int, Counter] = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id: int):
+        with self._lock:
+            self._active[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, thread_id: int) -> Counter:
+        """Stop sampling a thread; returns its folded stack counts"""
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+                if idle:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, counts in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[fold_stack(frame)] += 1
+            del frames
+
+
+class ProfileStore:
+    """Folded stack counts of the profiled requests of this process, per view"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(Counter)
+        self._requests = Counter()
+
+    def add(self, view: str, counts: Counter):
+        with self._lock:
+            stacks = self._views[view]
+            self._requests[view] += 1
+            for stack, count in counts.items():
+                if stack not in stacks and len(stacks) >= MAX_STACKS:
+                    stack = TRUNCATED_STACK
+                stacks[stack] += count
+
+    def folded(self, view: str) -> str:
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self._views.get(view, Counter()).most_common())
+
+    def summary(self, top: int = 10) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                view: {
+                    'requests': self._requests[view],
+                    'samples': sum(stacks.values()),
+                    'top_stacks': [{'stack': stack, 'count': count} for stack, count in stacks.most_common(top)],
+                }
+                for view, stacks in self._views.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+            self._requests.clear()
+
+
+sampler = StackSampler()
+profiles = ProfileStore()
+
+_rate = {'value': 0.0, 'checked_at': float('-inf')}
+
+
+def cache_is_shared() -> bool:
+    """Whether a rate set in one process is seen by the others, see module docstring"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def enable(rate: float, seconds: int = 300):
+    """Profile this fraction of requests for the next seconds, in every process if the cache is shared"""
+    if not cache_is_shared():
+        logger.warning("Profiling turned on in this process only: the cache is not shared between processes")
+    cache.set(CACHE_KEY_RATE, rate, min(seconds, MAX_PROFILE_SECONDS))
+    _rate['checked_at'] = float('-inf')
+
+
+def disable():
+    cache.delete(CACHE_KEY_RATE)
+    _rate['checked_at'] = float('-inf')
+
+
+def sampling_rate() -> float:
+    """Fraction of requests profiled, read from the cache every RATE_CHECK_INTERVAL seconds"""
+    now = time.monotonic()
+    if now - _rate['checked_at'] >= RATE_CHECK_INTERVAL:
+        try:
+            _rate['value'] = cache.get(CACHE_KEY_RATE, 0.0)
+        except Exception as e:
+            logger.error(f"Failed to read the profiling rate: {e}")
+            _rate['value'] = 0.0
+        _rate['checked_at'] = now
+    return _rate['value']
+
+
+def _is_staff(request) -> bool:
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff
+
+
+def _view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.view_name or match._func_path
+
+
+class ProfilingMiddleware:
+    """Sample the stacks of some requests, see module docstring. Goes after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = PROFILE_HEADER in request.META and _is_staff(request)
+        rate = sampling_rate()
+        if not requested and not (rate and random.random() < rate):
+            return self.get_response(request)
+
+        thread_id = threading.get_ident()
+        sampler.start(thread_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            counts = sampler.stop(thread_id)
+            profiles.add(_view_name(request), counts)
+        if requested:
+            response['X-Profile-Samples'] = str(sum(counts.values()))
+        return response
+
+
+@require_http_methods(["GET", "POST", "DELETE"])
+def profile_view(request):
+    """
+    Staff only. GET: stack counts per view, or ?view=<name>&format=folded for
+    one view's flame graph input. POST rate (0-1) and seconds: profile that
+    fraction of requests; all_processes in the reply says whether other
+    worker processes see it. DELETE: forget the stacks gathered so far.
+    """
+    if not _is_staff(request):
+        return JsonResponse({'error': 'Staff only'}, status=403)
+
+    if request.method == 'POST':
+        data = request.POST
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+            except json.JSONDecodeError:
+                return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        try:
+            rate = float(data.get('rate', 0))
+            seconds = int(data.get('seconds', 300))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'rate must be a number and seconds an integer'}, status=400)
+        if not 0 <= rate <= 1 or seconds <= 0:
+            return JsonResponse({'error': 'rate must be between 0 and 1 and seconds positive'}, status=400)
+        if rate:
+            enable(rate, seconds)
+        else:
+            disable()
+        return JsonResponse({
+            'rate': rate,
+            'seconds': min(seconds, MAX_PROFILE_SECONDS) if rate else 0,
+            'all_processes': cache_is_shared(),
+        })
+
+    if request.method == 'DELETE':
+        profiles.clear()
+        return JsonResponse({'status': 'cleared'})
+
+    view = request.GET.get('view')
+    if view and request.GET.get('format') == 'folded':
+        return HttpResponse(profiles.folded(view), content_type='text/plain')
+    return JsonResponse({
+        'pid': os.getpid(),
+        'rate': sampling_rate(),
+        'interval': PROFILE_INTERVAL,
+        'views': profiles.summary(),
+    }, json_dumps_params={'indent': 2})
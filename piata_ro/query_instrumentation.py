@@ -0,0 +1,139 @@
+"""
+Per-request database query instrumentation.
+RequestQueries is installed with connection.execute_wrapper() on every
+database connection for the duration of one request (see
+monitoring.MetricsMiddleware), so it sees each query whether DEBUG is on or
+not: it counts them, adds up their time and logs slow ones. Statements are
+keyed by their SQL text, which Django keeps apart from the parameters, so
+the same query shape run over and over for one request (an N+1) shows up
+as a repeated key; fingerprint() only has to fold IN lists of varying
+length. QueryReport aggregates requests per route and keeps a few sampled
+and every flagged request in detail.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Queries slower than this are logged
+SLOW_QUERY_SECONDS = getattr(settings, 'SLOW_QUERY_SECONDS', 0.5)
+# A query shape run this many times by one request is flagged as N+1
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'N_PLUS_ONE_THRESHOLD', 5)
+# Share of requests kept in detail in the report, besides the flagged ones
+QUERY_REPORT_SAMPLE_RATE = getattr(settings, 'QUERY_REPORT_SAMPLE_RATE', 0.01)
+QUERY_REPORT_SAMPLES = 5
+
+# Logged and reported statements are cut to this length
+STATEMENT_LENGTH = 300
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def fingerprint(sql: str) -> str:
+    """Shape of a statement, the same for every IN list length"""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+def sql_operation(sql: str) -> str:
+    """Operation type of a SQL statement"""
+    word = sql.lstrip()[:6].upper()
+    for operation in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'DROP'):
+        if word.startswith(operation):
+            return operation.lower()
+    return 'other'
+
+
+class RequestQueries:
+    """Execute wrapper recording the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+        # (database alias, sql, seconds) of every query
+        self.queries: List[Tuple[str, str, float]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.time += duration
+            self.statements[sql] += 1
+            self.queries.append((context['connection'].alias, sql, duration))
+            if duration >= SLOW_QUERY_SECONDS:
+                logger.warning(f"Slow query ({duration:.3f}s): {sql[:STATEMENT_LENGTH]}")
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """Query shapes run at least threshold times, most repeated first"""
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[fingerprint(sql)] += count
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+
+class RouteQueries:
+    """Query totals of one route, with a few requests in detail"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.time = 0.0
+        self.max_queries = 0
+        self.n_plus_one = 0
+        self.samples = deque(maxlen=QUERY_REPORT_SAMPLES)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'avg_queries': self.queries / self.requests,
+            'max_queries': self.max_queries,
+            'avg_db_time': self.time / self.requests,
+            'n_plus_one_requests': self.n_plus_one,
+            'samples': list(self.samples),
+        }
+
+
+class QueryReport:
+    """Per-route query report of this process"""
+
+    def __init__(self, sample_rate: float = QUERY_REPORT_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._routes = defaultdict(RouteQueries)
+        self._lock = threading.Lock()
+
+    def add(self, route: str, path: str, queries: RequestQueries, repeated: List[Tuple[str, int]]):
+        sample = None
+        if repeated or random.random() < self.sample_rate:
+            sample = {
+                'path': path,
+                'queries': queries.count,
+                'db_time': round(queries.time, 4),
+                'repeated': [{'statement': shape[:STATEMENT_LENGTH], 'count': count} for shape, count in repeated],
+            }
+        with self._lock:
+            stats = self._routes[route]
+            stats.requests += 1
+            stats.queries += queries.count
+            stats.time += queries.time
+            stats.max_queries = max(stats.max_queries, queries.count)
+            stats.n_plus_one += bool(repeated)
+            if sample is not None:
+                stats.samples.append(sample)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {route: stats.summary() for route, stats in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
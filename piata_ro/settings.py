@@ -267,6 +267,9 @@ LOGGING_CONFIG = 'logging.config.dictConfig'
 # Application monitoring
 MONITORING_ENABLED = os.getenv('MONITORING_ENABLED', 'True').lower() == 'true'
 MONITORING_EXPORTER_PORT = int(os.getenv('MONITORING_EXPORTER_PORT', 8001))
+# /monitoring/metrics/ is served to staff sessions and to scrapers sending
+# "Authorization: Bearer <token>"; left empty, only staff can read it
+MONITORING_METRICS_TOKEN = os.getenv('MONITORING_METRICS_TOKEN', '')
 
 # Health check settings
 HEALTH_CHECK_SETTINGS = {
@@ -307,6 +310,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Per-route request metrics and database query counts, see piata_ro.monitoring
+    'piata_ro.monitoring.MetricsMiddleware',
+    # Staff-controlled sampling profiler, idle unless turned on
+    'piata_ro.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # AllAuth middleware
@@ -362,6 +369,43 @@ DATABASES = {
     }
 }
 
+# Offline jobs such as recommender evaluation run in a scratch database, see marketplace.utils.scratch_database
+DATABASE_ROUTERS = ['marketplace.utils.scratch_database.ScratchRouter']
+
+# Cache shared by every worker process when REDIS_URL is set. Business gauges
+# and the profiling switch need one to span processes; without it each
+# process has its own LocMemCache (see marketplace.services.business_gauges)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Listing full-text search: 'auto' uses FTS5 on SQLite and tsvector/GIN on PostgreSQL
+MARKETPLACE_SEARCH_BACKEND = os.getenv('MARKETPLACE_SEARCH_BACKEND', 'auto')
+
+# Semantic listing search (/ai/search/): index files, and an optional
+# sentence-transformers model (hashed TF-IDF embeddings when unset)
+SEMANTIC_INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR', str(BASE_DIR / 'var' / 'semantic_index'))
+SEMANTIC_SEARCH_MODEL = os.getenv('SEMANTIC_SEARCH_MODEL', '')
+
+# Interaction events (listing views, favorites, contacts) are buffered in
+# process and flushed in batches to 'database', 'redis' or 'file'. Only
+# 'database' stores InteractionEvent rows, which the daily stats rollups
+# (rollup_daily_stats) and the recommender worker's event polling
+# (precompute_recommendations --follow) read; with the others the rollups
+# stay empty and the worker only sees new favorites
+INTERACTION_EVENT_SINK = os.getenv('INTERACTION_EVENT_SINK', 'database')
+INTERACTION_EVENT_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+INTERACTION_EVENT_FILE = os.getenv('INTERACTION_EVENT_FILE', str(BASE_DIR / 'var' / 'interaction_events.jsonl'))
+
+# Reverse proxies in front of the app that append the client's address to
+# X-Forwarded-For; with 0 the header is ignored and REMOTE_ADDR identifies
+# anonymous visitors (unique visitor counts)
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
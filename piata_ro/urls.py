@@ -29,10 +29,14 @@ from piata_ro.views import (
     natural_language_query, openai_models_endpoint, openai_chat_completions,
     rate_limit_exceeded, health_check
 )
+from piata_ro.monitoring import dashboard_view, metrics_view
+from piata_ro.profiling import profile_view
 from marketplace.admin import admin_site
+from api.views import semantic_search
 
 urlpatterns = [
     path('', include(('marketplace.urls', 'marketplace'), namespace='marketplace')),  # Include marketplace URLs for frontend
+    path('ai/search/', semantic_search, name='semantic_search'),  # Must come before the AI assistant include
     path('ai/', include(('ai_assistant.urls', 'ai_assistant'), namespace='ai_assistant')),  # Add AI assistant URLs
     path('ai-assistant/', include(('ai_assistant.urls', 'ai_assistant'), namespace='ai_assistant_alt')),  # Alternative path
     path('admin/', admin_site.urls),
@@ -59,6 +63,10 @@ urlpatterns = [
     path('api/health/', health_check, name='api_health_check'),
     path('rate-limit/', rate_limit_exceeded, name='rate_limit_exceeded'),
     path('metrics/', include('django_prometheus.urls')),
+    path('monitoring/dashboard/', dashboard_view, name='monitoring_dashboard'),
+    # Route-labelled request and per-request query metrics; /metrics/ above only has django_prometheus' own
+    path('monitoring/metrics/', metrics_view, name='monitoring_metrics'),
+    path('monitoring/profile/', profile_view, name='monitoring_profile'),
     path('status/', TemplateView.as_view(template_name='status.json', content_type='application/json'), name='status'),
 ]
 
@@ -0,0 +1,108 @@
+"""
+Tests for incrementally kept business gauges
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from marketplace import signals
+from marketplace.models import Category, Listing, Payment
+from marketplace.services import business_gauges
+from marketplace.services.business_gauges import ACTIVE_LISTINGS, ACTIVE_USERS, FEATURED_LISTINGS, REVENUE
+
+
+class BusinessGaugesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The test cache is per process; pretend it is shared like Redis
+        self.enterContext(patch.object(business_gauges, 'incremental', return_value=True))
+        signals.connect_gauge_signals()
+        self.addCleanup(signals.disconnect_gauge_signals)
+        self.category = Category.objects.create(name='Imobiliare', slug='imobiliare')
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.create_listing(status='active')
+        self.create_listing(status='pending')
+
+    def create_listing(self, **fields):
+        return Listing.objects.create(
+            title='Apartament', description='Descriere', price=Decimal('90000.00'), location='Sibiu',
+            user=self.seller, category=self.category, **fields
+        )
+
+    def create_payment(self, amount, status='pending'):
+        return Payment.objects.create(
+            user=self.seller, payment_type='credits', amount=Decimal(amount), status=status,
+            stripe_payment_intent_id=f'pi_{Payment.objects.count()}',
+        )
+
+    def test_gauges_follow_saves_and_deletes_without_counting(self):
+        self.assertEqual(business_gauges.read(), {ACTIVE_USERS: 1, ACTIVE_LISTINGS: 1, FEATURED_LISTINGS: 0, REVENUE: 0})
+
+        listing = self.create_listing(status='active', is_featured=True)
+        pending = Listing.objects.get(status='pending')
+        pending.status = 'active'
+        pending.save()
+        buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        payment = self.create_payment('49.99')
+        payment.status = 'succeeded'
+        payment.save()
+        self.create_payment('10.00', status='succeeded')
+        self.create_payment('99.00', status='failed')
+        with self.assertNumQueries(0):
+            self.assertEqual(business_gauges.read(),
+                             {ACTIVE_USERS: 2, ACTIVE_LISTINGS: 3, FEATURED_LISTINGS: 1, REVENUE: 5999})
+
+        listing.status = 'sold'
+        listing.save()
+        buyer.is_active = False
+        buyer.save(update_fields=['is_active'])
+        payment.status = 'refunded'
+        payment.save()
+        pending.delete()
+        # Saving an unchanged instance changes nothing
+        Listing.objects.get(status='active').save()
+        self.assertEqual(business_gauges.read(), {ACTIVE_USERS: 1, ACTIVE_LISTINGS: 1, FEATURED_LISTINGS: 0, REVENUE: 1000})
+        self.assertEqual(business_gauges.read(), business_gauges.count())
+
+    def test_reconciliation_corrects_bulk_updates(self):
+        business_gauges.read()
+        Listing.objects.update(status='active', is_featured=True)
+        self.assertEqual(business_gauges.read()[ACTIVE_LISTINGS], 1)
+
+        out = StringIO()
+        call_command('reconcile_gauges', stdout=out)
+        self.assertIn('active_listings: +1', out.getvalue())
+        self.assertIn('featured_listings: +2', out.getvalue())
+        self.assertEqual(business_gauges.read()[FEATURED_LISTINGS], 2)
+
+    def test_missing_gauges_are_recounted(self):
+        business_gauges.read()
+        cache.delete(business_gauges._key(ACTIVE_USERS))
+        User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        self.assertEqual(business_gauges.read()[ACTIVE_USERS], 2)
+
+
+class PerProcessCacheTestCase(TestCase):
+    def test_gauges_are_counted_without_a_shared_cache(self):
+        cache.clear()
+        self.enterContext(patch.object(business_gauges, '_counted', None))
+        self.assertFalse(business_gauges.incremental())
+        User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        with self.assertNumQueries(4):
+            self.assertEqual(business_gauges.read()[ACTIVE_USERS], 1)
+        self.assertIsNone(cache.get(business_gauges._key(ACTIVE_USERS)))
+
+        # Counted at most once per MONITORING_INTERVAL
+        User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        with self.assertNumQueries(0):
+            self.assertEqual(business_gauges.read()[ACTIVE_USERS], 1)
+        with override_settings(MONITORING_INTERVAL=0):
+            self.assertEqual(business_gauges.read()[ACTIVE_USERS], 2)
+
+        out = StringIO()
+        call_command('reconcile_gauges', stdout=out)
+        self.assertIn('counted on every read', out.getvalue())
@@ -0,0 +1,104 @@
+"""
+Tests for the daily listing and seller rollups
+"""
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from marketplace.models import Category, InteractionEvent, Listing, ListingDailyStats, SellerDailyStats
+from marketplace.recommendations.data.events import CONTACT, FAVORITE, VIEW, collector
+from marketplace.services import daily_stats
+
+
+class DailyStatsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        self.category = Category.objects.create(name='Auto', slug='auto')
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.buyers = [User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'pass') for n in range(2)]
+        self.listings = [
+            Listing.objects.create(
+                title=f'Mașină {n}', description='Descriere', price=Decimal('5000.00'), location='Brașov',
+                user=self.seller, category=self.category, status='active'
+            )
+            for n in range(2)
+        ]
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def event(self, kind, listing, user=None, day=None):
+        start, _ = daily_stats.day_bounds(day or self.today)
+        InteractionEvent.objects.create(kind=kind, listing=listing, user=user, created_at=start + timedelta(hours=10))
+
+    def test_rollup_counts_a_day_per_listing_and_seller(self):
+        first, second = self.listings
+        for _ in range(3):
+            self.event(VIEW, first)
+        self.event(VIEW, second, self.buyers[0])
+        self.event(FAVORITE, first, self.buyers[0])
+        self.event(CONTACT, first, self.buyers[0])
+        self.event(CONTACT, first, self.buyers[0])
+        self.event(CONTACT, second, self.buyers[0])
+        self.event(CONTACT, second, self.buyers[1])
+        self.event(VIEW, first, day=self.yesterday)
+
+        # One grouped SELECT and one upsert per table, however many listings
+        with self.assertNumQueries(4):
+            self.assertEqual(daily_stats.rollup(self.today), 2)
+        row = ListingDailyStats.objects.get(listing=first, date=self.today)
+        self.assertEqual((row.views, row.favorites, row.messages, row.contacts), (3, 1, 2, 1))
+        seller = SellerDailyStats.objects.get(user=self.seller, date=self.today)
+        # The same buyer contacting about both listings is one contact
+        self.assertEqual((seller.views, seller.favorites, seller.messages, seller.contacts), (4, 1, 4, 2))
+
+        # Running again recomputes instead of adding up
+        self.event(VIEW, first)
+        daily_stats.rollup(self.today)
+        self.assertEqual(ListingDailyStats.objects.get(listing=first, date=self.today).views, 4)
+        self.assertEqual(SellerDailyStats.objects.count(), 1)
+
+    def test_other_sinks_are_warned_about(self):
+        with self.assertNoLogs('marketplace.services.daily_stats', level='WARNING'):
+            daily_stats.rollup_days(1)
+        with override_settings(INTERACTION_EVENT_SINK='redis'), \
+                self.assertLogs('marketplace.services.daily_stats', level='WARNING'):
+            daily_stats.rollup_days(1)
+
+    def test_series_fills_days_without_rows(self):
+        self.event(VIEW, self.listings[0], day=self.yesterday)
+        self.event(VIEW, self.listings[1])
+        out = StringIO()
+        call_command('rollup_daily_stats', stdout=out)
+        self.assertIn('Rolled up 2 listing days over 2 days', out.getvalue())
+
+        start, end = daily_stats.date_range(3)
+        days = daily_stats.seller_series(self.seller.pk, start, end)
+        self.assertEqual([day['date'] for day in days], [start, self.yesterday, self.today])
+        self.assertEqual([day['views'] for day in days], [0, 1, 1])
+        self.assertEqual(
+            [day['views'] for day in daily_stats.listing_series(self.listings[0].pk, start, end)], [0, 1, 0]
+        )
+
+    def test_api_serves_stats_to_the_owner_only(self):
+        self.event(VIEW, self.listings[0])
+        daily_stats.rollup(self.today)
+
+        self.client.force_login(self.seller)
+        response = self.client.get('/api/analytics/daily/?days=7')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['days']), 7)
+        self.assertEqual(response.data['days'][-1]['views'], 1)
+        response = self.client.get(f'/api/listings/{self.listings[0].pk}/stats/')
+        self.assertEqual(len(response.data['days']), 30)
+
+        self.client.force_login(self.buyers[0])
+        self.assertEqual(self.client.get(f'/api/listings/{self.listings[0].pk}/stats/').status_code, 403)
+        self.assertEqual(self.client.get('/api/analytics/daily/').data['days'][-1]['views'], 0)
@@ -0,0 +1,118 @@
+"""
+Tests for grid-cell radius queries
+"""
+import math
+from decimal import Decimal
+from unittest.mock import patch
+from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api.serializers import ListingSerializer
+from api.views import ListingViewSet
+from marketplace.models import Category, Listing, Location
+from marketplace.utils.geo import (
+    GRID_COLUMNS, distances_from, grid_cell, grid_cells_q, haversine_batch, within_radius
+)
+
+
+class GeoListingsMixin:
+    def setUp(self):
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Imobiliare', slug='imobiliare')
+        self.bucuresti = self.create_listing('Apartament Bucuresti', '44.4268', '26.1025')
+        self.otopeni = self.create_listing('Casa Otopeni', '44.5500', '26.0700')
+        self.cluj = self.create_listing('Garsoniera Cluj', '46.7712', '23.6236')
+        self.no_coords = self.create_listing('Teren', None, None)
+
+    def create_listing(self, title, latitude, longitude):
+        return Listing.objects.create(
+            title=title,
+            description='Descriere',
+            price=Decimal('100000.00'),
+            location=title.split()[-1],
+            latitude=Decimal(latitude) if latitude else None,
+            longitude=Decimal(longitude) if longitude else None,
+            user=self.user,
+            category=self.category,
+            status='active'
+        )
+
+
+class GridCellTestCase(GeoListingsMixin, TestCase):
+    def test_grid_cell(self):
+        self.assertIsNone(grid_cell(None, 26.1))
+        self.assertEqual(grid_cell(-90, -180), 0)
+        self.assertEqual(grid_cell(44.4268, 26.1025), 1344 * GRID_COLUMNS + 2061)
+        self.assertEqual(grid_cell(0, 180), grid_cell(0, -180))
+
+    def test_geo_cell_follows_coordinates(self):
+        self.assertEqual(self.bucuresti.geo_cell, grid_cell(44.4268, 26.1025))
+        self.assertIsNone(self.no_coords.geo_cell)
+
+        self.no_coords.latitude = Decimal('45.7489')
+        self.no_coords.longitude = Decimal('21.2087')
+        self.no_coords.save(update_fields=['latitude', 'longitude'])
+        self.no_coords.refresh_from_db()
+        self.assertEqual(self.no_coords.geo_cell, grid_cell(45.7489, 21.2087))
+
+    def test_cells_cover_antimeridian(self):
+        cells = grid_cells_q(0, 179.99, 20)
+        ranges = [child[1] for child in cells.children]
+        self.assertTrue(any(low <= grid_cell(0, -179.95) <= high for low, high in ranges))
+        self.assertTrue(any(low <= grid_cell(0, 179.95) <= high for low, high in ranges))
+
+    def test_nearby_sorted_by_distance(self):
+        nearby = list(Listing.get_nearby_listings(44.43, 26.10, radius_km=25))
+        self.assertEqual(nearby, [self.bucuresti, self.otopeni])
+        expected = Location.calculate_distance(44.43, 26.10, 44.55, 26.07)
+        self.assertAlmostEqual(nearby[1].distance_km, expected, places=3)
+
+        self.assertEqual(list(Listing.get_nearby_listings(44.43, 26.10, radius_km=5)), [self.bucuresti])
+        self.assertEqual(
+            list(within_radius(Listing.objects.all(), 46.77, 23.62, 500).order_by('distance_km')),
+            [self.cluj, self.otopeni, self.bucuresti]
+        )
+
+    def test_api_radius_filter(self):
+        view = ListingViewSet.as_view({'get': 'list'})
+        request = APIRequestFactory().get('/api/listings/', {'latitude': '44.43', 'longitude': '26.10', 'radius': '25'})
+        data = view(request).data
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([item['id'] for item in results], [self.bucuresti.pk, self.otopeni.pk])
+
+    def test_api_nearby(self):
+        response = self.client.get(f'/api/listings/{self.bucuresti.pk}/nearby/', {'radius': '25'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()], [self.otopeni.pk])
+
+
+class BatchDistanceTestCase(GeoListingsMixin, TestCase):
+    def test_haversine_batch_matches_scalar(self):
+        distances = haversine_batch([44.4268, 46.7712, float('nan')], [26.1025, 23.6236, 0.0], 45.0, 25.0)
+        self.assertAlmostEqual(distances[0], Location.calculate_distance(45.0, 25.0, 44.4268, 26.1025), places=6)
+        self.assertAlmostEqual(distances[1], Location.calculate_distance(45.0, 25.0, 46.7712, 23.6236), places=6)
+        self.assertTrue(math.isnan(distances[2]))
+
+    def test_distances_from(self):
+        distances = distances_from(Listing.objects.order_by('pk'), 44.4268, 26.1025)
+        self.assertAlmostEqual(distances[self.bucuresti.pk], 0.0, places=6)
+        self.assertIsNone(distances[self.no_coords.pk])
+        self.assertEqual(distances_from([], 0, 0), {})
+
+    def test_serializer_computes_page_once(self):
+        request = APIRequestFactory().get('/api/listings/', {'ref_latitude': '44.4268', 'ref_longitude': '26.1025'})
+        listings = Listing.objects.order_by('pk')
+        with patch('api.serializers.distances_from', wraps=distances_from) as batch:
+            data = ListingSerializer(listings, many=True, context={'request': Request(request)}).data
+        self.assertEqual(batch.call_count, 1)
+        by_id = {item['id']: item['distance'] for item in data}
+        self.assertEqual(by_id[self.bucuresti.pk], 0.0)
+        self.assertIsNone(by_id[self.no_coords.pk])
+        self.assertAlmostEqual(by_id[self.otopeni.pk], round(self.otopeni.distance_to_point(44.4268, 26.1025), 2))
+
+    def test_serializer_single_object(self):
+        request = APIRequestFactory().get('/', {'ref_latitude': 'x', 'ref_longitude': '26.1'})
+        self.assertIsNone(ListingSerializer(self.cluj, context={'request': Request(request)}).data['distance'])
+        request = APIRequestFactory().get('/', {'ref_latitude': '44.4268', 'ref_longitude': '26.1025'})
+        self.assertEqual(ListingSerializer(self.bucuresti, context={'request': Request(request)}).data['distance'], 0.0)
@@ -0,0 +1,210 @@
+"""
+Tests for the interaction event pipeline
+"""
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+from django.utils import timezone
+from marketplace.models import Category, Favorite, InteractionEvent, Listing, Message
+from marketplace.recommendations.data import events
+from marketplace.recommendations.data.events import (
+    CONTACT,
+    FAVORITE,
+    UNFAVORITE,
+    VIEW,
+    DatabaseSink,
+    Event,
+    EventCollector,
+    FileSink,
+    RedisSink,
+    collector,
+    get_sink,
+)
+from marketplace.recommendations.services import CollaborativeFilteringRecommender
+
+
+class EventCollectorTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+        self.sink = FileSink(os.path.join(self.path, 'events.jsonl'))
+        self.collector = EventCollector(self.sink, background=False)
+
+    def test_events_are_buffered_until_flushed(self):
+        batches = []
+        self.collector.subscribe(batches.append)
+        self.collector.record(VIEW, 1, user_id=7)
+        self.collector.record(FAVORITE, 2, user_id=7)
+        self.collector.record(VIEW, 3, session_key='abc')
+        self.assertFalse(os.path.exists(self.sink.path))
+
+        self.assertEqual(self.collector.flush(), 3)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([(event.kind, event.listing_id) for event in batches[0]],
+                         [(VIEW, 1), (FAVORITE, 2), (VIEW, 3)])
+        self.assertEqual(self.collector.flush(), 0)
+
+        # Only signed-in users' events of the requested kinds, newest first
+        recent = self.collector.recent((VIEW, FAVORITE), 10)
+        self.assertEqual([event.listing_id for event in recent], [2, 1])
+        self.assertEqual(recent[0].user_id, 7)
+        self.assertEqual([event.listing_id for event in self.collector.recent((VIEW,), 10)], [1])
+
+    def test_flushes_once_a_batch_is_full(self):
+        with patch.object(events, 'FLUSH_SIZE', 3):
+            for listing_id in range(5):
+                self.collector.record(VIEW, listing_id, user_id=1)
+        self.assertEqual(len(self.sink.recent((VIEW,), 10)), 3)
+
+    def test_background_thread_flushes(self):
+        background = EventCollector(self.sink)
+        with patch.object(events, 'FLUSH_SIZE', 2):
+            background.record(VIEW, 1, user_id=1)
+            background.record(VIEW, 2, user_id=1)
+            deadline = time.monotonic() + 5
+            while not os.path.exists(self.sink.path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(len(self.sink.recent((VIEW,), 10)), 2)
+
+    def test_full_buffer_drops_oldest_events(self):
+        small = EventCollector(self.sink, background=False, buffer_size=3)
+        small._flushed_at = time.monotonic()
+        for listing_id in range(5):
+            small.record(VIEW, listing_id, user_id=1)
+        self.assertEqual(small.dropped, 2)
+        with self.assertLogs(events.logger, 'WARNING'):
+            small.flush()
+        self.assertEqual([event.listing_id for event in self.sink.recent((VIEW,), 10)], [4, 3, 2])
+
+    def test_sink_failures_do_not_reach_callers(self):
+        broken = MagicMock()
+        broken.write.side_effect = OSError('disk full')
+        failing = EventCollector(broken, background=False)
+        batches = []
+        failing.subscribe(batches.append)
+        failing.record(VIEW, 1, user_id=1)
+        with self.assertLogs(events.logger, 'ERROR'):
+            failing.flush()
+        self.assertEqual(len(batches), 1)
+
+
+class EventSinkTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.listing = Listing.objects.create(
+            title='Bicicletă', description='Descriere', price=Decimal('500.00'), location='Cluj',
+            user=self.seller, category=self.category, status='active'
+        )
+
+    def event(self, kind, user_id=None, session_key='', age=timedelta(0)):
+        return Event(kind, user_id, self.listing.pk, session_key, timezone.now() - age)
+
+    def test_database_sink_writes_a_batch_in_one_query(self):
+        sink = DatabaseSink()
+        sink._purged_at = time.monotonic()
+        events = [self.event(VIEW, self.seller.pk), self.event(VIEW, session_key='abc'), self.event(CONTACT, self.seller.pk)]
+        with self.assertNumQueries(1):
+            sink.write(events)
+        self.assertEqual(InteractionEvent.objects.filter(listing=self.listing).count(), 3)
+        self.assertEqual([event.kind for event in sink.recent((VIEW, CONTACT), 10)], [CONTACT, VIEW])
+
+    def test_database_sink_purges_old_events(self):
+        sink = DatabaseSink()
+        sink.write([self.event(VIEW, self.seller.pk, age=timedelta(days=events.RETENTION_DAYS + 1))])
+        sink._purged_at = 0
+        sink.write([self.event(VIEW, self.seller.pk)])
+        self.assertEqual(InteractionEvent.objects.filter(listing=self.listing).count(), 1)
+
+    def test_redis_sink_pipelines_a_batch(self):
+        sink = RedisSink('redis://localhost:6379/0')
+        sink._client = MagicMock()
+        pipeline = sink._client.pipeline.return_value
+        sink.write([self.event(VIEW, self.seller.pk), self.event(FAVORITE, self.seller.pk)])
+        self.assertEqual(pipeline.xadd.call_count, 2)
+        pipeline.execute.assert_called_once_with()
+
+    def test_configured_sink(self):
+        self.assertIsInstance(get_sink(), DatabaseSink)
+        with self.settings(INTERACTION_EVENT_SINK='file'):
+            self.assertIsInstance(get_sink(), FileSink)
+        with self.assertRaises(ValueError):
+            get_sink('kafka')
+
+
+class InteractionSourcesTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.listing = Listing.objects.create(
+            title='Bicicletă', description='Descriere', price=Decimal('500.00'), location='Cluj',
+            user=self.seller, category=self.category, status='active'
+        )
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        self.events = []
+        self.enterContext(patch.object(collector, '_listeners', [self.events.extend]))
+
+    def recorded(self):
+        collector.flush()
+        return [(event.kind, event.user_id, event.listing_id) for event in self.events]
+
+    def test_favorites_and_contacts(self):
+        # Recorded once the writes commit
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite = Favorite.objects.create(user=self.buyer, listing=self.listing)
+            favorite.delete()
+            Message.objects.create(sender=self.buyer, receiver=self.seller, listing=self.listing, content='Mai e valabil?')
+            Message.objects.create(sender=self.seller, receiver=self.buyer, content='Da')
+        self.assertEqual(self.recorded(), [
+            (FAVORITE, self.buyer.pk, self.listing.pk),
+            (UNFAVORITE, self.buyer.pk, self.listing.pk),
+            (CONTACT, self.buyer.pk, self.listing.pk),
+        ])
+
+    def test_rolled_back_favorites_are_not_recorded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Favorite.objects.create(user=self.buyer, listing=self.listing)
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(self.recorded(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.buyer, listing=self.listing)
+        self.assertEqual(self.recorded(), [(FAVORITE, self.buyer.pk, self.listing.pk)])
+
+    def test_views_of_anonymous_and_signed_in_visitors(self):
+        self.assertEqual(self.client.get(f'/api/listings/{self.listing.pk}/').status_code, 200)
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(f'/api/listings/{self.listing.pk}/').status_code, 200)
+        self.assertEqual(self.recorded(), [
+            (VIEW, None, self.listing.pk),
+            (VIEW, self.buyer.pk, self.listing.pk),
+        ])
+        self.assertTrue(self.events[1].session_key)
+
+    def test_recommender_starts_from_stored_events(self):
+        other = User.objects.create_user('other', 'other@example.com', 'testpass123')
+        second = Listing.objects.create(
+            title='Cască', description='Descriere', price=Decimal('50.00'), location='Cluj',
+            user=self.seller, category=self.category, status='active'
+        )
+        Favorite.objects.bulk_create([Favorite(user=other, listing=self.listing)])
+        DatabaseSink().write([
+            Event(VIEW, other.pk, second.pk, '', timezone.now()),
+            Event(CONTACT, self.buyer.pk, second.pk, '', timezone.now()),
+        ])
+        recommender = CollaborativeFilteringRecommender()
+        recommender.train_model()
+        self.assertIn(second.pk, recommender.model.similar(self.listing.pk))
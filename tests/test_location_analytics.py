@@ -0,0 +1,78 @@
+"""
+Tests for location analytics counters and latency histograms
+"""
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from marketplace.services.location_analytics import LocationAnalytics
+from marketplace.utils.histogram import LATENCY_BUCKETS, bucket_index, merge, percentile
+
+
+class HistogramTestCase(TestCase):
+    def test_percentiles_are_interpolated_within_buckets(self):
+        counts = [0] * len(LATENCY_BUCKETS)
+        for value in [0.2] * 90 + [3.0] * 9 + [20.0]:
+            counts[bucket_index(value)] += 1
+        self.assertEqual(bucket_index(0.1), LATENCY_BUCKETS.index(0.1))
+        self.assertTrue(0.1 < percentile(counts, 50) <= 0.25)
+        self.assertTrue(2.5 < percentile(counts, 95) <= 5.0)
+        # Beyond the last bound only the bound is known
+        self.assertEqual(percentile(counts, 100), 10.0)
+        self.assertEqual(percentile([0] * len(LATENCY_BUCKETS), 99), 0.0)
+        self.assertEqual(merge([counts, counts]), [count * 2 for count in counts])
+
+
+class LocationAnalyticsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_requests_are_all_counted(self):
+        def log():
+            for n in range(50):
+                LocationAnalytics.log_geocoding_request('Cluj', n % 10 != 0, 0.3)
+
+        threads = [threading.Thread(target=log) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        geocoding = LocationAnalytics.get_daily_stats()['geocoding']
+        self.assertEqual(geocoding['total_requests'], 400)
+        self.assertEqual(geocoding['successful_requests'], 360)
+        self.assertEqual(geocoding['failed_requests'], 40)
+        self.assertEqual(geocoding['avg_response_time'], 0.3)
+        self.assertEqual(sum(geocoding['latency_histogram']), 400)
+        self.assertTrue(0.25 < geocoding['p50_response_time'] <= 0.5)
+
+    def test_health_uses_the_tail_latency(self):
+        for _ in range(90):
+            LocationAnalytics.log_geocoding_request('Iași', True, 0.1)
+        for _ in range(10):
+            LocationAnalytics.log_geocoding_request('Iași', True, 8.0)
+        health = LocationAnalytics.get_service_health()
+        self.assertLess(health['p50_response_time'], 0.2)
+        self.assertGreater(health['p95_response_time'], 5.0)
+        self.assertEqual(health['status'], 'unhealthy')
+        self.assertEqual(health['total_requests_today'], 100)
+
+    def test_weekly_stats_read_every_day_at_once(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        with patch('django.utils.timezone.now', return_value=yesterday):
+            LocationAnalytics.log_location_search('Timișoara', 4, 0.05)
+            LocationAnalytics.log_rate_limit_hit()
+        LocationAnalytics.log_location_search('Brașov', 2, 0.02)
+
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            week = LocationAnalytics.get_weekly_stats()
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(len(week), 7)
+        self.assertEqual(week[-1]['date'], timezone.now().strftime('%Y-%m-%d'))
+        self.assertEqual([day['search']['total_searches'] for day in week[-2:]], [1, 1])
+        self.assertEqual(week[-2]['search']['avg_results'], 4)
+        self.assertEqual(week[-2]['rate_limits']['total_hits'], 1)
+        self.assertEqual(week[0]['geocoding']['total_requests'], 0)
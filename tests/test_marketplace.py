@@ -2,6 +2,7 @@
 Comprehensive tests for Piața.ro marketplace
 """
 import json
+import time
 from decimal import Decimal
 from django.test import TestCase, Client, TransactionTestCase
 from django.contrib.auth.models import User
@@ -14,7 +15,17 @@ from unittest.mock import patch, MagicMock
 from marketplace.models import Category, Listing, UserProfile, Favorite, Message, Report
 from marketplace.services.location_service import LocationService
 from marketplace.services.chat_service import MarketplaceChatService
-from marketplace.utils.cache_utils import ListingCache, SearchCache, CategoryCache
+from marketplace.utils.cache_utils import (
+    CACHE_PREFIX_GENERATION,
+    CACHE_PREFIX_SEARCH,
+    CategoryCache,
+    ListingCache,
+    SearchCache,
+    get_generation,
+    invalidate_listing_cache,
+    make_cache_key,
+)
+from marketplace.utils.view_counter import view_counter
 from marketplace.views import ListingViewSet
 from rest_framework.test import APITestCase
 from rest_framework import status
@@ -188,7 +199,8 @@ class MarketplaceTestCase(TestCase):
         response = self.client.get(f'/listing/{self.listing.id}/')
         self.assertEqual(response.status_code, 200)
         
-        # Refresh listing from database
+        # Views are written behind, see utils.view_counter
+        view_counter.flush()
         self.listing.refresh_from_db()
         self.assertEqual(self.listing.views, initial_views + 1)
         
@@ -241,20 +253,34 @@ class CacheTestCase(TestCase):
             
     def test_search_cache(self):
         """Test search caching functionality"""
+        cache.clear()
         filters = {'category': 1, 'min_price': 100}
         
         # Test cache miss
-        with patch('marketplace.utils.cache_utils.cache.get') as mock_get:
-            mock_get.return_value = None
-            result = SearchCache.get_search_results('active', filters)
-            mock_get.assert_called_once()
-            
+        self.assertIsNone(SearchCache.get_search_results('active', filters))
+        
         # Test cache hit
-        with patch('marketplace.utils.cache_utils.cache.get') as mock_get:
-            mock_get.return_value = ['listing1', 'listing2']
-            result = SearchCache.get_search_results('active', filters)
-            mock_get.assert_called_once()
-            
+        SearchCache.set_search_results('active', filters, [1, 2])
+        self.assertEqual(SearchCache.get_search_results('active', filters), [1, 2])
+        self.assertIsNone(SearchCache.get_search_results('active', {'category': 2}))
+        
+        # A new generation hides every earlier entry, on any cache backend
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        SearchCache.invalidate()
+        self.assertEqual(get_generation(CACHE_PREFIX_SEARCH), generation + 1)
+        self.assertIsNone(SearchCache.get_search_results('active', filters))
+        
+    def test_generation_survives_eviction(self):
+        """A lost generation counter never restarts at an old value"""
+        cache.clear()
+        SearchCache.invalidate()
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        SearchCache.set_search_results('active', {}, [1])
+        cache.delete(make_cache_key(CACHE_PREFIX_GENERATION, CACHE_PREFIX_SEARCH))
+        time.sleep(0.001)
+        self.assertGreater(get_generation(CACHE_PREFIX_SEARCH), generation)
+        self.assertIsNone(SearchCache.get_search_results('active', {}))
+        
     def test_cache_invalidation(self):
         """Test cache invalidation on model changes"""
         listing = Listing.objects.create(
@@ -0,0 +1,146 @@
+"""
+Tests for route-labelled request metrics and database query instrumentation
+"""
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import TestCase, override_settings
+from django.urls import path, resolve
+from marketplace.models import Category, Listing
+from piata_ro.monitoring import UNMATCHED_ROUTE, application_monitor
+from piata_ro.query_instrumentation import fingerprint
+
+
+def listing_titles(request):
+    # One query per listing
+    pks = Listing.objects.values_list('pk', flat=True)
+    return JsonResponse({'titles': [Listing.objects.get(pk=pk).title for pk in pks]})
+
+
+def listing_titles_at_once(request):
+    return JsonResponse({'titles': list(Listing.objects.values_list('title', flat=True))})
+
+
+urlpatterns = [
+    path('titles/', listing_titles, name='listing_titles'),
+    path('titles/at-once/', listing_titles_at_once, name='listing_titles_at_once'),
+]
+
+
+class MetricsMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.metrics = application_monitor.metrics_collector
+        self.metrics.route_stats.clear()
+        seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        category = Category.objects.create(name='Sport', slug='sport')
+        self.listings = [
+            Listing.objects.create(
+                title=f'Bicicletă {n}', description='Descriere', price=Decimal('800.00'), location='Oradea',
+                user=seller, category=category, status='active'
+            )
+            for n in range(3)
+        ]
+
+    def test_requests_are_labelled_by_route_not_path(self):
+        match = resolve(f'/api/listings/{self.listings[0].pk}/')
+        labels = {'method': 'GET', 'route': match.route, 'view': match.view_name}
+        registry = self.metrics.registry
+
+        def sample(name, **extra):
+            # The registry outlives each test
+            return registry.get_sample_value(name, {**labels, **extra}) or 0
+
+        before = {name: sample(name) for name in ['http_request_duration_seconds_count', 'http_request_size_bytes_sum',
+                                                  'http_response_size_bytes_sum']}
+        requests_before = sample('http_requests_total', status_code='200')
+        for listing in self.listings:
+            self.assertEqual(self.client.get(f'/api/listings/{listing.pk}/').status_code, 200)
+        self.client.get('/nu-exista/')
+
+        routes = self.metrics.get_performance_metrics()
+        stats = routes[match.route]
+        self.assertEqual(stats['count'], 3)
+        self.assertLessEqual(stats['p50_response_time'], stats['p95_response_time'])
+        self.assertLessEqual(stats['p95_response_time'], stats['p99_response_time'])
+        self.assertEqual(routes[UNMATCHED_ROUTE]['count'], 1)
+        self.assertEqual(len(routes), 2)
+
+        self.assertEqual(sample('http_requests_total', status_code='200') - requests_before, 3)
+        self.assertEqual(sample('http_request_duration_seconds_count') - before['http_request_duration_seconds_count'], 3)
+        self.assertGreater(sample('http_response_size_bytes_sum'), before['http_response_size_bytes_sum'])
+        self.assertEqual(sample('http_request_size_bytes_sum'), before['http_request_size_bytes_sum'])
+
+    @override_settings(MONITORING_METRICS_TOKEN='scrape-token')
+    def test_query_metrics_are_scraped(self):
+        self.client.get(f'/api/listings/{self.listings[0].pk}/')
+        self.assertEqual(self.client.get('/monitoring/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/monitoring/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/monitoring/metrics/', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        route = resolve(f'/api/listings/{self.listings[0].pk}/').route
+        self.assertIn(f'db_queries_per_request_count{{route="{route}"', response.content.decode())
+
+    def test_metrics_are_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get('/monitoring/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', 'admin@example.com', 'testpass123', is_staff=True))
+        self.assertEqual(self.client.get('/monitoring/metrics/').status_code, 200)
+
+    def test_dashboard_exposes_route_percentiles(self):
+        self.client.get(f'/api/listings/{self.listings[0].pk}/')
+        self.assertEqual(self.client.get('/monitoring/dashboard/').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('admin', 'admin@example.com', 'testpass123', is_staff=True))
+        performance = self.client.get('/monitoring/dashboard/').json()['performance_metrics']
+        self.assertEqual(performance[resolve(f'/api/listings/{self.listings[0].pk}/').route]['count'], 1)
+        self.assertTrue(all(
+            {'p50_response_time', 'p95_response_time', 'p99_response_time'} <= set(stats)
+            for stats in performance.values()
+        ))
+
+
+@override_settings(ROOT_URLCONF='tests.test_monitoring')
+class QueryInstrumentationTestCase(TestCase):
+    def setUp(self):
+        self.metrics = application_monitor.metrics_collector
+        self.metrics.query_report.clear()
+        seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        category = Category.objects.create(name='Carte', slug='carte')
+        for n in range(6):
+            Listing.objects.create(
+                title=f'Carte {n}', description='Descriere', price=Decimal('20.00'), location='Arad',
+                user=seller, category=category, status='active'
+            )
+
+    def n_plus_one_count(self):
+        labels = {'route': 'titles/', 'view': 'listing_titles'}
+        return self.metrics.registry.get_sample_value('db_n_plus_one_requests_total', labels) or 0
+
+    def test_repeated_query_shapes_are_flagged(self):
+        before = self.n_plus_one_count()
+        with self.assertLogs('piata_ro.monitoring', 'WARNING') as logs:
+            self.assertEqual(len(self.client.get('/titles/').json()['titles']), 6)
+        self.assertIn('Possible N+1 on /titles/', logs.output[0])
+        self.assertEqual(self.n_plus_one_count() - before, 1)
+        self.client.get('/titles/at-once/')
+
+        report = self.metrics.get_query_report()
+        titles = report['titles/']
+        self.assertEqual((titles['requests'], titles['max_queries'], titles['n_plus_one_requests']), (1, 7, 1))
+        self.assertEqual(titles['samples'][0]['repeated'][0]['count'], 6)
+        at_once = report['titles/at-once/']
+        self.assertEqual((at_once['max_queries'], at_once['n_plus_one_requests']), (1, 0))
+
+    def test_slow_queries_are_logged(self):
+        with patch('piata_ro.query_instrumentation.SLOW_QUERY_SECONDS', 0), \
+                self.assertLogs('piata_ro.query_instrumentation', 'WARNING') as logs:
+            self.client.get('/titles/at-once/')
+        self.assertIn('Slow query', logs.output[0])
+
+    def test_in_lists_share_a_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'), fingerprint('SELECT * FROM t WHERE id IN (%s)')
+        )
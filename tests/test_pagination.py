@@ -0,0 +1,154 @@
+"""
+Tests for keyset (cursor) pagination
+"""
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.utils import timezone
+from marketplace.models import Category, Listing
+from marketplace.pagination import InvalidCursor, KeysetPaginator, cached_count, encode_cursor
+from marketplace.utils.cache_utils import CACHE_PREFIX_SEARCH, get_generation
+
+
+class KeysetPaginatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        for i in range(25):
+            Listing.objects.create(
+                title=f'Anunt {i}',
+                description='Descriere',
+                price=None if i % 5 == 0 else Decimal(100 + i % 7),
+                location='Brasov',
+                views=i % 3,
+                user=self.user,
+                category=self.category,
+                status='active'
+            )
+        # Force ties on created_at so the id tie-breaker matters
+        Listing.objects.filter(pk__lte=Listing.objects.order_by('pk')[10].pk).update(created_at=timezone.now())
+
+    def walk(self, queryset, per_page=7):
+        paginator = KeysetPaginator(queryset, per_page)
+        page = paginator.page()
+        seen = list(page)
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            seen.extend(page)
+        return seen
+
+    def test_walk_matches_full_ordering(self):
+        for ordering in (('-created_at',), ('price',), ('-price',), ('views',), ('-views', 'price')):
+            queryset = Listing.objects.order_by(*ordering)
+            paginator = KeysetPaginator(queryset, 7)
+            expected = list(Listing.objects.order_by(*paginator._order_by(reverse=False)))
+            self.assertEqual(self.walk(queryset), expected, ordering)
+            self.assertEqual(len(set(listing.pk for listing in expected)), 25)
+
+    def test_previous_page(self):
+        paginator = KeysetPaginator(Listing.objects.order_by('price'), 7)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertFalse(first.has_previous())
+        self.assertEqual(list(paginator.page(third.previous_cursor)), list(second))
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_no_offset_queries(self):
+        paginator = KeysetPaginator(Listing.objects.all(), 7)
+        cursor = paginator.page().next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            list(paginator.page(cursor))
+        self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Listing.objects.all(), 7)
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+        with self.assertRaises(InvalidCursor):
+            paginator.page(encode_cursor(['yesterday', 1]))
+        page = paginator.get_page(QueryDict('cursor=garbage&sort=price'))
+        self.assertEqual(len(page), 7)
+        self.assertIn('sort=price', page.next_querystring)
+        self.assertIn('cursor=', page.next_querystring)
+
+    def test_unsupported_ordering_falls_back(self):
+        paginator = KeysetPaginator(Listing.objects.order_by('category__name'), 7)
+        self.assertEqual(paginator.ordering, ('-created_at', '-id'))
+
+    def test_count_is_cached(self):
+        queryset = Listing.objects.filter(status='active')
+        self.assertEqual(cached_count(queryset), 25)
+        # Bulk updates send no signals, so the cached count stays
+        Listing.objects.filter(pk=Listing.objects.first().pk).update(status='sold')
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_count(queryset), 25)
+        self.assertEqual(cached_count(queryset.filter(views=0)), 8)
+
+        # Listing writes invalidate it
+        Listing.objects.filter(status='active').first().delete()
+        self.assertEqual(cached_count(queryset), 23)
+
+    def test_api_cursor_pagination(self):
+        response = self.client.get('/api/listings/', {'page_size': 10, 'ordering': 'price'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 25)
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNone(data['previous'])
+
+        ids = [item['id'] for item in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            ids.extend(item['id'] for item in data['results'])
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+        self.assertEqual(self.client.get('/api/listings/', {'cursor': 'bad'}).status_code, 404)
+
+    def test_cached_pages_are_invalidated_by_writes(self):
+        queryset = Listing.objects.filter(status='active').order_by('price')
+        first = list(KeysetPaginator(queryset, 7, cache_pages=True).page())
+        with CaptureQueriesContext(connection) as queries:
+            cached = list(KeysetPaginator(queryset, 7, cache_pages=True).page())
+        self.assertEqual(cached, first)
+        self.assertIn('IN', queries[0]['sql'].upper())
+        self.assertNotIn('ORDER BY', queries[0]['sql'].upper())
+
+        # Bumping the view counter keeps the cached page
+        generation = get_generation(CACHE_PREFIX_SEARCH)
+        first[0].views += 1
+        first[0].save(update_fields=['views'])
+        self.assertEqual(get_generation(CACHE_PREFIX_SEARCH), generation)
+        with CaptureQueriesContext(connection) as queries:
+            list(KeysetPaginator(queryset, 7, cache_pages=True).page())
+        self.assertNotIn('ORDER BY', queries[0]['sql'].upper())
+
+        first[0].delete()
+        self.assertEqual(get_generation(CACHE_PREFIX_SEARCH), generation + 1)
+        refreshed = list(KeysetPaginator(queryset, 7, cache_pages=True).page())
+        self.assertNotIn(first[0], refreshed)
+        self.assertEqual(len(refreshed), 7)
+
+        first[1].status = 'sold'
+        first[1].save()
+        self.assertNotIn(first[1], list(KeysetPaginator(queryset, 7, cache_pages=True).page()))
+
+    def test_api_viewset_returns_queryset(self):
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from marketplace.views import ListingViewSet
+
+        view = ListingViewSet()
+        view.request = Request(APIRequestFactory().get('/', {'city': 'Brasov'}))
+        queryset = view.get_queryset()
+        self.assertTrue(hasattr(queryset, 'query'))
+        self.assertEqual(queryset.count(), 25)
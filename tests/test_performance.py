@@ -108,6 +108,75 @@ class PerformanceTestCase(TransactionTestCase):
         load_time = end_time - start_time
         self.assertLess(load_time, 0.5, f"Geospatial search took {load_time}s")
     
+    def test_facet_performance(self):
+        """Test facet counts stay within their latency target"""
+        from marketplace.search.facets import FACET_LATENCY_TARGET, compute_facets
+        
+        queryset = Listing.objects.filter(status='active')
+        start_time = time.time()
+        with self.assertNumQueries(1):
+            facets = compute_facets(queryset)
+        load_time = time.time() - start_time
+        
+        self.assertEqual(sum(facet['count'] for facet in facets['categories']), 100)
+        self.assertLess(load_time, FACET_LATENCY_TARGET, f"Facet computation took {load_time}s")
+        
+        start_time = time.time()
+        response = self.client.get('/api/listings/', {'facets': 'true'})
+        load_time = time.time() - start_time
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('facets', response.json())
+        self.assertLess(load_time, 0.5, f"Faceted listing API took {load_time}s")
+    
+    def test_suggest_performance(self):
+        """Test typeahead lookups stay within their latency target"""
+        from marketplace.search.suggest import SUGGEST_LATENCY_TARGET, SuggestIndex
+        
+        index = SuggestIndex()
+        index.rebuild()
+        for prefix in ('t', 'te', 'test', 'bucuresti'):
+            start_time = time.perf_counter()
+            index.suggest(prefix)
+            load_time = time.perf_counter() - start_time
+            self.assertLess(load_time, SUGGEST_LATENCY_TARGET, f"Suggest lookup took {load_time}s")
+        
+        self.client.get('/api/suggest', {'q': 'te'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/suggest', {'q': 'tes'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'])
+    
+    def test_item_neighbours_performance(self):
+        """Test item-item similarities scale to large interaction counts"""
+        import numpy as np
+        from marketplace.recommendations.services.collaborative_filtering import (
+            SCORE_LATENCY_TARGET,
+            ItemSimilarityModel,
+        )
+        from marketplace.recommendations.services.sparse import CSRMatrix, item_neighbours
+        
+        rng = np.random.default_rng(0)
+        users = rng.integers(0, 20000, 200000)
+        items = rng.zipf(1.5, 200000) % 10000
+        user_items = CSRMatrix.from_coo(users, items, np.ones(len(users)), (20000, 10000))
+        
+        start_time = time.perf_counter()
+        neighbours = item_neighbours(user_items, k=50)
+        self.assertLess(time.perf_counter() - start_time, 5.0)
+        
+        model = ItemSimilarityModel(np.arange(20000), np.arange(10000), user_items,
+                                    np.bincount(items, minlength=10000))
+        start_time = time.perf_counter()
+        scores = model.score(rng.integers(0, 10000, 100))
+        self.assertLess(time.perf_counter() - start_time, SCORE_LATENCY_TARGET)
+        self.assertTrue(scores)
+        
+        start_time = time.perf_counter()
+        model.apply([(int(user), int(item), 1.0) for user, item in zip(rng.integers(0, 20000, 100),
+                                                                        rng.integers(0, 10000, 100))])
+        self.assertLess(time.perf_counter() - start_time, 1.0)
+    
     def test_concurrent_requests(self):
         """Test handling of concurrent requests"""
         import threading
@@ -0,0 +1,92 @@
+"""
+Tests for the on-demand request profiler
+"""
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import TestCase, override_settings
+from django.urls import path
+from piata_ro import profiling
+from piata_ro.profiling import StackSampler, fold_stack
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def slow_view(request):
+    busy_loop(0.05)
+    return JsonResponse({'ok': True})
+
+
+urlpatterns = [
+    path('slow/', slow_view, name='slow'),
+    path('monitoring/profile/', profiling.profile_view, name='monitoring_profile'),
+]
+
+
+class StackSamplerTestCase(TestCase):
+    def test_samples_only_the_started_thread(self):
+        sampler = StackSampler(interval=0.001)
+        sampler.start(threading.get_ident())
+        busy_loop(0.05)
+        counts = sampler.stop(threading.get_ident())
+        self.assertGreater(sum(counts.values()), 2)
+        self.assertTrue(any(stack.endswith('tests.test_profiling.busy_loop') for stack in counts))
+        self.assertEqual(sampler.stop(threading.get_ident()), {})
+
+    def test_stacks_are_folded_outermost_first(self):
+        stack = fold_stack(__import__('sys')._getframe())
+        self.assertTrue(stack.endswith('StackSamplerTestCase.test_stacks_are_folded_outermost_first'))
+        self.assertIn(';', stack)
+
+
+@override_settings(ROOT_URLCONF='tests.test_profiling')
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiling.disable()
+        profiling.profiles.clear()
+        self.staff = User.objects.create_user('admin', 'admin@example.com', 'testpass123', is_staff=True)
+        self.user = User.objects.create_user('user', 'user@example.com', 'testpass123')
+
+    def test_header_profiles_a_single_request_for_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/slow/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Samples', response)
+        self.assertEqual(profiling.profiles.summary(), {})
+        self.assertEqual(self.client.get('/monitoring/profile/').status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/slow/', HTTP_X_PROFILE='1')
+        self.assertGreater(int(response['X-Profile-Samples']), 0)
+        summary = self.client.get('/monitoring/profile/').json()['views']
+        self.assertEqual(summary['slow']['requests'], 1)
+
+        folded = self.client.get('/monitoring/profile/', {'view': 'slow', 'format': 'folded'})
+        self.assertEqual(folded['Content-Type'], 'text/plain')
+        lines = folded.content.decode().splitlines()
+        self.assertTrue(any('tests.test_profiling.slow_view;tests.test_profiling.busy_loop ' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+    def test_staff_turn_on_sampling_for_a_fraction_of_requests(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/monitoring/profile/', {'rate': '1', 'seconds': '60'})
+        # The test settings keep a per-process LocMemCache
+        self.assertEqual(response.json(), {'rate': 1.0, 'seconds': 60, 'all_processes': False})
+        self.assertEqual(self.client.post('/monitoring/profile/', {'rate': '2'}).status_code, 400)
+
+        self.client.logout()
+        self.client.get('/slow/')
+        self.assertEqual(profiling.profiles.summary()['slow']['requests'], 1)
+
+        self.client.force_login(self.staff)
+        self.client.post('/monitoring/profile/', {'rate': '0'})
+        self.client.delete('/monitoring/profile/')
+        self.client.get('/slow/')
+        self.assertEqual(profiling.profiles.summary(), {})
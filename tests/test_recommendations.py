@@ -0,0 +1,536 @@
+"""
+Tests for listing recommendations
+"""
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from marketplace.models import Category, Favorite, InteractionEvent, Listing, RecommendationList
+from marketplace.recommendations import evaluation
+from marketplace.recommendations.data.events import VIEW, collector
+from marketplace.recommendations.services import RECOMMENDERS, CollaborativeFilteringRecommender
+from marketplace.recommendations.services import precomputed
+from marketplace.recommendations.services.collaborative_filtering import ItemSimilarityModel, recommender
+from marketplace.recommendations.services.content_based import (
+    SIMILAR_REBUILD_INTERVAL,
+    TOP_SIMILAR,
+    SimilarListingsIndex,
+    content_recommender,
+)
+from marketplace.recommendations.services.sparse import CSRMatrix, item_neighbours, row_blocks
+from marketplace.utils.scratch_database import SCRATCH_ALIAS
+
+
+def dense_cosine(matrix):
+    norms = np.linalg.norm(matrix, axis=0)
+    similarity = (matrix.T @ matrix) / np.outer(norms, norms)
+    np.fill_diagonal(similarity, 0)
+    return similarity
+
+
+class ItemNeighboursTestCase(TestCase):
+    def random_interactions(self, users=60, items=40, density=0.15, seed=0):
+        rng = np.random.default_rng(seed)
+        matrix = (rng.random((users, items)) < density).astype(np.float64)
+        matrix[:, matrix.sum(axis=0) == 0] = 0
+        rows, cols = np.nonzero(matrix)
+        return matrix, CSRMatrix.from_coo(rows, cols, matrix[rows, cols], matrix.shape)
+
+    def test_matches_dense_cosine(self):
+        matrix, user_items = self.random_interactions()
+        expected = dense_cosine(matrix)
+        neighbours = item_neighbours(user_items, k=5)
+        for item in range(matrix.shape[1]):
+            cols, scores = neighbours.row(item)
+            self.assertLessEqual(len(cols), 5)
+            np.testing.assert_allclose(scores, expected[item, cols], rtol=1e-5)
+            if len(cols):
+                self.assertAlmostEqual(float(scores[0]), expected[item].max(), places=5)
+                self.assertNotIn(item, cols)
+
+    def test_blocks_do_not_change_result(self):
+        _, user_items = self.random_interactions(seed=1)
+        whole = item_neighbours(user_items, k=10)
+        blockwise = item_neighbours(user_items, k=10, pair_budget=50)
+        np.testing.assert_array_equal(whole.indptr, blockwise.indptr)
+        np.testing.assert_allclose(whole.data, blockwise.data, rtol=1e-6)
+
+    def test_transpose(self):
+        matrix, user_items = self.random_interactions(users=7, items=5, density=0.5)
+        transposed = user_items.transpose()
+        self.assertEqual(transposed.shape, (5, 7))
+        for item in range(5):
+            cols, _ = transposed.row(item)
+            self.assertEqual(sorted(cols.tolist()), np.flatnonzero(matrix[:, item]).tolist())
+
+
+class CollaborativeFilteringTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Electronice', slug='electronice')
+        self.phone, self.case, self.charger, self.sofa, self.sold = [
+            Listing.objects.create(
+                title=title, description='Descriere', price=Decimal('100.00'), location='Cluj',
+                user=self.seller, category=self.category, status=status
+            )
+            for title, status in [
+                ('Telefon', 'active'), ('Husă telefon', 'active'), ('Încărcător', 'active'),
+                ('Canapea', 'active'), ('Telefon vândut', 'sold'),
+            ]
+        ]
+        self.buyers = [User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'pass') for n in range(4)]
+        for buyer in self.buyers[:3]:
+            self.favorite(buyer, self.phone, self.case)
+        self.favorite(self.buyers[0], self.charger)
+        self.favorite(self.buyers[3], self.sofa, self.sold)
+        self.recommender = CollaborativeFilteringRecommender()
+
+    def favorite(self, user, *listings):
+        for listing in listings:
+            Favorite.objects.create(user=user, listing=listing)
+
+    def test_train_streams_favorites_in_one_query(self):
+        # The first training also reads the stored views and contacts, and where they end
+        with self.assertNumQueries(3):
+            self.recommender.train_model()
+        with self.assertNumQueries(1):
+            self.recommender.train_model()
+        self.assertEqual(len(self.recommender.model), 4)
+
+    def test_similar_items(self):
+        similar = self.recommender.similar_items(self.phone.pk)
+        self.assertEqual([item['id'] for item in similar], [self.case.pk, self.charger.pk])
+        self.assertAlmostEqual(similar[0]['score'], 1.0)
+        self.assertEqual(self.recommender.similar_items(self.sold.pk), [])
+
+    def test_recommend_for_user(self):
+        newcomer = User.objects.create_user('newcomer', 'new@example.com', 'pass')
+        self.favorite(newcomer, self.case)
+        self.recommender.train_model()
+        recommended = [item['id'] for item in self.recommender.recommend_for_user(newcomer)]
+        self.assertEqual(recommended[0], self.phone.pk)
+        self.assertNotIn(self.case.pk, recommended)
+        self.assertNotIn(self.sofa.pk, recommended)
+
+    def test_cold_start_falls_back_to_popular(self):
+        newcomer = User.objects.create_user('newcomer', 'new@example.com', 'pass')
+        recommended = [item['id'] for item in self.recommender.recommend_for_user(newcomer, limit=2)]
+        self.assertEqual(set(recommended), {self.phone.pk, self.case.pk})
+
+    def test_views(self):
+        recommender.train_model()
+        content_recommender.train_model()
+        response = self.client.get(f'/recommendations/similar/{self.phone.pk}/', {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()], [self.case.pk])
+
+        response = self.client.get(f'/recommendations/recommendations/{self.buyers[3].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/recommendations/recommendations/999999/').status_code, 404)
+
+
+class OnlineUpdatesTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.listings = [
+            Listing.objects.create(
+                title=f'Anunț {n}', description='Descriere', price=Decimal('10.00'), location='Iași',
+                user=self.seller, category=self.category, status='active'
+            )
+            for n in range(12)
+        ]
+        self.users = [User.objects.create_user(f'user{n}', f'user{n}@example.com', 'pass') for n in range(10)]
+        rng = np.random.default_rng(3)
+        for user in self.users:
+            for listing in rng.choice(self.listings[:8], 3, replace=False):
+                Favorite.objects.create(user=user, listing=listing)
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        recommender._interactions.clear()
+        recommender._seeded = False
+        recommender.train_model()
+        self.model = recommender.model
+
+    def assert_matches_retrain(self, listing_ids):
+        retrained = ItemSimilarityModel.train(recommender._interactions.copy())
+        for listing_id in listing_ids:
+            online = self.model.similar(listing_id)
+            expected = retrained.similar(listing_id)
+            self.assertEqual(set(online), set(expected))
+            for pk, score in expected.items():
+                self.assertAlmostEqual(online[pk], score, places=5)
+
+    def test_new_favorites_update_touched_lists(self):
+        user = self.users[0]
+        new_listing = self.listings[10]
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=user, listing=new_listing)
+            Favorite.objects.create(user=self.users[1], listing=new_listing)
+        collector.flush()
+        changed = recommender.apply_pending(block=True)
+
+        self.assertIs(recommender.model, self.model)
+        self.assertTrue(self.model.similar(new_listing.pk))
+        touched = {new_listing.pk} | set(
+            Favorite.objects.filter(user__in=self.users[:2]).values_list('listing_id', flat=True)
+        )
+        self.assertEqual(set(changed), touched)
+        self.assert_matches_retrain(touched)
+        # Applied once
+        self.assertEqual(recommender.apply_pending(block=True), [])
+
+    def test_removed_favorites(self):
+        favorite = Favorite.objects.filter(user=self.users[0]).first()
+        listing_id = favorite.listing_id
+        others = list(Favorite.objects.filter(user=self.users[0]).exclude(pk=favorite.pk)
+                      .values_list('listing_id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite.delete()
+        collector.flush()
+        recommender.apply_pending(block=True)
+        self.assert_matches_retrain([listing_id] + others)
+
+    def test_views_count_as_weaker_interactions(self):
+        viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=viewer, listing=self.listings[11])
+        collector.record(VIEW, self.listings[9].pk, user_id=viewer.pk)
+        collector.flush()
+        recommender.apply_pending(block=True)
+        self.assertAlmostEqual(self.model.similar(self.listings[11].pk)[self.listings[9].pk], 0.5 / np.sqrt(0.25))
+
+        # Compaction keeps the view
+        recommender.train_model()
+        self.assertIn(self.listings[9].pk, recommender.model.similar(self.listings[11].pk))
+
+    def test_applying_never_waits_for_the_model_lock(self):
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with recommender._lock:
+                locked.set()
+                release.wait(5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.users[0], listing=self.listings[11])
+        collector.flush()
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        locked.wait(5)
+        try:
+            self.assertEqual(recommender.apply_pending(), [])
+        finally:
+            release.set()
+            holder.join()
+        self.assertIn(self.listings[11].pk, recommender.apply_pending(block=True))
+
+    def test_favorites_are_polled_from_sinks_without_read_back(self):
+        # Bypass the signals, as with a sink the events cannot be read back from
+        Favorite.objects.bulk_create([Favorite(user=self.users[2], listing=self.listings[10])])
+        with patch.object(collector, 'since', return_value=None):
+            recommender.apply_pending(block=True)
+        self.assertIn(self.listings[10].pk, self.model.similar(Favorite.objects.filter(
+            user=self.users[2]).exclude(listing=self.listings[10]).first().listing_id))
+
+
+class PrecomputedRecommendationsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.listings = [
+            Listing.objects.create(
+                title=f'Anunț {n}', description='Descriere', price=Decimal('10.00'), location='Iași',
+                user=self.seller, category=self.category, status='active'
+            )
+            for n in range(10)
+        ]
+        self.users = [User.objects.create_user(f'user{n}', f'user{n}@example.com', 'pass') for n in range(12)]
+        rng = np.random.default_rng(5)
+        for user in self.users:
+            for listing in rng.choice(self.listings, 3, replace=False):
+                Favorite.objects.create(user=user, listing=listing)
+        collector.flush()
+        recommender._interactions.clear()
+        recommender._seeded = False
+
+    def stored_ids(self, user):
+        entries = RecommendationList.objects.get(user=user).entries
+        return list(precomputed.unpack(entries))
+
+    def test_pack_keeps_the_best_scores(self):
+        entries = precomputed.pack({1: 0.5, 2: 2.0, 3: 1.0, 4: 3.0}, size=2, exclude=[4])
+        self.assertEqual(len(entries), 2 * precomputed.ENTRY_DTYPE.itemsize)
+        self.assertEqual(precomputed.unpack(entries), {2: 2.0, 3: 1.0})
+        # Listing pks are 64-bit
+        self.assertEqual(precomputed.unpack(precomputed.pack({2 ** 40: 1.0})), {2 ** 40: 1.0})
+
+    def test_precompute_matches_live_recommendations(self):
+        self.assertEqual(precomputed.precompute_all(workers=1), len(self.users))
+        for user in self.users:
+            live = [item['id'] for item in recommender.recommend_for_user(user, limit=precomputed.LIST_SIZE)]
+            self.assertEqual(self.stored_ids(user), live)
+
+        serial = {row.user_id: bytes(row.entries) for row in RecommendationList.objects.all()}
+        precomputed.precompute_all(workers=2)
+        parallel = {row.user_id: bytes(row.entries) for row in RecommendationList.objects.all()}
+        self.assertEqual(parallel, serial)
+
+    def test_serving_drops_inactive_listings_and_falls_back_to_popular(self):
+        user = self.users[0]
+        call_command('precompute_recommendations', workers=1, stdout=StringIO())
+        best = self.stored_ids(user)[0]
+        Listing.objects.filter(pk=best).update(status='sold')
+        with self.assertNumQueries(2):
+            served = [item['id'] for item in precomputed.recommend_for_user(user.pk, limit=3)]
+        self.assertEqual(served, [pk for pk in self.stored_ids(user) if pk != best][:3])
+
+        newcomer = User.objects.create_user('newcomer', 'new@example.com', 'pass')
+        response = self.client.get(f'/recommendations/recommendations/{newcomer.pk}/', {'limit': 3})
+        popular = [pk for pk, _ in sorted(precomputed.popular_scores().items(), key=lambda item: -item[1])]
+        self.assertEqual([item['id'] for item in response.json()], popular[:3])
+        self.assertNotIn(best, popular)
+
+    def test_lists_of_users_without_favorites_are_removed(self):
+        precomputed.precompute_all(workers=1)
+        Favorite.objects.filter(user=self.users[0]).delete()
+        precomputed.precompute_all(workers=1)
+        self.assertFalse(RecommendationList.objects.filter(user=self.users[0]).exists())
+
+    def test_new_favorites_reach_the_stored_lists_without_a_full_run(self):
+        self.enterContext(patch.object(collector, 'background', False))
+        precomputed.precompute_all(workers=1)
+        user = self.users[0]
+        before = {row.user_id: bytes(row.entries) for row in RecommendationList.objects.all()}
+        listing = next(listing for listing in self.listings
+                       if not Favorite.objects.filter(user=user, listing=listing).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=user, listing=listing)
+        collector.flush()
+
+        self.assertGreater(precomputed.precompute_changed(), 0)
+        self.assertNotEqual(bytes(RecommendationList.objects.get(user=user).entries), before[user.pk])
+        live = [item['id'] for item in recommender.recommend_for_user(user, limit=precomputed.LIST_SIZE)]
+        self.assertEqual(self.stored_ids(user), live)
+        self.assertEqual(precomputed.precompute_changed(), 0)
+
+
+class SimilarListingsTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.phones = Category.objects.create(name='Telefoane', slug='telefoane')
+        self.furniture = Category.objects.create(name='Mobilă', slug='mobila')
+        self.iphone = self.create_listing('iPhone 13 Pro 128GB', 'Telefon Apple, baterie 90%', '3000', self.phones, 'Cluj')
+        self.iphone_cheap = self.create_listing('iPhone 12 Apple', 'Telefon Apple folosit, ecran spart', '900', self.phones, 'Iași')
+        self.iphone_close = self.create_listing('iPhone 13 Apple', 'Telefon Apple ca nou', '2800', self.phones, 'Cluj')
+        self.samsung = self.create_listing('Samsung Galaxy S21', 'Telefon Android', '2000', self.phones, 'Cluj')
+        self.sofa = self.create_listing('Canapea extensibilă', 'Canapea Apple de sufragerie', '1500', self.furniture, 'Cluj')
+        content_recommender.train_model()
+
+    def create_listing(self, title, description, price, category, city):
+        return Listing.objects.create(
+            title=title, description=description, price=Decimal(price), location=city, city=city,
+            user=self.seller, category=category, status='active'
+        )
+
+    def similar_ids(self, listing):
+        return [item['id'] for item in content_recommender.similar_items(listing.pk, limit=TOP_SIMILAR)]
+
+    def test_ranks_text_category_price_and_region(self):
+        scores = content_recommender.similar_scores(self.iphone.pk)
+        similar = self.similar_ids(self.iphone)
+        self.assertEqual(similar[0], self.iphone_close.pk)
+        self.assertNotIn(self.iphone.pk, similar)
+        # Same category, nearby price and same city outweigh a closer title
+        self.assertGreater(scores[self.samsung.pk], scores[self.iphone_cheap.pk])
+        self.assertGreater(scores[self.iphone_cheap.pk], scores[self.sofa.pk])
+
+    def test_changed_listings_are_rescored_without_rebuild(self):
+        index = content_recommender.index
+        watch = self.create_listing('iPhone 13 Pro Max', 'Telefon Apple 256GB', '3100', self.phones, 'Cluj')
+        self.assertIn(watch.pk, self.similar_ids(self.iphone))
+        self.assertEqual(self.similar_ids(watch)[0], self.iphone.pk)
+
+        self.iphone_close.status = 'sold'
+        self.iphone_close.save()
+        self.assertNotIn(self.iphone_close.pk, self.similar_ids(self.iphone))
+        self.assertEqual(self.similar_ids(self.iphone_close), [])
+
+        self.sofa.title = 'iPhone 13 Pro'
+        self.sofa.description = 'Telefon Apple 128GB'
+        self.sofa.category = self.phones
+        self.sofa.save()
+        self.assertIn(self.sofa.pk, self.similar_ids(self.iphone)[:2])
+        self.assertIs(content_recommender.index, index)
+
+    def test_deleted_listings_disappear(self):
+        pk = self.iphone_close.pk
+        self.iphone_close.delete()
+        self.assertNotIn(pk, content_recommender.similar_scores(self.iphone.pk))
+
+    def test_parallel_build_matches_serial(self):
+        for number in range(40):
+            self.create_listing(f'Telefon model {number % 7}', f'Descriere {number % 5} telefon', str(100 + number),
+                                self.phones, 'Cluj')
+        serial = SimilarListingsIndex.build(workers=1)
+        with patch('marketplace.recommendations.services.sparse.PAIR_BUDGET', 200), \
+                patch('marketplace.recommendations.services.content_based.row_blocks',
+                      lambda rows, features: row_blocks(rows, features, 200)):
+            parallel = SimilarListingsIndex.build(workers=2)
+        for pk in serial.item_pks.tolist():
+            self.assertEqual(serial.similar(pk).keys(), parallel.similar(pk).keys())
+
+    def test_stale_index_is_rebuilt_off_the_request_thread(self):
+        release = threading.Event()
+        builds = []
+
+        def build():
+            builds.append(threading.current_thread().name)
+            release.wait(5)
+
+        index = content_recommender.index
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(content_recommender._builder, 'func', build), \
+                patch.object(content_recommender, 'built_at', content_recommender.built_at - SIMILAR_REBUILD_INTERVAL - 1):
+            # The old index keeps answering while the rebuild runs
+            self.assertEqual(self.similar_ids(self.iphone)[0], self.iphone_close.pk)
+            self.assertEqual(self.similar_ids(self.iphone)[0], self.iphone_close.pk)
+            release.set()
+            content_recommender._builder.join(5)
+            with patch.object(content_recommender, 'index', None):
+                # Before the first build the detail page falls back to the newest of the category
+                self.assertEqual(content_recommender.similar_listings(self.iphone, limit=1), [self.samsung])
+            content_recommender._builder.join(5)
+        self.assertIs(content_recommender.index, index)
+        self.assertEqual(builds, ['similar-listings-build'] * 2)
+
+    def test_changed_listings_are_rescored_off_the_request_thread(self):
+        release = threading.Event()
+        refreshes = []
+
+        def refresh():
+            refreshes.append(threading.current_thread().name)
+            release.wait(5)
+
+        watch = self.create_listing('iPhone 13 Pro Max', 'Telefon Apple 256GB', '3100', self.phones, 'Cluj')
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(content_recommender._refresher, 'func', refresh):
+            # The current index keeps answering while the refresh runs
+            self.assertNotIn(watch.pk, self.similar_ids(self.iphone))
+            self.assertNotIn(watch.pk, self.similar_ids(self.iphone))
+            release.set()
+            content_recommender._refresher.join(5)
+        self.assertEqual(refreshes, ['similar-listings-refresh'])
+        self.assertIn(watch.pk, self.similar_ids(self.iphone))
+
+    def test_detail_page_context(self):
+        similar = content_recommender.similar_listings(self.iphone, limit=4)
+        self.assertEqual(similar[0], self.iphone_close)
+        self.assertCountEqual(similar, [self.iphone_close, self.iphone_cheap, self.samsung, self.sofa])
+
+        lonely = self.create_listing('Zzz', 'Xyz', '10', self.furniture, 'Cluj')
+        self.assertEqual(content_recommender.similar_listings(lonely, limit=2), [self.sofa])
+
+
+class EvaluationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        collector.flush()
+        # Every run creates and drops its own scratch database
+        self.enterContext(patch.object(type(self), 'databases', {'default', SCRATCH_ALIAS}))
+        seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        category = Category.objects.create(name='Diverse', slug='diverse')
+        self.listing = Listing.objects.create(
+            title='Anunț existent', description='Descriere', price=Decimal('10.00'), location='Iași',
+            user=seller, category=category, status='active'
+        )
+        Favorite.objects.create(user=seller, listing=self.listing)
+
+    def test_time_split_holds_out_the_newest_favorites_of_known_users(self):
+        start = timezone.now()
+        favorites = [
+            (1, 10, start), (1, 11, start + timedelta(days=1)), (2, 10, start + timedelta(days=2)),
+            (1, 12, start + timedelta(days=3)), (3, 12, start + timedelta(days=4)),
+        ]
+        split = evaluation.time_split(favorites, test_fraction=0.4)
+        self.assertEqual(split.cutoff, start + timedelta(days=3))
+        self.assertEqual(len(split.train), 3)
+        # User 3 has no training history and cannot be evaluated
+        self.assertEqual(split.held_out, {1: {12}})
+
+    def test_every_recommender_is_evaluated_and_nothing_is_kept(self):
+        self.assertEqual(set(RECOMMENDERS), {'collaborative', 'content', 'popular'})
+        counts = (User.objects.count(), Listing.objects.count(), Favorite.objects.count(),
+                  InteractionEvent.objects.count())
+        listeners = list(collector._listeners)
+        dataset = evaluation.generate_dataset(users=120, listings=60, topics=6, seed=1)
+        results = evaluation.run_evaluation(dataset, k=5, max_users=50)
+
+        self.assertEqual([result.name for result in results], list(RECOMMENDERS))
+        for result in results:
+            self.assertGreater(result.users, 0)
+            self.assertLessEqual(result.users, 50)
+            for metric in (result.precision, result.recall, result.coverage):
+                self.assertGreaterEqual(metric, 0)
+                self.assertLessEqual(metric, 1)
+            self.assertGreater(result.peak_memory, 0)
+            self.assertLessEqual(result.recommend_latency[50], result.recommend_latency[99])
+        by_name = {result.name: result for result in results}
+        # Users stick to their topics, so item-item similarity beats raw popularity
+        self.assertGreater(by_name['collaborative'].recall, by_name['popular'].recall)
+
+        self.assertEqual((User.objects.count(), Listing.objects.count(), Favorite.objects.count(),
+                          InteractionEvent.objects.count()), counts)
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).status, 'active')
+        self.assertEqual(collector._listeners, listeners)
+
+    def test_live_favorites_are_evaluated_in_a_copy(self):
+        buyers = [User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'pass') for n in range(4)]
+        others = [
+            Listing.objects.create(
+                title=f'Anunț {n}', description='Descriere', price=Decimal('10.00'), location='Iași',
+                user=self.listing.user, category=self.listing.category, status='active'
+            )
+            for n in range(3)
+        ]
+        start = timezone.now() - timedelta(days=10)
+        for day, (buyer, listing) in enumerate([(0, 0), (1, 0), (0, 1), (1, 1), (2, 0), (2, 1), (0, 2), (1, 2)]):
+            favorite = Favorite.objects.create(user=buyers[buyer], listing=others[listing])
+            Favorite.objects.filter(pk=favorite.pk).update(created_at=start + timedelta(days=day))
+        dataset = evaluation.load_database()
+        self.assertEqual(dataset.descriptions[others[0].pk], 'Descriere')
+
+        favorites = Favorite.objects.count()
+        results = evaluation.run_evaluation(dataset, ['collaborative'], k=2, test_fraction=0.25)
+        self.assertEqual(results[0].users, 2)
+        # Held out favorites are left alone
+        self.assertEqual(Favorite.objects.count(), favorites)
+
+    def test_unknown_recommender(self):
+        with self.assertRaises(ValueError):
+            evaluation.run_evaluation(evaluation.generate_dataset(users=5, listings=5), ['missing'])
+
+    def test_command_reads_csv(self):
+        start = timezone.now() - timedelta(days=10)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write('user,listing,timestamp\n')
+            for day, (user, listing) in enumerate([(1, 1), (2, 1), (1, 2), (2, 2), (3, 1), (3, 2), (1, 3), (2, 3)]):
+                source.write(f'{user},{listing},{(start + timedelta(days=day)).isoformat()}\n')
+        self.addCleanup(os.remove, source.name)
+        out = StringIO()
+        call_command('evaluate_recommenders', '--source', 'csv', '--file', source.name, '--k', '2',
+                     '--recommenders', 'collaborative', 'popular', stdout=out)
+        self.assertIn('Evaluated 2 recommenders on 2 test users', out.getvalue())
+        self.assertEqual(Listing.objects.filter(status='active').count(), 1)
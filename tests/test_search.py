@@ -0,0 +1,498 @@
+"""
+Tests for listing full-text search
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+from marketplace.location_services import LocationService
+from marketplace.models import Category, Listing, SearchTermCount
+from marketplace.search import get_search_backend, search_listings, parse_query
+from marketplace.search.base_backend import ORMSearchBackend
+from marketplace.search.postgres_backend import PostgresFTSBackend
+from marketplace.search.facets import compute_facets, get_facets
+from marketplace.search.popular import (
+    KIND_LISTING,
+    SearchTermTracker,
+    SpaceSaving,
+    listing_searches,
+    location_searches,
+)
+from marketplace.search.suggest import (
+    SUGGEST_REBUILD_INTERVAL,
+    SUGGEST_RETRY_INTERVAL,
+    SuggestIndex,
+    get_suggestions,
+    suggest_index,
+)
+from marketplace.services.location_analytics import LocationAnalytics
+from marketplace.utils.background import BackgroundJob
+from marketplace.utils.cache_utils import SearchCache
+from marketplace.utils.text import fold_text, folded_prefix_q
+from marketplace.views.search import search as search_view
+
+
+class SearchBackendTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Electronice', slug='electronice')
+        self.phone = Listing.objects.create(
+            title='iPhone 13 Pro',
+            description='Telefon in stare foarte buna',
+            price=Decimal('3000.00'),
+            location='București',
+            user=self.user,
+            category=self.category,
+            status='active'
+        )
+        self.laptop = Listing.objects.create(
+            title='Laptop Lenovo',
+            description='Vand laptop, merge perfect, nu e iPhone',
+            price=Decimal('2500.00'),
+            location='Cluj-Napoca',
+            user=self.user,
+            category=self.category,
+            status='active'
+        )
+
+    def search(self, query):
+        return list(search_listings(Listing.objects.all(), query).order_by('-search_rank'))
+
+    def test_parse_query_drops_operators(self):
+        self.assertEqual(parse_query('iPhone OR "laptop" -(x)'), ['iphone', 'or', 'laptop', 'x'])
+        self.assertEqual(parse_query(''), [])
+
+    def test_title_matches_rank_first(self):
+        results = self.search('iphone')
+        self.assertEqual(results, [self.phone, self.laptop])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('laptop cluj'), [self.laptop])
+        self.assertEqual(self.search('laptop timisoara'), [])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search('lapt'), [self.laptop])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.laptop.title = 'Monitor Dell'
+        self.laptop.description = 'Monitor 27 inch'
+        self.laptop.save()
+        self.assertEqual(self.search('lenovo'), [])
+        self.assertEqual(self.search('monitor'), [self.laptop])
+
+        self.phone.delete()
+        self.assertEqual(self.search('iphone'), [])
+
+    def test_rebuild(self):
+        Listing.objects.filter(pk=self.phone.pk).update(title='Samsung Galaxy')
+        self.assertEqual(self.search('samsung'), [])
+        get_search_backend().rebuild()
+        self.assertEqual(self.search('samsung'), [self.phone])
+
+    def test_api_search(self):
+        response = self.client.get('/api/listings/', {'search': 'iphone'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([item['id'] for item in results], [self.phone.pk, self.laptop.pk])
+
+
+class RecordingConnection:
+    """Stands in for a PostgreSQL connection, recording the statements run on it"""
+    alias = 'default'
+
+    def __init__(self):
+        self.statements = []
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, [list(params)]))
+
+    def executemany(self, sql, param_list):
+        self.statements.append((sql, [list(params) for params in param_list]))
+
+
+class FoldedSearchKeysTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Mașini', slug='masini')
+        self.listing = Listing.objects.create(
+            title='Dacia  Logan Ușor Folosită',
+            description='Mașină în stare bună',
+            price=Decimal('15000.00'),
+            location='București, Sector 3',
+            city='București',
+            county='Ilfov',
+            latitude=Decimal('44.4268000'),
+            longitude=Decimal('26.1025000'),
+            user=self.user,
+            category=self.category,
+            status='active'
+        )
+
+    def test_fold_text(self):
+        self.assertEqual(fold_text('  Târgu   MUREȘ '), 'targu mures')
+        self.assertEqual(fold_text('Ștefănești'), 'stefanesti')
+        self.assertEqual(fold_text(None), '')
+        self.assertEqual(fold_text('Brașov', max_length=4), 'bras')
+
+    def test_folded_fields_filled_on_save(self):
+        self.assertEqual(self.listing.title_folded, 'dacia logan usor folosita')
+        self.assertEqual(self.listing.city_folded, 'bucuresti')
+        self.assertEqual(self.category.name_folded, 'masini')
+
+        self.listing.city = 'Iași'
+        self.listing.save(update_fields=['city'])
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.city_folded, 'iasi')
+
+    def test_prefix_lookup(self):
+        lookup = folded_prefix_q('location_folded', 'BUCUREȘTI')
+        self.assertEqual(list(Listing.objects.filter(lookup)), [self.listing])
+        self.assertFalse(Listing.objects.filter(folded_prefix_q('location_folded', 'cluj')).exists())
+
+    def test_search_ignores_diacritics(self):
+        for backend in (get_search_backend(), ORMSearchBackend()):
+            results = backend.search(Listing.objects.all(), 'usor bucuresti')
+            self.assertEqual(list(results), [self.listing])
+
+    def test_postgres_rebuild_indexes_the_documents_index_listing_does(self):
+        self.listing.address = 'Strada Ștefan cel Mare'
+        self.listing.save()
+        backend = PostgresFTSBackend()
+        connection = RecordingConnection()
+        backend.index_listing(self.listing, connection)
+        backend.rebuild(connection)
+        (indexed_sql, [indexed]), (truncate, _), (rebuilt_sql, rebuilt) = connection.statements
+        self.assertTrue(truncate.startswith('TRUNCATE'))
+        self.assertEqual(rebuilt_sql, indexed_sql)
+        self.assertEqual(rebuilt, [[self.listing.pk, *indexed[1:]]])
+        # Description and address have no folded shadow column but are folded all the same
+        self.assertIn('masina in stare buna', indexed)
+        self.assertIn('strada stefan cel mare', indexed)
+
+    def test_city_filter(self):
+        request = RequestFactory().get('/cautare/', {'location': 'bucuresti'})
+        with patch('marketplace.views.search.render') as render:
+            search_view(request)
+        context = render.call_args[0][2]
+        self.assertEqual(list(context['results']), [self.listing])
+
+    def test_category_api_search(self):
+        response = self.client.get('/api/categories/', {'search': 'MASI'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([item['id'] for item in results], [self.category.pk])
+
+    def test_backfill_command(self):
+        Listing.objects.filter(pk=self.listing.pk).update(city='Brăila', city_folded='')
+        call_command('backfill_folded_fields', batch_size=1, stdout=StringIO())
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.city_folded, 'braila')
+
+    def test_normalize_location_name(self):
+        self.assertEqual(LocationService.normalize_location_name('bucuresti'), 'București')
+        self.assertEqual(LocationService.normalize_location_name('Bucharest'), 'București')
+        self.assertEqual(LocationService.normalize_location_name('TARGU MURES'), 'Târgu Mureș')
+
+    def test_listing_cities_lookup(self):
+        Listing.objects.filter(pk=self.listing.pk).update(city='Voluntari', city_folded='voluntari')
+        matches = LocationService._search_listing_cities('volunțari', 5)
+        self.assertEqual([match['city'] for match in matches], ['Voluntari'])
+
+
+class FacetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.phones = Category.objects.create(name='Telefoane', slug='telefoane')
+        self.cars = Category.objects.create(name='Auto', slug='auto')
+        for title, price, city, category in (
+            ('iPhone 12', '50.00', 'București', self.phones),
+            ('iPhone 13', '2500.00', 'Bucuresti', self.phones),
+            ('Samsung S21', '700.00', 'Cluj-Napoca', self.phones),
+            ('Dacia Logan', '25000.00', 'Cluj-Napoca', self.cars),
+            ('Dacia Duster', None, None, self.cars),
+        ):
+            Listing.objects.create(
+                title=title,
+                description='Descriere',
+                price=Decimal(price) if price else None,
+                location=city or 'Romania',
+                city=city,
+                user=self.user,
+                category=category,
+                status='active'
+            )
+
+    def test_facet_counts(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Listing.objects.filter(status='active'))
+        self.assertEqual(
+            [(facet['slug'], facet['count']) for facet in facets['categories']],
+            [('telefoane', 3), ('auto', 2)]
+        )
+        self.assertEqual(
+            [(facet['key'], facet['count']) for facet in facets['cities']],
+            [('bucuresti', 2), ('cluj-napoca', 2)]
+        )
+        prices = {facet['key']: facet['count'] for facet in facets['price']}
+        self.assertEqual(prices, {
+            '0-100': 1, '100-500': 0, '500-1000': 1, '1000-5000': 1, '5000-20000': 0, '20000+': 1,
+        })
+
+    def test_facets_follow_filters_and_are_cached(self):
+        queryset = search_listings(Listing.objects.filter(status='active'), 'iphone')
+        facets = get_facets(queryset)
+        self.assertEqual([facet['count'] for facet in facets['categories']], [2])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_facets(queryset), facets)
+
+        # Listing writes invalidate them
+        Listing.objects.filter(title__icontains='iphone').first().save()
+        self.assertEqual(get_facets(queryset), facets)
+        Listing.objects.filter(title__icontains='iphone').first().delete()
+        self.assertEqual([facet['count'] for facet in get_facets(queryset)['categories']], [1])
+
+    def test_api_facets(self):
+        response = self.client.get('/api/listings/', {'facets': 'true', 'search': 'dacia'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['facets']['categories'][0]['slug'], 'auto')
+        self.assertEqual(data['facets']['categories'][0]['count'], 2)
+        self.assertNotIn('facets', self.client.get('/api/listings/').json())
+
+
+class SuggestTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.phones = Category.objects.create(name='Telefoane Mobile', slug='telefoane')
+        self.cars = Category.objects.create(name='Mașini', slug='masini')
+        self.iphone = self.create('Apple iPhone 13', self.phones, city='Iași')
+        self.create('Apple iPhone 13', self.phones, city='Iași')
+        self.create('iPhone 12 mini', self.phones, city='Cluj-Napoca')
+        self.create('Mașină Dacia Logan', self.cars, city='Ilfov')
+        self.index = suggest_index
+        self.index.rebuild()
+
+    def create(self, title, category, city, status='active'):
+        return Listing.objects.create(
+            title=title, description='Descriere', price=Decimal('100'), location=city, city=city,
+            user=self.user, category=category, status=status
+        )
+
+    def texts(self, query, **kwargs):
+        return [item['text'] for item in self.index.suggest(query, **kwargs)]
+
+    def test_prefix_and_word_matches(self):
+        self.assertEqual(self.texts('iph'), ['Apple iPhone 13', 'iPhone 12 mini'])
+        self.assertEqual(self.texts('masi'), ['Mașini', 'Mașină Dacia Logan'])
+        self.assertEqual(self.texts('mobile'), ['Telefoane Mobile'])
+        self.assertEqual(self.texts('i', limit=2), ['Iași', 'Apple iPhone 13'])
+        self.assertEqual(self.texts(''), [])
+        suggestion = self.index.suggest('tele')[0]
+        self.assertEqual((suggestion['type'], suggestion['slug'], suggestion['listings']), ('category', 'telefoane', 3))
+
+    def test_ranked_by_search_logs(self):
+        with patch('marketplace.search.suggest.search_term_counts', return_value={'ilfov': 5}):
+            self.index.rebuild()
+        self.assertEqual(self.texts('i')[0], 'Ilfov')
+        self.assertEqual(self.index.suggest('ilf')[0]['searches'], 5)
+
+    def test_incremental_updates(self):
+        self.create('Iaurt de casă', self.cars, city='Ilfov')
+        self.iphone.status = 'sold'
+        self.iphone.save()
+        with self.assertNumQueries(1):
+            self.index.ensure_fresh()
+        self.assertIn('Iaurt de casă', self.texts('iaurt'))
+        self.assertEqual(self.index.suggest('apple')[0]['listings'], 1)
+
+        Listing.objects.filter(title='Apple iPhone 13').delete()
+        self.index.ensure_fresh()
+        self.assertEqual(self.texts('apple'), [])
+        self.assertEqual(self.texts('iasi'), [])
+
+    def test_stale_index_is_rebuilt_off_the_request_thread(self):
+        release = threading.Event()
+        builds = []
+
+        def rebuild():
+            builds.append(threading.current_thread().name)
+            release.wait(5)
+
+        rebuilder = BackgroundJob(rebuild, 'suggest-index-rebuild')
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(self.index, '_rebuilder', rebuilder), \
+                patch.object(self.index, 'built_at', self.index.built_at - SUGGEST_REBUILD_INTERVAL - 1):
+            # The old index keeps answering while the rebuild runs
+            self.assertEqual(self.texts('iph'), ['Apple iPhone 13', 'iPhone 12 mini'])
+            self.assertEqual([item['text'] for item in get_suggestions('iph')], ['Apple iPhone 13', 'iPhone 12 mini'])
+            get_suggestions('iph')
+            release.set()
+            rebuilder.join(5)
+        self.assertEqual(builds, ['suggest-index-rebuild'])
+
+    def test_changes_are_applied_off_the_request_thread(self):
+        release = threading.Event()
+        refreshes = []
+
+        def refresh():
+            refreshes.append(threading.current_thread().name)
+            release.wait(5)
+
+        self.create('Iaurt de casă', self.cars, city='Ilfov')
+        refresher = BackgroundJob(refresh, 'suggest-index-refresh')
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(self.index, '_refresher', refresher):
+            # The loaded index keeps answering while the refresh runs
+            self.assertEqual([item['text'] for item in get_suggestions('iaurt')], [])
+            get_suggestions('iaurt')
+            release.set()
+            refresher.join(5)
+        self.assertEqual(refreshes, ['suggest-index-refresh'])
+        self.assertEqual([item['text'] for item in get_suggestions('iaurt')], ['Iaurt de casă'])
+
+    def test_failed_rebuilds_back_off(self):
+        self.addCleanup(setattr, self.index, '_failed_at', None)
+        with patch.object(SuggestIndex, '_load', side_effect=DatabaseError('gone')) as load, \
+                patch.object(self.index, 'built_at', self.index.built_at - SUGGEST_REBUILD_INTERVAL - 1):
+            get_suggestions('iph')
+            get_suggestions('iph')
+            self.assertEqual(load.call_count, 1)
+            # The old index keeps answering
+            self.assertEqual(self.texts('iph'), ['Apple iPhone 13', 'iPhone 12 mini'])
+
+            self.index._failed_at -= SUGGEST_RETRY_INTERVAL
+            get_suggestions('iph')
+            self.assertEqual(load.call_count, 2)
+
+    def test_suggest_endpoint(self):
+        response = self.client.get('/api/suggest', {'q': 'iph', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['text'] for item in response.json()['results']], ['Apple iPhone 13'])
+        self.assertEqual(self.client.get('/api/suggest/', {'q': ''}).json()['results'], [])
+
+
+class PopularSearchTermsTestCase(TestCase):
+    def setUp(self):
+        for tracker in (listing_searches, location_searches):
+            tracker.flush()
+        SearchTermCount.objects.all().delete()
+        cache.clear()
+
+    def test_space_saving_is_bounded(self):
+        summary = SpaceSaving(capacity=10)
+        for i in range(2000):
+            summary.add('iphone' if i % 3 == 0 else 'dacia' if i % 5 == 0 else f'rare {i}')
+        self.assertEqual(len(summary), 10)
+        self.assertEqual(summary.total, 2000)
+        top = summary.top(2)
+        self.assertEqual([item for item, _, _ in top], ['iphone', 'dacia'])
+        # Counts never underestimate and the error bound holds
+        for item, count, error in top:
+            true_count = 667 if item == 'iphone' else 266
+            self.assertGreaterEqual(count, true_count)
+            self.assertLessEqual(count - error, true_count)
+
+    def test_flush_and_lists(self):
+        tracker = SearchTermTracker(KIND_LISTING, capacity=50)
+        for query in ['iPhone 13'] * 3 + ['iphone 13', 'Mașină'] * 2:
+            tracker.record(query)
+        tracker.flush()
+        tracker.record('masina')
+        tracker.flush()
+        rows = dict(SearchTermCount.objects.values_list('term', 'count'))
+        self.assertEqual(rows, {'iphone 13': 5, 'masina': 3})
+
+        with self.assertNumQueries(0):
+            popular = tracker.popular()
+        self.assertEqual([(item['text'], item['count']) for item in popular], [('iPhone 13', 5), ('Mașină', 3)])
+
+        # Counted the same on the previous days, so not trending
+        today = timezone.localdate()
+        SearchTermCount.objects.bulk_create([
+            SearchTermCount(kind=KIND_LISTING, term='iphone 13', label='iPhone 13', date=today - timedelta(days=day), count=40)
+            for day in range(1, 8)
+        ])
+        lists = tracker.refresh_lists()
+        self.assertEqual([item['term'] for item in lists['trending']], ['masina'])
+        self.assertEqual(tracker.popular(1)[0]['count'], 6 * 40 + 5)
+
+    def test_flush_stores_guaranteed_counts(self):
+        tracker = SearchTermTracker(KIND_LISTING, capacity=2)
+        for query in ['dacia'] * 3 + ['rare one', 'rare two', 'rare three', 'rare three']:
+            tracker.record(query)
+        tracker.flush()
+        # "rare three" inherited a count of 2 from the evicted terms, which are not stored
+        rows = dict(SearchTermCount.objects.values_list('term', 'count'))
+        self.assertEqual(rows, {'dacia': 3, 'rare three': 2})
+
+    def test_due_flush_runs_off_the_request_thread(self):
+        tracker = SearchTermTracker(KIND_LISTING, capacity=50)
+        flushes = []
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(tracker._flusher, 'func', lambda: flushes.append(threading.current_thread().name)), \
+                patch('marketplace.search.popular.FLUSH_INTERVAL', 0):
+            tracker.record('iphone')
+            tracker._flusher.join(5)
+        self.assertEqual(flushes, ['listing-search-terms-flush'])
+
+    def test_stale_lists_are_served_while_the_flusher_recomputes_them(self):
+        tracker = SearchTermTracker(KIND_LISTING, capacity=50)
+        tracker.record('iPhone')
+        tracker.flush()
+        release = threading.Event()
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(tracker._flusher, 'func', lambda: release.wait(5)), \
+                patch('marketplace.search.popular.LIST_REFRESH_INTERVAL', 0):
+            with self.assertNumQueries(0):
+                self.assertEqual([item['text'] for item in tracker.popular()], ['iPhone'])
+            self.assertTrue(tracker._flusher.running)
+            release.set()
+            tracker._flusher.join(5)
+
+        # Before the first lists nothing is computed on the request either
+        cache.clear()
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(tracker._flusher, 'func', lambda: None), self.assertNumQueries(0):
+            self.assertEqual(tracker.trending(), [])
+
+    def test_search_endpoints_record_terms(self):
+        user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        category = Category.objects.create(name='Telefoane', slug='telefoane')
+        Listing.objects.create(
+            title='iPhone 13', description='Descriere', price=Decimal('100'), location='Iași',
+            user=user, category=category, status='active'
+        )
+        self.client.get('/api/listings/', {'search': 'iPhone'})
+        self.client.get('/api/listings/', {'search': 'iPhone', 'cursor': 'abc'})
+        self.client.get('/api/locations/search/', {'q': 'Iași'})
+        with patch('marketplace.views.search.render'):
+            search_view(RequestFactory().get('/cautare/', {'q': 'iphone'}))
+        listing_searches.flush()
+        location_searches.flush()
+
+        self.assertEqual(SearchCache.get_popular_searches(), ['iPhone'])
+        self.assertEqual(listing_searches.popular()[0]['count'], 2)
+        self.assertEqual(LocationAnalytics.get_popular_locations(), [{'query': 'Iași', 'search_count': 1}])
+        self.assertNotIn('popular_queries', LocationAnalytics.get_daily_stats()['search'])
+
+        response = self.client.get('/api/search/popular/')
+        self.assertEqual(response.json()['popular'][0]['term'], 'iphone')
+
+    def test_popular_searches_fallback(self):
+        self.assertEqual(SearchCache.get_popular_searches(3), ['iPhone', 'Samsung', 'Apartament'])
@@ -0,0 +1,236 @@
+"""
+Tests for semantic listing search
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from marketplace.ai_search.embeddings import HashingEmbedder
+from marketplace.ai_search.engine import (
+    CURRENT_FILE,
+    SEMANTIC_LATENCY_TARGET,
+    build_lock,
+    semantic_engine,
+    semantic_search,
+)
+from marketplace.ai_search.index import IVFIndex
+from marketplace.models import Category, Listing
+
+
+class IVFIndexTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+
+    def random_vectors(self, count, dimensions=32, seed=0):
+        vectors = np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def test_recall_against_exact_search(self):
+        vectors = self.random_vectors(2000)
+        ids = np.arange(1, 2001, dtype=np.int64)
+        index = IVFIndex.build(ids, vectors, self.path)
+        self.assertGreater(len(index.centroids), 1)
+
+        queries = self.random_vectors(50, seed=1)
+        found = 0
+        for query in queries:
+            exact = set(ids[np.argsort(-(vectors @ query))[:10]])
+            approximate, scores = index.search(query, 10, nprobe=16)
+            found += len(exact & set(approximate))
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+        self.assertGreaterEqual(found / 500, 0.8)
+
+    def test_index_is_memory_mapped(self):
+        IVFIndex.build(np.arange(10, dtype=np.int64), self.random_vectors(10), self.path)
+        index = IVFIndex.load(self.path)
+        self.assertIsInstance(index.vectors, np.memmap)
+        self.assertEqual(len(index), 10)
+
+    def test_excluded_ids_are_skipped(self):
+        vectors = self.random_vectors(20)
+        index = IVFIndex.build(np.arange(20, dtype=np.int64), vectors, self.path)
+        ids, _ = index.search(vectors[3], 5, exclude=np.array([3]))
+        self.assertNotIn(3, ids)
+
+    def test_empty_index(self):
+        index = IVFIndex.build(np.empty(0, dtype=np.int64), np.empty((0, 8), dtype=np.float32), self.path)
+        ids, scores = index.search(np.ones(8, dtype=np.float32) / np.sqrt(8), 5)
+        self.assertEqual(len(ids), 0)
+
+
+class HashingEmbedderTestCase(TestCase):
+    def test_inflected_forms_are_close(self):
+        embedder = HashingEmbedder()
+        masina, masini, apartament = embedder.embed(['mașină', 'masini', 'apartament'])
+        self.assertAlmostEqual(float(np.linalg.norm(masina)), 1.0, places=5)
+        self.assertGreater(masina @ masini, masina @ apartament)
+
+
+class SemanticSearchTestCase(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        settings_override = override_settings(SEMANTIC_INDEX_DIR=self.index_dir, SEMANTIC_SEARCH_MODEL='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.car = self.create_listing('Dacia Logan 2015', 'Mașină în stare bună, motor 1.5 diesel, acte la zi')
+        self.flat = self.create_listing('Apartament 2 camere', 'Apartament decomandat, zonă centrală, etaj 2')
+        self.bike = self.create_listing('Bicicletă de munte', 'Bicicletă cu 21 viteze, roți de 26')
+
+    def create_listing(self, title, description, **kwargs):
+        return Listing.objects.create(
+            title=title, description=description, price=Decimal('100.00'), location='Cluj',
+            user=self.user, category=self.category, status='active', **kwargs
+        )
+
+    def test_relevant_listing_ranks_first(self):
+        matches = semantic_engine.search('masina diesel')
+        self.assertEqual(matches[0][0], self.car.pk)
+        self.assertTrue(all(0 < score <= 1.0001 for _, score in matches))
+
+    def test_new_and_edited_listings_found_without_rebuild(self):
+        semantic_engine.search('apartament')
+        build = semantic_engine.build_name
+
+        boat = self.create_listing('Barcă pneumatică', 'Barcă gonflabilă pentru pescuit')
+        self.assertEqual(semantic_engine.search('barca pescuit')[0][0], boat.pk)
+
+        self.flat.title = 'Garsonieră'
+        self.flat.description = 'Garsonieră mobilată lângă parc'
+        self.flat.save()
+        matches = semantic_engine.search('garsoniera mobilata')
+        self.assertEqual(matches[0][0], self.flat.pk)
+        self.assertEqual([pk for pk, _ in matches].count(self.flat.pk), 1)
+        self.assertEqual(semantic_engine.build_name, build)
+
+    def test_inactive_and_deleted_listings_are_dropped(self):
+        semantic_engine.search('bicicleta')
+        self.bike.status = 'sold'
+        self.bike.save()
+        self.assertNotIn(self.bike.pk, [pk for pk, _ in semantic_engine.search('bicicleta viteze')])
+
+        car_pk = self.car.pk
+        self.car.delete()
+        self.assertNotIn(car_pk, [pk for pk, _ in semantic_engine.search('masina diesel')])
+
+    def test_listings_changed_during_a_build_keep_their_vectors(self):
+        fit = HashingEmbedder.fit
+        created = []
+
+        def fit_then_edit(embedder, texts):
+            fitted = fit(embedder, texts)
+            self.car.delete()
+            created.append(self.create_listing('Barcă pneumatică', 'Barcă gonflabilă pentru pescuit'))
+            return fitted
+
+        with patch.object(HashingEmbedder, 'fit', fit_then_edit):
+            semantic_engine.build()
+        self.assertEqual(len(semantic_engine.index), 2)
+        self.assertEqual(semantic_engine.search('apartament decomandat')[0][0], self.flat.pk)
+        self.assertEqual(semantic_engine.search('bicicleta viteze')[0][0], self.bike.pk)
+        # Created after the build started, so found through the delta
+        self.assertEqual(semantic_engine.search('barca pescuit')[0][0], created[0].pk)
+
+    def test_missing_index_is_built_off_the_request_thread(self):
+        release = threading.Event()
+        builds = []
+
+        def build():
+            builds.append(threading.current_thread().name)
+            release.wait(5)
+
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(semantic_engine._builder, 'func', build), patch.object(semantic_engine, 'index', None):
+            self.assertEqual(semantic_engine.search('masina diesel'), [])
+            # A build already going is not started again
+            self.assertEqual(semantic_engine.search('masina diesel'), [])
+            release.set()
+            semantic_engine._builder.join(5)
+        self.assertEqual(builds, ['semantic-index-build'])
+
+    def test_changes_are_embedded_off_the_request_thread(self):
+        semantic_engine.search('apartament')
+        boat = self.create_listing('Barcă pneumatică', 'Barcă gonflabilă pentru pescuit')
+        release = threading.Event()
+        refresh = semantic_engine.refresh
+
+        def slow_refresh():
+            release.wait(5)
+            refresh()
+
+        with patch('marketplace.utils.background.background_safe', return_value=True), \
+                patch.object(semantic_engine._refresher, 'func', slow_refresh):
+            # Served from what is loaded while the refresh waits
+            self.assertNotIn(boat.pk, [pk for pk, _ in semantic_engine.search('barca pescuit')])
+            release.set()
+            semantic_engine._refresher.join(5)
+        self.assertEqual(semantic_engine.search('barca pescuit')[0][0], boat.pk)
+
+    def test_builds_are_left_to_the_process_holding_the_lock(self):
+        with build_lock():
+            # As if another process were building
+            thread = threading.Thread(target=semantic_engine.build_missing)
+            thread.start()
+            thread.join(5)
+        self.assertFalse(os.path.exists(os.path.join(self.index_dir, CURRENT_FILE)))
+
+        semantic_engine.build_missing()
+        first = semantic_engine.build_name
+        semantic_engine.build_missing()
+        self.assertEqual(semantic_engine.build_name, first)
+
+    def test_only_older_builds_are_removed(self):
+        newer = os.path.join(self.index_dir, f'build-{time.time_ns() + 10 ** 12}')
+        os.makedirs(newer)
+        for _ in range(3):
+            semantic_engine.build()
+        builds = sorted(name for name in os.listdir(self.index_dir) if name.startswith('build-'))
+        self.assertEqual(len(builds), 3)
+        self.assertIn(os.path.basename(newer), builds)
+
+    def test_build_command(self):
+        out = StringIO()
+        call_command('build_semantic_index', stdout=out)
+        self.assertIn('3 listings indexed', out.getvalue())
+        self.assertIsInstance(semantic_engine.index.vectors, np.memmap)
+
+    def test_results_describe_listings(self):
+        results = semantic_search('bicicleta munte', limit=2)
+        self.assertEqual(results[0]['id'], self.bike.pk)
+        self.assertEqual(results[0]['title'], 'Bicicletă de munte')
+        self.assertIn('score', results[0])
+        self.assertLessEqual(len(results), 2)
+
+    def test_view(self):
+        response = self.client.get('/ai/search/', {'q': 'apartament central'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['query'], 'apartament central')
+        self.assertEqual(data['results'][0]['id'], self.flat.pk)
+        self.assertIn('took_ms', data)
+
+        self.assertEqual(self.client.get('/ai/search/').json()['results'], [])
+
+    def test_latency(self):
+        for number in range(300):
+            self.create_listing(f'Anunț {number} telefon', f'Descriere generică numărul {number}')
+        semantic_engine.build()
+        semantic_engine.search('telefon')
+
+        started = time.perf_counter()
+        for _ in range(20):
+            semantic_engine.search('telefon samsung')
+        self.assertLess((time.perf_counter() - started) / 20, SEMANTIC_LATENCY_TARGET)
@@ -0,0 +1,134 @@
+"""
+Tests for HyperLogLog unique visitor counts
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from marketplace.models import Category, Listing, ListingVisitorSketch, UserAnalytics
+from marketplace.recommendations.data.events import collector
+from marketplace.utils.hyperloglog import HyperLogLog
+from marketplace.utils import unique_visitors as unique_visitors_module
+from marketplace.utils.unique_visitors import UniqueVisitors, client_address, unique_visitors
+
+
+class HyperLogLogTestCase(TestCase):
+    def test_estimates_within_a_few_percent(self):
+        sketch = HyperLogLog()
+        for n in range(100000):
+            sketch.add(f'visitor-{n}')
+        self.assertAlmostEqual(sketch.count(), 100000, delta=5000)
+
+    def test_small_counts_and_repeats(self):
+        sketch = HyperLogLog()
+        for _ in range(50):
+            for n in range(10):
+                sketch.add(n)
+        self.assertEqual(sketch.count(), 10)
+        self.assertEqual(HyperLogLog().count(), 0)
+
+    def test_merge_is_the_sketch_of_the_union(self):
+        first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for n in range(3000):
+            (first if n % 2 else second).add(n)
+            union.add(n)
+            if n < 1000:
+                first.add(n)
+        self.assertEqual(HyperLogLog.union([first, second]), union)
+        self.assertAlmostEqual(union.count(), 3000, delta=150)
+
+        with self.assertRaises(ValueError):
+            first.update(HyperLogLog(precision=10))
+
+    def test_serialised_sketches_are_small(self):
+        sketch = HyperLogLog()
+        for n in range(5):
+            sketch.add(n)
+        data = sketch.to_bytes()
+        self.assertLess(len(data), 100)
+        self.assertEqual(HyperLogLog.from_bytes(data), sketch)
+
+
+class UniqueVisitorsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        unique_visitors.flush()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Electronice', slug='electronice')
+        self.phone, self.laptop = [
+            Listing.objects.create(
+                title=title, description='Descriere', price=Decimal('100.00'), location='Cluj',
+                user=self.seller, category=self.category, status='active'
+            )
+            for title in ('Telefon', 'Laptop')
+        ]
+
+    def test_processes_merge_their_sketches(self):
+        first, second = UniqueVisitors(), UniqueVisitors()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        for n in range(200):
+            first.add(self.phone.pk, f'u{n}')
+            second.add(self.phone.pk, f'u{n + 100}', day=yesterday if n % 2 else None)
+        self.assertEqual(first.flush(), 1)
+        self.assertEqual(second.flush(), 2)
+        first.add(self.phone.pk, 'u1')
+        first.flush()
+
+        self.assertEqual(ListingVisitorSketch.objects.filter(listing=self.phone).count(), 2)
+        self.assertAlmostEqual(first.count([self.phone.pk])[self.phone.pk], 300, delta=15)
+        # Today only: the first process's 200 and the 50 new ones the second saw today
+        self.assertAlmostEqual(first.count([self.phone.pk], days=1)[self.phone.pk], 250, delta=12)
+
+    def test_views_count_each_visitor_once(self):
+        buyer = User.objects.create_user('buyer', 'buyer@example.com', 'testpass123')
+        self.client.force_login(buyer)
+        for _ in range(3):
+            self.client.get(f'/api/listings/{self.phone.pk}/')
+        self.client.get(f'/api/listings/{self.laptop.pk}/')
+        self.client.logout()
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.2'):
+            self.client.get(f'/api/listings/{self.phone.pk}/', REMOTE_ADDR=address)
+
+        # Unflushed sketches are counted too
+        self.assertEqual(unique_visitors.count([self.phone.pk, self.laptop.pk]),
+                         {self.phone.pk: 3, self.laptop.pk: 1})
+        unique_visitors.flush()
+        listings = [self.phone, self.laptop]
+        self.assertEqual(unique_visitors.annotate(listings), 3)
+        self.assertEqual([listing.unique_viewers for listing in listings], [3, 1])
+
+        analytics = UserAnalytics.objects.create(user=self.seller)
+        analytics.update_analytics()
+        self.assertEqual(analytics.unique_viewers, 3)
+
+    def test_pending_sketches_are_capped(self):
+        visitors = UniqueVisitors()
+        with patch.object(unique_visitors_module, 'MAX_PENDING_SKETCHES', 2):
+            visitors.add(self.phone.pk, 'u1')
+            self.assertEqual(visitors.pending, 1)
+            visitors.add(self.laptop.pk, 'u1')
+        self.assertEqual(visitors.pending, 0)
+        self.assertEqual(ListingVisitorSketch.objects.count(), 2)
+
+    def test_exit_flush_skips_a_destroyed_database(self):
+        unique_visitors.add(self.phone.pk, 'u1')
+        with patch('marketplace.utils.unique_visitors.table_exists', return_value=False):
+            unique_visitors_module._flush_at_exit()
+        self.assertEqual(unique_visitors.pending, 1)
+        unique_visitors_module._flush_at_exit()
+        self.assertEqual(unique_visitors.pending, 0)
+
+    def test_forwarded_addresses_need_a_trusted_proxy(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2')
+        self.assertEqual(client_address(request), '10.0.0.9')
+        with override_settings(TRUSTED_PROXY_COUNT=1):
+            # 1.1.1.1 was made up by the client, 2.2.2.2 appended by the proxy
+            self.assertEqual(client_address(request), '2.2.2.2')
+        with override_settings(TRUSTED_PROXY_COUNT=5):
+            self.assertEqual(client_address(request), '1.1.1.1')
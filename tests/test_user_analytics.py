@@ -0,0 +1,96 @@
+"""
+Tests for set-based seller analytics
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from marketplace.models import Category, Favorite, Listing, Message, UserAnalytics
+from marketplace.recommendations.data.events import collector
+from marketplace.services import user_analytics
+from marketplace.utils.view_counter import view_counter
+
+
+class UserAnalyticsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        # Views counted by earlier tests would land on the listing pks reused here
+        view_counter.flush()
+        self.category = Category.objects.create(name='Diverse', slug='diverse')
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.other_seller = User.objects.create_user('other', 'other@example.com', 'testpass123')
+        self.buyers = [User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'pass') for n in range(3)]
+        self.listings = [self.create_listing(self.seller, views=n) for n in range(30)]
+        self.other_listing = self.create_listing(self.other_seller, views=7)
+        for buyer in self.buyers:
+            Favorite.objects.create(user=buyer, listing=self.listings[0])
+        Favorite.objects.create(user=self.buyers[0], listing=self.other_listing)
+        Message.objects.create(sender=self.buyers[0], receiver=self.seller, listing=self.listings[0], content='Salut')
+        Message.objects.create(sender=self.buyers[1], receiver=self.seller, content='Salut')
+        collector.flush()
+
+    def create_listing(self, user, views=0):
+        return Listing.objects.create(
+            title='Anunț', description='Descriere', price=Decimal('10.00'), location='Iași',
+            user=user, category=self.category, status='active', views=views
+        )
+
+    def test_totals_take_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(4):
+            totals = user_analytics.compute([self.seller.pk, self.other_seller.pk, self.buyers[0].pk])
+        self.assertEqual(totals[self.seller.pk], {
+            'total_listings': 30, 'total_views': sum(range(30)), 'total_favorites': 3, 'total_messages': 2,
+            'unique_viewers': 0, 'conversion_rate': Decimal('66.67'),
+        })
+        self.assertEqual(totals[self.other_seller.pk]['total_views'], 7)
+        self.assertEqual(totals[self.other_seller.pk]['total_favorites'], 1)
+        self.assertEqual(totals[self.buyers[0].pk]['total_listings'], 0)
+
+        analytics = UserAnalytics.objects.create(user=self.seller)
+        analytics.update_analytics()
+        analytics.refresh_from_db()
+        self.assertEqual((analytics.total_listings, analytics.total_favorites), (30, 3))
+
+    def test_command_refreshes_every_user_in_chunks(self):
+        UserAnalytics.objects.create(user=self.seller, total_listings=99)
+        out = StringIO()
+        call_command('refresh_user_analytics', '--chunk-size', '2', stdout=out)
+        self.assertIn('Refreshed analytics of 5 users', out.getvalue())
+        self.assertEqual(UserAnalytics.objects.count(), 5)
+        analytics = UserAnalytics.objects.get(user=self.seller)
+        self.assertEqual((analytics.total_listings, analytics.total_messages), (30, 2))
+
+        call_command('refresh_user_analytics', '--users', str(self.other_seller.pk), stdout=out)
+        self.assertEqual(UserAnalytics.objects.get(user=self.other_seller).total_views, 7)
+
+    def test_counters_follow_events_between_refreshes(self):
+        user_analytics.refresh()
+        self.client.get(f'/api/listings/{self.listings[1].pk}/')
+        self.client.get(f'/api/listings/{self.listings[2].pk}/')
+        self.client.get(f'/api/listings/{self.other_listing.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.buyers[1], listing=self.listings[1])
+            Favorite.objects.filter(user=self.buyers[0], listing=self.other_listing).delete()
+            Message.objects.create(sender=self.buyers[2], receiver=self.seller, content='Mai e valabil?')
+        listing = self.create_listing(self.seller)
+        collector.flush()
+
+        analytics = UserAnalytics.objects.get(user=self.seller)
+        self.assertEqual(analytics.total_views, sum(range(30)) + 2)
+        self.assertEqual(analytics.total_favorites, 4)
+        self.assertEqual(analytics.total_messages, 3)
+        self.assertEqual(analytics.total_listings, 31)
+        other = UserAnalytics.objects.get(user=self.other_seller)
+        self.assertEqual((other.total_views, other.total_favorites), (8, 0))
+
+        listing.delete()
+        self.assertEqual(UserAnalytics.objects.get(user=self.seller).total_listings, 30)
+        # A full refresh agrees with the incremental counts
+        user_analytics.refresh()
+        self.assertEqual(UserAnalytics.objects.get(user=self.seller).total_views, sum(range(30)) + 2)
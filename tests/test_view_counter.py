@@ -0,0 +1,87 @@
+"""
+Tests for write-behind listing view counts
+"""
+import threading
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from marketplace.models import Category, Listing
+from marketplace.recommendations.data.events import collector
+from marketplace.utils.view_counter import ViewCounter, view_counter
+
+
+class ViewCounterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(patch.object(collector, 'background', False))
+        collector.flush()
+        view_counter.flush()
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'testpass123')
+        self.category = Category.objects.create(name='Electronice', slug='electronice')
+        self.listings = [
+            Listing.objects.create(
+                title=f'Telefon {n}', description='Descriere', price=Decimal('100.00'), location='Cluj',
+                user=self.seller, category=self.category, status='active', views=n
+            )
+            for n in range(4)
+        ]
+
+    def views(self):
+        return list(Listing.objects.order_by('pk').values_list('views', flat=True))
+
+    def test_counts_from_many_threads_are_flushed_in_one_update_per_increment(self):
+        counter = ViewCounter(shards=4)
+        first, second, third, _ = self.listings
+
+        def view():
+            for _ in range(100):
+                counter.add(first.pk)
+                counter.add(second.pk)
+            counter.add(third.pk)
+
+        threads = [threading.Thread(target=view) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.pending(), {first.pk: 800, second.pk: 800, third.pk: 8})
+        self.assertEqual(self.views(), [0, 1, 2, 3])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counter.flush(), 1608)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        self.assertEqual(self.views(), [800, 801, 10, 3])
+        self.assertEqual(counter.pending(), {})
+        self.assertEqual(counter.flush(), 0)
+
+    def test_failed_flush_keeps_the_counts(self):
+        counter = ViewCounter()
+        counter.add(self.listings[0].pk, 3)
+        with patch('django.db.models.query.QuerySet.update', side_effect=RuntimeError('locked')), \
+                self.assertLogs('marketplace.utils.view_counter', 'ERROR'):
+            self.assertEqual(counter.flush(), 0)
+        self.assertEqual(counter.pending(), {self.listings[0].pk: 3})
+        counter.flush()
+        self.assertEqual(self.views()[0], 3)
+
+    def test_api_and_detail_page_views_are_written_behind(self):
+        listing = self.listings[0]
+        self.assertEqual(self.client.get(f'/api/listings/{listing.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/listings/{listing.pk}/').status_code, 200)
+        # The page template needs the site's auth URLs, only the view itself is under test
+        with patch('marketplace.views.listing.render', return_value=HttpResponse()):
+            self.assertEqual(self.client.get(f'/anunt/{listing.pk}/').status_code, 200)
+        listing.refresh_from_db()
+        self.assertEqual(listing.views, 0)
+        self.assertEqual(view_counter.pending(), {listing.pk: 3})
+
+        # Flushed along with the interaction events
+        collector.flush()
+        listing.refresh_from_db()
+        self.assertEqual(listing.views, 3)